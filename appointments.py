@@ -0,0 +1,132 @@
+"""Appointments with leads, stored next to them in the leads database.
+
+Like leads, write functions take a connection and run inside the caller's
+transaction. Appointment times are local "yyyy-MM-dd HH:MM" strings (see
+migrations.create_appointments_table), so the range functions take the same
+strings and a whole day is simply "2024-05-01" to "2024-05-02".
+"""
+from dataclasses import dataclass, fields
+from datetime import datetime
+
+import leads
+import migrations
+
+APPOINTMENT_STATUSES = migrations.APPOINTMENT_STATUSES
+
+TIME_FORMAT = "%Y-%m-%d %H:%M"
+
+
+@dataclass(slots=True)
+class Appointment:
+    """One row of the appointments table. status is an index into APPOINTMENT_STATUSES."""
+    lead_id: int
+    start_time: str
+    end_time: str
+    status: int = 0
+    notes: str | None = ""
+    id: int | None = None
+
+    @property
+    def status_label(self):
+        return APPOINTMENT_STATUSES[self.status] if 0 <= self.status < len(APPOINTMENT_STATUSES) else "Unknown Status"
+
+
+APPOINTMENT_FIELDS = tuple(field.name for field in fields(Appointment) if field.name != "id")
+
+SELECT_SQL = f"SELECT {', '.join(APPOINTMENT_FIELDS)}, id FROM appointments"
+
+# Each appointment with its lead: the Appointment columns, then the Lead columns in leads.SELECT_SQL order
+AGENDA_SQL = f"""
+    SELECT {', '.join(f'a.{field}' for field in APPOINTMENT_FIELDS)}, a.id,
+           {', '.join(f'l.{field}' for field in leads.LEAD_FIELDS)}, l.id
+    FROM appointments a JOIN leads l ON l.id = a.lead_id
+    WHERE a.start_time >= ? AND a.start_time < ?
+    ORDER BY a.start_time
+"""
+
+
+def parse_time(text):
+    """Normalize "yyyy-mm-dd hh:mm" (or a bare date, meaning midnight) to the stored format."""
+    text = text.strip()
+    try:
+        return datetime.strptime(text, TIME_FORMAT).strftime(TIME_FORMAT)
+    except ValueError:
+        return datetime.strptime(text, "%Y-%m-%d").strftime(TIME_FORMAT)
+
+
+def appointment_row(cursor, row):
+    return Appointment(*row)
+
+
+def agenda_row(cursor, row):
+    """Row factory for AGENDA_SQL: an (Appointment, Lead) pair."""
+    split = len(APPOINTMENT_FIELDS) + 1
+    return Appointment(*row[:split]), leads.Lead(*row[split:])
+
+
+def select_appointments(connection, sql, params=()):
+    cursor = connection.cursor()
+    cursor.row_factory = appointment_row
+    return cursor.execute(sql, params)
+
+
+def check_columns(columns):
+    unknown = set(columns) - set(APPOINTMENT_FIELDS)
+    if unknown:
+        raise ValueError(f"Unknown appointment columns: {', '.join(sorted(unknown))}")
+
+
+def check_times(start_time, end_time):
+    if end_time <= start_time:
+        raise ValueError(f"An appointment must end after it starts ({start_time} to {end_time})")
+
+
+def add_appointment(connection, appointment):
+    """Insert appointment and return its new id."""
+    check_times(appointment.start_time, appointment.end_time)
+    return connection.execute(
+        f"INSERT INTO appointments ({', '.join(APPOINTMENT_FIELDS)}) VALUES ({', '.join('?' for _ in APPOINTMENT_FIELDS)})",
+        tuple(getattr(appointment, field) for field in APPOINTMENT_FIELDS)).lastrowid
+
+
+def get_appointment(connection, appointment_id):
+    return select_appointments(connection, f"{SELECT_SQL} WHERE id = ?", (appointment_id,)).fetchone()
+
+
+def update_appointment(connection, appointment_id, **changes):
+    """Set the given columns on one appointment."""
+    check_columns(changes)
+    if not changes:
+        return
+    if "start_time" in changes or "end_time" in changes:
+        current = get_appointment(connection, appointment_id)
+        if current:
+            check_times(changes.get("start_time", current.start_time), changes.get("end_time", current.end_time))
+    assignments = ", ".join(f"{column} = ?" for column in changes)
+    connection.execute(f"UPDATE appointments SET {assignments} WHERE id = ?", [*changes.values(), appointment_id])
+
+
+def delete_appointment(connection, appointment_id):
+    connection.execute("DELETE FROM appointments WHERE id = ?", (appointment_id,))
+
+
+def agenda(connection, start_time, end_time):
+    """Return [(Appointment, Lead)] for appointments starting from start_time up to (not including) end_time."""
+    cursor = connection.cursor()
+    cursor.row_factory = agenda_row
+    return cursor.execute(AGENDA_SQL, (start_time, end_time)).fetchall()
+
+
+def lead_history(connection, lead_id):
+    """Every appointment with one lead, most recent first."""
+    return select_appointments(
+        connection, f"{SELECT_SQL} WHERE lead_id = ? ORDER BY start_time DESC", (lead_id,)).fetchall()
+
+
+def move_appointments(connection, from_lead_ids, to_lead_id):
+    """Give the appointments of from_lead_ids to to_lead_id, e.g. before merging duplicate leads."""
+    from_lead_ids = list(from_lead_ids)
+    if from_lead_ids:
+        connection.execute(
+            f"UPDATE appointments SET lead_id = ? WHERE lead_id IN ({', '.join('?' for _ in from_lead_ids)})",
+            [to_lead_id, *from_lead_ids])
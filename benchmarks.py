@@ -0,0 +1,776 @@
+"""Benchmarks for the leads database, exporters, grid and calendar at increasing table sizes.
+
+Each size gets a fresh database filled with synthetic leads, then the bulk import,
+single adds, filtered and sorted queries, appointment lookups, radius searches and
+route planning over synthetic ZIP code centroids, bulk edits, deletes and their undo,
+web form submissions to the local intake server, SMS and email campaigns against
+the local Twilio and SMTP stand-ins, the grid model's paged load and the CSV/TXT/PDF
+exporters are timed against it. Qt runs offscreen, so no display is needed.
+Every phase records the process's peak RSS while it ran; on Linux the peak is
+reset between phases through /proc/self/clear_refs. --trace-memory also records
+Python allocations with tracemalloc, which slows every phase down several times.
+Results are written as JSON. --compare prints how each timing moved against an
+earlier results file. The PDF export is by far the slowest phase at 1M leads.
+
+    python benchmarks.py --sizes 10000,100000,1000000 --output results.json
+    python benchmarks.py --sizes 100000 --skip pdf --compare results.json
+"""
+import argparse
+import asyncio
+import importlib.util
+import json
+import os
+import platform
+import random
+import sqlite3
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from urllib.parse import urlencode
+
+import appointments
+import database
+import email_queue
+import form_intake
+import geo
+import lead_counts
+import lead_dedupe
+import lead_export
+import lead_import
+import lead_query
+import leads
+import migrations
+import sms_mock
+import sms_queue
+import smtp_mock
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+FIRST_NAMES = (
+    "James", "Mary", "John", "Patricia", "Robert", "Jennifer", "Michael", "Linda", "William", "Elizabeth",
+    "David", "Barbara", "Richard", "Susan", "Joseph", "Jessica", "Thomas", "Sarah", "Carlos", "Karen",
+    "Daniel", "Nancy", "Matthew", "Lisa", "Anthony", "Betty", "Mark", "Margaret", "Donald", "Sandra",
+)
+LAST_NAMES = (
+    "Smith", "Johnson", "Williams", "Brown", "Jones", "Garcia", "Miller", "Davis", "Rodriguez", "Martinez",
+    "Hernandez", "Lopez", "Gonzalez", "Wilson", "Anderson", "Thomas", "Taylor", "Moore", "Jackson", "Martin",
+    "Lee", "Perez", "Thompson", "White", "Harris", "Sanchez", "Clark", "Ramirez", "Lewis", "Robinson",
+)
+CITIES = (
+    ("Springfield", "IL"), ("Austin", "TX"), ("Houston", "TX"), ("Denver", "CO"), ("Phoenix", "AZ"),
+    ("Portland", "OR"), ("Columbus", "OH"), ("Raleigh", "NC"), ("Tampa", "FL"), ("Boise", "ID"),
+    ("Madison", "WI"), ("Tulsa", "OK"), ("Reno", "NV"), ("Omaha", "NE"), ("Spokane", "WA"),
+)
+STREETS = ("Main St", "Oak Ave", "Maple Dr", "Cedar Ln", "Pine St", "Elm St", "Lake Rd", "Hill Ct")
+NOTE_WORDS = (
+    "roof", "leak", "kitchen", "remodel", "deck", "fence", "bathroom", "tile", "siding", "gutter",
+    "paint", "window", "hvac", "estimate", "urgent", "callback", "quote", "basement", "flooring", "solar",
+)
+REFERRERS = ("", "", "Google", "Yelp", "Angi", "Neighbor", "Facebook", "Repeat customer")
+
+EXPORTS = ("csv", "txt", "pdf", "pdf_parallel")
+
+GRID_PAGE_SIZE = 200
+GRID_VISIBLE_ROWS = 40
+GRID_JUMPS = 200
+SINGLE_ADDS = 1000
+QUERY_REPEATS = 5
+# Grid sorts timed for their first page and a page from the middle of the table
+SORTS = ("lead_status,last_name", "city,zipcode", "-id", "-last_name", "email", "last_name,first_name", "notes")
+CALENDAR_DAYS = 3650
+CALENDAR_LOOKUPS = 1000
+# One appointment per this many leads, spread over a year of working hours
+LEADS_PER_APPOINTMENT = 10
+# Radius searches from leads picked at random, and route sizes to plan
+NEAR_SEARCHES = 100
+NEAR_MILES = (15.0, 100.0)
+ROUTE_STOPS = (10, 25, 100)
+# Leads per bulk edit, delete and undo, like clearing out a filter's worth of bad leads
+BULK_LEADS = 5000
+# The SMS campaign goes to at most this many leads; the mock answers every Nth send with 429
+SMS_MESSAGES = 10000
+SMS_RATE = 2000.0
+SMS_RATE_LIMIT_EVERY = 500
+# Likewise for the email campaign, whose stand-in ends sessions after SMTP_SESSION_LIMIT messages
+EMAIL_MESSAGES = 10000
+EMAIL_RATE = 2000.0
+SMTP_SESSION_LIMIT = 100
+
+FORM_SUBMISSIONS = 20000
+FORM_CONNECTIONS = 64
+# Every Nth submission reuses an existing lead's phone number, to exercise dedupe-on-submit
+FORM_DUPLICATE_EVERY = 10
+
+
+def synthetic_leads(count, seed=0):
+    """Yield count Leads, the same leads for the same seed."""
+    rng = random.Random(seed)
+    for number in range(count):
+        first_name = rng.choice(FIRST_NAMES)
+        last_name = rng.choice(LAST_NAMES)
+        city, state = rng.choice(CITIES)
+        yield leads.Lead(
+            first_name, last_name,
+            f"{rng.randint(1, 9999)} {rng.choice(STREETS)}", rng.choice(("", "", "", f"Apt {rng.randint(1, 40)}")),
+            city, state, f"{rng.randint(10000, 99999)}",
+            f"{rng.randint(200, 989)}-{rng.randint(200, 999)}-{rng.randint(0, 9999):04d}",
+            f"{first_name.lower()}.{last_name.lower()}{number}@example.com",
+            " ".join(rng.sample(NOTE_WORDS, 4)),
+            rng.choice(REFERRERS), "",
+            rng.choice(leads.JOB_TYPES), rng.randrange(len(leads.LEAD_STATUSES)),
+        )
+
+
+class Phase:
+    """Times a block and records its memory high-water mark into results[name]."""
+    def __init__(self, results, name, trace_memory):
+        self.results = results
+        self.name = name
+        self.trace_memory = trace_memory
+
+    def __enter__(self):
+        self.result = self.results.setdefault(self.name, {})
+        reset_peak_rss()
+        if self.trace_memory:
+            tracemalloc.reset_peak()
+            self.memory_before = tracemalloc.get_traced_memory()[0]
+        self.started = time.perf_counter()
+        return self.result
+
+    def __exit__(self, *exc_info):
+        self.result["seconds"] = round(time.perf_counter() - self.started, 6)
+        if self.trace_memory:
+            current, peak = tracemalloc.get_traced_memory()
+            self.result["peak_mb"] = round((peak - self.memory_before) / 2 ** 20, 3)
+            self.result["retained_mb"] = round((current - self.memory_before) / 2 ** 20, 3)
+        self.result["peak_rss_mb"] = peak_rss_mb()
+
+
+def reset_peak_rss():
+    try:
+        with open("/proc/self/clear_refs", "w") as file:
+            file.write("5")
+    except OSError:
+        # Elsewhere the peak only ever grows, so it covers every phase up to this one
+        pass
+
+
+def peak_rss_mb():
+    try:
+        with open("/proc/self/status") as file:
+            for line in file:
+                if line.startswith("VmHWM:"):
+                    return round(int(line.split()[1]) / 1024, 1)
+    except OSError:
+        pass
+    try:
+        import resource
+    except ImportError:
+        return None
+    # ru_maxrss is in kilobytes on Linux and bytes on macOS
+    scale = 2 ** 20 if sys.platform == "darwin" else 1024
+    return round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / scale, 1)
+
+
+def query_filters(connection):
+    """Filters worth timing for this database, including lookups that match one row and most rows."""
+    phone, email = connection.execute("SELECT phone, email FROM leads ORDER BY id LIMIT 1").fetchone()
+    return {
+        "name_broad": {"name": "J"},
+        "name_word": {"name": "Garcia"},
+        "phone_prefix": {"phone": phone[:7]},
+        "email_one_match": {"email": email},
+        "city": {"city": "Spring"},
+        "state": {"state": "TX"},
+        "job_type": {"job_type": "Commercial"},
+        "lead_status": {"lead_status": 1},
+        "text": {"text": "roof leak"},
+        "combined": {"city": "Austin", "job_type": "Residential", "lead_status": 2, "text": "kitchen"},
+    }
+
+
+def bench_import(results, path, count, seed, trace_memory):
+    connection = leads.open_database(path)
+    try:
+        with Phase(results, "import", trace_memory) as result:
+            imported = lead_import.import_leads(connection, synthetic_leads(count, seed))[0]
+        result["rows"] = imported
+        result["rows_per_second"] = round(imported / result["seconds"])
+    finally:
+        connection.close()
+
+
+def bench_single_adds(results, path, trace_memory):
+    """Add leads one transaction at a time, the way the input form does, then remove them again."""
+    connection = database.connect(path)
+    try:
+        lead_ids = []
+        with Phase(results, "add_lead", trace_memory) as result:
+            for number in range(SINGLE_ADDS):
+                with connection:
+                    lead_ids.append(leads.add_lead(connection, leads.Lead(first_name="Bench", last_name=str(number))))
+        result["adds"] = SINGLE_ADDS
+        result["ms_per_add"] = round(result["seconds"] * 1000 / SINGLE_ADDS, 3)
+        with connection:
+            leads.delete_leads(connection, lead_ids)
+    finally:
+        connection.close()
+
+
+def bench_queries(results, path):
+    connection = database.connect(path)
+    try:
+        queries = results.setdefault("queries", {})
+        for name, filters in query_filters(connection).items():
+            # The first page is what the grid waits for after a filter changes
+            timings = []
+            for _ in range(QUERY_REPEATS):
+                started = time.perf_counter()
+                page = list(leads.query_leads(connection, filters, limit=GRID_PAGE_SIZE, page_size=GRID_PAGE_SIZE))
+                timings.append(time.perf_counter() - started)
+            started = time.perf_counter()
+            matches = leads.count_leads(connection, filters)
+            queries[name] = {
+                "first_page_seconds": round(statistics.median(timings), 6),
+                "first_page_rows": len(page),
+                "count_seconds": round(time.perf_counter() - started, 6),
+                "matches": matches,
+            }
+
+        sorts = results.setdefault("sorts", {})
+        total = lead_counts.total(connection)
+        for text in SORTS:
+            sort = lead_query.parse_sort(text)
+            first_timings = []
+            for _ in range(QUERY_REPEATS):
+                started = time.perf_counter()
+                page = leads.fetch_sorted_page(connection, None, GRID_PAGE_SIZE, sort=sort)
+                first_timings.append(time.perf_counter() - started)
+            # Keyset pages should cost the same halfway down as at the top
+            middle = leads.select_leads(connection, f"{leads.SELECT_SQL} ORDER BY {lead_query.order_by(sort)} "
+                                                    f"LIMIT 1 OFFSET ?", (total // 2,)).fetchone()
+            middle_timings = []
+            for _ in range(QUERY_REPEATS):
+                started = time.perf_counter()
+                leads.fetch_sorted_page(connection, lead_query.sort_key(middle, sort), GRID_PAGE_SIZE, sort=sort)
+                middle_timings.append(time.perf_counter() - started)
+            sorts[text] = {
+                "first_page_seconds": round(statistics.median(first_timings), 6),
+                "middle_page_seconds": round(statistics.median(middle_timings), 6),
+                "first_page_rows": len(page),
+            }
+
+        # The dashboard reads materialized counts; the scan is what it would cost without them
+        counter_timings = []
+        for _ in range(QUERY_REPEATS):
+            started = time.perf_counter()
+            leads.lead_stats(connection)
+            counter_timings.append(time.perf_counter() - started)
+        scan_timings = []
+        for _ in range(QUERY_REPEATS):
+            started = time.perf_counter()
+            for sql in lead_counts.DIMENSIONS.values():
+                connection.execute(f"SELECT {sql.format(row='')}, COUNT(*) FROM leads GROUP BY 1").fetchall()
+            scan_timings.append(time.perf_counter() - started)
+        results["dashboard"] = {
+            "counters_seconds": round(statistics.median(counter_timings), 6),
+            "scan_seconds": round(statistics.median(scan_timings), 6),
+        }
+    finally:
+        connection.close()
+
+
+def synthetic_centroids(seed=0):
+    """Yield a centroid for every ZIP code synthetic_leads uses, scattered over the continental US."""
+    rng = random.Random(seed)
+    for zipcode in range(10000, 100000):
+        yield str(zipcode), rng.uniform(25.0, 49.0), rng.uniform(-124.0, -67.0)
+
+
+def bench_geo(results, path, seed):
+    """Load ZIP centroids, then time radius searches around random leads and route planning."""
+    rng = random.Random(seed)
+    connection = database.connect(path)
+    try:
+        result = results["geo"] = {}
+        started = time.perf_counter()
+        with connection:
+            result["zipcodes"], result["located"] = geo.load_centroids(connection, synthetic_centroids(seed))
+        result["load_seconds"] = round(time.perf_counter() - started, 6)
+
+        lead_count = leads.count_leads(connection)
+        centers = [geo.lead_location(connection, rng.randrange(1, lead_count + 1)) for _ in range(NEAR_SEARCHES)]
+        for miles in NEAR_MILES:
+            timings = []
+            found = 0
+            for center in centers:
+                started = time.perf_counter()
+                found += len(leads.leads_near(connection, center, miles, {"lead_status": 1}))
+                timings.append(time.perf_counter() - started)
+            result[f"near_{miles:g}_miles"] = {
+                "median_seconds": round(statistics.median(timings), 6),
+                "max_seconds": round(max(timings), 6),
+                "mean_matches": round(found / NEAR_SEARCHES, 1),
+            }
+
+        for stops in ROUTE_STOPS:
+            # A day's stops spread over one metro area: the leads nearest a random one
+            nearby = leads.leads_near(connection, centers[0], 200.0)[:stops]
+            lead_ids = [lead.id for _, lead in nearby]
+            started = time.perf_counter()
+            route, miles, _ = leads.plan_visits(connection, lead_ids, centers[0])
+            result[f"route_{stops}_stops"] = {
+                "seconds": round(time.perf_counter() - started, 6),
+                "miles": round(miles, 1),
+                "input_order_miles": round(geo.route_length(
+                    [geo.lead_location(connection, lead_id) for lead_id in lead_ids],
+                    range(len(lead_ids)), centers[0]), 1),
+            }
+    finally:
+        connection.close()
+
+
+def bench_bulk(results, path, seed):
+    """Time a bulk status change, soft delete and undo of BULK_LEADS random leads, each one transaction."""
+    rng = random.Random(seed)
+    connection = database.connect(path)
+    try:
+        lead_count = leads.count_leads(connection)
+        lead_ids = rng.sample(range(1, lead_count + 1), min(BULK_LEADS, lead_count))
+        result = results["bulk"] = {"leads": len(lead_ids)}
+        started = time.perf_counter()
+        with connection:
+            leads.update_leads(connection, lead_ids, lead_status=3)
+        result["update_seconds"] = round(time.perf_counter() - started, 6)
+        started = time.perf_counter()
+        with connection:
+            batch, _ = leads.soft_delete_leads(connection, lead_ids)
+        result["delete_seconds"] = round(time.perf_counter() - started, 6)
+        started = time.perf_counter()
+        with connection:
+            leads.restore_leads(connection, batch)
+        result["restore_seconds"] = round(time.perf_counter() - started, 6)
+        result["counts_drift"] = len(lead_counts.find_drift(connection))
+    finally:
+        connection.close()
+
+
+def bench_forms(results, path, seed):
+    """Post FORM_SUBMISSIONS form submissions to form_intake over FORM_CONNECTIONS kept-alive connections.
+
+    Client and server share one event loop, so the rate is a lower bound for the server alone.
+    The duplicate index is brought up to date first, untimed, as the app does at startup.
+    """
+    rng = random.Random(seed)
+    connection = database.connect(path)
+    try:
+        started = time.perf_counter()
+        lead_dedupe.refresh_index(connection)
+        index_seconds = round(time.perf_counter() - started, 6)
+        with connection:
+            form = form_intake.create_form(connection, "Bench")
+        lead_count = leads.count_leads(connection)
+        known_phones = [row[0] for row in connection.execute(
+            f"SELECT phone FROM leads WHERE id IN ({leads.IDS_SQL})",
+            (json.dumps(rng.sample(range(1, lead_count + 1), min(lead_count, FORM_SUBMISSIONS // FORM_DUPLICATE_EVERY))),))]
+    finally:
+        connection.close()
+
+    bodies = []
+    for number in range(FORM_SUBMISSIONS):
+        phone = (known_phones[number // FORM_DUPLICATE_EVERY] if number % FORM_DUPLICATE_EVERY == 0
+                 and number // FORM_DUPLICATE_EVERY < len(known_phones) else f"1-800-{number:07d}")
+        bodies.append(urlencode({"first_name": rng.choice(FIRST_NAMES), "last_name": rng.choice(LAST_NAMES),
+                                 "phone": phone, "zipcode": f"{rng.randint(10000, 99999)}",
+                                 "notes": " ".join(rng.sample(NOTE_WORDS, 4))}).encode())
+
+    async def submit():
+        server = form_intake.IntakeServer(path)
+        port = await server.start(port=0)
+        pool = sms_queue.HTTPConnectionPool(f"http://127.0.0.1:{port}", size=FORM_CONNECTIONS)
+        headers = ["Content-Type: application/x-www-form-urlencoded"]
+        latencies = []
+        statuses = []
+        pending = iter(bodies)
+
+        async def client():
+            # Each client posts its next submission once the last one is answered, like a busy browser
+            for body in pending:
+                posted = time.perf_counter()
+                status, _, _ = await pool.request("POST", f"/forms/{form.slug}", headers, body)
+                latencies.append(time.perf_counter() - posted)
+                statuses.append(status)
+
+        started = time.perf_counter()
+        try:
+            await asyncio.gather(*(client() for _ in range(FORM_CONNECTIONS)))
+        finally:
+            seconds = time.perf_counter() - started
+            await pool.close()
+            await server.close()
+        return seconds, statuses, sorted(latencies), server
+
+    seconds, statuses, latencies, server = asyncio.run(submit())
+    connection = database.connect(path)
+    try:
+        drift = len(lead_counts.find_drift(connection))
+    finally:
+        connection.close()
+    results["forms"] = {
+        "submissions": len(bodies),
+        "seconds": round(seconds, 6),
+        "submissions_per_second": round(len(bodies) / seconds),
+        "accepted": statuses.count(303),
+        "written": server.written,
+        "duplicates": server.duplicates,
+        "batches": server.batches,
+        "mean_batch": round(len(bodies) / max(server.batches, 1), 1),
+        "p50_ms": round(latencies[len(latencies) // 2] * 1000, 2),
+        "p99_ms": round(latencies[len(latencies) * 99 // 100] * 1000, 2),
+        "connections": server.connections,
+        "index_seconds": index_seconds,
+        "counts_drift": drift,
+    }
+
+
+def bench_appointments(results, path, seed):
+    """Book appointments for some of the leads, then time a week's agenda and per-lead histories."""
+    rng = random.Random(seed)
+    connection = database.connect(path)
+    try:
+        lead_count = leads.count_leads(connection)
+        start = time.mktime((2024, 1, 1, 0, 0, 0, 0, 0, -1))
+        booked = []
+        for _ in range(max(1, lead_count // LEADS_PER_APPOINTMENT)):
+            day = start + rng.randrange(365) * 86400
+            hour = rng.randrange(8, 17)
+            booked.append(appointments.Appointment(
+                rng.randrange(1, lead_count + 1),
+                time.strftime(f"%Y-%m-%d {hour:02d}:00", time.localtime(day)),
+                time.strftime(f"%Y-%m-%d {hour + 1:02d}:00", time.localtime(day))))
+        started = time.perf_counter()
+        with connection:
+            for appointment in booked:
+                appointments.add_appointment(connection, appointment)
+        insert_seconds = time.perf_counter() - started
+
+        week_timings = []
+        for _ in range(QUERY_REPEATS):
+            week_start = start + rng.randrange(358) * 86400
+            started = time.perf_counter()
+            week = appointments.agenda(connection, time.strftime("%Y-%m-%d", time.localtime(week_start)),
+                                       time.strftime("%Y-%m-%d", time.localtime(week_start + 7 * 86400)))
+            week_timings.append(time.perf_counter() - started)
+        history_timings = []
+        for appointment in rng.sample(booked, min(len(booked), 100)):
+            started = time.perf_counter()
+            appointments.lead_history(connection, appointment.lead_id)
+            history_timings.append(time.perf_counter() - started)
+        results["appointments"] = {
+            "appointments": len(booked),
+            "insert_seconds": round(insert_seconds, 6),
+            "week_agenda_seconds": round(statistics.median(week_timings), 6),
+            "week_appointments": len(week),
+            "lead_history_seconds": round(statistics.median(history_timings), 6),
+        }
+    finally:
+        connection.close()
+
+
+def bench_sms(results, path, trace_memory):
+    """Queue a campaign to the first SMS_MESSAGES leads and send it through sms_mock over pooled connections."""
+    with tempfile.TemporaryDirectory() as directory:
+        queue = database.connect(os.path.join(directory, "twilio.db"))
+        leads_connection = database.connect(path)
+        try:
+            migrations.migrate(queue, migrations.TWILIO_MIGRATIONS)
+            with Phase(results, "sms_enqueue", trace_memory) as result:
+                with queue:
+                    _, queued, skipped = sms_queue.enqueue_campaign(
+                        queue, leads_connection, "Bench", "Hi $first_name, about your $city project", limit=SMS_MESSAGES)
+            result["queued"] = queued
+            result["skipped"] = skipped
+
+            async def send():
+                server = sms_mock.MockTwilioServer(rate_limit_every=SMS_RATE_LIMIT_EVERY)
+                transport = sms_queue.TwilioTransport("ACbench", "token", "+15550000000", await server.start())
+                try:
+                    sent = await sms_queue.SmsWorker(queue, transport, SMS_RATE, concurrency=16).run()
+                finally:
+                    await transport.close()
+                    await server.close()
+                return sent, server.connections, server.requests
+
+            with Phase(results, "sms_send", trace_memory) as result:
+                sent, connections, requests = asyncio.run(send())
+            result["sent"] = sent
+            result["messages_per_second"] = round(sent / result["seconds"])
+            result["http_requests"] = requests
+            result["connections_opened"] = connections
+        finally:
+            leads_connection.close()
+            queue.close()
+
+
+def bench_email(results, path, trace_memory):
+    """Queue a campaign to the first EMAIL_MESSAGES leads and send it through smtp_mock over persistent sessions."""
+    server = smtp_mock.MockSmtpServer("bench", "secret", max_messages_per_connection=SMTP_SESSION_LIMIT)
+    port = server.start_thread()
+    with tempfile.TemporaryDirectory() as directory:
+        queue = database.connect(os.path.join(directory, "email.db"))
+        leads_connection = database.connect(path)
+        try:
+            migrations.migrate(queue, migrations.EMAIL_MIGRATIONS)
+            with Phase(results, "email_enqueue", trace_memory) as result:
+                with queue:
+                    _, queued, skipped = email_queue.enqueue_campaign(
+                        queue, leads_connection, "Bench", "A quote for $first_name",
+                        "Hi $first_name,\n\nAbout your project in $city: ...\n", limit=EMAIL_MESSAGES)
+            result["queued"] = queued
+            result["skipped"] = skipped
+
+            settings = email_queue.SmtpSettings("127.0.0.1", port, "none", "bench", "secret", "bench@example.com")
+            transport = email_queue.SmtpTransport(settings)
+            with Phase(results, "email_send", trace_memory) as result:
+                try:
+                    sent = email_queue.EmailWorker(queue, transport, EMAIL_RATE).run()
+                finally:
+                    transport.close()
+            result["sent"] = sent
+            result["messages_per_second"] = round(sent / result["seconds"])
+            result["connections_opened"] = transport.opened
+            result["logins"] = server.logins
+        finally:
+            leads_connection.close()
+            queue.close()
+            server.stop_thread()
+
+
+def bench_exports(results, path, skip, trace_memory):
+    connection = database.connect(path)
+    try:
+        with tempfile.TemporaryDirectory() as directory:
+            for name in EXPORTS:
+                if name in skip:
+                    continue
+                export = getattr(lead_export, f"export_{name}")
+                output = os.path.join(directory, f"{name}.{name.split('_')[0]}")
+                with Phase(results, f"export_{name}", trace_memory) as result:
+                    exported, _ = export(connection, output)
+                result["rows"] = exported
+                result["rows_per_second"] = round(exported / result["seconds"]) if result["seconds"] else None
+                result["file_mb"] = round(os.path.getsize(output) / 2 ** 20, 3)
+                if name == "pdf_parallel":
+                    result["workers"] = os.cpu_count()
+    finally:
+        connection.close()
+
+
+def load_app():
+    """Import the GUI module (its file name has spaces, so it can't be imported by name) and start Qt offscreen."""
+    os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+    spec = importlib.util.spec_from_file_location("leads_app", os.path.join(HERE, "well i tried.py"))
+    app = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(app)
+    qapp = app.QApplication.instance() or app.QApplication([sys.argv[0]])
+    return app, qapp
+
+
+def wait_until(qapp, condition):
+    from PyQt5.QtCore import QEventLoop
+    while not condition():
+        # Results from the database executor arrive as queued signals
+        qapp.processEvents(QEventLoop.WaitForMoreEvents)
+
+
+def paint(model, top):
+    """Read every cell of GRID_VISIBLE_ROWS rows from top, as the view does when painting.
+
+    Returns False while any of them is still loading, which the model signals by returning None.
+    """
+    painted = True
+    for row in range(top, min(top + GRID_VISIBLE_ROWS, model.rowCount())):
+        for column in range(len(leads.LEAD_FIELDS)):
+            if model.data(model.index(row, column)) is None:
+                painted = False
+    return painted
+
+
+def bench_grid(results, path, app, qapp, trace_memory):
+    """Load the grid model the way the view does: the first page, then page after page to the end."""
+    repository = app.LeadRepository(database.get_database(path))
+    model = app.LeadsTableModel(repository, GRID_PAGE_SIZE)
+    try:
+        with Phase(results, "grid_first_page", trace_memory) as result:
+            model.refresh()
+            wait_until(qapp, lambda: model.rowCount() or model.exhausted)
+        result["rows"] = model.rowCount()
+
+        with Phase(results, "grid_full_load", trace_memory) as result:
+            while not model.exhausted:
+                model.fetchMore()
+                wait_until(qapp, lambda: not model.fetching)
+        result["rows"] = model.rowCount()
+        result["pages"] = -(-model.rowCount() // GRID_PAGE_SIZE)
+
+        # Jump around the loaded rows like dragging the scroll bar, reading a screenful each time
+        rng = random.Random(0)
+        rows = model.rowCount()
+        with Phase(results, "grid_scroll", trace_memory) as result:
+            for _ in range(GRID_JUMPS):
+                top = rng.randrange(max(1, rows - GRID_VISIBLE_ROWS))
+                wait_until(qapp, lambda: paint(model, top))
+        result["jumps"] = GRID_JUMPS
+        result["ms_per_jump"] = round(result["seconds"] * 1000 / GRID_JUMPS, 3)
+    finally:
+        model.deleteLater()
+        repository.deleteLater()
+        database.get_database(path).close()
+
+
+def bench_calendar(results, directory, app, trace_memory):
+    """Look up notes through the calendar tab's month cache, for random days and for consecutive ones."""
+    path = os.path.join(directory, "calendar.db")
+    calendar_db = database.get_database(path)
+    with calendar_db.lock:
+        migrations.migrate(calendar_db.writer, migrations.CALENDAR_MIGRATIONS)
+    rng = random.Random(0)
+    start = time.mktime((2020, 1, 1, 12, 0, 0, 0, 0, -1))
+    days = [time.strftime("%Y-%m-%d", time.localtime(start + day * 86400)) for day in range(CALENDAR_DAYS)]
+    with calendar_db.transaction() as connection:
+        connection.executemany("INSERT OR REPLACE INTO Calendar (Date, Notes) VALUES (?, ?)",
+                               ((day, " ".join(rng.sample(NOTE_WORDS, 5))) for day in days[::2]))
+    tab = app.OfflineCalendarTab(calendar_db)
+    try:
+        lookups = [rng.choice(days) for _ in range(CALENDAR_LOOKUPS)]
+        with Phase(results, "calendar_lookup", trace_memory) as result:
+            for day in lookups:
+                tab.notes_cache.notes(day)
+        result["lookups"] = CALENDAR_LOOKUPS
+        result["us_per_lookup"] = round(result["seconds"] * 1e6 / CALENDAR_LOOKUPS, 2)
+
+        # Paging through the calendar and clicking each date: one query per month, the rest from memory
+        tab.notes_cache.clear()
+        with Phase(results, "calendar_browse", trace_memory) as result:
+            for day in days[:CALENDAR_LOOKUPS]:
+                tab.notes_cache.notes(day)
+        result["lookups"] = CALENDAR_LOOKUPS
+        result["us_per_lookup"] = round(result["seconds"] * 1e6 / CALENDAR_LOOKUPS, 2)
+    finally:
+        tab.deleteLater()
+        calendar_db.close()
+
+
+def git_revision():
+    try:
+        return subprocess.run(["git", "describe", "--always", "--dirty"], cwd=HERE, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run(sizes, skip, seed, trace_memory):
+    report = {
+        "revision": git_revision(),
+        "started": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": platform.python_version(),
+        "sqlite": sqlite3.sqlite_version,
+        "platform": platform.platform(),
+        "trace_memory": trace_memory,
+        "sizes": {},
+    }
+    app = qapp = None
+    if "grid" not in skip or "calendar" not in skip:
+        app, qapp = load_app()
+    if trace_memory:
+        tracemalloc.start()
+    try:
+        with tempfile.TemporaryDirectory() as directory:
+            if "calendar" not in skip:
+                print("calendar", file=sys.stderr)
+                bench_calendar(report, directory, app, trace_memory)
+            for size in sizes:
+                print(f"{size} leads", file=sys.stderr)
+                results = report["sizes"][str(size)] = {}
+                path = os.path.join(directory, f"leads_{size}.db")
+                bench_import(results, path, size, seed, trace_memory)
+                if "add" not in skip:
+                    bench_single_adds(results, path, trace_memory)
+                if "queries" not in skip:
+                    bench_queries(results, path)
+                if "appointments" not in skip:
+                    bench_appointments(results, path, seed)
+                if "geo" not in skip:
+                    bench_geo(results, path, seed)
+                if "bulk" not in skip:
+                    bench_bulk(results, path, seed)
+                if "forms" not in skip:
+                    bench_forms(results, path, seed)
+                if "sms" not in skip:
+                    bench_sms(results, path, trace_memory)
+                if "email" not in skip:
+                    bench_email(results, path, trace_memory)
+                if "grid" not in skip:
+                    bench_grid(results, path, app, qapp, trace_memory)
+                bench_exports(results, path, skip, trace_memory)
+                database.close_all()
+                os.remove(path)
+    finally:
+        if trace_memory:
+            tracemalloc.stop()
+        if app is not None:
+            app.get_executor().shutdown()
+    return report
+
+
+def timings(report, prefix=""):
+    """Flatten every "...seconds" entry of a results file into {"path/to/phase.key": seconds}."""
+    flat = {}
+    for key, value in report.items():
+        if isinstance(value, dict):
+            flat.update(timings(value, f"{prefix}{key}/"))
+        elif key.endswith("seconds") and isinstance(value, (int, float)):
+            flat[f"{prefix.rstrip('/')}.{key}"] = value
+    return flat
+
+
+def compare(report, baseline):
+    before = timings(baseline)
+    after = timings(report)
+    print(f"{'timing':<52}{'before':>10}{'after':>10}{'change':>9}")
+    for name, seconds in after.items():
+        if name in before and before[name]:
+            change = (seconds - before[name]) / before[name] * 100
+            print(f"{name:<52}{before[name]:>10.4f}{seconds:>10.4f}{change:>+8.0f}%")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the leads database, exporters, grid and calendar.")
+    parser.add_argument("--sizes", default="10000,100000,1000000",
+                        help="comma separated lead counts to benchmark (default: %(default)s)")
+    parser.add_argument("--skip", default="", help="comma separated phases to leave out: "
+                        "add, queries, appointments, geo, bulk, forms, sms, email, grid, calendar, " + ", ".join(EXPORTS))
+    parser.add_argument("--seed", type=int, default=0, help="seed for the synthetic leads (default: %(default)s)")
+    parser.add_argument("--trace-memory", action="store_true",
+                        help="also record Python allocations with tracemalloc (slows every phase down)")
+    parser.add_argument("--output", default="benchmark-results.json", help="results file (default: %(default)s)")
+    parser.add_argument("--compare", help="an earlier results file to compare timings against")
+    args = parser.parse_args(argv)
+
+    sizes = [int(size.replace("_", "")) for size in args.sizes.split(",") if size]
+    skip = {phase.strip() for phase in args.skip.split(",") if phase.strip()}
+    report = run(sizes, skip, args.seed, args.trace_memory)
+    with open(args.output, "w") as file:
+        json.dump(report, file, indent=2)
+    print(f"Results written to {args.output}", file=sys.stderr)
+    if args.compare:
+        with open(args.compare) as file:
+            compare(report, json.load(file))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,110 @@
+"""Shared, tuned SQLite connections for every database file the app uses.
+
+Each file gets one Database: a single writer connection guarded by a lock and a
+reader connection per thread. Connections are opened once and reused, run in WAL
+mode so readers never wait on the writer, and keep a prepared-statement cache.
+"""
+import os
+import sqlite3
+import threading
+from contextlib import contextmanager
+
+LEADS_DATABASE = "leads_database.db"
+CALENDAR_DATABASE = "calendar.db"
+TWILIO_DATABASE = "twilio_credentials.db"
+EMAIL_DATABASE = "email_campaigns.db"
+
+PRAGMAS = (
+    "PRAGMA journal_mode = WAL",
+    "PRAGMA synchronous = NORMAL",
+    "PRAGMA mmap_size = 268435456",
+    "PRAGMA cache_size = -65536",
+    "PRAGMA temp_store = MEMORY",
+    "PRAGMA busy_timeout = 5000",
+)
+
+CACHED_STATEMENTS = 256
+
+
+def connect(path, check_same_thread=True):
+    """Open a new connection to path with the app's pragmas applied."""
+    connection = sqlite3.connect(path, check_same_thread=check_same_thread, cached_statements=CACHED_STATEMENTS)
+    for pragma in PRAGMAS:
+        connection.execute(pragma)
+    return connection
+
+
+class Database:
+    """The pooled connections for one database file."""
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.RLock()
+        self.local = threading.local()
+        self.readers = []
+        self._writer = None
+
+    @property
+    def writer(self):
+        """The single connection all writes go through; hold self.lock while using it off the GUI thread."""
+        with self.lock:
+            if self._writer is None:
+                self._writer = connect(self.path, check_same_thread=False)
+            return self._writer
+
+    def reader(self):
+        """A read-only connection owned by the calling thread."""
+        connection = getattr(self.local, "connection", None)
+        if connection is None:
+            connection = connect(self.path)
+            connection.execute("PRAGMA query_only = ON")
+            self.local.connection = connection
+            with self.lock:
+                self.readers.append(connection)
+        return connection
+
+    @contextmanager
+    def transaction(self):
+        """Hold the write lock and yield the writer, committing on success and rolling back on error."""
+        with self.lock:
+            connection = self.writer
+            try:
+                yield connection
+            except BaseException:
+                connection.rollback()
+                raise
+            else:
+                connection.commit()
+
+    def close(self):
+        with self.lock:
+            for connection in self.readers:
+                try:
+                    connection.close()
+                except sqlite3.ProgrammingError:
+                    # Readers belong to their threads; one that already exited can't be closed from here
+                    pass
+            self.readers = []
+            self.local = threading.local()
+            if self._writer is not None:
+                self._writer.close()
+                self._writer = None
+
+
+_databases = {}
+_databases_lock = threading.Lock()
+
+
+def get_database(path):
+    """Return the shared Database for path, creating it on first use."""
+    key = os.path.abspath(path)
+    with _databases_lock:
+        if key not in _databases:
+            _databases[key] = Database(path)
+        return _databases[key]
+
+
+def close_all():
+    with _databases_lock:
+        for db in _databases.values():
+            db.close()
+        _databases.clear()
@@ -0,0 +1,494 @@
+"""Email campaigns: a send queue in SQLite drained over a few persistent SMTP sessions.
+
+enqueue_campaign renders each matching lead's subject and body into email_messages
+(see migrations.create_email_queue), so a campaign survives restarts and a stopped
+one carries on where it left off. EmailWorker claims due messages a batch at a time
+and hands them to a small thread pool. SmtpTransport gives each of those threads one
+logged-in SMTP session that carries up to MESSAGES_PER_CONNECTION messages, rather
+than connecting and logging in for every message. Sends are spaced to a rate that
+halves whenever the server defers a message, and deferred messages are retried with
+backoff, through the queue mechanics shared with sms_queue in send_queue. Like
+sms_queue this has no Qt dependency; smtp_mock is a local SMTP server to try it
+against.
+
+    python email_queue.py configure --host smtp.gmail.com --username me@gmail.com --password ... --from me@gmail.com
+    python email_queue.py send --campaign "Spring promo" --subject 'Hi $first_name' --body-file promo.txt --city Spring
+    python email_queue.py run
+    python email_queue.py status
+"""
+import argparse
+import json
+import re
+import smtplib
+import ssl
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import astuple, dataclass
+from email.message import EmailMessage
+from email.utils import formataddr, formatdate, make_msgid
+
+import database
+import leads
+import migrations
+import send_queue
+
+PENDING = send_queue.PENDING
+SENDING = send_queue.SENDING
+SENT = send_queue.SENT
+FAILED = send_queue.FAILED
+MESSAGE_STATUSES = (PENDING, SENDING, SENT, FAILED)
+
+SECURITY_MODES = ("starttls", "ssl", "none")
+DEFAULT_PORTS = {"starttls": 587, "ssl": 465, "none": 25}
+# Gmail takes SMTP with an app password; it also caps how many messages an account sends a day
+GMAIL_SERVER = ("smtp.gmail.com", 587, "starttls")
+
+DEFAULT_RATE = 5.0
+DEFAULT_CONNECTIONS = 3
+# Providers commonly end a session after about this many messages, so start a fresh one first
+MESSAGES_PER_CONNECTION = 100
+# Deferrals are often greylisting, which wants the retry to come minutes later
+BACKOFF_SECONDS = 60.0
+MAX_BACKOFF_SECONDS = 3600.0
+# What EmailWorker.send returns for each message, followed by its id
+RESULT_COLUMNS = ("status", "attempts", "next_attempt_at", "error", "updated_at")
+SMTP_TIMEOUT = 30.0
+
+EMAIL_ADDRESS = re.compile(r"[^@\s<>,;]+@[^@\s<>,;]+\.[^@\s<>,;]+")
+
+
+@dataclass(slots=True)
+class SmtpSettings:
+    host: str
+    port: int
+    security: str = "starttls"
+    username: str | None = None
+    password: str | None = None
+    from_address: str = ""
+    from_name: str | None = None
+
+
+@dataclass(slots=True)
+class QueuedEmail:
+    id: int
+    to_address: str
+    subject: str
+    body: str
+    attempts: int = 0
+
+
+class SendError(Exception):
+    """A message the server refused or that never reached it.
+
+    Retryable errors are tried again later; deferred ones (4xx replies) also slow the
+    worker down.
+    """
+    def __init__(self, message, retryable=False, deferred=False):
+        super().__init__(message)
+        self.retryable = retryable
+        self.deferred = deferred
+
+
+def refusal(code, reply):
+    if isinstance(reply, bytes):
+        reply = reply.decode("utf-8", "replace")
+    temporary = 400 <= code < 500
+    return SendError(f"The mail server refused the message ({code}): {reply}", retryable=temporary, deferred=temporary)
+
+
+def email_address(email):
+    """Return email stripped of surrounding space, or None if it doesn't look deliverable."""
+    email = (email or "").strip()
+    return email if EMAIL_ADDRESS.fullmatch(email) else None
+
+
+def enqueue_campaign(connection, leads_connection, name, subject, body, filters=None, limit=None):
+    """Queue a message for every lead matching filters, or the first limit of them; returns (campaign_id, queued, skipped).
+
+    Leads without a usable email address are skipped, and so are repeats of an address
+    already in the campaign. Runs inside the caller's transaction on connection.
+    """
+    campaign_id = connection.execute(
+        "INSERT INTO email_campaigns (name, subject, body, created_at) VALUES (?, ?, ?, ?)",
+        (name, subject, body, time.strftime("%Y-%m-%d %H:%M"))).lastrowid
+    insert_sql = """
+        INSERT OR IGNORE INTO email_messages (campaign_id, lead_id, to_address, subject, body) VALUES (?, ?, ?, ?, ?)
+    """
+    skipped = 0
+    batch = []
+    for lead in leads.query_leads(leads_connection, filters, limit=limit):
+        address = email_address(lead.email)
+        if address is None:
+            skipped += 1
+            continue
+        # A subject is a single header line, whatever the lead's fields contain
+        lead_subject = " ".join(leads.fill_template(subject, lead).split())
+        batch.append((campaign_id, lead.id, address, lead_subject, leads.fill_template(body, lead)))
+        if len(batch) >= send_queue.ENQUEUE_BATCH_SIZE:
+            connection.executemany(insert_sql, batch)
+            batch = []
+    connection.executemany(insert_sql, batch)
+    queued = connection.execute("SELECT COUNT(*) FROM email_messages WHERE campaign_id = ?", (campaign_id,)).fetchone()[0]
+    return campaign_id, queued, skipped
+
+
+def claim_due(connection, limit, now):
+    """Mark up to limit messages that are due as sending and return them as QueuedEmails."""
+    return [QueuedEmail(*row) for row in send_queue.claim_due(
+        connection, "email_messages", "id, to_address, subject, body, attempts", limit, now)]
+
+
+def campaign_summaries(connection):
+    """Return [(campaign_id, name, created_at, {status: count})], newest campaign first."""
+    return send_queue.campaign_summaries(connection, "email_campaigns", "email_messages", MESSAGE_STATUSES)
+
+
+def load_settings(connection):
+    """Return the saved SmtpSettings, or None if there are none."""
+    row = connection.execute("""
+        SELECT host, port, security, username, password, from_address, from_name FROM smtp_settings LIMIT 1
+    """).fetchone()
+    return SmtpSettings(*row) if row else None
+
+
+def save_settings(connection, settings):
+    """Replace the saved SMTP settings. Runs inside the caller's transaction."""
+    connection.execute("DELETE FROM smtp_settings")
+    connection.execute("""
+        INSERT INTO smtp_settings (host, port, security, username, password, from_address, from_name)
+        VALUES (?, ?, ?, ?, ?, ?, ?)
+    """, astuple(settings))
+
+
+class SmtpTransport:
+    """Sends messages over persistent SMTP sessions, one per calling thread.
+
+    A thread's session is opened and logged into on its first send and reused until
+    it has carried messages_per_connection messages or the server drops it. Errors
+    about a single message raise SendError. Errors that stop every message, like a
+    rejected login or a server without STARTTLS, are raised as smtplib raised them.
+    """
+    def __init__(self, settings, messages_per_connection=MESSAGES_PER_CONNECTION, timeout=SMTP_TIMEOUT):
+        self.settings = settings
+        self.messages_per_connection = messages_per_connection
+        self.timeout = timeout
+        self.local = threading.local()
+        self.lock = threading.Lock()
+        self.sessions = []
+        self.opened = 0
+        sender_domain = settings.from_address.rpartition("@")[2]
+        self.message_id_domain = sender_domain or None
+
+    def connect(self):
+        settings = self.settings
+        if settings.security == "ssl":
+            session = smtplib.SMTP_SSL(settings.host, settings.port, timeout=self.timeout,
+                                       context=ssl.create_default_context())
+        else:
+            session = smtplib.SMTP(settings.host, settings.port, timeout=self.timeout)
+        try:
+            if settings.security == "starttls":
+                session.starttls(context=ssl.create_default_context())
+            if settings.username:
+                session.login(settings.username, settings.password or "")
+        except BaseException:
+            session.close()
+            raise
+        with self.lock:
+            self.sessions.append(session)
+            self.opened += 1
+        return session
+
+    def session(self):
+        session = getattr(self.local, "session", None)
+        if session is not None and self.local.sent >= self.messages_per_connection:
+            self.discard(session, polite=True)
+            session = None
+        if session is None:
+            session = self.local.session = self.connect()
+            self.local.sent = 0
+        return session
+
+    def discard(self, session, polite=False):
+        self.local.session = None
+        with self.lock:
+            if session in self.sessions:
+                self.sessions.remove(session)
+        close(session, polite)
+
+    def message(self, to_address, subject, body):
+        message = EmailMessage()
+        message["From"] = formataddr((self.settings.from_name or "", self.settings.from_address))
+        message["To"] = to_address
+        message["Subject"] = subject
+        message["Date"] = formatdate(localtime=True)
+        message["Message-ID"] = make_msgid(domain=self.message_id_domain)
+        message.set_content(body)
+        return message
+
+    def send(self, to_address, subject, body):
+        try:
+            message = self.message(to_address, subject, body)
+        except (ValueError, TypeError) as e:
+            # e.g. a header with a line break in it; no retry will fix that
+            raise SendError(f"Could not build the message: {e}")
+        while True:
+            reused = getattr(self.local, "session", None) is not None
+            try:
+                session = self.session()
+            except (smtplib.SMTPAuthenticationError, smtplib.SMTPNotSupportedError, ssl.SSLError):
+                raise
+            except smtplib.SMTPResponseException as e:
+                if e.smtp_code >= 500:
+                    raise
+                raise refusal(e.smtp_code, e.smtp_error)
+            except (smtplib.SMTPException, OSError) as e:
+                raise SendError(f"Could not reach the mail server: {e or type(e).__name__}", retryable=True)
+            try:
+                session.send_message(message)
+            except smtplib.SMTPRecipientsRefused as e:
+                code, reply = next(iter(e.recipients.values()))
+                raise refusal(code, reply)
+            except smtplib.SMTPResponseException as e:
+                if e.smtp_code != 421:
+                    raise refusal(e.smtp_code, e.smtp_error)
+                # 421 closes the session, often because it has carried as many messages as the server allows
+                self.discard(session)
+                if reused:
+                    continue
+                raise refusal(e.smtp_code, e.smtp_error)
+            except (smtplib.SMTPServerDisconnected, OSError) as e:
+                self.discard(session)
+                # The server may have dropped a session that sat idle; try once more on a new one
+                if reused:
+                    continue
+                raise SendError(f"Could not reach the mail server: {e or type(e).__name__}", retryable=True)
+            except Exception as e:
+                # e.g. a body that can't be encoded for this server; the session may be midway through a command
+                self.discard(session)
+                raise SendError(f"Could not send the message: {e or type(e).__name__}")
+            self.local.sent += 1
+            return
+
+    def close(self):
+        with self.lock:
+            sessions, self.sessions = self.sessions, []
+        for session in sessions:
+            close(session, polite=True)
+
+
+def close(session, polite=False):
+    try:
+        if polite:
+            session.quit()
+        else:
+            session.close()
+    except (smtplib.SMTPException, OSError):
+        session.close()
+
+
+def unexpected_failure(message, error):
+    """The result of a send that raised something other than SendError: failed, without a retry."""
+    return FAILED, message.attempts + 1, 0, f"{type(error).__name__}: {error}", time.time(), message.id
+
+
+class EmailWorker:
+    """Drains the queue in connection's database through transport from a pool of connections threads.
+
+    run() sends every due message, sleeps until retries come due, and returns once
+    nothing is left pending or should_stop() says so. Messages not yet sent stay
+    queued for the next run. progress() is called after each batch of results is
+    committed. connection is only used from the thread calling run().
+    """
+    def __init__(self, connection, transport, rate=DEFAULT_RATE, connections=DEFAULT_CONNECTIONS,
+                 max_attempts=send_queue.MAX_ATTEMPTS, progress=None):
+        self.connection = connection
+        self.transport = transport
+        self.rate = rate
+        self.connections = connections
+        self.max_attempts = max_attempts
+        self.progress = progress
+        self.should_stop = None
+        self.fatal = None
+
+    def stopping(self):
+        return self.fatal is not None or bool(self.should_stop and self.should_stop())
+
+    def run(self, should_stop=None):
+        """Return how many messages were sent; re-raises an error that keeps every message from being sent."""
+        self.should_stop = should_stop
+        self.fatal = None
+        self.limiter = send_queue.RateLimiter(self.rate)
+        send_queue.reset_interrupted(self.connection, "email_messages")
+        sent = 0
+        with ThreadPoolExecutor(max_workers=self.connections, thread_name_prefix="smtp") as pool:
+            while not self.stopping():
+                batch = claim_due(self.connection, send_queue.claim_size(self.limiter.rate, self.connections), time.time())
+                if batch:
+                    # send() records its own failures; checking each future keeps one it missed from losing the batch
+                    futures = [pool.submit(self.send, message) for message in batch]
+                    results = [unexpected_failure(message, future.exception()) if future.exception() else future.result()
+                               for message, future in zip(batch, futures)]
+                    send_queue.record_results(self.connection, "email_messages", RESULT_COLUMNS, results)
+                    sent += sum(1 for result in results if result[0] == SENT)
+                    if self.progress:
+                        self.progress()
+                    continue
+                next_due = send_queue.next_due_time(self.connection, "email_messages")
+                if next_due is None:
+                    break
+                time.sleep(min(max(next_due - time.time(), 0), send_queue.IDLE_CHECK_SECONDS))
+        if self.fatal is not None:
+            raise self.fatal
+        return sent
+
+    def send(self, message):
+        if not self.limiter.wait(self.stopping):
+            return PENDING, message.attempts, 0, None, time.time(), message.id
+        attempts = message.attempts + 1
+        try:
+            self.transport.send(message.to_address, message.subject, message.body)
+        except SendError as e:
+            if e.deferred:
+                self.limiter.throttled()
+            if e.retryable and attempts < self.max_attempts:
+                delay = send_queue.retry_delay(attempts, BACKOFF_SECONDS, MAX_BACKOFF_SECONDS)
+                return PENDING, attempts, time.time() + delay, str(e), time.time(), message.id
+            return FAILED, attempts, 0, str(e), time.time(), message.id
+        except (smtplib.SMTPException, OSError) as e:
+            # Nothing will get through, e.g. the login was refused; stop and leave the queue as it is
+            self.fatal = e
+            return PENDING, message.attempts, 0, str(e), time.time(), message.id
+        except Exception as e:
+            return unexpected_failure(message, e)
+        self.limiter.succeeded()
+        return SENT, attempts, 0, None, time.time(), message.id
+
+
+def open_queue(path):
+    connection = database.connect(path)
+    migrations.migrate(connection, migrations.EMAIL_MIGRATIONS)
+    return connection
+
+
+def command_configure(connection, args):
+    port = args.port or DEFAULT_PORTS[args.security]
+    with connection:
+        save_settings(connection, SmtpSettings(args.host, port, args.security, args.username, args.password,
+                                               args.from_address, args.from_name))
+    print(f"Saved {args.host}:{port} ({args.security})", file=sys.stderr)
+    return 0
+
+
+def command_send(connection, args):
+    if args.body_file:
+        with open(args.body_file, encoding="utf-8") as file:
+            body = file.read()
+    else:
+        body = args.body
+    filters = {name: getattr(args, name) for _, name in leads.QUERY_FILTERS if getattr(args, name)}
+    if args.status is not None:
+        filters["lead_status"] = args.status
+    leads_connection = leads.open_database(args.leads_db)
+    try:
+        with connection:
+            campaign_id, queued, skipped = enqueue_campaign(
+                connection, leads_connection, args.campaign, args.subject, body, filters)
+    finally:
+        leads_connection.close()
+    print(f"Campaign {campaign_id}: {queued} messages queued, {skipped} leads without an email address",
+          file=sys.stderr)
+    if args.queue_only:
+        return 0
+    return command_run(connection, args)
+
+
+def command_run(connection, args):
+    settings = load_settings(connection)
+    if settings is None:
+        print("Save SMTP settings first, with the configure command or the Email tab in the app.", file=sys.stderr)
+        return 2
+
+    def report():
+        counts = {}
+        for *_, campaign_counts in campaign_summaries(connection):
+            for status, count in campaign_counts.items():
+                counts[status] = counts.get(status, 0) + count
+        print("\r" + ", ".join(f"{count} {status}" for status, count in counts.items() if count),
+              end="", file=sys.stderr, flush=True)
+
+    transport = SmtpTransport(settings)
+    worker = EmailWorker(connection, transport, args.rate, args.connections, progress=report)
+    try:
+        sent = worker.run()
+    except KeyboardInterrupt:
+        print("\nStopped; unsent messages stay queued for the next run.", file=sys.stderr)
+        return 1
+    except (smtplib.SMTPException, OSError) as e:
+        print(f"\nThe mail server won't take messages: {e}", file=sys.stderr)
+        return 1
+    finally:
+        transport.close()
+    print(f"\n{sent} messages sent over {transport.opened} connections", file=sys.stderr)
+    return 0
+
+
+def command_status(connection, args):
+    print("campaign,name,created_at," + ",".join(MESSAGE_STATUSES))
+    for campaign_id, name, created_at, counts in campaign_summaries(connection):
+        print(f"{campaign_id},{json.dumps(name)},{created_at}," + ",".join(str(counts[status]) for status in MESSAGE_STATUSES))
+    return 0
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(prog="email_queue", description="Queue and send email campaigns to leads.")
+    parser.add_argument("--db", default=database.EMAIL_DATABASE, help="queue and settings database (default: %(default)s)")
+    parser.add_argument("--leads-db", default=database.LEADS_DATABASE, help="leads database (default: %(default)s)")
+    parser.add_argument("--rate", type=float, default=DEFAULT_RATE, help="messages per second (default: %(default)s)")
+    parser.add_argument("--connections", type=int, default=DEFAULT_CONNECTIONS,
+                        help="SMTP sessions kept open (default: %(default)s)")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    configure = commands.add_parser("configure", help="save the SMTP server to send through")
+    configure.add_argument("--host", required=True)
+    configure.add_argument("--port", type=int, help="default: 587, 465 or 25 to suit --security")
+    configure.add_argument("--security", choices=SECURITY_MODES, default="starttls")
+    configure.add_argument("--username")
+    configure.add_argument("--password")
+    configure.add_argument("--from", dest="from_address", required=True, help="sender address")
+    configure.add_argument("--from-name", help="sender name shown to recipients")
+    configure.set_defaults(run=command_configure)
+
+    send = commands.add_parser("send", help="queue a message for every matching lead, then send the queue")
+    send.add_argument("--campaign", required=True, help="campaign name")
+    send.add_argument("--subject", required=True, help="subject line; $first_name, $city etc. are filled in per lead")
+    body = send.add_mutually_exclusive_group(required=True)
+    body.add_argument("--body", help="message text, with the same placeholders as --subject")
+    body.add_argument("--body-file", help="read the message text from this file")
+    for flag, name in leads.QUERY_FILTERS:
+        send.add_argument(flag, dest=name)
+    send.add_argument("--status", type=leads.status_code, help="lead status label")
+    send.add_argument("--queue-only", action="store_true", help="queue the messages without sending them")
+    send.set_defaults(run=command_send)
+
+    run = commands.add_parser("run", help="send every queued message, waiting for retries")
+    run.set_defaults(run=command_run)
+
+    status = commands.add_parser("status", help="print message counts per campaign as CSV")
+    status.set_defaults(run=command_status)
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    connection = open_queue(args.db)
+    try:
+        return args.run(connection, args)
+    finally:
+        connection.close()
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,599 @@
+"""Web forms for taking in leads, served by a small local HTTP server.
+
+Each form in lead_forms (see migrations.create_lead_forms) asks for some of the
+leads columns and is served at /forms/<slug>, as a page of its own or embedded in
+a website through an iframe or a plain HTML form posting to it. Posts are accepted
+as urlencoded form data or JSON.
+
+IntakeServer is asyncio and stdlib only, so it runs in the GUI's worker thread or
+from the command line below. Handlers never touch SQLite: each submission is put on
+a bounded in-memory queue and a single writer drains it, taking everything queued
+at once, up to BATCH_SIZE, and inserting it in one transaction on a thread of its
+own. A quiet server writes each submission straight away; a busy one writes bigger
+batches, so thousands of posts a second cost a few commits. Each post is answered
+once its batch has committed. When the queue stays full for ENQUEUE_TIMEOUT the
+post is answered 503 with Retry-After instead of piling up in memory.
+
+A submission whose phone number or email matches an existing lead's, through
+lead_dedupe's lead_keys index, or an earlier submission's in the same batch, is
+counted as a duplicate of that lead rather than inserted again.
+
+    python form_intake.py create "Spring roofing" --fields first_name,last_name,phone,email,zipcode,notes
+    python form_intake.py list
+    python form_intake.py serve --port 8088
+"""
+import argparse
+import asyncio
+import html
+import json
+import re
+import sqlite3
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from http import HTTPStatus
+from urllib.parse import parse_qs
+
+import database
+import lead_dedupe
+import leads
+import migrations
+
+DEFAULT_HOST = "127.0.0.1"
+DEFAULT_PORT = 8088
+
+# Submissions waiting for the writer; when it's full posts wait up to ENQUEUE_TIMEOUT, then get a 503
+QUEUE_SIZE = 10000
+ENQUEUE_TIMEOUT = 1.0
+RETRY_AFTER_SECONDS = 1
+BATCH_SIZE = 1000
+
+MAX_BODY_BYTES = 65536
+MAX_FIELD_LENGTH = 2000
+KEEP_ALIVE_SECONDS = 30.0
+
+# The leads columns a form can ask for; referred_by comes from the form, the rest are for the office
+FORM_FIELDS = tuple(field for field in leads.LEAD_FIELDS if field not in ("referred_by", "referred_to", "lead_status"))
+DEFAULT_FIELDS = ("first_name", "last_name", "phone", "email", "address_line1", "city", "state", "zipcode",
+                  "job_type", "notes")
+FIELD_LABELS = {
+    "first_name": "First name", "last_name": "Last name", "address_line1": "Street address",
+    "address_line2": "Apartment, suite, etc.", "city": "City", "state": "State", "zipcode": "ZIP code",
+    "phone": "Phone", "email": "Email", "notes": "How can we help?", "job_type": "Type of job",
+}
+INPUT_TYPES = {"phone": "tel", "email": "email"}
+AUTOCOMPLETE = {
+    "first_name": "given-name", "last_name": "family-name", "address_line1": "address-line1",
+    "address_line2": "address-line2", "city": "address-level2", "state": "address-level1",
+    "zipcode": "postal-code", "phone": "tel", "email": "email",
+}
+
+FORM_PATH = re.compile(r"^/forms/([a-z0-9-]+)(/thanks)?/?$")
+
+PAGE = """<!DOCTYPE html>
+<html lang="en"><head><meta charset="utf-8"><meta name="viewport" content="width=device-width, initial-scale=1">
+<title>{title}</title>
+<style>
+body {{ font-family: system-ui, sans-serif; max-width: 32rem; margin: 2rem auto; padding: 0 1rem; }}
+label {{ display: block; margin-top: .8rem; font-weight: 600; }}
+input, select, textarea {{ width: 100%; box-sizing: border-box; padding: .5rem; font: inherit; }}
+button {{ margin-top: 1.2rem; padding: .6rem 1.4rem; font: inherit; }}
+.error {{ color: #b00020; }}
+</style></head>
+<body><h1>{title}</h1>
+{content}
+</body></html>
+"""
+
+
+@dataclass
+class LeadForm:
+    id: int
+    slug: str
+    title: str
+    fields: tuple
+    referred_by: str | None = None
+    submissions: int = 0
+    duplicates: int = 0
+    created_at: str = ""
+
+
+FORM_COLUMNS = "id, slug, title, fields, referred_by, submissions, duplicates, created_at"
+
+
+def open_database(path):
+    # Unlike leads.open_database this leaves the grid's edit journal alone; the app replays it itself
+    connection = database.connect(path)
+    migrations.migrate(connection, migrations.LEADS_MIGRATIONS)
+    return connection
+
+
+def form_row(cursor, row):
+    form_id, slug, title, fields, *rest = row
+    return LeadForm(form_id, slug, title, tuple(json.loads(fields)), *rest)
+
+
+def slugify(title):
+    return re.sub(r"[^a-z0-9]+", "-", title.lower()).strip("-")[:40].strip("-") or "form"
+
+
+def check_fields(fields):
+    fields = tuple(dict.fromkeys(fields))
+    unknown = set(fields) - set(FORM_FIELDS)
+    if unknown:
+        raise ValueError(f"Forms can't ask for: {', '.join(sorted(unknown))}")
+    if not {"first_name", "last_name"} & set(fields) or not {"phone", "email"} & set(fields):
+        raise ValueError("A form needs a name field and a phone or email field.")
+    return fields
+
+
+def create_form(connection, title, fields=DEFAULT_FIELDS, referred_by=None):
+    """Add a form and return it; its slug is made from title. Runs inside the caller's transaction."""
+    title = title.strip()
+    if not title:
+        raise ValueError("Give the form a title.")
+    fields = check_fields(fields)
+    base = slug = slugify(title)
+    number = 1
+    while connection.execute("SELECT 1 FROM lead_forms WHERE slug = ?", (slug,)).fetchone():
+        number += 1
+        slug = f"{base}-{number}"
+    connection.execute("""
+        INSERT INTO lead_forms (slug, title, fields, referred_by, created_at)
+        VALUES (?, ?, ?, ?, datetime('now', 'localtime'))
+    """, (slug, title, json.dumps(fields), (referred_by or "").strip() or None))
+    return get_form(connection, slug)
+
+
+def get_form(connection, slug):
+    cursor = connection.cursor()
+    cursor.row_factory = form_row
+    return cursor.execute(f"SELECT {FORM_COLUMNS} FROM lead_forms WHERE slug = ?", (slug,)).fetchone()
+
+
+def list_forms(connection):
+    cursor = connection.cursor()
+    cursor.row_factory = form_row
+    return cursor.execute(f"SELECT {FORM_COLUMNS} FROM lead_forms ORDER BY id").fetchall()
+
+
+def delete_form(connection, slug):
+    """Remove a form; the leads it took in stay. Returns whether it existed."""
+    return connection.execute("DELETE FROM lead_forms WHERE slug = ?", (slug,)).rowcount > 0
+
+
+def identity_keys(lead):
+    """The lead_keys entries that make a submission a duplicate: its normalized phone and email."""
+    keys = []
+    phone = lead_dedupe.normalize_phone(lead.phone)
+    if phone:
+        keys.append(f"phone:{phone}")
+    email = lead_dedupe.normalize_email(lead.email)
+    if email:
+        keys.append(f"email:{email}")
+    return keys
+
+
+def form_lead(form, values):
+    """Build the Lead a submission to form describes; raises ValueError, worded for the visitor, if it's incomplete."""
+    lead = leads.Lead(referred_by=form.referred_by or form.title)
+    for field in form.fields:
+        value = values.get(field)
+        if value is None:
+            continue
+        value = str(value).strip() if field == "notes" else " ".join(str(value).split())
+        setattr(lead, field, value[:MAX_FIELD_LENGTH])
+    if lead.job_type not in leads.JOB_TYPES:
+        lead.job_type = "Unknown"
+    if not lead.first_name and not lead.last_name:
+        raise ValueError("Please enter your name.")
+    if not identity_keys(lead):
+        raise ValueError("Please enter a phone number or an email address we can reach you at.")
+    return lead
+
+
+def write_submissions(connection, submissions):
+    """Insert a batch of submitted leads in one transaction, leaving out duplicates.
+
+    submissions is [(form id, Lead)]. Returns [(lead id, duplicate)] in the same order,
+    where a duplicate's id is that of the lead it matched. The form counters are
+    updated in the same transaction.
+    """
+    # Key the leads added or edited since the last batch, this server's included, so they're
+    # matched too: the bulk of them a committed chunk at a time, then whatever another
+    # connection slipped in before the write lock was taken
+    lead_dedupe.refresh_index(connection)
+    keys = [identity_keys(lead) for _, lead in submissions]
+    connection.execute("BEGIN IMMEDIATE")
+    try:
+        while lead_dedupe.refresh_chunk(connection):
+            pass
+        known = dict(connection.execute(f"SELECT key, lead_id FROM lead_keys WHERE key IN ({leads.IDS_SQL})",
+                                        (json.dumps([key for lead_keys in keys for key in lead_keys]),)))
+        # Holding the write lock, the new rows get the next ids from the leads AUTOINCREMENT sequence
+        next_id = leads.next_lead_id(connection)
+        new_leads = []
+        results = []
+        counts = {}
+        for (form_id, lead), lead_keys in zip(submissions, keys):
+            form_counts = counts.setdefault(form_id, [0, 0, form_id])
+            form_counts[0] += 1
+            duplicate_of = next((known[key] for key in lead_keys if key in known), None)
+            if duplicate_of is not None:
+                form_counts[1] += 1
+                results.append((duplicate_of, True))
+                continue
+            lead_id = next_id + len(new_leads)
+            new_leads.append(lead)
+            known.update((key, lead_id) for key in lead_keys)
+            results.append((lead_id, False))
+        if new_leads:
+            first_id, last_id = leads.add_leads(connection, new_leads)
+            if (first_id, last_id) != (next_id, next_id + len(new_leads) - 1):
+                raise sqlite3.IntegrityError(f"expected lead ids {next_id}-{next_id + len(new_leads) - 1}, "
+                                             f"got {first_id}-{last_id}")
+        connection.executemany(
+            "UPDATE lead_forms SET submissions = submissions + ?, duplicates = duplicates + ? WHERE id = ?",
+            list(counts.values()))
+    except BaseException:
+        connection.rollback()
+        raise
+    connection.commit()
+    return results
+
+
+def page(title, content):
+    return PAGE.format(title=html.escape(title), content=content).encode()
+
+
+def field_html(field, value=""):
+    label = html.escape(FIELD_LABELS[field])
+    if field == "notes":
+        control = f'<textarea id="{field}" name="{field}" rows="4">{html.escape(value)}</textarea>'
+    elif field == "job_type":
+        options = "".join(f'<option{" selected" if job_type == value else ""}>{html.escape(job_type)}</option>'
+                          for job_type in leads.JOB_TYPES)
+        control = f'<select id="{field}" name="{field}">{options}</select>'
+    else:
+        control = (f'<input id="{field}" name="{field}" type="{INPUT_TYPES.get(field, "text")}" '
+                   f'autocomplete="{AUTOCOMPLETE[field]}" maxlength="{MAX_FIELD_LENGTH}" value="{html.escape(value)}">')
+    return f'<label for="{field}">{label}</label>{control}'
+
+
+def form_page(form, error=None, values=None):
+    values = values or {}
+    content = [f'<p class="error">{html.escape(error)}</p>'] if error else []
+    content.append(f'<form method="post" action="/forms/{form.slug}">')
+    content.extend(field_html(field, str(values.get(field, ""))) for field in form.fields)
+    content.append('<button type="submit">Send</button></form>')
+    return page(form.title, "\n".join(content))
+
+
+def thanks_page(form):
+    return page(form.title, "<p>Thanks! We got your details and will be in touch soon.</p>")
+
+
+def embed_snippet(form, base_url):
+    """HTML to paste into a website: the form in an iframe, or posting straight to the server."""
+    url = f"{base_url}/forms/{form.slug}"
+    fields = "\n".join(f"  {field_html(field)}" for field in form.fields)
+    return (f'<iframe src="{url}" title="{html.escape(form.title)}" style="width: 100%; height: 720px; border: 0"></iframe>\n\n'
+            f'<!-- or, styled by your own site: -->\n<form method="post" action="{url}">\n{fields}\n'
+            f'  <button type="submit">Send</button>\n</form>\n')
+
+
+def parse_submission(content_type, body):
+    """The submitted fields as {name: value}; urlencoded form data or a JSON object."""
+    text = body.decode("utf-8", "replace")
+    if "json" in content_type:
+        values = json.loads(text or "{}")
+        if not isinstance(values, dict):
+            raise ValueError("Send the fields as a JSON object.")
+        return {name: value for name, value in values.items() if isinstance(value, (str, int, float))}
+    return {name: values[0] for name, values in parse_qs(text).items()}
+
+
+class IntakeServer:
+    """Serves the forms in the leads database at path and writes their submissions to it.
+
+    on_written(new lead ids, duplicates) is called from the event loop after each batch
+    commits, e.g. to tell the GUI; the counters below are there for /health and the GUI.
+    """
+    def __init__(self, path, queue_size=QUEUE_SIZE, batch_size=BATCH_SIZE, enqueue_timeout=ENQUEUE_TIMEOUT,
+                 on_written=None):
+        self.path = path
+        self.batch_size = batch_size
+        self.enqueue_timeout = enqueue_timeout
+        self.on_written = on_written
+        self.queue = asyncio.Queue(queue_size)
+        self.forms = {}
+        self.form_pages = {}
+        self.connections = 0
+        self.requests = 0
+        self.accepted = 0
+        self.written = 0
+        self.duplicates = 0
+        self.rejected = 0
+        self.batches = 0
+        self.server = None
+        self.handlers = {}
+        self.writer_task = None
+        # The single thread, and connection, every write goes through
+        self.executor = ThreadPoolExecutor(1, thread_name_prefix="form-writer")
+        self.connection = None
+
+    async def run_in_writer(self, function, *args):
+        return await asyncio.get_running_loop().run_in_executor(self.executor, function, *args)
+
+    async def start(self, host=DEFAULT_HOST, port=DEFAULT_PORT):
+        """Load the forms, start the writer and start listening; returns the port."""
+        self.connection = await self.run_in_writer(open_database, self.path)
+        await self.reload_forms()
+        try:
+            self.server = await asyncio.start_server(self.handle, host, port)
+        except OSError:
+            # e.g. the port is taken
+            await self.run_in_writer(self.connection.close)
+            self.executor.shutdown()
+            raise
+        self.writer_task = asyncio.create_task(self.write_batches())
+        return self.server.sockets[0].getsockname()[1]
+
+    async def close(self):
+        """Stop taking connections, write what's queued and close the database."""
+        self.server.close()
+        for writer in self.handlers.values():
+            writer.close()
+        await asyncio.gather(*self.handlers, return_exceptions=True)
+        await self.server.wait_closed()
+        await self.queue.put(None)
+        await self.writer_task
+        await self.run_in_writer(self.connection.close)
+        self.executor.shutdown()
+
+    async def reload_forms(self):
+        """Pick up forms created, changed or deleted since the server started."""
+        forms = await self.run_in_writer(list_forms, self.connection)
+        self.forms = {form.slug: form for form in forms}
+        self.form_pages = {form.slug: form_page(form) for form in forms}
+
+    def stats(self):
+        return {"connections": self.connections, "requests": self.requests, "accepted": self.accepted,
+                "written": self.written, "duplicates": self.duplicates, "rejected": self.rejected,
+                "batches": self.batches, "queued": self.queue.qsize()}
+
+    async def handle(self, reader, writer):
+        self.connections += 1
+        self.handlers[asyncio.current_task()] = writer
+        try:
+            while True:
+                head = await asyncio.wait_for(reader.readuntil(b"\r\n\r\n"), KEEP_ALIVE_SECONDS)
+                request_line, *header_lines = head.decode("latin-1").split("\r\n")
+                method, target, version = request_line.split(" ", 2)
+                headers = {}
+                for line in header_lines:
+                    name, _, value = line.partition(":")
+                    headers[name.strip().lower()] = value.strip()
+                keep_alive = (headers.get("connection", "").lower() != "close"
+                              if version == "HTTP/1.1" else headers.get("connection", "").lower() == "keep-alive")
+                self.requests += 1
+                if "transfer-encoding" in headers:
+                    status, body, extra_headers = self.error(411, "Send a Content-Length.")
+                    keep_alive = False
+                elif int(headers.get("content-length") or 0) > MAX_BODY_BYTES:
+                    status, body, extra_headers = self.error(413, "That's more than a form can hold.")
+                    keep_alive = False
+                else:
+                    data = await reader.readexactly(int(headers.get("content-length") or 0))
+                    status, body, extra_headers = await self.respond(method, target.split("?", 1)[0], headers, data)
+                head = [f"HTTP/1.1 {status} {HTTPStatus(status).phrase}", f"Content-Length: {len(body)}",
+                        *extra_headers]
+                if not keep_alive:
+                    head.append("Connection: close")
+                writer.write(("\r\n".join(head) + "\r\n\r\n").encode("latin-1") + body)
+                await writer.drain()
+                if not keep_alive:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError, asyncio.LimitOverrunError, asyncio.TimeoutError,
+                ValueError):
+            pass
+        finally:
+            writer.close()
+            self.handlers.pop(asyncio.current_task(), None)
+
+    def error(self, status, message, wants_json=False):
+        if wants_json:
+            return status, json.dumps({"error": message}).encode(), ["Content-Type: application/json"]
+        return status, page(HTTPStatus(status).phrase, f"<p>{html.escape(message)}</p>"), [
+            "Content-Type: text/html; charset=utf-8"]
+
+    async def respond(self, method, path, headers, body):
+        """Return (status, body bytes, extra header lines) for one request."""
+        html_headers = ["Content-Type: text/html; charset=utf-8"]
+        if path == "/health":
+            return 200, json.dumps(self.stats()).encode(), ["Content-Type: application/json"]
+        if path == "/":
+            links = "".join(f'<li><a href="/forms/{form.slug}">{html.escape(form.title)}</a></li>'
+                            for form in self.forms.values())
+            return 200, page("Forms", f"<ul>{links}</ul>"), html_headers
+        match = FORM_PATH.match(path)
+        form = self.forms.get(match.group(1)) if match else None
+        if form is None:
+            return self.error(404, "There's no form here.")
+        if match.group(2):
+            return 200, thanks_page(form), html_headers
+        if method == "GET":
+            return 200, self.form_pages[form.slug], html_headers
+        if method != "POST":
+            status, body, extra_headers = self.error(405, "Forms are sent with POST.")
+            return status, body, extra_headers + ["Allow: GET, POST"]
+        return await self.submit(form, headers, body)
+
+    async def submit(self, form, headers, body):
+        content_type = headers.get("content-type", "")
+        wants_json = "json" in content_type or "json" in headers.get("accept", "")
+        values = {}
+        try:
+            values = parse_submission(content_type, body)
+            lead = form_lead(form, values)
+        except ValueError as e:
+            if wants_json:
+                return self.error(400, str(e), True)
+            return 400, form_page(form, str(e), values), ["Content-Type: text/html; charset=utf-8"]
+
+        written = asyncio.get_running_loop().create_future()
+        if self.queue.full():
+            try:
+                await asyncio.wait_for(self.queue.put((form.id, lead, written)), self.enqueue_timeout)
+            except asyncio.TimeoutError:
+                self.rejected += 1
+                status, body, extra_headers = self.error(503, "We're busy; please try again in a moment.", wants_json)
+                return status, body, extra_headers + [f"Retry-After: {RETRY_AFTER_SECONDS}"]
+        else:
+            self.queue.put_nowait((form.id, lead, written))
+        self.accepted += 1
+        try:
+            lead_id, duplicate = await written
+        except sqlite3.Error:
+            status, body, extra_headers = self.error(503, "We couldn't save that; please try again.", wants_json)
+            return status, body, extra_headers + [f"Retry-After: {RETRY_AFTER_SECONDS}"]
+        except Exception:
+            return self.error(500, "We couldn't save that.", wants_json)
+        if wants_json:
+            if duplicate:
+                return 200, json.dumps({"duplicate_of": lead_id}).encode(), ["Content-Type: application/json"]
+            return 201, json.dumps({"id": lead_id}).encode(), ["Content-Type: application/json"]
+        # Redirecting to the thank-you page keeps a reload from posting the form again
+        return 303, b"", [f"Location: /forms/{form.slug}/thanks"]
+
+    async def write_batches(self):
+        """The single writer: take whatever is queued, write it in one transaction, answer its posts, repeat."""
+        while True:
+            batch = [await self.queue.get()]
+            while len(batch) < self.batch_size and not self.queue.empty():
+                batch.append(self.queue.get_nowait())
+            submissions = [item for item in batch if item is not None]
+            if submissions:
+                await self.write(submissions)
+            if len(submissions) < len(batch):
+                return
+
+    async def write(self, submissions):
+        try:
+            results = await self.run_in_writer(
+                write_submissions, self.connection, [(form_id, lead) for form_id, lead, _ in submissions])
+        except Exception as e:
+            # Only this batch fails; the writer goes on with the next one
+            for _, _, written in submissions:
+                if not written.done():
+                    written.set_exception(e)
+            return
+        self.batches += 1
+        new_ids = [lead_id for lead_id, duplicate in results if not duplicate]
+        self.written += len(new_ids)
+        self.duplicates += len(results) - len(new_ids)
+        for (_, _, written), result in zip(submissions, results):
+            if not written.done():
+                written.set_result(result)
+        if self.on_written:
+            self.on_written(new_ids, len(results) - len(new_ids))
+
+
+def command_create(connection, args):
+    try:
+        with connection:
+            form = create_form(connection, args.title, args.fields.split(",") if args.fields else DEFAULT_FIELDS,
+                               args.source)
+    except ValueError as e:
+        print(e, file=sys.stderr)
+        return 2
+    print(f"Created /forms/{form.slug}", file=sys.stderr)
+    return 0
+
+
+def command_list(connection, args):
+    print("slug,title,fields,referred_by,submissions,duplicates,created_at")
+    for form in list_forms(connection):
+        print(f"{form.slug},{json.dumps(form.title)},{'|'.join(form.fields)},{json.dumps(form.referred_by or '')},"
+              f"{form.submissions},{form.duplicates},{form.created_at}")
+    return 0
+
+
+def command_delete(connection, args):
+    with connection:
+        deleted = delete_form(connection, args.slug)
+    if not deleted:
+        print(f"No form {args.slug}", file=sys.stderr)
+        return 2
+    return 0
+
+
+async def serve(args):
+    server = IntakeServer(args.db, args.queue_size, args.batch_size)
+    port = await server.start(args.host, args.port)
+    print(f"Serving {len(server.forms)} forms on http://{args.host}:{port}/", file=sys.stderr)
+    try:
+        reported = (0, 0, 0)
+        while True:
+            await asyncio.sleep(1)
+            stats = (server.written, server.duplicates, server.rejected)
+            if stats != reported:
+                print(f"\r{server.written} leads added, {server.duplicates} duplicates, {server.rejected} turned away",
+                      end="", file=sys.stderr, flush=True)
+                reported = stats
+    finally:
+        await server.close()
+
+
+def command_serve(connection, args):
+    # The server opens its own connection on its writer thread
+    connection.close()
+    started = time.perf_counter()
+    try:
+        asyncio.run(serve(args))
+    except KeyboardInterrupt:
+        print(f"\nStopped after {time.perf_counter() - started:.0f}s", file=sys.stderr)
+    return 0
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(prog="form_intake", description="Serve web forms that add leads.")
+    parser.add_argument("--db", default=database.LEADS_DATABASE, help="leads database (default: %(default)s)")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    create = commands.add_parser("create", help="add a form")
+    create.add_argument("title")
+    create.add_argument("--fields", help=f"comma separated columns to ask for, from: {', '.join(FORM_FIELDS)}")
+    create.add_argument("--source", help="referred_by for the leads it takes in (default: the title)")
+    create.set_defaults(run=command_create)
+
+    list_command = commands.add_parser("list", help="print the forms and their counts as CSV")
+    list_command.set_defaults(run=command_list)
+
+    delete = commands.add_parser("delete", help="remove a form; its leads stay")
+    delete.add_argument("slug")
+    delete.set_defaults(run=command_delete)
+
+    serve_command = commands.add_parser("serve", help="serve the forms and take in submissions")
+    serve_command.add_argument("--host", default=DEFAULT_HOST, help="address to listen on; 0.0.0.0 for the whole network")
+    serve_command.add_argument("--port", type=int, default=DEFAULT_PORT)
+    serve_command.add_argument("--queue-size", type=int, default=QUEUE_SIZE,
+                               help="submissions held before posts are turned away (default: %(default)s)")
+    serve_command.add_argument("--batch-size", type=int, default=BATCH_SIZE,
+                               help="most submissions written per transaction (default: %(default)s)")
+    serve_command.set_defaults(run=command_serve)
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    connection = open_database(args.db)
+    try:
+        return args.run(connection, args)
+    finally:
+        connection.close()
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,220 @@
+"""Offline lead locations from ZIP code centroids, for radius searches and visit routes.
+
+zip_centroids holds the centre point of each five-digit ZIP code. It is loaded once
+from a file by `leads.py load-zips`, so nothing is ever looked up over the network.
+The Census Bureau's ZCTA gazetteer file (2023_Gaz_zcta_national.txt, public domain)
+works as downloaded, and so does any CSV with zip, latitude and longitude columns.
+lead_locations is an R*Tree holding one point per lead whose ZIP code is known. The
+triggers created here keep it current as leads are added, edited and deleted, and
+bulk inserts are located set-wise by locate_new_leads, as lead_counts does.
+
+Distances are great-circle miles between centroids, so leads in the same ZIP code
+are 0 miles apart. That's coarse for one street, but right for planning which
+jobs to drive to on the same day.
+"""
+import csv
+import math
+import re
+
+EARTH_RADIUS_MILES = 3958.8
+
+# Normalized header names in a centroid file, see read_centroids
+ZIP_HEADERS = ("geoid", "zcta", "zcta5", "zip", "zipcode", "postalcode")
+LATITUDE_HEADERS = ("intptlat", "lat", "latitude")
+LONGITUDE_HEADERS = ("intptlong", "lon", "lng", "long", "longitude")
+
+# The ZIP code a leads row locates by; ZIP+4 and stray spaces are ignored. {row} is "new." or "leads."
+ZIP_SQL = "substr(trim({row}zipcode), 1, 5)"
+
+LOCATE_SQL = """
+    INSERT INTO lead_locations (lead_id, min_lat, max_lat, min_lon, max_lon)
+    SELECT {id}, latitude, latitude, longitude, longitude FROM zip_centroids WHERE zipcode = {zipcode}
+"""
+
+
+def create_schema(connection):
+    """Create zip_centroids, lead_locations and the triggers that keep it current. Runs inside the migration."""
+    connection.execute("""
+        CREATE TABLE zip_centroids (
+            zipcode TEXT PRIMARY KEY,
+            latitude REAL NOT NULL,
+            longitude REAL NOT NULL
+        ) WITHOUT ROWID""")
+    connection.execute("CREATE VIRTUAL TABLE lead_locations USING rtree(lead_id, min_lat, max_lat, min_lon, max_lon)")
+    locate_new = LOCATE_SQL.format(id="new.id", zipcode=ZIP_SQL.format(row="new."))
+    connection.execute(f"""
+        CREATE TRIGGER leads_locations_insert AFTER INSERT ON leads
+        WHEN NOT (SELECT deferred FROM leads_fts_state) BEGIN
+            {locate_new};
+        END""")
+    connection.execute("""
+        CREATE TRIGGER leads_locations_delete AFTER DELETE ON leads BEGIN
+            DELETE FROM lead_locations WHERE lead_id = old.id;
+        END""")
+    connection.execute(f"""
+        CREATE TRIGGER leads_locations_update AFTER UPDATE OF zipcode ON leads
+        WHEN old.zipcode IS NOT new.zipcode BEGIN
+            DELETE FROM lead_locations WHERE lead_id = old.id;
+            {locate_new};
+        END""")
+
+
+def locate_new_leads(connection, after_id):
+    """Locate the leads with ids above after_id, inserted while the insert trigger was deferred."""
+    connection.execute(f"""
+        INSERT INTO lead_locations (lead_id, min_lat, max_lat, min_lon, max_lon)
+        SELECT leads.id, latitude, latitude, longitude, longitude
+        FROM leads JOIN zip_centroids ON zip_centroids.zipcode = {ZIP_SQL.format(row="leads.")}
+        WHERE leads.id > ?""", (after_id,))
+
+
+def relocate(connection):
+    """Rebuild lead_locations from scratch and return how many leads have a location."""
+    connection.execute("DELETE FROM lead_locations")
+    locate_new_leads(connection, 0)
+    return connection.execute("SELECT COUNT(*) FROM lead_locations").fetchone()[0]
+
+
+def normalize(header):
+    return re.sub(r"[^a-z0-9]", "", header.lower())
+
+
+def read_centroids(path):
+    """Yield (zipcode, latitude, longitude) from a gazetteer file or CSV, tab or comma separated."""
+    with open(path, newline="", encoding="utf-8-sig") as centroid_file:
+        sample = centroid_file.readline()
+        centroid_file.seek(0)
+        reader = csv.reader(centroid_file, delimiter="\t" if "\t" in sample else ",")
+        headers = [normalize(header) for header in next(reader, [])]
+
+        def column(names):
+            for name in names:
+                if name in headers:
+                    return headers.index(name)
+            raise ValueError(f"{path} has no {names[-1]} column")
+
+        zip_column, lat_column, lon_column = column(ZIP_HEADERS), column(LATITUDE_HEADERS), column(LONGITUDE_HEADERS)
+        for row in reader:
+            if len(row) <= max(zip_column, lat_column, lon_column):
+                continue
+            zipcode = row[zip_column].strip()
+            if zipcode.isdigit():
+                yield zipcode.zfill(5), float(row[lat_column]), float(row[lon_column])
+
+
+def load_centroids(connection, centroids):
+    """Replace zip_centroids with centroids and relocate every lead; returns (centroids, leads located).
+
+    Runs inside the caller's transaction.
+    """
+    connection.execute("DELETE FROM zip_centroids")
+    connection.executemany(
+        "INSERT OR REPLACE INTO zip_centroids (zipcode, latitude, longitude) VALUES (?, ?, ?)", centroids)
+    loaded = connection.execute("SELECT COUNT(*) FROM zip_centroids").fetchone()[0]
+    return loaded, relocate(connection)
+
+
+def zip_location(connection, zipcode):
+    """Return (latitude, longitude) for zipcode, or None if it isn't in zip_centroids."""
+    return connection.execute("SELECT latitude, longitude FROM zip_centroids WHERE zipcode = ?",
+                              ((zipcode or "").strip()[:5],)).fetchone()
+
+
+def lead_location(connection, lead_id):
+    """Return (latitude, longitude) for a lead, or None if its ZIP code is unknown."""
+    return connection.execute("""
+        SELECT (min_lat + max_lat) / 2, (min_lon + max_lon) / 2 FROM lead_locations WHERE lead_id = ?
+    """, (lead_id,)).fetchone()
+
+
+def locations_of(connection, lead_ids):
+    """Return {lead_id: (latitude, longitude)} for whichever of lead_ids have a location."""
+    locations = {}
+    for lead_id in lead_ids:
+        location = lead_location(connection, lead_id)
+        if location is not None:
+            locations[lead_id] = location
+    return locations
+
+
+def distance_miles(origin, destination):
+    """Great-circle distance in miles between two (latitude, longitude) points."""
+    lat1, lon1 = map(math.radians, origin)
+    lat2, lon2 = map(math.radians, destination)
+    a = math.sin((lat2 - lat1) / 2) ** 2 + math.cos(lat1) * math.cos(lat2) * math.sin((lon2 - lon1) / 2) ** 2
+    return 2 * EARTH_RADIUS_MILES * math.asin(min(1.0, math.sqrt(a)))
+
+
+def bounding_box(center, miles):
+    """Return (south, north, west, east) around center that contains every point within miles of it."""
+    latitude, longitude = center
+    lat_delta = math.degrees(miles / EARTH_RADIUS_MILES)
+    # Meridians converge toward the poles, so a mile spans more degrees of longitude
+    cos_lat = math.cos(math.radians(min(89.9, abs(latitude) + lat_delta)))
+    lon_delta = min(180.0, math.degrees(miles / (EARTH_RADIUS_MILES * cos_lat)))
+    return latitude - lat_delta, latitude + lat_delta, longitude - lon_delta, longitude + lon_delta
+
+
+def box_sql(alias="lead_locations"):
+    """The R*Tree constraint for rows overlapping a bounding_box, taking its four values as parameters."""
+    return (f"{alias}.max_lat >= ? AND {alias}.min_lat <= ? AND "
+            f"{alias}.max_lon >= ? AND {alias}.min_lon <= ?")
+
+
+def route_length(points, order, start=None, round_trip=False):
+    """Miles driven visiting points in order, from start if given and back to it if round_trip."""
+    stops = [points[index] for index in order]
+    if start is not None:
+        stops.insert(0, start)
+        if round_trip:
+            stops.append(start)
+    return sum(distance_miles(a, b) for a, b in zip(stops, stops[1:]))
+
+
+def plan_route(points, start=None, round_trip=False):
+    """Return an order of indexes into points, a list of (latitude, longitude), that keeps the driving short.
+
+    The route is built nearest neighbour first from start, or from the point farthest
+    from the others' centre when there's no start, then improved with 2-opt: any two
+    legs that cross are uncrossed by reversing the stops between them, until no swap
+    helps. It won't always find the shortest route, but on a day's stops it usually
+    lands within a few percent of it in milliseconds.
+    """
+    count = len(points)
+    if count <= 1:
+        return list(range(count))
+    # Node 0 is the start when there is one; the others are the points, shifted by one
+    nodes = ([start] if start is not None else []) + list(points)
+    fixed = 1 if start is not None else 0
+    distance = [[distance_miles(a, b) for b in nodes] for a in nodes]
+
+    if fixed:
+        first = 0
+    else:
+        centre = (sum(lat for lat, _ in points) / count, sum(lon for _, lon in points) / count)
+        first = max(range(count), key=lambda index: distance_miles(centre, points[index]))
+    route = [first]
+    remaining = set(range(len(nodes))) - {first}
+    while remaining:
+        row = distance[route[-1]]
+        nearest = min(remaining, key=row.__getitem__)
+        route.append(nearest)
+        remaining.remove(nearest)
+
+    # Without a round trip the route ends wherever it ends, so the last leg costs nothing to change
+    closing = route[0] if round_trip and fixed else None
+    last = len(route) - 1
+    improved = True
+    while improved:
+        improved = False
+        for i in range(fixed, last):
+            before = route[i - 1] if i > 0 else None
+            for j in range(i + 1, last + 1):
+                after = route[j + 1] if j < last else closing
+                a, b, c = route[i], route[j], after
+                old = (distance[before][a] if before is not None else 0.0) + (distance[b][c] if c is not None else 0.0)
+                new = (distance[before][b] if before is not None else 0.0) + (distance[a][c] if c is not None else 0.0)
+                if new < old - 1e-9:
+                    route[i:j + 1] = route[i:j + 1][::-1]
+                    improved = True
+    return [node - fixed for node in route[fixed:]]
@@ -0,0 +1,117 @@
+"""Materialized lead counts for the dashboard and `leads.py stats`.
+
+lead_counts holds one row per (dimension, value), e.g. ("city", "Tampa") or
+("status", "2"), with the number of leads that have it, plus a ("total", "") row.
+Triggers keep it current as leads are inserted, edited and deleted, so reading the
+counts costs the same at any table size. Bulk inserts set the deferred flag that
+lead_query.insert_many already uses for leads_fts; their rows are counted in one
+grouped statement per dimension by count_new_leads. rebuild() recounts everything
+from the leads table, for after a restore or a manual edit of the database.
+"""
+
+# How each dimension's value is computed from a leads row; {row} is "new.", "old." or ""
+DIMENSIONS = {
+    "status": "CAST({row}lead_status AS TEXT)",
+    "job_type": "trim(COALESCE({row}job_type, ''))",
+    "referred_by": "trim(COALESCE({row}referred_by, ''))",
+    "city": "trim(COALESCE({row}city, ''))",
+    # The Monday of the week the lead was added; "" for leads from before created_at existed
+    "week": "COALESCE(date({row}created_at, 'weekday 0', '-6 days'), '')",
+}
+
+UPSERT = "ON CONFLICT (dimension, value) DO UPDATE SET count = count + excluded.count"
+
+
+def value_rows(row, delta, with_total):
+    rows = [f"('{dimension}', {sql.format(row=row)}, {delta})" for dimension, sql in DIMENSIONS.items()]
+    if with_total:
+        rows.append(f"('total', '', {delta})")
+    return ", ".join(rows)
+
+
+def create_schema(connection):
+    """Create lead_counts and its triggers and count the existing leads. Runs inside the migration."""
+    connection.execute("""
+        CREATE TABLE lead_counts (
+            dimension TEXT NOT NULL,
+            value TEXT NOT NULL COLLATE NOCASE,
+            count INTEGER NOT NULL,
+            PRIMARY KEY (dimension, value)
+        ) WITHOUT ROWID""")
+    connection.execute(f"""
+        CREATE TRIGGER leads_counts_insert AFTER INSERT ON leads
+        WHEN NOT (SELECT deferred FROM leads_fts_state) BEGIN
+            INSERT INTO lead_counts (dimension, value, count) VALUES {value_rows("new.", 1, True)} {UPSERT};
+        END""")
+    connection.execute(f"""
+        CREATE TRIGGER leads_counts_delete AFTER DELETE ON leads BEGIN
+            INSERT INTO lead_counts (dimension, value, count) VALUES {value_rows("old.", -1, True)} {UPSERT};
+        END""")
+    connection.execute(f"""
+        CREATE TRIGGER leads_counts_update AFTER UPDATE OF lead_status, job_type, referred_by, city, created_at ON leads
+        WHEN old.lead_status IS NOT new.lead_status OR old.job_type IS NOT new.job_type
+            OR old.referred_by IS NOT new.referred_by OR old.city IS NOT new.city
+            OR old.created_at IS NOT new.created_at BEGIN
+            INSERT INTO lead_counts (dimension, value, count) VALUES {value_rows("old.", -1, False)} {UPSERT};
+            INSERT INTO lead_counts (dimension, value, count) VALUES {value_rows("new.", 1, False)} {UPSERT};
+        END""")
+    rebuild(connection)
+
+
+def count_new_leads(connection, after_id):
+    """Count the leads with ids above after_id, inserted while the insert trigger was deferred."""
+    for dimension, sql in DIMENSIONS.items():
+        connection.execute(f"""
+            INSERT INTO lead_counts (dimension, value, count)
+            SELECT '{dimension}', {sql.format(row="")}, COUNT(*) FROM leads WHERE id > ? GROUP BY 2 {UPSERT}
+        """, (after_id,))
+    connection.execute(f"""
+        INSERT INTO lead_counts (dimension, value, count)
+        SELECT 'total', '', COUNT(*) FROM leads WHERE id > ? {UPSERT}
+    """, (after_id,))
+
+
+def rebuild(connection):
+    """Recount every dimension from the leads table and return the total. Runs inside the caller's transaction."""
+    connection.execute("DELETE FROM lead_counts")
+    count_new_leads(connection, 0)
+    # A deleted row's values leave zero counts behind; a rebuild starts clean
+    connection.execute("DELETE FROM lead_counts WHERE count = 0")
+    return total(connection)
+
+
+def total(connection):
+    row = connection.execute("SELECT count FROM lead_counts WHERE dimension = 'total'").fetchone()
+    return row[0] if row else 0
+
+
+def counts(connection, dimension, limit=None, by_value=False):
+    """Return [(value, count)] for dimension, largest first or in value order; at most limit of them."""
+    order = "value" if by_value else "count DESC, value"
+    return connection.execute(f"""
+        SELECT value, count FROM lead_counts WHERE dimension = ? AND count != 0 ORDER BY {order} LIMIT ?
+    """, (dimension, -1 if limit is None else limit)).fetchall()
+
+
+def recent_weeks(connection, weeks):
+    """Return [(monday, count)] for the latest weeks that had new leads, oldest first."""
+    rows = connection.execute("""
+        SELECT value, count FROM lead_counts WHERE dimension = 'week' AND value != '' AND count != 0
+        ORDER BY value DESC LIMIT ?
+    """, (weeks,)).fetchall()
+    return rows[::-1]
+
+
+def find_drift(connection):
+    """Compare lead_counts with a fresh count of the leads table; returns [(dimension, value, stored, actual)]."""
+    stored = {(dimension, value.lower()): count for dimension, value, count in connection.execute(
+        "SELECT dimension, value, count FROM lead_counts WHERE count != 0")}
+    actual = {}
+    for dimension, sql in DIMENSIONS.items():
+        for value, count in connection.execute(f"SELECT {sql.format(row='')}, COUNT(*) FROM leads GROUP BY 1"):
+            key = (dimension, value.lower())
+            actual[key] = actual.get(key, 0) + count
+    actual[("total", "")] = connection.execute("SELECT COUNT(*) FROM leads").fetchone()[0]
+    return sorted((dimension, value, stored.get((dimension, value), 0), actual.get((dimension, value), 0))
+                  for dimension, value in stored.keys() | actual.keys()
+                  if stored.get((dimension, value), 0) != actual.get((dimension, value), 0))
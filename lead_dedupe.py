@@ -0,0 +1,274 @@
+"""Duplicate lead detection and merging.
+
+Comparing every lead with every other one is quadratic, so each lead is instead
+given a few blocking keys: its normalized phone, its normalized email, zip code
+plus street number, and the Soundex code of its last name plus zip code. Only
+leads that share a key are compared. The keys live in the lead_keys table, which
+is brought up to date incrementally: new leads are keyed by id, and the triggers
+from migrations.create_dedupe_schema and key_reused_lead_ids queue edited leads
+and leads inserted under an already indexed id, and drop the keys of deleted
+ones.
+"""
+import json
+import re
+
+import appointments
+import leads
+
+# Blocks bigger than this are a shared office number or a placeholder email, not one person
+MAX_BLOCK_SIZE = 50
+
+INDEX_CHUNK_SIZE = 10000
+
+SOUNDEX_CODES = {
+    **dict.fromkeys("BFPV", "1"), **dict.fromkeys("CGJKQSXZ", "2"), **dict.fromkeys("DT", "3"),
+    "L": "4", **dict.fromkeys("MN", "5"), "R": "6",
+}
+
+STREET_SUFFIXES = {
+    "street": "st", "avenue": "ave", "road": "rd", "drive": "dr", "lane": "ln", "court": "ct",
+    "boulevard": "blvd", "place": "pl", "circle": "cir", "highway": "hwy", "parkway": "pkwy",
+    "north": "n", "south": "s", "east": "e", "west": "w", "apartment": "apt", "suite": "ste",
+}
+
+
+def normalize_phone(phone):
+    """Digits only, without a leading US country code; "" if too short to be a phone number."""
+    digits = re.sub(r"\D", "", phone or "")
+    if len(digits) == 11 and digits.startswith("1"):
+        digits = digits[1:]
+    return digits if len(digits) >= 7 else ""
+
+
+def normalize_email(email):
+    email = (email or "").strip().lower()
+    local, at, domain = email.rpartition("@")
+    if not at or not local or not domain:
+        return ""
+    local = local.split("+", 1)[0]
+    if domain in ("gmail.com", "googlemail.com"):
+        # Gmail ignores dots in the local part
+        local = local.replace(".", "")
+        domain = "gmail.com"
+    return f"{local}@{domain}"
+
+
+def normalize_address(address):
+    """Lowercase, drop punctuation and abbreviate street suffixes, so "12 Oak Street." matches "12 oak st"."""
+    words = re.findall(r"[a-z0-9]+", (address or "").lower())
+    return " ".join(STREET_SUFFIXES.get(word, word) for word in words)
+
+
+def normalize_zip(zipcode):
+    digits = re.sub(r"\D", "", zipcode or "")
+    return digits[:5] if len(digits) >= 5 else ""
+
+
+def street_number(address):
+    match = re.match(r"\s*(\d+)", address or "")
+    return match.group(1) if match else ""
+
+
+def soundex(name):
+    letters = [letter for letter in (name or "").upper() if "A" <= letter <= "Z"]
+    if not letters:
+        return ""
+    code = [letters[0]]
+    previous = SOUNDEX_CODES.get(letters[0], "")
+    for letter in letters[1:]:
+        digit = SOUNDEX_CODES.get(letter, "")
+        if digit and digit != previous:
+            code.append(digit)
+        # H and W don't separate letters with the same code; vowels do
+        if letter not in "HW":
+            previous = digit
+    return "".join(code).ljust(4, "0")[:4]
+
+
+def blocking_keys(lead):
+    """The lead_keys entries for lead; leads sharing any of them are compared with match_reasons."""
+    keys = []
+    phone = normalize_phone(lead.phone)
+    if phone:
+        keys.append(f"phone:{phone}")
+    email = normalize_email(lead.email)
+    if email:
+        keys.append(f"email:{email}")
+    zipcode = normalize_zip(lead.zipcode)
+    number = street_number(lead.address_line1)
+    if zipcode and number:
+        keys.append(f"address:{zipcode}:{number}")
+    last_name = soundex(lead.last_name)
+    place = zipcode or (lead.city or "").strip().lower()
+    if last_name and place:
+        keys.append(f"name:{last_name}:{place}")
+    return keys
+
+
+def match_reasons(a, b):
+    """Return why two leads look like the same person, e.g. ["phone", "email"]; [] if they don't."""
+    reasons = []
+    phone = normalize_phone(a.phone)
+    if phone and phone == normalize_phone(b.phone):
+        reasons.append("phone")
+    email = normalize_email(a.email)
+    if email and email == normalize_email(b.email):
+        reasons.append("email")
+    same_first = (a.first_name or "").strip().lower() == (b.first_name or "").strip().lower() and bool(a.first_name)
+    same_last = soundex(a.last_name) == soundex(b.last_name) and bool(soundex(a.last_name))
+    address = normalize_address(a.address_line1)
+    same_zip = normalize_zip(a.zipcode) == normalize_zip(b.zipcode)
+    if address and address == normalize_address(b.address_line1) and same_zip and (same_first or same_last):
+        reasons.append("address")
+    numbers = (street_number(a.address_line1), street_number(b.address_line1))
+    if same_first and same_last and same_zip and (numbers[0] == numbers[1] or not all(numbers)):
+        reasons.append("name")
+    return reasons
+
+
+def refresh_index(connection, limit=None):
+    """Key leads added since the last refresh and re-key edited ones, committing a chunk at a time.
+
+    With limit, stop after about that many leads so a caller holding a lock can let
+    others in between calls. Returns True once the index is up to date.
+    """
+    done = 0
+    while limit is None or done < limit:
+        with connection:
+            keyed = refresh_chunk(connection)
+        if not keyed:
+            return True
+        done += keyed
+    return False
+
+
+def refresh_chunk(connection):
+    """Key up to INDEX_CHUNK_SIZE stale or new leads without committing; returns how many, 0 once up to date."""
+    stale = [row[0] for row in connection.execute(
+        "SELECT lead_id FROM lead_keys_stale LIMIT ?", (INDEX_CHUNK_SIZE,))]
+    if stale:
+        stale_ids = (json.dumps(stale),)
+        connection.execute(f"DELETE FROM lead_keys WHERE lead_id IN ({leads.IDS_SQL})", stale_ids)
+        connection.execute(f"DELETE FROM lead_keys_stale WHERE lead_id IN ({leads.IDS_SQL})", stale_ids)
+        add_keys(connection, leads.get_leads(connection, stale))
+        return len(stale)
+    indexed_through = connection.execute("SELECT indexed_through FROM lead_keys_state").fetchone()[0]
+    page = leads.fetch_page(connection, indexed_through, INDEX_CHUNK_SIZE)
+    if page:
+        add_keys(connection, page)
+        connection.execute("UPDATE lead_keys_state SET indexed_through = ?", (page[-1].id,))
+    return len(page)
+
+
+def add_keys(connection, keyed_leads):
+    connection.executemany(
+        "INSERT OR IGNORE INTO lead_keys (key, lead_id) VALUES (?, ?)",
+        [(key, lead.id) for lead in keyed_leads for key in blocking_keys(lead)])
+
+
+def find_matches(connection, lead, limit=10):
+    """Return [(existing Lead, reasons)] for leads that look like duplicates of lead, best matches first."""
+    refresh_index(connection)
+    keys = blocking_keys(lead)
+    if not keys:
+        return []
+    candidate_ids = [row[0] for row in connection.execute(
+        f"SELECT DISTINCT lead_id FROM lead_keys WHERE key IN ({leads.IDS_SQL}) LIMIT ?",
+        (json.dumps(keys), MAX_BLOCK_SIZE * len(keys)))]
+    matches = []
+    for candidate in leads.get_leads(connection, candidate_ids):
+        if candidate.id == lead.id:
+            continue
+        reasons = match_reasons(lead, candidate)
+        if reasons:
+            matches.append((candidate, reasons))
+    matches.sort(key=lambda match: -len(match[1]))
+    return matches[:limit]
+
+
+def find_duplicate_groups(connection, progress=None, should_cancel=None):
+    """Return lists of lead ids that are the same person, each sorted with the oldest lead first.
+
+    Only leads sharing a blocking key are compared, so the work grows with the number
+    of leads rather than its square. progress(blocks_done, blocks_total) is called as
+    blocks are compared and should_cancel() can stop the search early, returning [].
+    """
+    refresh_index(connection)
+    parent = {}
+
+    def find(lead_id):
+        root = lead_id
+        while parent.get(root, root) != root:
+            root = parent[root]
+        while parent.get(lead_id, lead_id) != root:
+            parent[lead_id], lead_id = root, parent[lead_id]
+        return root
+
+    blocks = connection.execute("""
+        SELECT group_concat(lead_id) FROM lead_keys GROUP BY key HAVING COUNT(*) BETWEEN 2 AND ?
+    """, (MAX_BLOCK_SIZE,)).fetchall()
+    for done, (block,) in enumerate(blocks, 1):
+        if should_cancel and should_cancel():
+            return []
+        block_leads = leads.get_leads(connection, [int(lead_id) for lead_id in block.split(",")])
+        for position, a in enumerate(block_leads):
+            for b in block_leads[position + 1:]:
+                if find(a.id) != find(b.id) and match_reasons(a, b):
+                    first, second = sorted((find(a.id), find(b.id)))
+                    parent[second] = first
+        if progress and done % 1000 == 0:
+            progress(done, len(blocks))
+
+    groups = {}
+    for lead_id in parent:
+        groups.setdefault(find(lead_id), set()).add(lead_id)
+    return sorted(sorted(group | {root}) for root, group in groups.items())
+
+
+def merge_group(connection, lead_ids):
+    """Fold the leads in lead_ids into the oldest one and delete the rest; returns (kept_id, removed_ids).
+
+    Blank fields of the kept lead are filled from the others in id order, notes are
+    combined, and a lead still "In System" takes the most advanced status of the group.
+    Appointments with the removed leads move to the kept one. Runs inside the caller's
+    transaction.
+    """
+    group = leads.get_leads(connection, sorted(lead_ids))
+    if len(group) < 2:
+        return (group[0].id if group else None), []
+    kept, others = group[0], group[1:]
+    changes = {}
+    for field in leads.LEAD_FIELDS:
+        if field in ("notes", "lead_status"):
+            continue
+        if not getattr(kept, field):
+            value = next((getattr(other, field) for other in others if getattr(other, field)), None)
+            if value:
+                changes[field] = value
+    notes = []
+    for lead in group:
+        if lead.notes and lead.notes not in notes:
+            notes.append(lead.notes)
+    if "\n".join(notes) != (kept.notes or ""):
+        changes["notes"] = "\n".join(notes)
+    if not kept.lead_status:
+        status = max(lead.lead_status or 0 for lead in group)
+        if status:
+            changes["lead_status"] = status
+    leads.update_lead(connection, kept.id, **changes)
+    removed = [lead.id for lead in others]
+    appointments.move_appointments(connection, removed, kept.id)
+    leads.delete_leads(connection, removed)
+    return kept.id, removed
+
+
+def merge_groups(connection, groups):
+    """Merge every group; returns (kept_ids, removed_ids). Runs inside the caller's transaction."""
+    kept_ids = []
+    removed_ids = []
+    for group in groups:
+        kept_id, removed = merge_group(connection, group)
+        if removed:
+            kept_ids.append(kept_id)
+            removed_ids.extend(removed)
+    return kept_ids, removed_ids
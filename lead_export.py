@@ -0,0 +1,312 @@
+"""Streaming CSV, TXT and PDF exports of the leads table.
+
+Every exporter reads from a SQLite cursor with fetchmany, so memory use stays the
+same whether the table holds a hundred leads or a million. Like lead_import this
+module has no Qt dependency; the GUI runs the exporters on a worker thread.
+reportlab is only imported once a PDF export actually runs, since loading it costs
+more than the rest of the app's startup imports; multiprocessing likewise waits for
+a parallel export.
+
+reportlab lays tables out on one core, so large PDF exports can be split into id
+ranges that worker processes render as separate PDFs. Those are then stitched into
+one file by merge_pdfs, which only understands the PDFs reportlab itself writes.
+"""
+import csv
+import json
+import os
+import re
+import sqlite3
+import tempfile
+
+import leads
+
+EXPORT_HEADERS = ["Name", "Address", "Phone", "Email", "Notes", "Job Type"]
+
+EXPORT_SQL = f"{leads.SELECT_SQL} ORDER BY id"
+EXPORT_RANGE_SQL = f"{leads.SELECT_SQL} WHERE id BETWEEN ? AND ? ORDER BY id"
+# A selection of leads, in the order their ids are listed in the JSON array parameter
+EXPORT_SELECTION_SQL = (f"SELECT {', '.join(f'leads.{field}' for field in leads.LEAD_FIELDS)}, leads.id "
+                        f"FROM json_each(?) AS selected JOIN leads ON leads.id = selected.value ORDER BY selected.key")
+
+# One lead in the TXT export: a "Header: value" line per column and a blank line after
+TXT_RECORD = "".join(f"{header}: {{}}\n" for header in EXPORT_HEADERS) + "\n"
+
+# Rows per reportlab table; each chunk is laid out and released before the next is read
+PDF_ROWS_PER_TABLE = 500
+PDF_COLUMN_WIDTHS = [80, 110, 70, 90, 90, 60]
+PDF_TABLE_STYLE = [('BACKGROUND', (0, 0), (-1, 0), 'grey'),
+                   ('TEXTCOLOR', (0, 0), (-1, 0), 'whitesmoke'),
+                   ('ALIGN', (0, 0), (-1, -1), 'CENTER'),
+                   ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
+                   ('FONTSIZE', (0, 0), (-1, -1), 7),
+                   ('BOTTOMPADDING', (0, 0), (-1, 0), 12),
+                   ('BACKGROUND', (0, 1), (-1, -1), 'beige'),
+                   ('GRID', (0, 0), (-1, -1), 1, 'black')]
+
+# Leads per worker process job in a parallel PDF export; fewer than two shards' worth is exported in-process
+PDF_SHARD_SIZE = 5000
+
+
+def format_lead(lead):
+    """Turn a leads.Lead into the [Name, Address, Phone, Email, Notes, Job Type] export layout."""
+    name = " ".join(part for part in (lead.first_name, lead.last_name) if part)
+    region = " ".join(part for part in (lead.state, lead.zipcode) if part)
+    address = ", ".join(part for part in (lead.address_line1, lead.address_line2, lead.city, region) if part)
+    return [name, address, lead.phone or "", lead.email or "", lead.notes or "", lead.job_type or ""]
+
+
+def count_leads(connection):
+    return connection.execute("SELECT COUNT(*) FROM leads").fetchone()[0]
+
+
+def iter_chunks(connection, chunk_size=1000, sql=EXPORT_SQL, params=()):
+    """Yield lists of formatted leads, chunk_size at a time, straight off the cursor."""
+    cursor = leads.select_leads(connection, sql, params)
+    while True:
+        rows = cursor.fetchmany(chunk_size)
+        if not rows:
+            break
+        yield [format_lead(row) for row in rows]
+
+
+class ExportCancelled(Exception):
+    pass
+
+
+def run_export(write, path, connection, progress, should_cancel, chunk_size=1000, lead_ids=None):
+    """Feed write() a stream of lead chunks and return (exported, cancelled).
+
+    progress(exported, total) is called after each chunk is written and should_cancel()
+    is checked before the next one is read. A cancelled export removes its partial file.
+    With lead_ids, only those leads are exported, in that order.
+    """
+    if lead_ids is None:
+        sql, params = EXPORT_SQL, ()
+        total = count_leads(connection) if progress else 0
+    else:
+        sql, params = EXPORT_SELECTION_SQL, (json.dumps(list(lead_ids)),)
+        total = len(lead_ids)
+    exported = 0
+
+    def chunks():
+        nonlocal exported
+        for chunk in iter_chunks(connection, chunk_size, sql, params):
+            if should_cancel and should_cancel():
+                raise ExportCancelled()
+            yield chunk
+            exported += len(chunk)
+            if progress:
+                progress(exported, total)
+
+    try:
+        write(chunks())
+    except ExportCancelled:
+        if os.path.exists(path):
+            os.remove(path)
+        return exported, True
+    return exported, False
+
+
+def export_csv(connection, path, progress=None, should_cancel=None, lead_ids=None):
+    def write(chunks):
+        with open(path, "w", newline="") as csvfile:
+            writer = csv.writer(csvfile)
+            writer.writerow(EXPORT_HEADERS)
+            for chunk in chunks:
+                writer.writerows(chunk)
+
+    return run_export(write, path, connection, progress, should_cancel, lead_ids=lead_ids)
+
+
+def export_txt(connection, path, progress=None, should_cancel=None, lead_ids=None):
+    def write(chunks):
+        with open(path, "w") as file:
+            for chunk in chunks:
+                file.write("".join(TXT_RECORD.format(*lead) for lead in chunk))
+
+    return run_export(write, path, connection, progress, should_cancel, lead_ids=lead_ids)
+
+
+class FlowableStream(list):
+    """A flowable list for doc.build that pulls the next table from a generator when it runs dry.
+
+    reportlab consumes flowables from the front of the list, so only the table being
+    laid out is ever in memory instead of one table holding every lead.
+    """
+    def __init__(self, flowables):
+        super().__init__()
+        self.flowables = iter(flowables)
+
+    def __len__(self):
+        if not super().__len__():
+            flowable = next(self.flowables, None)
+            if flowable is not None:
+                self.append(flowable)
+        return super().__len__()
+
+
+def pdf_tables(chunks):
+    from reportlab.platypus import LongTable, TableStyle
+
+    style = TableStyle(PDF_TABLE_STYLE)
+    for chunk in chunks:
+        table = LongTable([EXPORT_HEADERS] + chunk, colWidths=PDF_COLUMN_WIDTHS, repeatRows=1)
+        table.setStyle(style)
+        yield table
+
+
+def write_pdf(path, chunks):
+    from reportlab.lib.pagesizes import letter
+    from reportlab.platypus import SimpleDocTemplate
+
+    doc = SimpleDocTemplate(path, pagesize=letter)
+    doc.build(FlowableStream(pdf_tables(chunks)))
+
+
+def export_pdf(connection, path, progress=None, should_cancel=None, lead_ids=None):
+    return run_export(lambda chunks: write_pdf(path, chunks), path, connection, progress, should_cancel,
+                      PDF_ROWS_PER_TABLE, lead_ids)
+
+
+def pdf_shards(connection, shard_size=PDF_SHARD_SIZE):
+    """Split the leads table into [(first_id, last_id, count)] ranges of shard_size leads."""
+    shards = []
+    last_id = 0
+    while True:
+        first_id, last_id, count = connection.execute("""
+            SELECT MIN(id), MAX(id), COUNT(*) FROM (SELECT id FROM leads WHERE id > ? ORDER BY id LIMIT ?)
+        """, (last_id, shard_size)).fetchone()
+        if not count:
+            return shards
+        shards.append((first_id, last_id, count))
+
+
+def render_pdf_shard(db_path, first_id, last_id, path):
+    """Write the leads with ids from first_id to last_id to their own PDF; runs in a worker process."""
+    connection = sqlite3.connect(db_path)
+    try:
+        write_pdf(path, iter_chunks(connection, PDF_ROWS_PER_TABLE, EXPORT_RANGE_SQL, (first_id, last_id)))
+    finally:
+        connection.close()
+
+
+def export_pdf_parallel(connection, path, progress=None, should_cancel=None, workers=None):
+    """export_pdf spread over worker processes, one PDF_SHARD_SIZE range of leads at a time.
+
+    Each range starts on a new page, otherwise the output matches export_pdf. Workers
+    read through their own connections, so leads edited during the export may show
+    either version. A cancelled export never creates path.
+    """
+    # Imported here so that only a parallel export pays for loading multiprocessing
+    import multiprocessing
+    from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+    from concurrent.futures.process import BrokenProcessPool
+
+    workers = workers or os.cpu_count() or 1
+    shards = pdf_shards(connection)
+    if workers < 2 or len(shards) < 2:
+        return export_pdf(connection, path, progress, should_cancel)
+    db_path = connection.execute("PRAGMA database_list").fetchone()[2]
+    total = sum(count for _, _, count in shards)
+    exported = 0
+
+    with tempfile.TemporaryDirectory(dir=os.path.dirname(os.path.abspath(path))) as parts_dir:
+        part_paths = [os.path.join(parts_dir, f"{index}.pdf") for index in range(len(shards))]
+        # spawn rather than fork: the GUI calls this from a thread of a process that already runs others
+        pool = ProcessPoolExecutor(min(workers, len(shards)), mp_context=multiprocessing.get_context("spawn"))
+        try:
+            pending = {pool.submit(render_pdf_shard, db_path, first_id, last_id, part_path): count
+                       for (first_id, last_id, count), part_path in zip(shards, part_paths)}
+            while pending:
+                if should_cancel and should_cancel():
+                    return exported, True
+                done, _ = wait(pending, timeout=0.1, return_when=FIRST_COMPLETED)
+                for future in done:
+                    future.result()
+                    exported += pending.pop(future)
+                    if progress:
+                        progress(exported, total)
+        except BrokenProcessPool as e:
+            raise OSError(f"A PDF export worker stopped unexpectedly: {e}") from e
+        finally:
+            pool.shutdown(cancel_futures=True)
+        merge_pdfs(part_paths, path)
+    return exported, False
+
+
+PDF_OBJECT_RE = re.compile(rb"(\d+) 0 obj\s*")
+PDF_STREAM_RE = re.compile(rb"stream\r?\n")
+PDF_LENGTH_RE = re.compile(rb"/Length (\d+)")
+PDF_REFERENCE_RE = re.compile(rb"(\d+) 0 R\b")
+
+
+def read_pdf(path):
+    """Return ({number: (dictionary, stream or None)}, catalog number, info number) for a reportlab PDF.
+
+    Relies on what reportlab writes: one classic xref table and a direct /Length on
+    every stream, so stream data is copied without being decoded or searched.
+    """
+    with open(path, "rb") as file:
+        data = file.read()
+    xref = int(re.search(rb"startxref\s+(\d+)\s+%%EOF\s*$", data).group(1))
+    table = re.compile(rb"xref\s+0 (\d+)\s+").match(data, xref)
+    entries = re.findall(rb"(\d{10}) \d{5} ([nf])", data[table.end():table.end() + 20 * int(table.group(1))])
+    trailer = data[table.end() + 20 * int(table.group(1)):]
+    objects = {}
+    for number, (offset, kind) in enumerate(entries):
+        if kind != b"n":
+            continue
+        start = PDF_OBJECT_RE.match(data, int(offset)).end()
+        end = data.index(b"endobj", start)
+        stream = PDF_STREAM_RE.search(data, start, end)
+        if stream:
+            length = int(PDF_LENGTH_RE.search(data, start, stream.start()).group(1))
+            objects[number] = (data[start:stream.start()].rstrip(), data[stream.end():stream.end() + length])
+        else:
+            objects[number] = (data[start:end].rstrip(), None)
+    catalog = int(re.search(rb"/Root (\d+) 0 R", trailer).group(1))
+    info = re.search(rb"/Info (\d+) 0 R", trailer)
+    return objects, catalog, info and int(info.group(1))
+
+
+def merge_pdfs(part_paths, path):
+    """Concatenate the pages of reportlab-written PDFs into one PDF at path, reading one part at a time."""
+    # Object 1 is the merged page tree and 2 the catalog; both are written last
+    offsets = {}
+    kids = []
+    next_number = 3
+    with open(path, "wb") as out:
+        out.write(b"%PDF-1.4\n%\xe2\xe3\xcf\xd3\n")
+        for part_path in part_paths:
+            objects, catalog, info = read_pdf(part_path)
+            pages = int(re.search(rb"/Pages (\d+) 0 R", objects[catalog][0]).group(1))
+            # The part's own catalog, page tree and info are replaced; its pages point at the merged tree
+            numbers = {pages: 1}
+            for number in objects:
+                if number not in (catalog, pages, info):
+                    numbers[number] = next_number
+                    next_number += 1
+
+            def renumber(dictionary):
+                return PDF_REFERENCE_RE.sub(lambda ref: b"%d 0 R" % numbers[int(ref.group(1))], dictionary)
+
+            kids.extend(numbers[int(kid)] for kid in re.findall(
+                rb"(\d+) 0 R", re.search(rb"/Kids \[([^\]]*)\]", objects[pages][0]).group(1)))
+            for number, (dictionary, stream) in objects.items():
+                if number in (catalog, pages, info):
+                    continue
+                offsets[numbers[number]] = out.tell()
+                out.write(b"%d 0 obj\n%s\n" % (numbers[number], renumber(dictionary)))
+                if stream is not None:
+                    out.write(b"stream\n%s\nendstream\n" % stream)
+                out.write(b"endobj\n")
+
+        offsets[1] = out.tell()
+        out.write(b"1 0 obj\n<< /Type /Pages /Count %d /Kids [ %s ] >>\nendobj\n" % (
+            len(kids), b" ".join(b"%d 0 R" % kid for kid in kids)))
+        offsets[2] = out.tell()
+        out.write(b"2 0 obj\n<< /Type /Catalog /Pages 1 0 R >>\nendobj\n")
+        xref = out.tell()
+        out.write(b"xref\n0 %d\n0000000000 65535 f \n" % next_number)
+        out.write(b"".join(b"%010d 00000 n \n" % offsets[number] for number in range(1, next_number)))
+        out.write(b"trailer\n<< /Size %d /Root 2 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (next_number, xref))
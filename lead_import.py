@@ -0,0 +1,187 @@
+"""Bulk import of purchased lead lists (CSV or vCard) into the leads table.
+
+Rows are streamed from the file with generators as leads.Lead records and written
+with leads.add_leads in large batches, one transaction per batch, so a 100k row
+list is a few dozen commits instead of one per lead. Nothing here depends on Qt,
+so the same code backs the GUI import button and `python leads.py import`.
+"""
+import csv
+import os
+import re
+import time
+
+import leads
+import migrations
+
+DEFAULT_VALUES = {"job_type": "Unknown", "lead_status": 0}
+
+STATUS_CODES = {label.lower(): status for status, label in enumerate(migrations.LEAD_STATUSES)}
+
+# Normalized CSV header -> leads column
+HEADER_ALIASES = {
+    "firstname": "first_name", "first": "first_name", "givenname": "first_name", "fname": "first_name",
+    "lastname": "last_name", "last": "last_name", "surname": "last_name", "familyname": "last_name",
+    "lname": "last_name",
+    "name": "name", "fullname": "name", "contactname": "name",
+    "address": "address_line1", "address1": "address_line1", "addressline1": "address_line1",
+    "street": "address_line1", "streetaddress": "address_line1",
+    "address2": "address_line2", "addressline2": "address_line2", "apt": "address_line2",
+    "suite": "address_line2", "unit": "address_line2",
+    "city": "city", "town": "city",
+    "state": "state", "st": "state", "province": "state", "region": "state",
+    "zip": "zipcode", "zipcode": "zipcode", "postalcode": "zipcode", "postcode": "zipcode",
+    "phone": "phone", "phonenumber": "phone", "telephone": "phone", "tel": "phone", "mobile": "phone",
+    "cell": "phone", "cellphone": "phone",
+    "email": "email", "emailaddress": "email",
+    "notes": "notes", "note": "notes", "comments": "notes",
+    "referredby": "referred_by", "referral": "referred_by", "source": "referred_by",
+    "referredto": "referred_to",
+    "jobtype": "job_type", "type": "job_type",
+    "leadstatus": "lead_status", "status": "lead_status",
+}
+
+
+def normalize_header(header):
+    return re.sub(r"[^a-z0-9]", "", header.lower())
+
+
+def map_headers(headers):
+    """Return {leads column: index in the CSV row} for the headers we recognise."""
+    mapping = {}
+    for position, header in enumerate(headers):
+        column = HEADER_ALIASES.get(normalize_header(header))
+        if column and column not in mapping:
+            mapping[column] = position
+    return mapping
+
+
+def split_name(name):
+    first, _, last = name.strip().partition(" ")
+    return first, last.strip()
+
+
+def make_lead(values):
+    """Build a leads.Lead from a {column: value} dict."""
+    if "name" in values and not (values.get("first_name") or values.get("last_name")):
+        values["first_name"], values["last_name"] = split_name(values["name"])
+    if "lead_status" in values:
+        values["lead_status"] = STATUS_CODES.get(values["lead_status"].strip().lower(), 0)
+    return leads.Lead(*(values.get(field) or DEFAULT_VALUES.get(field, "") for field in leads.LEAD_FIELDS))
+
+
+def read_csv(path):
+    """Yield one Lead per CSV record, mapping recognised headers onto the leads columns."""
+    with open(path, newline="", encoding="utf-8-sig") as csvfile:
+        reader = csv.reader(csvfile)
+        headers = next(reader, None)
+        if headers is None:
+            return
+        mapping = map_headers(headers)
+        if not mapping:
+            raise ValueError(f"No recognised lead columns in {path}: {headers}")
+        items = list(mapping.items())
+        for record in reader:
+            if not any(record):
+                continue
+            yield make_lead({column: record[position].strip() for column, position in items if position < len(record)})
+
+
+def unescape_vcard(value):
+    return value.replace("\\n", "\n").replace("\\N", "\n").replace("\\,", ",").replace("\\;", ";").replace("\\\\", "\\")
+
+
+def vcard_lines(vcfile):
+    """Yield logical vCard lines, joining folded continuation lines."""
+    current = None
+    for line in vcfile:
+        line = line.rstrip("\r\n")
+        if line[:1] in (" ", "\t") and current is not None:
+            current += line[1:]
+            continue
+        if current is not None:
+            yield current
+        current = line
+    if current is not None:
+        yield current
+
+
+def read_vcard(path):
+    """Yield one Lead per vCard in the file."""
+    with open(path, encoding="utf-8-sig") as vcfile:
+        values = None
+        for line in vcard_lines(vcfile):
+            name, _, value = line.partition(":")
+            prop = name.split(";")[0].split(".")[-1].upper()
+            if prop == "BEGIN":
+                values = {}
+            elif values is None:
+                continue
+            elif prop == "END":
+                yield make_lead(values)
+                values = None
+            elif prop == "N":
+                parts = value.split(";") + [""] * 2
+                values.setdefault("last_name", unescape_vcard(parts[0]))
+                values.setdefault("first_name", unescape_vcard(parts[1]))
+            elif prop == "FN":
+                values.setdefault("name", unescape_vcard(value))
+            elif prop == "TEL":
+                values.setdefault("phone", value.removeprefix("tel:"))
+            elif prop == "EMAIL":
+                values.setdefault("email", value)
+            elif prop == "ADR" and "address_line1" not in values:
+                parts = [unescape_vcard(part) for part in value.split(";")] + [""] * 7
+                values["address_line2"] = parts[1]
+                values["address_line1"] = parts[2]
+                values["city"] = parts[3]
+                values["state"] = parts[4]
+                values["zipcode"] = parts[5]
+            elif prop == "NOTE":
+                values.setdefault("notes", unescape_vcard(value))
+
+
+def read_leads(path):
+    """Pick a reader from the file extension."""
+    if os.path.splitext(path)[1].lower() in (".vcf", ".vcard"):
+        return read_vcard(path)
+    return read_csv(path)
+
+
+def import_leads(connection, rows, batch_size=10000, progress=None, should_cancel=None):
+    """Insert the Leads in rows in batches of batch_size, one transaction per batch.
+
+    progress(imported, elapsed_seconds) is called after every committed batch and
+    should_cancel() is checked before each one. Returns (imported, elapsed_seconds,
+    cancelled, first_id, last_id); the ids bound the rows that were inserted.
+    """
+    first_id = leads.next_lead_id(connection)
+    last_id = first_id - 1
+    imported = 0
+    cancelled = False
+    started = time.perf_counter()
+
+    def flush(batch):
+        nonlocal imported, last_id
+        with connection:
+            last_id = leads.add_leads(connection, batch)[1]
+        imported += len(batch)
+        if progress:
+            progress(imported, time.perf_counter() - started)
+
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) < batch_size:
+            continue
+        if should_cancel and should_cancel():
+            cancelled = True
+            break
+        flush(batch)
+        batch = []
+    else:
+        if batch and should_cancel and should_cancel():
+            cancelled = True
+        elif batch:
+            flush(batch)
+
+    return imported, time.perf_counter() - started, cancelled, first_id, last_id
@@ -0,0 +1,268 @@
+"""Search filters for the leads table, pushed down into SQL.
+
+Filters are a dict of {filter name: text} as typed into the filter bar. Each one
+becomes a parameterized predicate that can use one of the indexes created by
+create_search_indexes, and the "text" filter runs a full-text match against the
+leads_fts FTS5 table over names, address and notes.
+
+Unsorted pages are read in id order, so a prefix filter that matches most rows is fastest as a
+plain predicate on an id-ordered scan, while one that matches few rows must go through
+its index. build_where probes the index to tell the two apart.
+
+Sorting is pushed down too. A sort is a sequence of (column, descending) pairs, ending
+implicitly in id so ties always come out in the same order, and pages of a sorted
+listing are read by keyset: keyset_segments turns the sort key of the last row shown
+into conditions that each seek straight to their place in a sort index, so a page
+deep into a million rows costs what the first one does.
+"""
+import re
+
+import geo
+import lead_counts
+
+# Text columns matched by prefix. The indexes use NOCASE so SQLite's LIKE optimization applies.
+PREFIX_FILTERS = {
+    "phone": ("phone",),
+    "email": ("email",),
+    "city": ("city",),
+    "zipcode": ("zipcode",),
+    "referred_by": ("referred_by",),
+    "name": ("first_name", "last_name"),
+}
+
+# Columns matched exactly (ignoring case), e.g. from a combo box
+EXACT_FILTERS = ("state", "job_type")
+
+INDEXED_COLUMNS = ("first_name", "last_name", "phone", "email", "city", "state", "zipcode", "referred_by", "job_type")
+
+# A prefix filter matching fewer rows than this is looked up through its index
+SELECTIVE_LIMIT = 2000
+
+# Columns that can be sorted on and the expression each sorts by; text sorts ignore case like the indexes
+SORT_COLUMNS = {
+    "id": "id",
+    "lead_status": "lead_status",
+    **{column: f"{column} COLLATE NOCASE" for column in (
+        "first_name", "last_name", "address_line1", "address_line2", "city", "state", "zipcode",
+        "phone", "email", "notes", "referred_by", "referred_to", "job_type")},
+}
+
+# Indexes for the common multi-column sorts, and for referred_to, which INDEXED_COLUMNS
+# leaves out. A single-column index serves its column alone, holding rows in (column, id)
+# order; the address and notes columns aren't worth indexing and sort by scanning.
+SORT_INDEXES = {
+    "idx_leads_status_last_name": ("lead_status", "last_name COLLATE NOCASE"),
+    "idx_leads_city_zipcode": ("city COLLATE NOCASE", "zipcode COLLATE NOCASE"),
+    "idx_leads_referred_to": ("referred_to COLLATE NOCASE",),
+}
+
+FTS_COLUMNS = ("first_name", "last_name", "address_line1", "address_line2", "city", "notes")
+
+
+def create_search_indexes(connection):
+    """Create the filter indexes and the leads_fts table, filling it the first time it is created.
+
+    Runs as part of the leads migrations; the caller commits.
+    """
+    for column in INDEXED_COLUMNS:
+        connection.execute(f"CREATE INDEX IF NOT EXISTS idx_leads_{column} ON leads ({column} COLLATE NOCASE)")
+
+    fts_exists = connection.execute(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'leads_fts'").fetchone()
+    if not fts_exists:
+        columns = ", ".join(FTS_COLUMNS)
+        new_columns = ", ".join(f"new.{column}" for column in FTS_COLUMNS)
+        old_columns = ", ".join(f"old.{column}" for column in FTS_COLUMNS)
+        connection.execute(
+            f"CREATE VIRTUAL TABLE leads_fts USING fts5({columns}, content='leads', content_rowid='id')")
+        # Bulk inserts set deferred and index their rows in one pass instead of row by row
+        connection.execute("CREATE TABLE leads_fts_state (deferred INTEGER NOT NULL)")
+        connection.execute("INSERT INTO leads_fts_state (deferred) VALUES (0)")
+        # Keep the external-content index in step with the leads table
+        connection.execute(f"""
+            CREATE TRIGGER leads_fts_insert AFTER INSERT ON leads
+            WHEN NOT (SELECT deferred FROM leads_fts_state) BEGIN
+                INSERT INTO leads_fts (rowid, {columns}) VALUES (new.id, {new_columns});
+            END""")
+        connection.execute(f"""
+            CREATE TRIGGER leads_fts_delete AFTER DELETE ON leads BEGIN
+                INSERT INTO leads_fts (leads_fts, rowid, {columns}) VALUES ('delete', old.id, {old_columns});
+            END""")
+        create_fts_update_trigger(connection)
+        connection.execute("INSERT INTO leads_fts (leads_fts) VALUES ('rebuild')")
+
+
+def create_fts_update_trigger(connection):
+    """(Re)create leads_fts_update so it only fires for updates that set one of FTS_COLUMNS.
+
+    Status, job type and other bulk edits then leave leads_fts alone instead of deleting
+    and re-adding every row they touch. The caller commits.
+    """
+    columns = ", ".join(FTS_COLUMNS)
+    new_columns = ", ".join(f"new.{column}" for column in FTS_COLUMNS)
+    old_columns = ", ".join(f"old.{column}" for column in FTS_COLUMNS)
+    connection.execute("DROP TRIGGER IF EXISTS leads_fts_update")
+    connection.execute(f"""
+        CREATE TRIGGER leads_fts_update AFTER UPDATE OF {columns} ON leads BEGIN
+            INSERT INTO leads_fts (leads_fts, rowid, {columns}) VALUES ('delete', old.id, {old_columns});
+            INSERT INTO leads_fts (rowid, {columns}) VALUES (new.id, {new_columns});
+        END""")
+
+
+def create_sort_indexes(connection):
+    """Create SORT_INDEXES. Runs as part of the leads migrations; the caller commits."""
+    for name, columns in SORT_INDEXES.items():
+        connection.execute(f"CREATE INDEX IF NOT EXISTS {name} ON leads ({', '.join(columns)})")
+
+
+def insert_many(connection, insert_sql, rows):
+    """executemany insert_sql into leads, then add the new rows to leads_fts, lead_counts and lead_locations set-wise.
+
+    Indexing and counting row by row from the insert triggers is several times slower for large batches.
+    Call this inside the caller's transaction: the deferred flag is set and cleared while
+    holding the write lock, so no other connection ever sees it set.
+    """
+    last_id = connection.execute("SELECT MAX(id) FROM leads").fetchone()[0] or 0
+    connection.execute("UPDATE leads_fts_state SET deferred = 1")
+    connection.executemany(insert_sql, rows)
+    columns = ", ".join(FTS_COLUMNS)
+    connection.execute(
+        f"INSERT INTO leads_fts (rowid, {columns}) SELECT id, {columns} FROM leads WHERE id > ?", (last_id,))
+    lead_counts.count_new_leads(connection, last_id)
+    geo.locate_new_leads(connection, last_id)
+    connection.execute("UPDATE leads_fts_state SET deferred = 0")
+
+
+def escape_like(text):
+    return text.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+
+
+def fts_query(text):
+    """Turn free text into an FTS5 query that prefix-matches every word."""
+    words = re.findall(r"\w+", text)
+    return " ".join(f'"{word}"*' for word in words)
+
+
+def is_selective(connection, columns, pattern):
+    """Count index matches for pattern, stopping early once SELECTIVE_LIMIT is reached."""
+    matches = 0
+    for column in columns:
+        matches += connection.execute(
+            f"SELECT COUNT(*) FROM (SELECT 1 FROM leads WHERE {column} LIKE ? ESCAPE '\\' LIMIT ?)",
+            (pattern, SELECTIVE_LIMIT)).fetchone()[0]
+        if matches >= SELECTIVE_LIMIT:
+            return False
+    return True
+
+
+def build_where(connection, filters, sort=()):
+    """Return (where_sql, params) for the non-empty filters, where_sql being "" when nothing applies.
+
+    Pass the sort the rows will be read in: a broad prefix filter on the leading sort
+    column is better matched as a range of the index that sort walks anyway.
+    """
+    leading = sort[0][0] if sort else "id"
+    clauses = []
+    params = []
+    for name, value in filters.items():
+        value = str(value if value is not None else "").strip()
+        if not value:
+            continue
+        if name in PREFIX_FILTERS:
+            columns = PREFIX_FILTERS[name]
+            pattern = escape_like(value) + "%"
+            if is_selective(connection, columns, pattern):
+                lookups = " UNION ALL ".join(f"SELECT id FROM leads WHERE {column} LIKE ? ESCAPE '\\'" for column in columns)
+                clauses.append(f"id IN ({lookups})")
+            elif columns == (leading,):
+                clauses.append(f"{leading} LIKE ? ESCAPE '\\'")
+            else:
+                # The unary + keeps SQLite from using the index, so matches come straight off the id scan
+                clauses.append("(" + " OR ".join(f"+{column} LIKE ? ESCAPE '\\'" for column in columns) + ")")
+            params.extend([pattern] * len(columns))
+        elif name in EXACT_FILTERS:
+            clauses.append(f"{name} = ? COLLATE NOCASE")
+            params.append(value)
+        elif name == "lead_status":
+            clauses.append("lead_status = ?")
+            params.append(int(value))
+        elif name == "text":
+            query = fts_query(value)
+            if query:
+                clauses.append("id IN (SELECT rowid FROM leads_fts WHERE leads_fts MATCH ?)")
+                params.append(query)
+        else:
+            raise ValueError(f"Unknown lead filter: {name}")
+    return " AND ".join(clauses), params
+
+
+def check_sort(sort):
+    """Return sort as a tuple of (column, descending), raising ValueError for a column that can't be sorted on."""
+    sort = tuple((column, bool(descending)) for column, descending in sort)
+    for column, _ in sort:
+        if column not in SORT_COLUMNS:
+            raise ValueError(f"Cannot sort leads by {column!r}")
+    return sort
+
+
+def parse_sort(text):
+    """Parse "last_name,-city" (a leading - meaning descending) into a sort."""
+    return check_sort((name.strip().lstrip("-"), name.strip().startswith("-"))
+                      for name in text.split(",") if name.strip())
+
+
+def sort_terms(sort):
+    """Return [(column, expression, descending)] for sort, ending with id.
+
+    An id added to break ties takes the direction of the last key, so a sort whose keys
+    all run one way can walk its index from end to end without sorting anything.
+    """
+    terms = [(column, SORT_COLUMNS[column], descending) for column, descending in sort]
+    if not terms or terms[-1][0] != "id":
+        terms.append(("id", "id", terms[-1][2] if terms else False))
+    return terms
+
+
+def order_by(sort):
+    return ", ".join(f"{expression} DESC" if descending else expression
+                     for _, expression, descending in sort_terms(sort))
+
+
+def sort_key(lead, sort):
+    """The values a lead sorts by under sort, id last; pass the last row's to keyset_segments for the next page."""
+    return tuple(getattr(lead, column) for column, _, _ in sort_terms(sort))
+
+
+def keyset_segments(sort, key):
+    """Return [(where_sql, params)] that between them select the rows after key, in the order they come.
+
+    Rows after key either match its first n values and come after it on the next one,
+    for n from the most to the fewest; each of those is an equality on a prefix of a
+    sort index plus a range on the next column, so it is one index seek. NULLs sort
+    first ascending and last descending, so a descending range gets a second segment
+    for the NULLs after it. key None selects every row.
+    """
+    if key is None:
+        return [("", [])]
+    terms = sort_terms(sort)
+    segments = []
+    for depth in range(len(terms) - 1, -1, -1):
+        equal = []
+        params = []
+        for (column, expression, _), value in zip(terms[:depth], key):
+            if value is None:
+                equal.append(f"{column} IS NULL")
+            else:
+                equal.append(f"{expression} = ?")
+                params.append(value)
+        column, expression, descending = terms[depth]
+        value = key[depth]
+        if value is None:
+            after = [] if descending else [(f"{column} IS NOT NULL", [])]
+        elif descending:
+            after = [(f"{expression} < ?", [value])] + ([(f"{column} IS NULL", [])] if column != "id" else [])
+        else:
+            after = [(f"{expression} > ?", [value])]
+        for condition, condition_params in after:
+            segments.append((" AND ".join(equal + [condition]), params + condition_params))
+    return segments
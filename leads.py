@@ -0,0 +1,952 @@
+"""Headless core for the leads database: typed lead records and the operations on them.
+
+Everything the app does to leads goes through the functions here. The GUI's
+LeadRepository is a thin Qt wrapper around them, and the command line below runs
+the same code without importing PyQt5, so batch jobs work on machines without a
+display. Write functions take a connection and run inside the caller's
+transaction; reads work on any connection.
+
+    python leads.py add --first-name Ann --last-name Lee --phone 555-0100
+    python leads.py import list.csv
+    python leads.py query --city spring --status "Good Lead" --limit 20
+    python leads.py query --sort lead_status,-last_name --limit 20
+    python leads.py export leads.csv
+    python leads.py update --status "Bad Lead" --city spring --set-referred-to "Spring Co"
+    python leads.py delete --status "Bad Lead"
+    python leads.py undelete
+    python leads.py stats
+    python leads.py rebuild-stats
+    python leads.py dedupe --merge
+    python leads.py schedule 42 "2024-05-01 09:00" "2024-05-01 10:00"
+    python leads.py agenda --days 7
+    python leads.py load-zips 2023_Gaz_zcta_national.txt
+    python leads.py near --lead 42 --miles 15 --status "Good Lead"
+    python leads.py route --day 2024-05-01 --from-zip 33602 --round-trip
+"""
+import argparse
+import csv
+import json
+import functools
+import os
+import string
+import sys
+import threading
+import time
+from dataclasses import asdict, dataclass, fields
+from datetime import date, datetime, timedelta
+
+import database
+import geo
+import lead_counts
+import lead_query
+import migrations
+
+LEAD_STATUSES = migrations.LEAD_STATUSES
+
+JOB_TYPES = ("Residential", "Commercial", "Unknown")
+
+
+@dataclass(slots=True)
+class Lead:
+    """One row of the leads table. lead_status is an index into LEAD_STATUSES; id is None until inserted.
+
+    Slotted, so a Lead costs a fixed block of pointers rather than an instance dict.
+    """
+    first_name: str | None = ""
+    last_name: str | None = ""
+    address_line1: str | None = ""
+    address_line2: str | None = ""
+    city: str | None = ""
+    state: str | None = ""
+    zipcode: str | None = ""
+    phone: str | None = ""
+    email: str | None = ""
+    notes: str | None = ""
+    referred_by: str | None = ""
+    referred_to: str | None = ""
+    job_type: str | None = "Unknown"
+    lead_status: int = 0
+    id: int | None = None
+
+    def values(self):
+        """The column values in LEAD_FIELDS order, as inserted."""
+        return tuple(getattr(self, field) for field in LEAD_FIELDS)
+
+    @property
+    def status_label(self):
+        return LEAD_STATUSES[self.lead_status] if 0 <= self.lead_status < len(LEAD_STATUSES) else "Unknown Status"
+
+
+# The stored columns in insert order
+LEAD_FIELDS = tuple(field.name for field in fields(Lead) if field.name != "id")
+
+# Selects columns in Lead field order, id last, so lead_row can pass a row straight to Lead()
+SELECT_SQL = f"SELECT {', '.join(LEAD_FIELDS)}, id FROM leads"
+# Columns copied between leads and deleted_leads
+ARCHIVE_COLUMNS = ", ".join((*LEAD_FIELDS, "created_at"))
+
+# The ids in a JSON array passed as one parameter, so a statement can take any number of them
+IDS_SQL = "SELECT value FROM json_each(?)"
+
+INSERT_SQL = (f"INSERT INTO leads ({', '.join(LEAD_FIELDS)}, created_at) "
+              f"VALUES ({', '.join('?' for _ in LEAD_FIELDS)}, date('now', 'localtime'))")
+
+
+def lead_row(cursor, row):
+    """sqlite3 row factory turning SELECT_SQL rows into Lead records."""
+    return Lead(*row)
+
+
+def select_leads(connection, sql, params=()):
+    """Run sql (which should start with SELECT_SQL) on its own cursor that yields Leads."""
+    cursor = connection.cursor()
+    cursor.row_factory = lead_row
+    return cursor.execute(sql, params)
+
+
+def check_columns(columns):
+    unknown = set(columns) - set(LEAD_FIELDS)
+    if unknown:
+        raise ValueError(f"Unknown lead columns: {', '.join(sorted(unknown))}")
+
+
+def add_lead(connection, lead):
+    """Insert lead and return its new id."""
+    return connection.execute(INSERT_SQL, lead.values()).lastrowid
+
+
+def next_lead_id(connection):
+    """The id the next lead inserted will get; leads.id is AUTOINCREMENT, so ids of deleted leads aren't reused."""
+    row = connection.execute("SELECT seq FROM sqlite_sequence WHERE name = 'leads'").fetchone()
+    return (row[0] if row else 0) + 1
+
+
+def add_leads(connection, leads):
+    """Insert many leads with a single executemany; returns (first_id, last_id) of the new rows."""
+    first_id = next_lead_id(connection)
+    lead_query.insert_many(connection, INSERT_SQL, (lead.values() for lead in leads))
+    last_id = connection.execute("SELECT MAX(id) FROM leads").fetchone()[0] or 0
+    return first_id, last_id
+
+
+def get_lead(connection, lead_id):
+    return select_leads(connection, f"{SELECT_SQL} WHERE id = ?", (lead_id,)).fetchone()
+
+
+def get_leads(connection, lead_ids):
+    """Return the leads with the given ids that still exist, in id order."""
+    lead_ids = list(lead_ids)
+    if not lead_ids:
+        return []
+    return select_leads(
+        connection, f"{SELECT_SQL} WHERE id IN ({IDS_SQL}) ORDER BY id", (json.dumps(lead_ids),)).fetchall()
+
+
+def update_lead(connection, lead_id, **changes):
+    """Set the given columns on one lead."""
+    update_leads(connection, [lead_id], **changes)
+
+
+def update_leads(connection, lead_ids, **changes):
+    """Set the same column values on every lead in lead_ids with one statement; returns the rows changed."""
+    check_columns(changes)
+    lead_ids = list(lead_ids)
+    if not changes or not lead_ids:
+        return 0
+    assignments = ", ".join(f"{column} = ?" for column in changes)
+    return connection.execute(
+        f"UPDATE leads SET {assignments} WHERE id IN ({IDS_SQL})", [*changes.values(), json.dumps(lead_ids)]).rowcount
+
+
+def delete_leads(connection, lead_ids):
+    lead_ids = list(lead_ids)
+    if not lead_ids:
+        return 0
+    return connection.execute(
+        f"DELETE FROM leads WHERE id IN ({IDS_SQL})", (json.dumps(lead_ids),)).rowcount
+
+
+def soft_delete_leads(connection, lead_ids):
+    """Move leads and their appointments to deleted_leads as one batch; returns (batch, leads deleted).
+
+    The rows leave the leads table, so the triggers keep every count and index as after
+    a plain delete and no query has to skip them. restore_leads(batch) undoes it.
+    """
+    ids = json.dumps(list(lead_ids))
+    batch = connection.execute("SELECT COALESCE(MAX(batch), 0) + 1 FROM deleted_leads").fetchone()[0]
+    connection.execute(f"""
+        INSERT INTO deleted_appointments (batch, lead_id, start_time, end_time, status, notes)
+        SELECT ?, lead_id, start_time, end_time, status, notes FROM appointments WHERE lead_id IN ({IDS_SQL})
+    """, (batch, ids))
+    connection.execute(f"""
+        INSERT INTO deleted_leads (batch, deleted_at, id, {ARCHIVE_COLUMNS})
+        SELECT ?, datetime('now', 'localtime'), id, {ARCHIVE_COLUMNS} FROM leads WHERE id IN ({IDS_SQL})
+    """, (batch, ids))
+    deleted = connection.execute(f"DELETE FROM leads WHERE id IN ({IDS_SQL})", (ids,)).rowcount
+    return batch, deleted
+
+
+def restore_leads(connection, batch):
+    """Put a batch from soft_delete_leads back, appointments included; returns the restored leads' ids.
+
+    Leads get their old ids back. Ids are never reused, but a lead that has somehow
+    taken one since, e.g. in a database restored from an older backup, is kept and the
+    deleted lead restored under a new id.
+    """
+    taken = [row[0] for row in connection.execute(
+        "SELECT deleted_leads.id FROM deleted_leads JOIN leads USING (id) WHERE batch = ?", (batch,))]
+    restored = [row[0] for row in connection.execute(
+        f"SELECT id FROM deleted_leads WHERE batch = ? AND id NOT IN ({IDS_SQL})", (batch, json.dumps(taken)))]
+    connection.execute(f"""
+        INSERT INTO leads (id, {ARCHIVE_COLUMNS})
+        SELECT id, {ARCHIVE_COLUMNS} FROM deleted_leads WHERE batch = ? AND id NOT IN ({IDS_SQL})
+    """, (batch, json.dumps(taken)))
+    for old_id in taken:
+        new_id = connection.execute(f"""
+            INSERT INTO leads ({ARCHIVE_COLUMNS}) SELECT {ARCHIVE_COLUMNS} FROM deleted_leads WHERE batch = ? AND id = ?
+        """, (batch, old_id)).lastrowid
+        connection.execute("UPDATE deleted_appointments SET lead_id = ? WHERE batch = ? AND lead_id = ?",
+                           (new_id, batch, old_id))
+        restored.append(new_id)
+    connection.execute("""
+        INSERT INTO appointments (lead_id, start_time, end_time, status, notes)
+        SELECT lead_id, start_time, end_time, status, notes FROM deleted_appointments WHERE batch = ?
+    """, (batch,))
+    # The delete dropped their duplicate keys; lead_dedupe's next refresh keys them again
+    connection.execute(f"INSERT OR IGNORE INTO lead_keys_stale (lead_id) {IDS_SQL}", (json.dumps(restored),))
+    connection.execute("DELETE FROM deleted_appointments WHERE batch = ?", (batch,))
+    connection.execute("DELETE FROM deleted_leads WHERE batch = ?", (batch,))
+    return sorted(restored)
+
+
+def deleted_batches(connection):
+    """Return [(batch, deleted_at, leads)] for the deletes that can still be undone, latest first."""
+    return connection.execute("""
+        SELECT batch, MIN(deleted_at), COUNT(*) FROM deleted_leads GROUP BY batch ORDER BY batch DESC
+    """).fetchall()
+
+
+def purge_deleted(connection, days):
+    """Drop soft-deleted leads older than days for good; returns how many were dropped."""
+    cutoff = f"-{days} days"
+    purged = connection.execute(
+        "DELETE FROM deleted_leads WHERE deleted_at < datetime('now', 'localtime', ?)", (cutoff,)).rowcount
+    connection.execute("DELETE FROM deleted_appointments WHERE batch NOT IN (SELECT batch FROM deleted_leads)")
+    return purged
+
+
+def matching_ids(connection, filters):
+    """Return the ids of the leads matching filters, in id order."""
+    where, params = lead_query.build_where(connection, filters)
+    where = f"WHERE {where}" if where else ""
+    return [row[0] for row in connection.execute(f"SELECT id FROM leads {where} ORDER BY id", params)]
+
+
+def fetch_page(connection, after_id, limit, where="", params=()):
+    """Return up to limit leads with ids after after_id, optionally narrowed by a lead_query where clause."""
+    where = f"AND {where}" if where else ""
+    return select_leads(
+        connection, f"{SELECT_SQL} WHERE id > ? {where} ORDER BY id LIMIT ?", [after_id, *params, limit]).fetchall()
+
+
+def fetch_sorted_page(connection, after_key, limit, where="", params=(), sort=()):
+    """Return up to limit leads following after_key in sort order (see lead_query.keyset_segments).
+
+    after_key is lead_query.sort_key of the last lead of the previous page, or None for the first page.
+    """
+    order = lead_query.order_by(sort)
+    page = []
+    for condition, condition_params in lead_query.keyset_segments(sort, after_key):
+        clauses = " AND ".join(clause for clause in (condition, where) if clause)
+        clauses = f"WHERE {clauses}" if clauses else ""
+        page += select_leads(connection, f"{SELECT_SQL} {clauses} ORDER BY {order} LIMIT ?",
+                             [*condition_params, *params, limit - len(page)]).fetchall()
+        if len(page) >= limit:
+            break
+    return page
+
+
+def query_leads(connection, filters=None, limit=None, page_size=1000, sort=()):
+    """Yield the leads matching filters (see lead_query.build_where) in sort order, a page at a time.
+
+    sort is a sequence of (column, descending) pairs; leads come in id order without one.
+    """
+    sort = lead_query.check_sort(sort)
+    where, params = lead_query.build_where(connection, filters or {}, sort)
+    after_key = None
+    remaining = limit
+    while remaining is None or remaining > 0:
+        size = page_size if remaining is None else min(page_size, remaining)
+        page = fetch_sorted_page(connection, after_key, size, where, params, sort)
+        yield from page
+        if len(page) < size:
+            break
+        after_key = lead_query.sort_key(page[-1], sort)
+        if remaining is not None:
+            remaining -= len(page)
+
+
+def count_leads(connection, filters=None):
+    where, params = lead_query.build_where(connection, filters or {})
+    where = f"WHERE {where}" if where else ""
+    return connection.execute(f"SELECT COUNT(*) FROM leads {where}", params).fetchone()[0]
+
+
+def lead_stats(connection, top=10, weeks=12):
+    """Return the pipeline counts from lead_counts, without scanning the leads table.
+
+    {"total": n, "by_status": {label: n}, "by_job_type": {job type: n}, "by_referred_by"
+    and "by_city": the top biggest {value: n}, "by_week": {monday: new leads} for the
+    latest weeks}. Blank values are keyed "".
+    """
+    by_status = dict.fromkeys(LEAD_STATUSES, 0)
+    for status, count in lead_counts.counts(connection, "status"):
+        status = int(status)
+        label = LEAD_STATUSES[status] if 0 <= status < len(LEAD_STATUSES) else "Unknown Status"
+        by_status[label] = by_status.get(label, 0) + count
+    return {
+        "total": lead_counts.total(connection),
+        "by_status": by_status,
+        "by_job_type": dict(lead_counts.counts(connection, "job_type")),
+        "by_referred_by": dict(lead_counts.counts(connection, "referred_by", top)),
+        "by_city": dict(lead_counts.counts(connection, "city", top)),
+        "by_week": dict(lead_counts.recent_weeks(connection, weeks)),
+    }
+
+
+def leads_near(connection, center, miles, filters=None):
+    """Return [(miles away, Lead)] for the leads matching filters within miles of center, nearest first.
+
+    center is a (latitude, longitude), e.g. from geo.lead_location. The R*Tree narrows
+    the search to a box around it, so only the leads in the box are measured.
+    """
+    where, params = lead_query.build_where(connection, filters or {})
+    where = f"AND {where}" if where else ""
+    columns = ", ".join(f"leads.{field}" for field in LEAD_FIELDS)
+    # CROSS JOIN keeps the R*Tree as the outer loop; a broad filter would otherwise drive the join
+    rows = connection.execute(f"""
+        SELECT {columns}, leads.id, (min_lat + max_lat) / 2, (min_lon + max_lon) / 2
+        FROM lead_locations CROSS JOIN leads ON leads.id = lead_locations.lead_id
+        WHERE {geo.box_sql()} {where}
+    """, [*geo.bounding_box(center, miles), *params])
+    nearby = []
+    for row in rows:
+        distance = geo.distance_miles(center, row[-2:])
+        if distance <= miles:
+            nearby.append((distance, Lead(*row[:-2])))
+    nearby.sort(key=lambda item: (item[0], item[1].id))
+    return nearby
+
+
+def plan_visits(connection, lead_ids, start=None, round_trip=False):
+    """Order a day's leads into a short driving route with geo.plan_route.
+
+    Returns (route, miles, unlocated): route is [(Lead, miles from the previous stop)],
+    from start (a (latitude, longitude)) when given and back to it if round_trip, and
+    unlocated the leads whose ZIP codes aren't in zip_centroids, to fit in by hand.
+    """
+    lead_ids = list(dict.fromkeys(lead_ids))
+    by_id = {lead.id: lead for lead in get_leads(connection, lead_ids)}
+    locations = geo.locations_of(connection, by_id)
+    located = [lead_id for lead_id in lead_ids if lead_id in locations]
+    points = [locations[lead_id] for lead_id in located]
+    route = []
+    previous = start
+    for index in geo.plan_route(points, start, round_trip):
+        route.append((by_id[located[index]], geo.distance_miles(previous, points[index]) if previous else 0.0))
+        previous = points[index]
+    miles = sum(leg for _, leg in route)
+    if round_trip and start is not None and previous is not None:
+        miles += geo.distance_miles(previous, start)
+    unlocated = [by_id[lead_id] for lead_id in lead_ids if lead_id in by_id and lead_id not in locations]
+    return route, miles, unlocated
+
+
+def fill_template(text, lead):
+    """Fill $first_name-style placeholders in text from lead; unknown placeholders are left as they are."""
+    return string.Template(text).safe_substitute(
+        {field: getattr(lead, field) or "" for field in LEAD_FIELDS}, status=lead.status_label)
+
+
+def journal_path(database_path):
+    return os.path.splitext(database_path)[0] + ".edits.jsonl"
+
+
+class EditJournal:
+    """Cell edits waiting to be written, coalesced by (lead id, column) and mirrored to a file.
+
+    record() appends the edit to an append-only journal file instead of touching the
+    database, so a burst of edits costs one small file write each and survives a crash.
+    flush() writes everything pending in a single transaction, then rewrites the file
+    with only the edits that arrived meanwhile. Each line holds a cell's whole new
+    value, so replaying a journal whose edits were already committed changes nothing.
+    """
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+        # (lead_id, column) -> (sequence, value); the sequence tells a newer edit of the same cell apart
+        self.pending = {}
+        self.sequence = 0
+        self.file = None
+        self.load()
+
+    def load(self):
+        try:
+            with open(self.path) as file:
+                for line in file:
+                    try:
+                        lead_id, column, value = json.loads(line)
+                    except ValueError:
+                        # A crash can leave the last line half written
+                        continue
+                    if column in LEAD_FIELDS:
+                        self.sequence += 1
+                        self.pending[(lead_id, column)] = (self.sequence, value)
+        except FileNotFoundError:
+            pass
+
+    def record(self, lead_id, column, value):
+        check_columns([column])
+        with self.lock:
+            self.sequence += 1
+            self.pending[(lead_id, column)] = (self.sequence, value)
+            if self.file is None:
+                self.file = open(self.path, "a")
+            self.file.write(json.dumps([lead_id, column, value]) + "\n")
+            self.file.flush()
+
+    def value(self, lead_id, column, default=None):
+        """The pending value for a cell, or default if it has no unsaved edit."""
+        entry = self.pending.get((lead_id, column))
+        return default if entry is None else entry[1]
+
+    def flush(self, connection):
+        """Commit every pending edit in one transaction on connection; return the ids of the edited leads."""
+        with self.lock:
+            batch = dict(self.pending)
+        if not batch:
+            return []
+        by_column = {}
+        for (lead_id, column), (_, value) in batch.items():
+            by_column.setdefault(column, []).append((value, lead_id))
+        with connection:
+            for column, rows in by_column.items():
+                connection.executemany(f"UPDATE leads SET {column} = ? WHERE id = ?", rows)
+        with self.lock:
+            for key, entry in batch.items():
+                if self.pending.get(key) is entry:
+                    del self.pending[key]
+            self.rewrite()
+        return sorted({lead_id for lead_id, _ in batch})
+
+    def rewrite(self):
+        # Called with the lock held, once the flushed edits are committed
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+        if not self.pending:
+            if os.path.exists(self.path):
+                os.remove(self.path)
+            return
+        temporary = self.path + ".tmp"
+        with open(temporary, "w") as file:
+            for (lead_id, column), (_, value) in sorted(self.pending.items(), key=lambda item: item[1][0]):
+                file.write(json.dumps([lead_id, column, value]) + "\n")
+        os.replace(temporary, self.path)
+
+    def close(self):
+        with self.lock:
+            if self.file is not None:
+                self.file.close()
+                self.file = None
+
+
+def recover_edits(connection, database_path):
+    """Commit edits a crashed session left in the journal; return the ids of the leads they touched."""
+    journal = EditJournal(journal_path(database_path))
+    try:
+        return journal.flush(connection)
+    finally:
+        journal.close()
+
+
+def open_database(path):
+    """Open path with the app's pragmas, bring its leads schema up to date and replay any unsaved edits."""
+    connection = database.connect(path)
+    migrations.migrate(connection, migrations.LEADS_MIGRATIONS)
+    recover_edits(connection, path)
+    return connection
+
+
+# Filter flags shared by the query command: (flag, lead_query filter name)
+QUERY_FILTERS = (
+    ("--name", "name"), ("--phone", "phone"), ("--email", "email"), ("--city", "city"),
+    ("--state", "state"), ("--zipcode", "zipcode"), ("--referred-by", "referred_by"),
+    ("--job-type", "job_type"), ("--text", "text"),
+)
+
+EXPORT_FORMATS = ("csv", "pdf", "txt")
+
+
+def status_code(label):
+    for status, name in enumerate(LEAD_STATUSES):
+        if name.lower() == label.strip().lower():
+            return status
+    raise argparse.ArgumentTypeError(f"unknown status {label!r}; choose from {', '.join(LEAD_STATUSES)}")
+
+
+def sort_columns(text):
+    try:
+        return lead_query.parse_sort(text)
+    except ValueError as exc:
+        raise argparse.ArgumentTypeError(f"{exc}; choose from {', '.join(lead_query.SORT_COLUMNS)}")
+
+
+def command_add(connection, args):
+    lead = Lead(**{field: getattr(args, field) for field in LEAD_FIELDS})
+    with connection:
+        lead_id = add_lead(connection, lead)
+    print(lead_id)
+    return 0
+
+
+def command_import(connection, args):
+    # lead_import builds this module's Lead records, so it is imported here rather than at the top
+    import lead_import
+
+    def report(imported, elapsed):
+        rate = imported / elapsed if elapsed else 0
+        print(f"\r{imported} leads imported ({rate:,.0f} leads/s)", end="", file=sys.stderr, flush=True)
+
+    for path in args.files:
+        print(f"Importing {path}", file=sys.stderr)
+        try:
+            imported, elapsed, _, _, _ = lead_import.import_leads(
+                connection, lead_import.read_leads(path), args.batch_size, report)
+        except KeyboardInterrupt:
+            print("\nImport cancelled; committed batches were kept.", file=sys.stderr)
+            return 1
+        print(f"\r{imported} leads imported from {path} in {elapsed:.1f}s", file=sys.stderr)
+    return 0
+
+
+def command_export(connection, args):
+    # lead_export reads through this module's row factory, so it is imported here rather than at the top
+    import lead_export
+
+    export_format = args.format or os.path.splitext(args.path)[1][1:].lower()
+    if export_format not in EXPORT_FORMATS:
+        print(f"Can't tell the export format of {args.path}; pass --format", file=sys.stderr)
+        return 2
+
+    def report(exported, total):
+        print(f"\r{exported} of {total} leads exported", end="", file=sys.stderr, flush=True)
+
+    if export_format == "pdf":
+        export = functools.partial(lead_export.export_pdf_parallel, workers=args.workers)
+    else:
+        export = getattr(lead_export, f"export_{export_format}")
+    started = time.perf_counter()
+    try:
+        exported, _ = export(connection, args.path, progress=report)
+    except KeyboardInterrupt:
+        if os.path.exists(args.path):
+            os.remove(args.path)
+        print("\nExport cancelled.", file=sys.stderr)
+        return 1
+    print(f"\r{exported} leads exported to {args.path} in {time.perf_counter() - started:.1f}s", file=sys.stderr)
+    return 0
+
+
+def command_query(connection, args):
+    filters = {name: getattr(args, name) for _, name in QUERY_FILTERS if getattr(args, name)}
+    if args.status is not None:
+        filters["lead_status"] = args.status
+    if args.count:
+        print(count_leads(connection, filters))
+        return 0
+    results = query_leads(connection, filters, args.limit, sort=args.sort)
+    if args.json:
+        for lead in results:
+            print(json.dumps(asdict(lead)))
+    else:
+        writer = csv.writer(sys.stdout)
+        writer.writerow(("id",) + LEAD_FIELDS)
+        for lead in results:
+            writer.writerow((lead.id,) + lead.values())
+    return 0
+
+
+def command_stats(connection, args):
+    stats = lead_stats(connection)
+    if args.json:
+        print(json.dumps(stats, indent=2))
+        return 0
+    print(f"Total leads: {stats['total']}")
+    print("By status:")
+    for label, count in stats["by_status"].items():
+        print(f"  {label:<16}{count:>10}")
+    for title, key in [("By job type:", "by_job_type"), ("Top referrers:", "by_referred_by"),
+                       ("Top cities:", "by_city"), ("New leads by week:", "by_week")]:
+        print(title)
+        for value, count in stats[key].items():
+            print(f"  {value or '(none)':<16}{count:>10}")
+    return 0
+
+
+def command_rebuild_stats(connection, args):
+    drift = lead_counts.find_drift(connection)
+    for dimension, value, stored, actual in drift:
+        print(f"{dimension} {value or '(none)'!r}: counted {stored}, actually {actual}", file=sys.stderr)
+    if args.check:
+        return 1 if drift else 0
+    started = time.perf_counter()
+    with connection:
+        total = lead_counts.rebuild(connection)
+    print(f"Recounted {total} leads in {time.perf_counter() - started:.2f}s", file=sys.stderr)
+    return 0
+
+
+def command_dedupe(connection, args):
+    # lead_dedupe builds on this module, so it is imported here rather than at the top
+    import lead_dedupe
+
+    def report(done, total):
+        print(f"\r{done} of {total} blocks compared", end="", file=sys.stderr, flush=True)
+
+    started = time.perf_counter()
+    groups = lead_dedupe.find_duplicate_groups(connection, report)
+    writer = csv.writer(sys.stdout)
+    for group in groups:
+        writer.writerow(group)
+    duplicates = sum(len(group) - 1 for group in groups)
+    print(f"\r{len(groups)} groups, {duplicates} duplicate leads found in {time.perf_counter() - started:.1f}s",
+          file=sys.stderr)
+    if args.merge and groups:
+        with connection:
+            _, removed = lead_dedupe.merge_groups(connection, groups)
+        print(f"Merged {len(removed)} duplicates into the oldest lead of each group", file=sys.stderr)
+    return 0
+
+
+def command_schedule(connection, args):
+    # appointments builds on this module, so it is imported here rather than at the top
+    import appointments
+
+    try:
+        start_time, end_time = appointments.parse_time(args.start), appointments.parse_time(args.end)
+        if get_lead(connection, args.lead_id) is None:
+            raise ValueError(f"There is no lead {args.lead_id}")
+        with connection:
+            appointment_id = appointments.add_appointment(
+                connection, appointments.Appointment(args.lead_id, start_time, end_time, notes=args.notes))
+    except ValueError as e:
+        print(e, file=sys.stderr)
+        return 2
+    print(appointment_id)
+    return 0
+
+
+def command_agenda(connection, args):
+    import appointments
+
+    try:
+        start = datetime.strptime(args.start, "%Y-%m-%d") if args.start else datetime.combine(date.today(), datetime.min.time())
+    except ValueError as e:
+        print(e, file=sys.stderr)
+        return 2
+    end = start + timedelta(days=args.days)
+    writer = csv.writer(sys.stdout)
+    writer.writerow(["start_time", "end_time", "status", "lead_id", "name", "phone", "address", "notes"])
+    for appointment, lead in appointments.agenda(
+            connection, start.strftime(appointments.TIME_FORMAT), end.strftime(appointments.TIME_FORMAT)):
+        name = " ".join(part for part in (lead.first_name, lead.last_name) if part)
+        address = ", ".join(part for part in (lead.address_line1, lead.city) if part)
+        writer.writerow([appointment.start_time, appointment.end_time, appointment.status_label, lead.id, name,
+                         lead.phone, address, appointment.notes])
+    return 0
+
+
+def command_load_zips(connection, args):
+    started = time.perf_counter()
+    try:
+        with connection:
+            loaded, located = geo.load_centroids(connection, geo.read_centroids(args.file))
+    except (OSError, ValueError, UnicodeDecodeError, csv.Error) as e:
+        print(e, file=sys.stderr)
+        return 2
+    total = connection.execute("SELECT COUNT(*) FROM leads").fetchone()[0]
+    print(f"Loaded {loaded} ZIP codes in {time.perf_counter() - started:.1f}s; "
+          f"{located} of {total} leads have a location", file=sys.stderr)
+    return 0
+
+
+def location_argument(connection, args):
+    """The (latitude, longitude) named by --from-lead/--lead or --from-zip/--zip, or None; raises ValueError."""
+    if args.lead is not None:
+        location = geo.lead_location(connection, args.lead)
+        if location is None:
+            raise ValueError(f"Lead {args.lead} has no location; is its ZIP code in the loaded ZIP codes?")
+        return location
+    if args.zip is not None:
+        location = geo.zip_location(connection, args.zip)
+        if location is None:
+            raise ValueError(f"ZIP code {args.zip} isn't in the loaded ZIP codes")
+        return location
+    return None
+
+
+def command_near(connection, args):
+    filters = {name: getattr(args, name) for _, name in QUERY_FILTERS if getattr(args, name)}
+    if args.status is not None:
+        filters["lead_status"] = args.status
+    try:
+        center = location_argument(connection, args)
+    except ValueError as e:
+        print(e, file=sys.stderr)
+        return 2
+    writer = csv.writer(sys.stdout)
+    writer.writerow(("miles", "id") + LEAD_FIELDS)
+    nearby = [(distance, lead) for distance, lead in leads_near(connection, center, args.miles, filters)
+              if lead.id != args.lead]
+    for distance, lead in nearby[:args.limit]:
+        writer.writerow((f"{distance:.1f}", lead.id) + lead.values())
+    return 0
+
+
+def command_route(connection, args):
+    import appointments
+
+    lead_ids = list(args.lead_ids)
+    try:
+        if args.day:
+            start = appointments.parse_time(args.day)
+            end = (datetime.strptime(start, appointments.TIME_FORMAT) + timedelta(days=1)).strftime(appointments.TIME_FORMAT)
+            # Only the appointments still scheduled; a cancelled one is no reason to drive there
+            lead_ids += [lead.id for appointment, lead in appointments.agenda(connection, start, end)
+                         if appointment.status == appointments.APPOINTMENT_STATUSES.index("Scheduled")]
+        origin = location_argument(connection, args)
+    except ValueError as e:
+        print(e, file=sys.stderr)
+        return 2
+    route, miles, unlocated = plan_visits(connection, lead_ids, origin, args.round_trip)
+    writer = csv.writer(sys.stdout)
+    writer.writerow(["stop", "leg_miles", "lead_id", "name", "phone", "address", "city", "zipcode"])
+    for stop, (lead, leg) in enumerate(route, 1):
+        name = " ".join(part for part in (lead.first_name, lead.last_name) if part)
+        writer.writerow([stop, f"{leg:.1f}", lead.id, name, lead.phone, lead.address_line1, lead.city, lead.zipcode])
+    for lead in unlocated:
+        print(f"Lead {lead.id} has no location (ZIP code {lead.zipcode!r}); fit it in by hand", file=sys.stderr)
+    print(f"{len(route)} stops, {miles:.1f} miles", file=sys.stderr)
+    return 0
+
+
+def command_history(connection, args):
+    import appointments
+
+    writer = csv.writer(sys.stdout)
+    writer.writerow(["id", "start_time", "end_time", "status", "notes"])
+    for appointment in appointments.lead_history(connection, args.lead_id):
+        writer.writerow([appointment.id, appointment.start_time, appointment.end_time, appointment.status_label,
+                         appointment.notes])
+    return 0
+
+
+def bulk_ids(connection, args):
+    """The leads a bulk command acts on: the ids given, narrowed by any filter flags, or every match of the filters."""
+    filters = {name: getattr(args, name) for _, name in QUERY_FILTERS if getattr(args, name)}
+    if args.status is not None:
+        filters["lead_status"] = args.status
+    if not (args.lead_ids or filters or args.all):
+        raise ValueError("Pass lead ids or filters, or --all for every lead")
+    if not args.lead_ids:
+        return matching_ids(connection, filters)
+    if not filters:
+        return list(args.lead_ids)
+    wanted = set(args.lead_ids)
+    return [lead_id for lead_id in matching_ids(connection, filters) if lead_id in wanted]
+
+
+def command_update(connection, args):
+    changes = {column: getattr(args, f"set_{column}") for column in ("lead_status", "job_type", "referred_to")
+               if getattr(args, f"set_{column}") is not None}
+    try:
+        if not changes:
+            raise ValueError("Nothing to change; pass --set-status, --set-job-type or --set-referred-to")
+        lead_ids = bulk_ids(connection, args)
+    except ValueError as e:
+        print(e, file=sys.stderr)
+        return 2
+    started = time.perf_counter()
+    with connection:
+        updated = update_leads(connection, lead_ids, **changes)
+    print(f"Updated {updated} leads in {time.perf_counter() - started:.2f}s", file=sys.stderr)
+    return 0
+
+
+def command_delete(connection, args):
+    try:
+        lead_ids = bulk_ids(connection, args)
+    except ValueError as e:
+        print(e, file=sys.stderr)
+        return 2
+    started = time.perf_counter()
+    with connection:
+        batch, deleted = soft_delete_leads(connection, lead_ids)
+    print(batch)
+    print(f"Deleted {deleted} leads in {time.perf_counter() - started:.2f}s; undo with: leads.py undelete {batch}",
+          file=sys.stderr)
+    return 0
+
+
+def command_undelete(connection, args):
+    batches = deleted_batches(connection)
+    if args.list:
+        writer = csv.writer(sys.stdout)
+        writer.writerow(["batch", "deleted_at", "leads"])
+        writer.writerows(batches)
+        return 0
+    batch = args.batch if args.batch is not None else (batches[0][0] if batches else None)
+    if batch is None or batch not in {row[0] for row in batches}:
+        print("Nothing to undelete" if batch is None else f"There is no deleted batch {batch}", file=sys.stderr)
+        return 1
+    with connection:
+        restored = restore_leads(connection, batch)
+    print(f"Restored {len(restored)} leads", file=sys.stderr)
+    return 0
+
+
+def command_purge_deleted(connection, args):
+    with connection:
+        purged = purge_deleted(connection, args.days)
+    print(f"Purged {purged} leads deleted more than {args.days} days ago", file=sys.stderr)
+    return 0
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(prog="leads", description="Manage the contractor leads database without the GUI.")
+    parser.add_argument("--db", default=database.LEADS_DATABASE, help="leads database file (default: %(default)s)")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    add = commands.add_parser("add", help="add one lead and print its id")
+    for field in LEAD_FIELDS:
+        if field == "lead_status":
+            add.add_argument("--status", dest=field, type=status_code, default=0, help="lead status label")
+        else:
+            default = "Unknown" if field == "job_type" else ""
+            add.add_argument("--" + field.replace("_", "-"), dest=field, default=default)
+    add.set_defaults(run=command_add)
+
+    import_ = commands.add_parser("import", help="import CSV or vCard lead lists")
+    import_.add_argument("files", nargs="+", help="CSV or vCard (.vcf) files to import")
+    import_.add_argument("--batch-size", type=int, default=10000, help="rows per transaction (default: %(default)s)")
+    import_.set_defaults(run=command_import)
+
+    export = commands.add_parser("export", help="export every lead to CSV, PDF or TXT")
+    export.add_argument("path", help="output file; the format follows its extension")
+    export.add_argument("--format", choices=EXPORT_FORMATS, help="format to write instead of the one the extension implies")
+    export.add_argument("--workers", type=int,
+                        help="processes rendering a PDF export (default: one per CPU; 1 renders in this process)")
+    export.set_defaults(run=command_export)
+
+    query = commands.add_parser("query", help="print matching leads as CSV or JSON lines")
+    for flag, name in QUERY_FILTERS:
+        query.add_argument(flag, dest=name)
+    query.add_argument("--status", type=status_code, help="lead status label")
+    query.add_argument("--limit", type=int, help="stop after this many leads")
+    query.add_argument("--sort", type=sort_columns, default=(),
+                       help='columns to sort by, e.g. "lead_status,-last_name" (- for descending)')
+    query.add_argument("--count", action="store_true", help="print only the number of matches")
+    query.add_argument("--json", action="store_true", help="one JSON object per line instead of CSV")
+    query.set_defaults(run=command_query)
+
+    update = commands.add_parser("update", help="set the status, job type or referred to of many leads at once")
+    delete = commands.add_parser("delete", help="delete leads so they can be restored with undelete; prints the batch")
+    for bulk in (update, delete):
+        bulk.add_argument("lead_ids", type=int, nargs="*")
+        for flag, name in QUERY_FILTERS:
+            bulk.add_argument(flag, dest=name)
+        bulk.add_argument("--status", type=status_code, help="lead status label")
+        bulk.add_argument("--all", action="store_true", help="every lead, when no ids or filters are given")
+    update.add_argument("--set-status", dest="set_lead_status", type=status_code)
+    update.add_argument("--set-job-type", dest="set_job_type")
+    update.add_argument("--set-referred-to", dest="set_referred_to")
+    update.set_defaults(run=command_update)
+    delete.set_defaults(run=command_delete)
+
+    undelete = commands.add_parser("undelete", help="restore a batch of deleted leads, the latest by default")
+    undelete.add_argument("batch", type=int, nargs="?")
+    undelete.add_argument("--list", action="store_true", help="list the batches that can be restored")
+    undelete.set_defaults(run=command_undelete)
+
+    purge_deleted = commands.add_parser("purge-deleted", help="drop deleted leads for good")
+    purge_deleted.add_argument("--days", type=int, default=30,
+                               help="only those deleted more than this many days ago (default: %(default)s)")
+    purge_deleted.set_defaults(run=command_purge_deleted)
+
+    stats = commands.add_parser("stats", help="lead counts by status, job type, referrer, city and week")
+    stats.add_argument("--json", action="store_true")
+    stats.set_defaults(run=command_stats)
+
+    rebuild_stats = commands.add_parser("rebuild-stats", help="recount the stats from scratch")
+    rebuild_stats.add_argument("--check", action="store_true",
+                               help="only report counts that are off, exiting 1 if any are")
+    rebuild_stats.set_defaults(run=command_rebuild_stats)
+
+    dedupe = commands.add_parser("dedupe", help="print groups of duplicate lead ids, one group per line")
+    dedupe.add_argument("--merge", action="store_true", help="fold each group into its oldest lead")
+    dedupe.set_defaults(run=command_dedupe)
+
+    schedule = commands.add_parser("schedule", help="book an appointment with a lead and print its id")
+    schedule.add_argument("lead_id", type=int)
+    schedule.add_argument("start", help='start time, "yyyy-mm-dd hh:mm"')
+    schedule.add_argument("end", help='end time, "yyyy-mm-dd hh:mm"')
+    schedule.add_argument("--notes", default="")
+    schedule.set_defaults(run=command_schedule)
+
+    agenda = commands.add_parser("agenda", help="print appointments with their leads' details as CSV")
+    agenda.add_argument("--from", dest="start", help="first day, yyyy-mm-dd (default: today)")
+    agenda.add_argument("--days", type=int, default=7, help="number of days to cover (default: %(default)s)")
+    agenda.set_defaults(run=command_agenda)
+
+    history = commands.add_parser("history", help="print one lead's appointments, most recent first")
+    history.add_argument("lead_id", type=int)
+    history.set_defaults(run=command_history)
+
+    load_zips = commands.add_parser("load-zips", help="load ZIP code centroids and locate every lead by them")
+    load_zips.add_argument("file", help="Census ZCTA gazetteer file, or a CSV with zip, latitude and longitude")
+    load_zips.set_defaults(run=command_load_zips)
+
+    near = commands.add_parser("near", help="print leads within some miles of a lead or ZIP code, nearest first")
+    origin = near.add_mutually_exclusive_group(required=True)
+    origin.add_argument("--lead", type=int, help="measure from this lead")
+    origin.add_argument("--zip", help="measure from this ZIP code")
+    near.add_argument("--miles", type=float, default=15.0, help="search radius (default: %(default)s)")
+    for flag, name in QUERY_FILTERS:
+        near.add_argument(flag, dest=name)
+    near.add_argument("--status", type=status_code, help="lead status label")
+    near.add_argument("--limit", type=int, help="stop after this many leads")
+    near.set_defaults(run=command_near)
+
+    route = commands.add_parser("route", help="order leads, or a day's appointments, into a short driving route")
+    route.add_argument("lead_ids", type=int, nargs="*")
+    route.add_argument("--day", help="add the leads with appointments scheduled that day, yyyy-mm-dd")
+    start = route.add_mutually_exclusive_group()
+    start.add_argument("--from-lead", dest="lead", type=int, help="start at this lead")
+    start.add_argument("--from-zip", dest="zip", help="start at this ZIP code, e.g. the shop's")
+    route.add_argument("--round-trip", action="store_true", help="end back at the start")
+    route.set_defaults(run=command_route)
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    connection = open_database(args.db)
+    try:
+        return args.run(connection, args)
+    finally:
+        connection.close()
+
+
+if __name__ == "__main__":
+    sys.exit(main())
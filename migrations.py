@@ -0,0 +1,430 @@
+"""Versioned schema migrations for the app's SQLite databases.
+
+Each database has an ordered list of migration steps. PRAGMA user_version records
+how many have been applied, so startup runs only the missing steps, all of them in
+one transaction, and issues no DDL at all once a database is up to date. Steps are
+append-only: never edit or reorder one that has shipped, add a new step instead.
+"""
+import re
+
+import database
+import geo
+import lead_counts
+import lead_query
+
+# lead_status stores an index into this tuple
+LEAD_STATUSES = ("In System", "Good Lead", "Contact Later", "Bad Lead", "Passed Along", "Closed")
+
+# appointments.status stores an index into this tuple
+APPOINTMENT_STATUSES = ("Scheduled", "Completed", "Cancelled", "No Show")
+
+
+def create_leads_table(connection):
+    connection.execute("""
+        CREATE TABLE IF NOT EXISTS leads (
+            id INTEGER PRIMARY KEY,
+            first_name TEXT,
+            last_name TEXT,
+            address_line1 TEXT,
+            address_line2 TEXT,
+            city TEXT,
+            state TEXT,
+            zipcode TEXT,
+            phone TEXT,
+            email TEXT,
+            notes TEXT,
+            referred_by TEXT,
+            job_type TEXT,
+            lead_status TEXT
+        )
+    """)
+
+
+def add_referred_to(connection):
+    # The grid has always shown a Referred To column that had nowhere to be stored
+    connection.execute("ALTER TABLE leads ADD COLUMN referred_to TEXT")
+
+
+def create_search_schema(connection):
+    lead_query.create_search_indexes(connection)
+
+
+def convert_lead_status_to_integer(connection):
+    """Store lead_status as an index into LEAD_STATUSES instead of its label.
+
+    The TEXT column is renamed aside and a new INTEGER column added, both of which only
+    touch the schema. Rows are then converted in place by a single UPDATE rather than
+    copying the whole table into a new one.
+    """
+    connection.execute("DROP INDEX IF EXISTS idx_leads_lead_status")
+    connection.execute("ALTER TABLE leads RENAME COLUMN lead_status TO legacy_lead_status")
+    connection.execute("ALTER TABLE leads ADD COLUMN lead_status INTEGER NOT NULL DEFAULT 0")
+    cases = " ".join(f"WHEN {label!r} THEN {status}" for status, label in enumerate(LEAD_STATUSES))
+    connection.execute(f"""
+        UPDATE leads SET lead_status = CASE legacy_lead_status {cases} ELSE 0 END, legacy_lead_status = NULL
+        WHERE legacy_lead_status IS NOT NULL
+    """)
+    connection.execute("CREATE INDEX idx_leads_lead_status ON leads (lead_status)")
+
+
+def create_dedupe_schema(connection):
+    """Create lead_keys, the blocking index lead_dedupe compares leads through, and what keeps it current.
+
+    lead_dedupe.refresh_index keys leads with ids above indexed_through and re-keys the
+    ones the update trigger queued in lead_keys_stale, so imports need no trigger of their own.
+    Leads inserted under an id at or below the watermark are queued too, see key_reused_lead_ids.
+    """
+    connection.execute("""
+        CREATE TABLE lead_keys (
+            key TEXT NOT NULL,
+            lead_id INTEGER NOT NULL,
+            PRIMARY KEY (key, lead_id)
+        ) WITHOUT ROWID""")
+    connection.execute("CREATE INDEX idx_lead_keys_lead_id ON lead_keys (lead_id)")
+    connection.execute("CREATE TABLE lead_keys_state (indexed_through INTEGER NOT NULL)")
+    connection.execute("INSERT INTO lead_keys_state (indexed_through) VALUES (0)")
+    connection.execute("CREATE TABLE lead_keys_stale (lead_id INTEGER PRIMARY KEY)")
+    # The columns blocking keys are built from
+    connection.execute("""
+        CREATE TRIGGER leads_keys_update
+        AFTER UPDATE OF first_name, last_name, address_line1, city, zipcode, phone, email ON leads BEGIN
+            INSERT OR IGNORE INTO lead_keys_stale (lead_id) VALUES (new.id);
+        END""")
+    connection.execute("""
+        CREATE TRIGGER leads_keys_delete AFTER DELETE ON leads BEGIN
+            DELETE FROM lead_keys WHERE lead_id = old.id;
+            DELETE FROM lead_keys_stale WHERE lead_id = old.id;
+        END""")
+
+
+def create_appointments_table(connection):
+    """Appointments with leads, in the leads database so they can be joined to them.
+
+    Times are local "yyyy-MM-dd HH:MM" strings, which sort in time order, so a day or
+    week of the calendar is a range scan of idx_appointments_start_time and a lead's
+    history a range scan of idx_appointments_lead_id. Foreign keys are not enabled on
+    the app's connections, so a trigger removes the appointments of deleted leads.
+    """
+    connection.execute("""
+        CREATE TABLE appointments (
+            id INTEGER PRIMARY KEY,
+            lead_id INTEGER NOT NULL REFERENCES leads (id),
+            start_time TEXT NOT NULL,
+            end_time TEXT NOT NULL,
+            status INTEGER NOT NULL DEFAULT 0,
+            notes TEXT
+        )
+    """)
+    connection.execute("CREATE INDEX idx_appointments_start_time ON appointments (start_time)")
+    connection.execute("CREATE INDEX idx_appointments_lead_id ON appointments (lead_id, start_time)")
+    connection.execute("""
+        CREATE TRIGGER leads_appointments_delete AFTER DELETE ON leads BEGIN
+            DELETE FROM appointments WHERE lead_id = old.id;
+        END
+    """)
+
+
+def add_lead_created_at(connection):
+    # The local date a lead was added, set by the insert statements; unknown for older leads
+    connection.execute("ALTER TABLE leads ADD COLUMN created_at TEXT")
+
+
+def create_lead_counts(connection):
+    lead_counts.create_schema(connection)
+
+
+def create_sort_indexes(connection):
+    lead_query.create_sort_indexes(connection)
+
+
+def create_geo_schema(connection):
+    geo.create_schema(connection)
+
+
+def create_deleted_leads(connection):
+    """Where leads.soft_delete_leads moves deleted leads and their appointments until they're restored or purged.
+
+    Rows are grouped in batches, one per delete, so a delete of thousands is undone as a
+    whole. id is the lead's id in the leads table, kept so a restore can put it back.
+    """
+    connection.execute("""
+        CREATE TABLE deleted_leads (
+            batch INTEGER NOT NULL,
+            deleted_at TEXT NOT NULL,
+            id INTEGER NOT NULL,
+            first_name TEXT,
+            last_name TEXT,
+            address_line1 TEXT,
+            address_line2 TEXT,
+            city TEXT,
+            state TEXT,
+            zipcode TEXT,
+            phone TEXT,
+            email TEXT,
+            notes TEXT,
+            referred_by TEXT,
+            referred_to TEXT,
+            job_type TEXT,
+            lead_status INTEGER NOT NULL DEFAULT 0,
+            created_at TEXT,
+            PRIMARY KEY (batch, id)
+        ) WITHOUT ROWID
+    """)
+    connection.execute("""
+        CREATE TABLE deleted_appointments (
+            batch INTEGER NOT NULL,
+            lead_id INTEGER NOT NULL,
+            start_time TEXT NOT NULL,
+            end_time TEXT NOT NULL,
+            status INTEGER NOT NULL DEFAULT 0,
+            notes TEXT
+        )
+    """)
+    connection.execute("CREATE INDEX idx_deleted_appointments_batch ON deleted_appointments (batch, lead_id)")
+
+
+def create_lead_forms(connection):
+    """The web forms form_intake serves; fields is a JSON list of the leads columns each one asks for.
+
+    referred_by is stored on every lead the form takes in. submissions and duplicates
+    are counted by the intake server as it writes each batch.
+    """
+    connection.execute("""
+        CREATE TABLE lead_forms (
+            id INTEGER PRIMARY KEY,
+            slug TEXT NOT NULL UNIQUE,
+            title TEXT NOT NULL,
+            fields TEXT NOT NULL,
+            referred_by TEXT,
+            submissions INTEGER NOT NULL DEFAULT 0,
+            duplicates INTEGER NOT NULL DEFAULT 0,
+            created_at TEXT NOT NULL
+        )
+    """)
+
+
+def key_reused_lead_ids(connection):
+    """Queue leads inserted at or below lead_keys_state.indexed_through for keying.
+
+    refresh_index only keys new leads above that watermark, so a lead that takes an id
+    at or below it, such as a restored one, would never be keyed. Leads that already
+    slipped through that way are queued once here.
+    """
+    connection.execute("""
+        CREATE TRIGGER leads_keys_insert AFTER INSERT ON leads
+        WHEN new.id <= (SELECT indexed_through FROM lead_keys_state) BEGIN
+            INSERT OR IGNORE INTO lead_keys_stale (lead_id) VALUES (new.id);
+        END""")
+    connection.execute("""
+        INSERT OR IGNORE INTO lead_keys_stale (lead_id)
+        SELECT id FROM leads WHERE id <= (SELECT indexed_through FROM lead_keys_state)
+            AND NOT EXISTS (SELECT 1 FROM lead_keys WHERE lead_keys.lead_id = leads.id)
+    """)
+
+
+def make_lead_ids_monotonic(connection):
+    """Rebuild leads with AUTOINCREMENT, so an id is never handed out twice.
+
+    Without it a new lead takes MAX(id) + 1, which reuses the id of a deleted
+    highest lead. Soft deletes made that routine, and a reused id picks up the old
+    lead's journaled grid edits. SQLite can't add AUTOINCREMENT to a table, so the
+    table is copied and its indexes and triggers created again from their saved SQL.
+    The sequence starts past every id used so far, soft-deleted ones included.
+    """
+    table_sql = connection.execute("SELECT sql FROM sqlite_master WHERE type = 'table' AND name = 'leads'").fetchone()[0]
+    dependents = [row[0] for row in connection.execute(
+        "SELECT sql FROM sqlite_master WHERE tbl_name = 'leads' AND type IN ('index', 'trigger') AND sql IS NOT NULL")]
+    new_sql = re.sub(r"^CREATE TABLE (IF NOT EXISTS )?leads\b", "CREATE TABLE leads_new", table_sql)
+    new_sql = re.sub(r"\bid INTEGER PRIMARY KEY\b", "id INTEGER PRIMARY KEY AUTOINCREMENT", new_sql, count=1)
+    connection.execute(new_sql)
+    connection.execute("INSERT INTO leads_new SELECT * FROM leads")
+    connection.execute("DROP TABLE leads")
+    connection.execute("ALTER TABLE leads_new RENAME TO leads")
+    for sql in dependents:
+        connection.execute(sql)
+    # The copy left the sequence at the highest id still in leads, renamed along with the table
+    connection.execute("DELETE FROM sqlite_sequence WHERE name = 'leads'")
+    connection.execute("""
+        INSERT INTO sqlite_sequence (name, seq) SELECT 'leads', MAX(
+            COALESCE((SELECT MAX(id) FROM leads), 0), COALESCE((SELECT MAX(id) FROM deleted_leads), 0),
+            (SELECT indexed_through FROM lead_keys_state))
+    """)
+
+
+def narrow_fts_update_trigger(connection):
+    lead_query.create_fts_update_trigger(connection)
+
+
+LEADS_MIGRATIONS = [
+    create_leads_table,
+    add_referred_to,
+    create_search_schema,
+    convert_lead_status_to_integer,
+    create_dedupe_schema,
+    create_appointments_table,
+    add_lead_created_at,
+    create_lead_counts,
+    create_sort_indexes,
+    create_geo_schema,
+    create_deleted_leads,
+    create_lead_forms,
+    key_reused_lead_ids,
+    make_lead_ids_monotonic,
+    narrow_fts_update_trigger,
+]
+
+
+def create_calendar_table(connection):
+    connection.execute("""
+        CREATE TABLE IF NOT EXISTS Calendar (
+            Date TEXT PRIMARY KEY,
+            Notes TEXT
+        )
+    """)
+
+
+CALENDAR_MIGRATIONS = [
+    create_calendar_table,
+]
+
+
+def create_twilio_credentials_table(connection):
+    connection.execute("CREATE TABLE IF NOT EXISTS TwilioCredentials (SID TEXT, AuthToken TEXT)")
+
+
+def add_twilio_from_number(connection):
+    # The number (or messaging service SID) outgoing texts are sent from
+    connection.execute("ALTER TABLE TwilioCredentials ADD COLUMN FromNumber TEXT")
+
+
+def create_sms_queue(connection):
+    """The outbound SMS queue drained by sms_queue.SmsWorker.
+
+    A message is "pending" until its next_attempt_at comes round, "sending" while a
+    worker has it, then "sent" once Twilio accepted it, and later "delivered",
+    "undelivered" or "failed". idx_sms_messages_due serves the worker's claim query
+    and idx_sms_messages_campaign the per-campaign counts. A number is only texted
+    once per campaign, however many leads share it.
+    """
+    connection.execute("""
+        CREATE TABLE sms_campaigns (
+            id INTEGER PRIMARY KEY,
+            name TEXT NOT NULL,
+            body TEXT NOT NULL,
+            created_at TEXT NOT NULL
+        )
+    """)
+    connection.execute("""
+        CREATE TABLE sms_messages (
+            id INTEGER PRIMARY KEY,
+            campaign_id INTEGER NOT NULL REFERENCES sms_campaigns (id),
+            lead_id INTEGER,
+            to_number TEXT NOT NULL,
+            body TEXT NOT NULL,
+            status TEXT NOT NULL DEFAULT 'pending',
+            attempts INTEGER NOT NULL DEFAULT 0,
+            next_attempt_at REAL NOT NULL DEFAULT 0,
+            provider_sid TEXT,
+            provider_status TEXT,
+            error TEXT,
+            updated_at REAL,
+            UNIQUE (campaign_id, to_number)
+        )
+    """)
+    connection.execute("CREATE INDEX idx_sms_messages_due ON sms_messages (status, next_attempt_at)")
+    connection.execute("CREATE INDEX idx_sms_messages_campaign ON sms_messages (campaign_id, status)")
+
+
+TWILIO_MIGRATIONS = [
+    create_twilio_credentials_table,
+    add_twilio_from_number,
+    create_sms_queue,
+]
+
+
+def create_smtp_settings_table(connection):
+    # security is "starttls", "ssl" or "none"
+    connection.execute("""
+        CREATE TABLE smtp_settings (
+            host TEXT NOT NULL,
+            port INTEGER NOT NULL,
+            security TEXT NOT NULL DEFAULT 'starttls',
+            username TEXT,
+            password TEXT,
+            from_address TEXT NOT NULL,
+            from_name TEXT
+        )
+    """)
+
+
+def create_email_queue(connection):
+    """The outbound email queue drained by email_queue.EmailWorker.
+
+    Messages move from "pending" to "sending" while a worker has them, then to "sent"
+    or "failed", like sms_messages. An address only gets one message per campaign.
+    """
+    connection.execute("""
+        CREATE TABLE email_campaigns (
+            id INTEGER PRIMARY KEY,
+            name TEXT NOT NULL,
+            subject TEXT NOT NULL,
+            body TEXT NOT NULL,
+            created_at TEXT NOT NULL
+        )
+    """)
+    connection.execute("""
+        CREATE TABLE email_messages (
+            id INTEGER PRIMARY KEY,
+            campaign_id INTEGER NOT NULL REFERENCES email_campaigns (id),
+            lead_id INTEGER,
+            to_address TEXT NOT NULL COLLATE NOCASE,
+            subject TEXT NOT NULL,
+            body TEXT NOT NULL,
+            status TEXT NOT NULL DEFAULT 'pending',
+            attempts INTEGER NOT NULL DEFAULT 0,
+            next_attempt_at REAL NOT NULL DEFAULT 0,
+            error TEXT,
+            updated_at REAL,
+            UNIQUE (campaign_id, to_address)
+        )
+    """)
+    connection.execute("CREATE INDEX idx_email_messages_due ON email_messages (status, next_attempt_at)")
+    connection.execute("CREATE INDEX idx_email_messages_campaign ON email_messages (campaign_id, status)")
+
+
+EMAIL_MIGRATIONS = [
+    create_smtp_settings_table,
+    create_email_queue,
+]
+
+MIGRATIONS = {
+    database.LEADS_DATABASE: LEADS_MIGRATIONS,
+    database.CALENDAR_DATABASE: CALENDAR_MIGRATIONS,
+    database.TWILIO_DATABASE: TWILIO_MIGRATIONS,
+    database.EMAIL_DATABASE: EMAIL_MIGRATIONS,
+}
+
+
+def migrate(connection, steps):
+    """Apply the steps this database hasn't seen yet in a single transaction; return the new version."""
+    version = connection.execute("PRAGMA user_version").fetchone()[0]
+    if version >= len(steps):
+        return version
+    connection.execute("BEGIN IMMEDIATE")
+    try:
+        for step in steps[version:]:
+            step(connection)
+        connection.execute(f"PRAGMA user_version = {len(steps)}")
+    except BaseException:
+        connection.rollback()
+        raise
+    connection.commit()
+    return len(steps)
+
+
+def migrate_all():
+    """Bring every app database up to date through its shared writer connection."""
+    for path, steps in MIGRATIONS.items():
+        db = database.get_database(path)
+        with db.lock:
+            migrate(db.writer, steps)
@@ -0,0 +1,132 @@
+"""One-off environment check, run with --check-env instead of on every launch.
+
+Importing the GUI toolkit and reportlab, and making sure SQLite was built with
+FTS5, takes long enough that normal launches skip it. A passing result is cached
+against the interpreter and the installed package versions, so the check only
+runs again after one of them changes. This module must not import PyQt5 at the
+top level: it has to work when PyQt5 is missing or broken.
+"""
+import argparse
+import importlib
+import importlib.metadata
+import json
+import os
+import sqlite3
+import sys
+
+# Distribution name -> modules the app imports from it
+REQUIRED_PACKAGES = {
+    "PyQt5": ("PyQt5.QtCore", "PyQt5.QtGui", "PyQt5.QtWidgets"),
+    "reportlab": ("reportlab.platypus",),
+}
+
+REQUIREMENTS_FILE = "requirements.txt"
+CACHE_FILE = "environment_check.json"
+
+
+def package_version(name):
+    try:
+        return importlib.metadata.version(name)
+    except importlib.metadata.PackageNotFoundError:
+        return None
+
+
+def environment_key():
+    """What a cached result is valid for: the interpreter, SQLite and every required package's version."""
+    return {
+        "executable": sys.executable,
+        "python": sys.version,
+        "sqlite": sqlite3.sqlite_version,
+        "packages": {name: package_version(name) for name in REQUIRED_PACKAGES},
+    }
+
+
+def find_problems():
+    """Import everything the app needs and return a list of what failed; empty means ready to run."""
+    problems = []
+    for name, modules in REQUIRED_PACKAGES.items():
+        if package_version(name) is None:
+            problems.append(f"{name} is not installed")
+            continue
+        for module in modules:
+            try:
+                importlib.import_module(module)
+            except Exception as e:
+                problems.append(f"{module} failed to import: {e}")
+    connection = sqlite3.connect(":memory:")
+    # Lead search needs FTS5, locations the R*Tree module and bulk edits the JSON functions
+    for feature, sql in [("FTS5", "CREATE VIRTUAL TABLE fts_check USING fts5(content)"),
+                         ("R*Tree", "CREATE VIRTUAL TABLE rtree_check USING rtree(id, min_x, max_x)"),
+                         ("JSON", "SELECT value FROM json_each('[1]')")]:
+        try:
+            connection.execute(sql)
+        except sqlite3.Error as e:
+            problems.append(f"SQLite {sqlite3.sqlite_version} has no {feature} support: {e}")
+    connection.close()
+    return problems
+
+
+def load_cache(path):
+    try:
+        with open(path) as file:
+            return json.load(file)
+    except (OSError, ValueError):
+        return None
+
+
+def save_cache(path, key):
+    with open(path, "w") as file:
+        json.dump(key, file, indent=2)
+
+
+def install_dependencies():
+    import subprocess
+    if os.path.exists(REQUIREMENTS_FILE):
+        command = [sys.executable, "-m", "pip", "install", "-r", REQUIREMENTS_FILE]
+    else:
+        command = [sys.executable, "-m", "pip", "install", *REQUIRED_PACKAGES]
+    try:
+        subprocess.check_call(command)
+    except (OSError, subprocess.CalledProcessError):
+        print("Failed to install required dependencies.", file=sys.stderr)
+        return False
+    importlib.invalidate_caches()
+    return True
+
+
+def check_environment(cache_path=CACHE_FILE, force=False, install=False):
+    """Return the problems found, [] when the environment is ready; a cached pass skips the imports."""
+    key = environment_key()
+    if not force and load_cache(cache_path) == key:
+        return []
+    problems = find_problems()
+    if problems and install and install_dependencies():
+        key = environment_key()
+        problems = find_problems()
+    if problems:
+        if os.path.exists(cache_path):
+            os.remove(cache_path)
+    else:
+        save_cache(cache_path, key)
+    return problems
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Check that this machine can run the Contractor Leads app.")
+    parser.add_argument("--check-env", action="store_true", help=argparse.SUPPRESS)
+    parser.add_argument("--force", action="store_true", help="ignore a cached result and check again")
+    parser.add_argument("--install", action="store_true", help="pip install missing packages (needs network access)")
+    parser.add_argument("--cache", default=CACHE_FILE, help="where to cache a passing result (default: %(default)s)")
+    args = parser.parse_args(argv)
+
+    problems = check_environment(args.cache, args.force, args.install)
+    if problems:
+        for problem in problems:
+            print(problem, file=sys.stderr)
+        return 1
+    print("Environment OK", file=sys.stderr)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,133 @@
+"""The queue mechanics sms_queue and email_queue share.
+
+Both keep a campaigns table and a messages table whose rows go from "pending" to
+"sending" while a worker has them and on to a result, with attempts,
+next_attempt_at, error and updated_at columns (see migrations.create_sms_queue and
+create_email_queue). The functions here take the table names, so each queue keeps
+its own columns and record types. RateLimiter spaces sends for the asyncio SMS
+worker and the threaded email worker alike. Nothing here imports Qt.
+"""
+import asyncio
+import random
+import threading
+import time
+
+PENDING = "pending"
+SENDING = "sending"
+SENT = "sent"
+FAILED = "failed"
+
+MAX_ATTEMPTS = 5
+# A worker claims about this many seconds' worth of messages at a time, within these bounds
+CLAIM_SECONDS = 2.0
+MIN_CLAIM = 8
+MAX_CLAIM = 500
+# How long a worker sleeps at most before checking for stop requests and newly due retries
+IDLE_CHECK_SECONDS = 0.5
+ENQUEUE_BATCH_SIZE = 1000
+
+
+def reset_interrupted(connection, table):
+    """Put messages a stopped or crashed worker was sending back in the queue.
+
+    A crash between the provider accepting a message and the result being committed
+    means that message goes out twice; the queues err on the side of sending.
+    """
+    with connection:
+        connection.execute(f"UPDATE {table} SET status = ? WHERE status = ?", (PENDING, SENDING))
+
+
+def claim_due(connection, table, columns, limit, now):
+    """Mark up to limit messages in table that are due as sending and return their columns; columns starts with id."""
+    with connection:
+        rows = connection.execute(f"""
+            SELECT {columns} FROM {table}
+            WHERE status = ? AND next_attempt_at <= ? ORDER BY next_attempt_at, id LIMIT ?
+        """, (PENDING, now, limit)).fetchall()
+        connection.executemany(f"UPDATE {table} SET status = ? WHERE id = ?", [(SENDING, row[0]) for row in rows])
+    return rows
+
+
+def claim_size(rate, parallelism):
+    """How many messages to claim at once: about CLAIM_SECONDS at rate, and enough to keep every sender busy."""
+    return max(MIN_CLAIM, parallelism, min(MAX_CLAIM, int(rate * CLAIM_SECONDS)))
+
+
+def next_due_time(connection, table):
+    """When the next pending message in table is due, or None if nothing is pending."""
+    return connection.execute(f"SELECT MIN(next_attempt_at) FROM {table} WHERE status = ?", (PENDING,)).fetchone()[0]
+
+
+def record_results(connection, table, columns, results):
+    """Commit send results to table; each result holds the values of columns in order, then the message id."""
+    assignments = ", ".join(f"{column} = ?" for column in columns)
+    with connection:
+        connection.executemany(f"UPDATE {table} SET {assignments} WHERE id = ?", results)
+
+
+def retry_delay(attempts, backoff_seconds, max_backoff_seconds, retry_after=None):
+    """Seconds until the next try: retry_after if the provider said, else exponential backoff.
+
+    Jitter keeps retries of one failed batch from all landing at the same moment.
+    """
+    delay = retry_after or min(max_backoff_seconds, backoff_seconds * 2 ** (attempts - 1))
+    return delay * random.uniform(0.75, 1.25)
+
+
+def campaign_summaries(connection, campaigns_table, messages_table, statuses):
+    """Return [(campaign_id, name, created_at, {status: count})], newest campaign first."""
+    summaries = {}
+    for campaign_id, name, created_at in connection.execute(
+            f"SELECT id, name, created_at FROM {campaigns_table} ORDER BY id DESC"):
+        summaries[campaign_id] = (campaign_id, name, created_at, dict.fromkeys(statuses, 0))
+    for campaign_id, status, count in connection.execute(
+            f"SELECT campaign_id, status, COUNT(*) FROM {messages_table} GROUP BY campaign_id, status"):
+        if campaign_id in summaries:
+            summaries[campaign_id][3][status] = count
+    return list(summaries.values())
+
+
+class RateLimiter:
+    """Spaces sends evenly at up to rate per second, from threads or from coroutines.
+
+    The rate halves each time the provider pushes back and creeps back up by 5% with
+    every success, so a worker settles just under whatever the account allows.
+    """
+    def __init__(self, rate):
+        self.max_rate = self.rate = rate
+        self.next_time = 0.0
+        self.lock = threading.Lock()
+
+    def reserve(self):
+        """Take the next free slot and return the time.monotonic() at which it comes round."""
+        with self.lock:
+            turn = max(time.monotonic(), self.next_time)
+            self.next_time = turn + 1 / self.rate
+        return turn
+
+    def wait(self, should_stop=None):
+        """Sleep until the caller's turn to send; returns False instead if should_stop() turns true first."""
+        turn = self.reserve()
+        while True:
+            if should_stop and should_stop():
+                return False
+            remaining = turn - time.monotonic()
+            if remaining <= 0:
+                return True
+            time.sleep(min(remaining, IDLE_CHECK_SECONDS))
+
+    async def wait_async(self):
+        """wait() for coroutines, without blocking the event loop."""
+        remaining = self.reserve() - time.monotonic()
+        if remaining > 0:
+            await asyncio.sleep(remaining)
+
+    def throttled(self, retry_after=None):
+        with self.lock:
+            self.rate = max(self.max_rate / 64, self.rate / 2)
+            if retry_after:
+                self.next_time = max(self.next_time, time.monotonic() + retry_after)
+
+    def succeeded(self):
+        with self.lock:
+            self.rate = min(self.max_rate, self.rate * 1.05)
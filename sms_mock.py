@@ -0,0 +1,151 @@
+"""A local stand-in for the parts of Twilio's Messages API that sms_queue uses.
+
+Point the app or the sms_queue command line at it to try campaigns without
+texting anyone or paying for it:
+
+    python sms_mock.py --port 8099 --rate-limit-every 50
+    TWILIO_API_URL=http://127.0.0.1:8099 python sms_queue.py run
+
+It speaks HTTP/1.1 with keep-alive and counts connections, so connection reuse can
+be checked. Numbers ending in 0000 are refused as invalid. Numbers ending in 9999
+are accepted and then reported undelivered. --rate-limit-every and --error-every
+answer every Nth send with a 429 or a 500, to exercise backoff and retries.
+"""
+import argparse
+import asyncio
+import json
+import re
+import sys
+import uuid
+from urllib.parse import parse_qs
+
+MESSAGES_PATH = re.compile(r"^/2010-04-01/Accounts/(\w+)/Messages(?:/(\w+))?\.json$")
+
+STATUS_TEXT = {200: "OK", 201: "Created", 400: "Bad Request", 401: "Unauthorized", 404: "Not Found",
+               429: "Too Many Requests", 500: "Internal Server Error"}
+
+
+class MockTwilioServer:
+    def __init__(self, rate_limit_every=0, error_every=0, latency=0.0):
+        self.rate_limit_every = rate_limit_every
+        self.error_every = error_every
+        self.latency = latency
+        self.messages = {}
+        self.connections = 0
+        self.requests = 0
+        self.sends = 0
+        self.server = None
+        self.handlers = {}
+
+    async def start(self, host="127.0.0.1", port=0):
+        """Start listening and return the base URL to give TwilioTransport."""
+        self.server = await asyncio.start_server(self.handle, host, port)
+        host, port = self.server.sockets[0].getsockname()[:2]
+        return f"http://{host}:{port}"
+
+    async def close(self):
+        self.server.close()
+        for writer in self.handlers.values():
+            writer.close()
+        await asyncio.gather(*self.handlers, return_exceptions=True)
+        await self.server.wait_closed()
+
+    async def handle(self, reader, writer):
+        self.connections += 1
+        self.handlers[asyncio.current_task()] = writer
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    break
+                method, path, _ = request_line.decode("latin-1").split(" ", 2)
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b"\r\n", b"\n", b""):
+                        break
+                    name, _, value = line.decode("latin-1").partition(":")
+                    headers[name.strip().lower()] = value.strip()
+                body = await reader.readexactly(int(headers.get("content-length", 0)))
+                self.requests += 1
+                if self.latency:
+                    await asyncio.sleep(self.latency)
+                status, payload, extra_headers = self.respond(method, path, headers, body)
+                data = json.dumps(payload).encode()
+                head = [f"HTTP/1.1 {status} {STATUS_TEXT.get(status, '')}", "Content-Type: application/json",
+                        f"Content-Length: {len(data)}", *extra_headers]
+                writer.write(("\r\n".join(head) + "\r\n\r\n").encode("latin-1") + data)
+                await writer.drain()
+                if headers.get("connection", "").lower() == "close":
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+            self.handlers.pop(asyncio.current_task(), None)
+
+    def respond(self, method, path, headers, body):
+        """Return (status, JSON payload, extra header lines) for one request."""
+        match = MESSAGES_PATH.match(path)
+        if not match:
+            return 404, {"code": 20404, "message": "The requested resource was not found"}, []
+        if not headers.get("authorization", "").startswith("Basic "):
+            return 401, {"code": 20003, "message": "Authenticate"}, []
+        account_sid, message_sid = match.groups()
+
+        if method == "GET" and message_sid:
+            message = self.messages.get(message_sid)
+            if message is None:
+                return 404, {"code": 20404, "message": "Message not found"}, []
+            message["status"] = "undelivered" if message["to"].endswith("9999") else "delivered"
+            return 200, message, []
+
+        if method == "POST" and not message_sid:
+            self.sends += 1
+            if self.rate_limit_every and self.sends % self.rate_limit_every == 0:
+                return 429, {"code": 20429, "message": "Too Many Requests"}, ["Retry-After: 1"]
+            if self.error_every and self.sends % self.error_every == 0:
+                return 500, {"code": 20500, "message": "Internal Server Error"}, []
+            form = {name: values[0] for name, values in parse_qs(body.decode()).items()}
+            to_number = form.get("To", "")
+            if not re.fullmatch(r"\+\d{8,15}", to_number) or to_number.endswith("0000"):
+                return 400, {"code": 21211, "message": f"The 'To' number {to_number} is not a valid phone number."}, []
+            message = {
+                "sid": "SM" + uuid.uuid4().hex,
+                "account_sid": account_sid,
+                "to": to_number,
+                "from": form.get("From") or form.get("MessagingServiceSid"),
+                "body": form.get("Body", ""),
+                "status": "queued",
+            }
+            self.messages[message["sid"]] = message
+            return 201, message, []
+
+        return 404, {"code": 20404, "message": "The requested resource was not found"}, []
+
+
+async def serve(args):
+    server = MockTwilioServer(args.rate_limit_every, args.error_every, args.latency)
+    url = await server.start(args.host, args.port)
+    print(f"Mock Twilio listening on {url}", file=sys.stderr)
+    async with server.server:
+        await server.server.serve_forever()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Run a local stand-in for Twilio's Messages API.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8099)
+    parser.add_argument("--rate-limit-every", type=int, default=0, help="answer every Nth send with 429")
+    parser.add_argument("--error-every", type=int, default=0, help="answer every Nth send with 500")
+    parser.add_argument("--latency", type=float, default=0.0, help="seconds to wait before each response")
+    args = parser.parse_args(argv)
+    try:
+        asyncio.run(serve(args))
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,499 @@
+"""Outbound SMS campaigns: a send queue in SQLite and an asyncio worker that drains it.
+
+enqueue_campaign renders one message per matching lead into sms_messages (see
+migrations.create_sms_queue), so a campaign survives restarts and crashes.
+SmsWorker sends due messages through a transport with bounded concurrency and a
+rate limit that halves when the provider answers 429. Failed sends are retried
+with exponential backoff, and results are committed a batch at a time; the
+claiming, retry and rate limit mechanics shared with email_queue are in send_queue.
+TwilioTransport talks to Twilio's REST API over a few kept-alive connections from
+HTTPConnectionPool rather than one connection per message. Nothing here imports
+Qt: the GUI runs the worker on its own thread and the command line below runs it
+directly. sms_mock is a local stand-in for Twilio to point TWILIO_API_URL at.
+
+    python sms_queue.py send --campaign "Spring promo" --body 'Hi $first_name, ...' --city Spring
+    python sms_queue.py run
+    python sms_queue.py status --refresh
+"""
+import argparse
+import asyncio
+import base64
+import json
+import os
+import re
+import ssl
+import sys
+import time
+from dataclasses import dataclass
+from urllib.parse import urlencode, urlsplit
+
+import database
+import leads
+import migrations
+import send_queue
+
+TWILIO_API_URL = "https://api.twilio.com"
+
+PENDING = send_queue.PENDING
+SENDING = send_queue.SENDING
+SENT = send_queue.SENT
+DELIVERED = "delivered"
+UNDELIVERED = "undelivered"
+FAILED = send_queue.FAILED
+MESSAGE_STATUSES = (PENDING, SENDING, SENT, DELIVERED, UNDELIVERED, FAILED)
+
+# Twilio message statuses that settle a message, and what they settle it as
+FINAL_PROVIDER_STATUSES = {"delivered": DELIVERED, "read": DELIVERED, "undelivered": UNDELIVERED, "failed": FAILED}
+
+# A single Twilio long code is allowed about one message per second; raise it for toll-free numbers or services
+DEFAULT_RATE = 1.0
+DEFAULT_CONCURRENCY = 4
+DEFAULT_CONNECTIONS = 4
+# Status lookups don't count against the sending rate; Twilio allows far more of them
+STATUS_CHECK_RATE = 25.0
+BACKOFF_SECONDS = 2.0
+MAX_BACKOFF_SECONDS = 300.0
+# What SmsWorker.send returns for each message, followed by its id
+RESULT_COLUMNS = ("status", "attempts", "next_attempt_at", "provider_sid", "provider_status", "error", "updated_at")
+
+
+@dataclass(slots=True)
+class QueuedMessage:
+    id: int
+    to_number: str
+    body: str
+    attempts: int = 0
+    provider_sid: str | None = None
+
+
+class TransportError(Exception):
+    """A send the provider refused or that never reached it.
+
+    Retryable errors are tried again later, after retry_after seconds if the
+    provider said how long to wait; rate_limited ones also slow the worker down.
+    """
+    def __init__(self, message, retryable=False, retry_after=None, rate_limited=False):
+        super().__init__(message)
+        self.retryable = retryable
+        self.retry_after = retry_after
+        self.rate_limited = rate_limited
+
+
+def normalize_number(phone):
+    """Return phone in E.164 form, assuming US numbers without a country code; None if it can't be texted."""
+    phone = (phone or "").strip()
+    digits = re.sub(r"\D", "", phone)
+    if phone.startswith("+") and 8 <= len(digits) <= 15:
+        return "+" + digits
+    if len(digits) == 10:
+        return "+1" + digits
+    if len(digits) == 11 and digits.startswith("1"):
+        return "+" + digits
+    return None
+
+
+def enqueue_campaign(connection, leads_connection, name, body, filters=None, limit=None):
+    """Queue body for every lead matching filters, or the first limit of them; returns (campaign_id, queued, skipped).
+
+    Leads without a phone number that can be texted are skipped, and so are repeats of
+    a number already in the campaign. Runs inside the caller's transaction on connection.
+    """
+    campaign_id = connection.execute(
+        "INSERT INTO sms_campaigns (name, body, created_at) VALUES (?, ?, ?)",
+        (name, body, time.strftime("%Y-%m-%d %H:%M"))).lastrowid
+    insert_sql = "INSERT OR IGNORE INTO sms_messages (campaign_id, lead_id, to_number, body) VALUES (?, ?, ?, ?)"
+    skipped = 0
+    batch = []
+    for lead in leads.query_leads(leads_connection, filters, limit=limit):
+        number = normalize_number(lead.phone)
+        if number is None:
+            skipped += 1
+            continue
+        batch.append((campaign_id, lead.id, number, leads.fill_template(body, lead)))
+        if len(batch) >= send_queue.ENQUEUE_BATCH_SIZE:
+            connection.executemany(insert_sql, batch)
+            batch = []
+    connection.executemany(insert_sql, batch)
+    queued = connection.execute("SELECT COUNT(*) FROM sms_messages WHERE campaign_id = ?", (campaign_id,)).fetchone()[0]
+    return campaign_id, queued, skipped
+
+
+def claim_due(connection, limit, now):
+    """Mark up to limit messages that are due as sending and return them as QueuedMessages."""
+    return [QueuedMessage(*row) for row in send_queue.claim_due(
+        connection, "sms_messages", "id, to_number, body, attempts", limit, now)]
+
+
+def awaiting_delivery(connection, limit, sent_before):
+    """Messages Twilio accepted before sent_before whose delivery isn't known yet."""
+    return [QueuedMessage(*row) for row in connection.execute("""
+        SELECT id, to_number, body, attempts, provider_sid FROM sms_messages
+        WHERE status = ? AND updated_at <= ? ORDER BY updated_at LIMIT ?
+    """, (SENT, sent_before, limit))]
+
+
+def campaign_summaries(connection):
+    """Return [(campaign_id, name, created_at, {status: count})], newest campaign first."""
+    return send_queue.campaign_summaries(connection, "sms_campaigns", "sms_messages", MESSAGE_STATUSES)
+
+
+def load_credentials(connection):
+    """Return (account_sid, auth_token, from_number) from TwilioCredentials, or None if they aren't saved."""
+    row = connection.execute("SELECT SID, AuthToken, FromNumber FROM TwilioCredentials LIMIT 1").fetchone()
+    return row if row and all(row) else None
+
+
+class HTTPConnectionPool:
+    """A few persistent HTTP/1.1 connections to one host, shared by many concurrent requests.
+
+    At most size requests are in flight; each takes an idle connection or opens a new
+    one and hands it back afterwards unless the server closes it. Just enough HTTP for
+    a JSON REST API: Content-Length or chunked responses, no redirects.
+    """
+    def __init__(self, base_url, size=DEFAULT_CONNECTIONS, timeout=30.0):
+        parts = urlsplit(base_url)
+        self.host = parts.hostname
+        self.port = parts.port or (443 if parts.scheme == "https" else 80)
+        self.host_header = parts.netloc
+        self.ssl = ssl.create_default_context() if parts.scheme == "https" else None
+        self.timeout = timeout
+        self.slots = asyncio.Semaphore(size)
+        self.idle = []
+        self.opened = 0
+
+    async def request(self, method, path, headers=(), body=b""):
+        """Return (status, {lowercase header: value}, body bytes)."""
+        async with self.slots:
+            connection = self.idle.pop() if self.idle else None
+            while True:
+                reused = connection is not None
+                if connection is None:
+                    connection = await asyncio.wait_for(
+                        asyncio.open_connection(self.host, self.port, ssl=self.ssl), self.timeout)
+                    self.opened += 1
+                try:
+                    status, response_headers, data, keep_alive = await asyncio.wait_for(
+                        self.exchange(connection, method, path, headers, body), self.timeout)
+                except (OSError, asyncio.IncompleteReadError, asyncio.TimeoutError):
+                    connection[1].close()
+                    # The server may have dropped a connection that sat idle; try once more on a new one
+                    if reused:
+                        connection = None
+                        continue
+                    raise
+                except Exception:
+                    # e.g. a reply that couldn't be parsed; whatever is left of it would garble the next one
+                    connection[1].close()
+                    raise
+                if keep_alive:
+                    self.idle.append(connection)
+                else:
+                    connection[1].close()
+                return status, response_headers, data
+
+    async def exchange(self, connection, method, path, headers, body):
+        reader, writer = connection
+        head = [f"{method} {path} HTTP/1.1", f"Host: {self.host_header}", f"Content-Length: {len(body)}", *headers]
+        writer.write(("\r\n".join(head) + "\r\n\r\n").encode("latin-1") + body)
+        await writer.drain()
+
+        status = int((await reader.readuntil(b"\r\n")).split()[1])
+        response_headers = {}
+        while True:
+            line = await reader.readuntil(b"\r\n")
+            if line == b"\r\n":
+                break
+            name, _, value = line.decode("latin-1").partition(":")
+            response_headers[name.strip().lower()] = value.strip()
+
+        keep_alive = response_headers.get("connection", "").lower() != "close"
+        if "chunked" in response_headers.get("transfer-encoding", "").lower():
+            chunks = []
+            while True:
+                size = int((await reader.readuntil(b"\r\n")).split(b";")[0], 16)
+                chunk = await reader.readexactly(size + 2)
+                if not size:
+                    break
+                chunks.append(chunk[:-2])
+            data = b"".join(chunks)
+        elif "content-length" in response_headers:
+            data = await reader.readexactly(int(response_headers["content-length"]))
+        else:
+            data = await reader.read()
+            keep_alive = False
+        return status, response_headers, data, keep_alive
+
+    async def close(self):
+        for _, writer in self.idle:
+            writer.close()
+        self.idle = []
+
+
+class TwilioTransport:
+    """Sends messages through Twilio's Messages API; base_url defaults to $TWILIO_API_URL or Twilio itself.
+
+    from_number may be a phone number or a messaging service SID (MG...).
+    """
+    def __init__(self, account_sid, auth_token, from_number, base_url=None, connections=DEFAULT_CONNECTIONS):
+        self.pool = HTTPConnectionPool(base_url or os.environ.get("TWILIO_API_URL", TWILIO_API_URL), connections)
+        credentials = base64.b64encode(f"{account_sid}:{auth_token}".encode()).decode()
+        self.headers = (f"Authorization: Basic {credentials}", "Accept: application/json")
+        self.messages_path = f"/2010-04-01/Accounts/{account_sid}/Messages"
+        self.sender = ("MessagingServiceSid" if from_number.startswith("MG") else "From", from_number)
+
+    async def send(self, to_number, body):
+        """Return (message sid, Twilio status) once Twilio has accepted the message."""
+        form = urlencode([("To", to_number), self.sender, ("Body", body)]).encode()
+        payload = await self.request(
+            "POST", f"{self.messages_path}.json", form, ("Content-Type: application/x-www-form-urlencoded",))
+        if not payload.get("sid"):
+            # Not retried: Twilio may have taken the message all the same
+            raise TransportError("Twilio's reply has no message sid")
+        return payload["sid"], payload.get("status", "queued")
+
+    async def fetch_status(self, provider_sid):
+        payload = await self.request("GET", f"{self.messages_path}/{provider_sid}.json")
+        return payload.get("status")
+
+    async def request(self, method, path, body=b"", headers=()):
+        try:
+            status, response_headers, data = await self.pool.request(method, path, self.headers + headers, body)
+        except (OSError, asyncio.IncompleteReadError, asyncio.TimeoutError) as e:
+            raise TransportError(f"Could not reach Twilio: {e or type(e).__name__}", retryable=True)
+        except (ValueError, IndexError, asyncio.LimitOverrunError) as e:
+            raise TransportError(f"Could not read Twilio's reply: {e or type(e).__name__}", retryable=True)
+        if status == 429:
+            retry_after = response_headers.get("retry-after", "")
+            raise TransportError("Twilio rate limit reached", retryable=True, rate_limited=True,
+                                 retry_after=float(retry_after) if retry_after.replace(".", "", 1).isdigit() else None)
+        try:
+            payload = json.loads(data or b"{}")
+        except ValueError:
+            payload = {}
+        if not isinstance(payload, dict):
+            payload = {}
+        if status >= 500:
+            raise TransportError(f"Twilio error {status}", retryable=True)
+        if status >= 400:
+            raise TransportError(f"Twilio refused the message ({status}): {payload.get('message', '')}".rstrip(": "))
+        return payload
+
+    async def close(self):
+        await self.pool.close()
+
+
+def unexpected_failure(message, error):
+    """The result of a send that raised something other than TransportError: failed, without a retry."""
+    return FAILED, message.attempts + 1, 0, None, None, f"{type(error).__name__}: {error}", time.time(), message.id
+
+
+class SmsWorker:
+    """Drains the queue in connection's database through transport.
+
+    run() sends every due message, sleeps until retries come due, and returns once
+    nothing is left pending or should_stop() says so. Stopping takes effect before the
+    next request; messages not yet sent stay queued for the next run. progress() is
+    called after each batch of results is committed.
+    """
+    def __init__(self, connection, transport, rate=DEFAULT_RATE, concurrency=DEFAULT_CONCURRENCY,
+                 max_attempts=send_queue.MAX_ATTEMPTS, progress=None):
+        self.connection = connection
+        self.transport = transport
+        self.rate = rate
+        self.concurrency = concurrency
+        self.max_attempts = max_attempts
+        self.progress = progress
+        self.should_stop = None
+
+    def stopping(self):
+        return bool(self.should_stop and self.should_stop())
+
+    async def run(self, should_stop=None):
+        self.should_stop = should_stop
+        self.limiter = send_queue.RateLimiter(self.rate)
+        self.slots = asyncio.Semaphore(self.concurrency)
+        send_queue.reset_interrupted(self.connection, "sms_messages")
+        sent = 0
+        while not self.stopping():
+            batch = claim_due(self.connection, send_queue.claim_size(self.limiter.rate, self.concurrency), time.time())
+            if batch:
+                # send() records its own failures; return_exceptions keeps one it missed from losing the batch
+                results = await asyncio.gather(*(self.send(message) for message in batch), return_exceptions=True)
+                results = [unexpected_failure(message, result) if isinstance(result, BaseException) else result
+                           for message, result in zip(batch, results)]
+                send_queue.record_results(self.connection, "sms_messages", RESULT_COLUMNS, results)
+                sent += sum(1 for result in results if result[0] in (SENT, DELIVERED))
+                if self.progress:
+                    self.progress()
+                continue
+            next_due = send_queue.next_due_time(self.connection, "sms_messages")
+            if next_due is None:
+                break
+            await asyncio.sleep(min(max(next_due - time.time(), 0), send_queue.IDLE_CHECK_SECONDS))
+        return sent
+
+    async def send(self, message):
+        async with self.slots:
+            if not self.stopping():
+                await self.limiter.wait_async()
+            if self.stopping():
+                return PENDING, message.attempts, 0, None, None, None, time.time(), message.id
+            attempts = message.attempts + 1
+            try:
+                provider_sid, provider_status = await self.transport.send(message.to_number, message.body)
+            except TransportError as e:
+                if e.rate_limited:
+                    self.limiter.throttled(e.retry_after)
+                if e.retryable and attempts < self.max_attempts:
+                    delay = send_queue.retry_delay(attempts, BACKOFF_SECONDS, MAX_BACKOFF_SECONDS, e.retry_after)
+                    return PENDING, attempts, time.time() + delay, None, None, str(e), time.time(), message.id
+                return FAILED, attempts, 0, None, None, str(e), time.time(), message.id
+            except Exception as e:
+                return unexpected_failure(message, e)
+            self.limiter.succeeded()
+            status = FINAL_PROVIDER_STATUSES.get(provider_status, SENT)
+            return status, attempts, 0, provider_sid, provider_status, None, time.time(), message.id
+
+    async def refresh_statuses(self, min_age=60.0, limit=1000, should_stop=None):
+        """Ask the provider what became of messages sent at least min_age seconds ago; returns how many settled."""
+        self.should_stop = should_stop
+        self.limiter = send_queue.RateLimiter(max(self.rate, STATUS_CHECK_RATE))
+        self.slots = asyncio.Semaphore(self.concurrency)
+        messages = awaiting_delivery(self.connection, limit, time.time() - min_age)
+
+        async def check(message):
+            async with self.slots:
+                if self.stopping():
+                    return None
+                await self.limiter.wait_async()
+                try:
+                    provider_status = await self.transport.fetch_status(message.provider_sid)
+                except Exception:
+                    # The message stays sent and is asked about again next time
+                    return None
+                return provider_status, message.id
+
+        results = await asyncio.gather(*(check(message) for message in messages), return_exceptions=True)
+        checked = [result for result in results if result and not isinstance(result, BaseException)]
+        settled = [(FINAL_PROVIDER_STATUSES[status], status, time.time(), message_id)
+                   for status, message_id in checked if status in FINAL_PROVIDER_STATUSES]
+        with self.connection:
+            self.connection.executemany(
+                "UPDATE sms_messages SET status = ?, provider_status = ?, updated_at = ? WHERE id = ?", settled)
+        return len(settled)
+
+
+def open_queue(path):
+    connection = database.connect(path)
+    migrations.migrate(connection, migrations.TWILIO_MIGRATIONS)
+    return connection
+
+
+def make_transport(connection, args):
+    credentials = load_credentials(connection)
+    if credentials is None:
+        print("Save a Twilio SID, auth token and from number first (Integrations tab in the app).", file=sys.stderr)
+        return None
+    return TwilioTransport(*credentials, connections=args.connections)
+
+
+async def drain(connection, transport, args, refresh=False):
+    def report():
+        counts = {}
+        for *_, campaign_counts in campaign_summaries(connection):
+            for status, count in campaign_counts.items():
+                counts[status] = counts.get(status, 0) + count
+        print("\r" + ", ".join(f"{count} {status}" for status, count in counts.items() if count),
+              end="", file=sys.stderr, flush=True)
+
+    worker = SmsWorker(connection, transport, args.rate, args.concurrency, progress=report)
+    try:
+        if refresh:
+            return await worker.refresh_statuses(min_age=0)
+        return await worker.run()
+    finally:
+        await transport.close()
+        print(file=sys.stderr)
+
+
+def command_send(connection, args):
+    filters = {name: getattr(args, name) for _, name in leads.QUERY_FILTERS if getattr(args, name)}
+    if args.status is not None:
+        filters["lead_status"] = args.status
+    leads_connection = leads.open_database(args.leads_db)
+    try:
+        with connection:
+            campaign_id, queued, skipped = enqueue_campaign(connection, leads_connection, args.campaign, args.body, filters)
+    finally:
+        leads_connection.close()
+    print(f"Campaign {campaign_id}: {queued} messages queued, {skipped} leads without a textable phone number",
+          file=sys.stderr)
+    if args.queue_only:
+        return 0
+    return command_run(connection, args)
+
+
+def command_run(connection, args):
+    transport = make_transport(connection, args)
+    if transport is None:
+        return 2
+    try:
+        sent = asyncio.run(drain(connection, transport, args))
+    except KeyboardInterrupt:
+        print("\nStopped; unsent messages stay queued for the next run.", file=sys.stderr)
+        return 1
+    print(f"{sent} messages sent", file=sys.stderr)
+    return 0
+
+
+def command_status(connection, args):
+    if args.refresh:
+        transport = make_transport(connection, args)
+        if transport is None:
+            return 2
+        settled = asyncio.run(drain(connection, transport, args, refresh=True))
+        print(f"{settled} messages settled", file=sys.stderr)
+    print("campaign,name,created_at," + ",".join(MESSAGE_STATUSES))
+    for campaign_id, name, created_at, counts in campaign_summaries(connection):
+        print(f"{campaign_id},{json.dumps(name)},{created_at}," + ",".join(str(counts[status]) for status in MESSAGE_STATUSES))
+    return 0
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(prog="sms_queue", description="Queue and send SMS campaigns to leads.")
+    parser.add_argument("--db", default=database.TWILIO_DATABASE, help="queue and credentials database (default: %(default)s)")
+    parser.add_argument("--leads-db", default=database.LEADS_DATABASE, help="leads database (default: %(default)s)")
+    parser.add_argument("--rate", type=float, default=DEFAULT_RATE, help="messages per second (default: %(default)s)")
+    parser.add_argument("--concurrency", type=int, default=DEFAULT_CONCURRENCY, help="requests in flight (default: %(default)s)")
+    parser.add_argument("--connections", type=int, default=DEFAULT_CONNECTIONS, help="HTTP connections kept open (default: %(default)s)")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    send = commands.add_parser("send", help="queue a message for every matching lead, then send the queue")
+    send.add_argument("--campaign", required=True, help="campaign name")
+    send.add_argument("--body", required=True, help="message text; $first_name, $city etc. are filled in per lead")
+    for flag, name in leads.QUERY_FILTERS:
+        send.add_argument(flag, dest=name)
+    send.add_argument("--status", type=leads.status_code, help="lead status label")
+    send.add_argument("--queue-only", action="store_true", help="queue the messages without sending them")
+    send.set_defaults(run=command_send)
+
+    run = commands.add_parser("run", help="send every queued message, waiting for retries")
+    run.set_defaults(run=command_run)
+
+    status = commands.add_parser("status", help="print message counts per campaign as CSV")
+    status.add_argument("--refresh", action="store_true", help="ask Twilio what became of sent messages first")
+    status.set_defaults(run=command_status)
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    connection = open_queue(args.db)
+    try:
+        return args.run(connection, args)
+    finally:
+        connection.close()
+
+
+if __name__ == "__main__":
+    sys.exit(main())
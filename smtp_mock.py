@@ -0,0 +1,212 @@
+"""A local SMTP server that accepts and counts mail, to try email campaigns against.
+
+    python smtp_mock.py --port 8025 --defer-every 50
+    python email_queue.py configure --host 127.0.0.1 --port 8025 --security none --from me@example.com
+    python email_queue.py run
+
+It speaks enough ESMTP for smtplib, without TLS: EHLO advertising AUTH PLAIN and
+LOGIN, MAIL, RCPT, DATA, RSET, NOOP and QUIT. It counts connections, logins and
+messages, so session reuse can be checked, and keeps no message bodies. Recipients
+at invalid.example are refused with 550. --defer-every answers every Nth recipient
+with 451, and --max-messages-per-connection ends sessions with 421 the way busy
+providers do.
+"""
+import argparse
+import asyncio
+import base64
+import binascii
+import sys
+import threading
+
+
+class MockSmtpServer:
+    def __init__(self, username=None, password=None, defer_every=0, max_messages_per_connection=0, latency=0.0):
+        self.username = username
+        self.password = password
+        self.defer_every = defer_every
+        self.max_messages_per_connection = max_messages_per_connection
+        self.latency = latency
+        self.connections = 0
+        self.logins = 0
+        self.recipients = 0
+        self.messages = 0
+        self.bytes = 0
+        self.server = None
+        self.handlers = {}
+        self.loop = None
+        self.thread = None
+
+    async def start(self, host="127.0.0.1", port=0):
+        """Start listening and return the port."""
+        self.server = await asyncio.start_server(self.handle, host, port)
+        return self.server.sockets[0].getsockname()[1]
+
+    async def close(self):
+        self.server.close()
+        for writer in self.handlers.values():
+            writer.close()
+        await asyncio.gather(*self.handlers, return_exceptions=True)
+        await self.server.wait_closed()
+
+    def start_thread(self, host="127.0.0.1", port=0):
+        """Serve from an event loop on a daemon thread, for blocking clients like smtplib; returns the port."""
+        self.loop = asyncio.new_event_loop()
+        port = self.loop.run_until_complete(self.start(host, port))
+        self.thread = threading.Thread(target=self.loop.run_forever, name="smtp-mock", daemon=True)
+        self.thread.start()
+        return port
+
+    def stop_thread(self):
+        asyncio.run_coroutine_threadsafe(self.close(), self.loop).result()
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.thread.join()
+        self.loop.close()
+
+    async def handle(self, reader, writer):
+        self.connections += 1
+        self.handlers[asyncio.current_task()] = writer
+        authenticated = not self.username
+        sender = None
+        recipients = []
+        delivered_here = 0
+
+        def reply(line):
+            writer.write(f"{line}\r\n".encode())
+
+        try:
+            reply("220 localhost Mock ESMTP")
+            await writer.drain()
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                verb, _, argument = line.decode("utf-8", "replace").rstrip("\r\n").partition(" ")
+                verb = verb.upper()
+                if verb == "EHLO":
+                    writer.write(b"250-localhost\r\n250-AUTH PLAIN LOGIN\r\n250-8BITMIME\r\n250 SIZE 10485760\r\n")
+                elif verb == "HELO":
+                    reply("250 localhost")
+                elif verb == "AUTH":
+                    authenticated = await self.authenticate(argument, reader, writer)
+                elif verb == "MAIL":
+                    if not authenticated:
+                        reply("530 5.7.0 Authentication required")
+                    elif self.max_messages_per_connection and delivered_here >= self.max_messages_per_connection:
+                        reply("421 4.7.0 Too many messages for one session, closing")
+                        break
+                    else:
+                        sender = argument
+                        recipients = []
+                        reply("250 2.1.0 OK")
+                elif verb == "RCPT":
+                    address = argument.partition(":")[2].strip().strip("<>")
+                    if sender is None:
+                        reply("503 5.5.1 MAIL first")
+                    else:
+                        self.recipients += 1
+                        if self.defer_every and self.recipients % self.defer_every == 0:
+                            reply("451 4.3.0 Try again later")
+                        elif address.lower().endswith("@invalid.example"):
+                            reply("550 5.1.1 No such user")
+                        else:
+                            recipients.append(address)
+                            reply("250 2.1.5 OK")
+                elif verb == "DATA" and not recipients:
+                    reply("503 5.5.1 RCPT first")
+                elif verb == "DATA":
+                    reply("354 End data with <CR><LF>.<CR><LF>")
+                    await writer.drain()
+                    size = 0
+                    while True:
+                        data = await reader.readline()
+                        if not data:
+                            raise ConnectionError("client went away during DATA")
+                        if data in (b".\r\n", b".\n"):
+                            break
+                        size += len(data)
+                    if self.latency:
+                        await asyncio.sleep(self.latency)
+                    self.messages += 1
+                    self.bytes += size
+                    delivered_here += 1
+                    sender = None
+                    recipients = []
+                    reply("250 2.0.0 OK queued")
+                elif verb == "RSET":
+                    sender = None
+                    recipients = []
+                    reply("250 2.0.0 OK")
+                elif verb == "NOOP":
+                    reply("250 2.0.0 OK")
+                elif verb == "QUIT":
+                    reply("221 2.0.0 Bye")
+                    break
+                else:
+                    reply("502 5.5.2 Command not implemented")
+                await writer.drain()
+            await writer.drain()
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+            self.handlers.pop(asyncio.current_task(), None)
+
+    async def authenticate(self, argument, reader, writer):
+        """Run one AUTH exchange and return whether it logged in."""
+        mechanism, _, initial = argument.partition(" ")
+
+        async def ask(prompt):
+            writer.write(f"334 {prompt}\r\n".encode())
+            await writer.drain()
+            return (await reader.readline()).strip()
+
+        try:
+            if mechanism.upper() == "PLAIN":
+                response = initial or await ask("")
+                _, username, password = base64.b64decode(response).decode().split("\0")
+            elif mechanism.upper() == "LOGIN":
+                username = base64.b64decode(initial or await ask("VXNlcm5hbWU6")).decode()
+                password = base64.b64decode(await ask("UGFzc3dvcmQ6")).decode()
+            else:
+                writer.write(b"504 5.5.4 Unrecognized authentication type\r\n")
+                return False
+        except (ValueError, binascii.Error):
+            writer.write(b"501 5.5.2 Cannot decode response\r\n")
+            return False
+        if self.username is not None and (username, password) != (self.username, self.password):
+            writer.write(b"535 5.7.8 Authentication credentials invalid\r\n")
+            return False
+        self.logins += 1
+        writer.write(b"235 2.7.0 Authentication successful\r\n")
+        return True
+
+
+async def serve(args):
+    server = MockSmtpServer(args.username, args.password, args.defer_every, args.max_messages_per_connection,
+                            args.latency)
+    port = await server.start(args.host, args.port)
+    print(f"Mock SMTP server listening on {args.host}:{port}", file=sys.stderr)
+    async with server.server:
+        await server.server.serve_forever()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Run a local SMTP server that accepts and counts mail.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8025)
+    parser.add_argument("--username", help="require AUTH with this username")
+    parser.add_argument("--password", help="and this password")
+    parser.add_argument("--defer-every", type=int, default=0, help="answer every Nth recipient with 451")
+    parser.add_argument("--max-messages-per-connection", type=int, default=0,
+                        help="end a session with 421 after this many messages")
+    parser.add_argument("--latency", type=float, default=0.0, help="seconds to wait before accepting each message")
+    args = parser.parse_args(argv)
+    try:
+        asyncio.run(serve(args))
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,105 @@
+"""EmailWorker and SmtpTransport against smtp_mock on localhost."""
+import pytest
+
+import email_queue
+import leads
+import smtp_mock
+
+EMAILS = ["ann@example.com", "bob@example.com", "cy@example.com", "di@example.com", "ed@invalid.example",
+          "flo@example.com"]
+
+
+@pytest.fixture
+def queue(tmp_path):
+    leads_connection = leads.open_database(str(tmp_path / "leads_database.db"))
+    with leads_connection:
+        leads.add_leads(leads_connection, [leads.Lead(first_name=f"Lead{i}", email=email) for i, email in enumerate(EMAILS)])
+    connection = email_queue.open_queue(str(tmp_path / "email_campaigns.db"))
+    with connection:
+        email_queue.enqueue_campaign(connection, leads_connection, "Spring", "Hi $first_name", "Roof season is here.")
+    leads_connection.close()
+    yield connection
+    connection.close()
+
+
+@pytest.fixture(autouse=True)
+def fast_retries(monkeypatch):
+    monkeypatch.setattr(email_queue, "BACKOFF_SECONDS", 0.01)
+
+
+@pytest.fixture
+def mock_server():
+    servers = []
+
+    def start(**options):
+        server = smtp_mock.MockSmtpServer(username="me", password="secret", **options)
+        servers.append(server)
+        return server, server.start_thread()
+    yield start
+    for server in servers:
+        server.stop_thread()
+
+
+def run_worker(connection, port, connections=1, messages_per_connection=email_queue.MESSAGES_PER_CONNECTION):
+    settings = email_queue.SmtpSettings("127.0.0.1", port, "none", "me", "secret", "me@example.com")
+    transport = email_queue.SmtpTransport(settings, messages_per_connection)
+    try:
+        return email_queue.EmailWorker(connection, transport, rate=1000, connections=connections).run(), transport
+    finally:
+        transport.close()
+
+
+def statuses(connection):
+    return dict(connection.execute("SELECT to_address, status FROM email_messages"))
+
+
+def test_worker_sends_over_persistent_sessions(queue, mock_server):
+    server, port = mock_server()
+    sent, transport = run_worker(queue, port, connections=2)
+    assert sent == 5
+    assert statuses(queue)["ed@invalid.example"] == "failed"
+    assert server.messages == 5
+    assert server.connections == server.logins == transport.opened <= 2
+
+
+def test_retry_after_421_on_a_fresh_session(queue, mock_server):
+    # The server ends each session after two messages, as providers do
+    server, port = mock_server(max_messages_per_connection=2)
+    sent, transport = run_worker(queue, port)
+    assert sent == 5
+    assert server.messages == 5
+    assert server.connections == transport.opened == 3
+    assert queue.execute("SELECT MAX(attempts) FROM email_messages").fetchone()[0] == 1
+
+
+def test_deferred_messages_are_retried(queue, mock_server):
+    server, port = mock_server(defer_every=2)
+    sent, _ = run_worker(queue, port)
+    assert sent == 5
+    assert statuses(queue)["ed@invalid.example"] == "failed"
+    assert queue.execute("SELECT MAX(attempts) FROM email_messages").fetchone()[0] > 1
+
+
+def test_unbuildable_message_fails_only_that_message(queue, mock_server):
+    server, port = mock_server()
+    with queue:
+        queue.execute("UPDATE email_messages SET subject = 'Hi\nBcc: everyone@example.com' WHERE to_address = 'bob@example.com'")
+    sent, _ = run_worker(queue, port)
+    assert sent == 4
+    assert queue.execute("SELECT COUNT(*) FROM email_messages WHERE status = 'sending'").fetchone()[0] == 0
+    status, error = queue.execute("SELECT status, error FROM email_messages WHERE to_address = 'bob@example.com'").fetchone()
+    assert status == "failed" and error.startswith("Could not build the message")
+
+
+class BrokenTransport:
+    """Raises something other than SendError for one address."""
+    def send(self, to_address, subject, body):
+        if to_address.startswith("cy@"):
+            raise KeyError("Subject")
+
+
+def test_unexpected_error_fails_only_that_message(queue):
+    sent = email_queue.EmailWorker(queue, BrokenTransport(), rate=1000).run()
+    assert sent == 5
+    assert queue.execute(
+        "SELECT status, error FROM email_messages WHERE to_address = 'cy@example.com'").fetchone() == ("failed", "KeyError: 'Subject'")
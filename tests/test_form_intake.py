@@ -0,0 +1,145 @@
+"""form_intake against a real database, and IntakeServer on localhost."""
+import asyncio
+import json
+
+import pytest
+
+import database
+import form_intake
+import lead_dedupe
+import leads
+import sms_queue
+
+JSON_HEADERS = ["Content-Type: application/json"]
+
+
+@pytest.fixture
+def db_path(tmp_path):
+    path = str(tmp_path / "leads_database.db")
+    connection = form_intake.open_database(path)
+    with connection:
+        form_intake.create_form(connection, "Spring Roofing")
+    connection.close()
+    return path
+
+
+def submission(connection, first_name, phone):
+    form = form_intake.get_form(connection, "spring-roofing")
+    return form.id, leads.Lead(first_name=first_name, last_name="Lee", phone=phone)
+
+
+def test_write_submissions_dedupes_within_and_across_batches(db_path):
+    connection = form_intake.open_database(db_path)
+    results = form_intake.write_submissions(connection, [
+        submission(connection, "Ann", "555-111-2222"),
+        submission(connection, "Bob", "555-333-4444"),
+        submission(connection, "Ann", "(555) 111-2222"),
+    ])
+    assert results == [(1, False), (2, False), (1, True)]
+    assert form_intake.write_submissions(connection, [submission(connection, "Bob", "5553334444")]) == [(2, True)]
+    form = form_intake.get_form(connection, "spring-roofing")
+    assert (form.submissions, form.duplicates) == (4, 2)
+
+
+def test_write_submissions_dedupes_after_soft_delete(db_path):
+    connection = form_intake.open_database(db_path)
+    form_intake.write_submissions(connection, [submission(connection, "Ann", "555-111-2222"),
+                                               submission(connection, "Bob", "555-333-4444")])
+    with connection:
+        leads.soft_delete_leads(connection, [2])
+    # The next lead must not take the deleted lead's id, and must still be matched afterwards
+    assert form_intake.write_submissions(connection, [submission(connection, "Cy", "555-555-6666")]) == [(3, False)]
+    assert form_intake.write_submissions(connection, [submission(connection, "Cy", "555-555-6666")]) == [(3, True)]
+    # A deleted lead's keys go with it, so the same person can send the form again
+    assert form_intake.write_submissions(connection, [submission(connection, "Bob", "555-333-4444")]) == [(4, False)]
+
+
+def test_write_submissions_dedupes_against_an_unkeyed_bulk_import(db_path, monkeypatch):
+    monkeypatch.setattr(lead_dedupe, "INDEX_CHUNK_SIZE", 2)
+    connection = form_intake.open_database(db_path)
+    with connection:
+        leads.add_leads(connection, [leads.Lead(first_name=f"Lead {n}", phone=f"555-000-{n:04}") for n in range(7)])
+    # Another connection adds a lead after the batch's own refresh; it must still be matched
+    refresh_index = lead_dedupe.refresh_index
+
+    def refresh_then_insert(connection, limit=None):
+        refresh_index(connection, limit)
+        other = database.connect(db_path)
+        with other:
+            leads.add_lead(other, leads.Lead(first_name="Late", phone="555-999-0000"))
+        other.close()
+
+    monkeypatch.setattr(lead_dedupe, "refresh_index", refresh_then_insert)
+    assert form_intake.write_submissions(connection, [submission(connection, "Lead 6", "555-000-0006"),
+                                                      submission(connection, "Late", "555-999-0000")]) == [
+        (7, True), (8, True)]
+
+
+def run_server(db_path, client):
+    """Start an IntakeServer on a free localhost port, run client(server, pool) and shut both down."""
+    async def main():
+        server = form_intake.IntakeServer(db_path)
+        port = await server.start("127.0.0.1", 0)
+        pool = sms_queue.HTTPConnectionPool(f"http://127.0.0.1:{port}", size=16)
+        try:
+            return await client(server, pool)
+        finally:
+            await pool.close()
+            await server.close()
+    return asyncio.run(main())
+
+
+def post(pool, first_name, phone):
+    body = json.dumps({"first_name": first_name, "phone": phone}).encode()
+    return pool.request("POST", "/forms/spring-roofing", JSON_HEADERS, body)
+
+
+def test_server_writes_concurrent_posts_in_batches(db_path):
+    async def client(server, pool):
+        responses = await asyncio.gather(*(post(pool, f"A{i}", f"555-000-{i:04d}") for i in range(100)))
+        responses.append(await post(pool, "A7", "555-000-0007"))
+        return server.stats(), responses
+
+    stats, responses = run_server(db_path, client)
+    assert [status for status, _, _ in responses] == [201] * 100 + [200]
+    assert sorted(json.loads(body)["id"] for _, _, body in responses[:100]) == list(range(1, 101))
+    assert json.loads(responses[-1][2]) == {"duplicate_of": 8}
+    assert stats["written"] == 100 and stats["duplicates"] == 1
+    assert stats["batches"] < 50
+    connection = database.connect(db_path)
+    assert connection.execute("SELECT COUNT(*) FROM leads").fetchone()[0] == 100
+
+
+def test_server_dedupes_after_soft_delete(db_path):
+    async def client(server, pool):
+        await post(pool, "Ann", "555-111-2222")
+        await post(pool, "Bob", "555-333-4444")
+        connection = database.connect(db_path)
+        with connection:
+            leads.soft_delete_leads(connection, [2])
+        connection.close()
+        return [await post(pool, "Cy", "555-555-6666"), await post(pool, "Cy", "555-555-6666")]
+
+    (status, _, body), (duplicate_status, _, duplicate_body) = run_server(db_path, client)
+    assert (status, json.loads(body)) == (201, {"id": 3})
+    assert (duplicate_status, json.loads(duplicate_body)) == (200, {"duplicate_of": 3})
+
+
+def test_server_fails_only_the_batch_that_raised(db_path, monkeypatch):
+    write_submissions = form_intake.write_submissions
+    calls = []
+
+    def flaky_write_submissions(connection, submissions):
+        calls.append(len(submissions))
+        if len(calls) == 1:
+            raise ValueError("bad batch")
+        return write_submissions(connection, submissions)
+
+    monkeypatch.setattr(form_intake, "write_submissions", flaky_write_submissions)
+
+    async def client(server, pool):
+        return [await post(pool, "Ann", "555-111-2222"), await post(pool, "Ann", "555-111-2222")]
+
+    (status, _, body), (retry_status, _, retry_body) = run_server(db_path, client)
+    assert (status, json.loads(body)) == (500, {"error": "We couldn't save that."})
+    assert (retry_status, json.loads(retry_body)) == (201, {"id": 1})
@@ -0,0 +1,136 @@
+"""SmsWorker and TwilioTransport against sms_mock on localhost."""
+import asyncio
+
+import pytest
+
+import leads
+import sms_mock
+import sms_queue
+
+PHONES = ["555-010-0001", "555-010-0002", "555-010-0003", "555-010-0004", "555-010-0000", "555-010-9999"]
+
+
+@pytest.fixture
+def queue(tmp_path):
+    leads_connection = leads.open_database(str(tmp_path / "leads_database.db"))
+    with leads_connection:
+        leads.add_leads(leads_connection, [leads.Lead(first_name=f"Lead{i}", phone=phone) for i, phone in enumerate(PHONES)])
+    connection = sms_queue.open_queue(str(tmp_path / "twilio_credentials.db"))
+    with connection:
+        sms_queue.enqueue_campaign(connection, leads_connection, "Spring", "Hi $first_name")
+    leads_connection.close()
+    yield connection
+    connection.close()
+
+
+@pytest.fixture(autouse=True)
+def fast_retries(monkeypatch):
+    monkeypatch.setattr(sms_queue, "BACKOFF_SECONDS", 0.01)
+
+
+def statuses(connection):
+    return dict(connection.execute("SELECT to_number, status FROM sms_messages"))
+
+
+def run_worker(connection, mock, refresh=False):
+    """Drain the queue through a TwilioTransport pointed at mock; returns what the worker returned."""
+    async def main():
+        url = await mock.start()
+        transport = sms_queue.TwilioTransport("AC123", "token", "+15550100000", base_url=url)
+        worker = sms_queue.SmsWorker(connection, transport, rate=1000)
+        try:
+            if refresh:
+                return await worker.refresh_statuses(min_age=0)
+            return await worker.run()
+        finally:
+            await transport.close()
+            await mock.close()
+    return asyncio.run(main())
+
+
+def test_worker_sends_over_few_connections_and_retries_server_errors(queue):
+    mock = sms_mock.MockTwilioServer(rate_limit_every=3, error_every=4)
+    assert run_worker(queue, mock) == 5
+    assert statuses(queue) == {"+15550100001": "sent", "+15550100002": "sent", "+15550100003": "sent",
+                               "+15550100004": "sent", "+15550100000": "failed", "+15550109999": "sent"}
+    assert mock.sends > 6
+    assert mock.connections <= sms_queue.DEFAULT_CONNECTIONS
+    assert run_worker(queue, sms_mock.MockTwilioServer(), refresh=True) == 0
+
+
+def test_pool_retries_on_a_dropped_keep_alive_connection():
+    async def main():
+        mock = sms_mock.MockTwilioServer()
+        pool = sms_queue.HTTPConnectionPool(await mock.start(), size=1)
+        try:
+            first = await pool.request("GET", "/missing")
+            # The server closes the idle kept-alive connection, as servers do after a timeout
+            for writer in list(mock.handlers.values()):
+                writer.close()
+            await asyncio.sleep(0.05)
+            second = await pool.request("GET", "/missing")
+        finally:
+            await pool.close()
+            await mock.close()
+        return first[0], second[0], pool.opened, mock.connections
+
+    assert asyncio.run(main()) == (404, 404, 2, 2)
+
+
+class NoSidMock(sms_mock.MockTwilioServer):
+    def respond(self, method, path, headers, body):
+        status, payload, extra_headers = super().respond(method, path, headers, body)
+        if status == 201 and payload["to"].endswith("0002"):
+            payload = {key: value for key, value in payload.items() if key != "sid"}
+        return status, payload, extra_headers
+
+
+def test_reply_without_a_sid_fails_only_that_message(queue):
+    assert run_worker(queue, NoSidMock()) == 4
+    failed = dict(queue.execute("SELECT to_number, error FROM sms_messages WHERE status = 'failed'"))
+    assert failed == {"+15550100002": "Twilio's reply has no message sid",
+                      "+15550100000": "Twilio refused the message (400): "
+                                      "The 'To' number +15550100000 is not a valid phone number."}
+
+
+class BrokenTransport:
+    """Raises something other than TransportError for one number."""
+    async def send(self, to_number, body):
+        if to_number.endswith("0003"):
+            raise ValueError("bad header")
+        return "SM" + to_number[1:], "queued"
+
+    async def close(self):
+        pass
+
+
+def test_unexpected_error_fails_only_that_message(queue):
+    sent = asyncio.run(sms_queue.SmsWorker(queue, BrokenTransport(), rate=1000).run())
+    assert sent == 5
+    assert queue.execute("SELECT COUNT(*) FROM sms_messages WHERE status = 'sending'").fetchone()[0] == 0
+    assert queue.execute(
+        "SELECT status, error FROM sms_messages WHERE to_number = '+15550100003'").fetchone() == ("failed", "ValueError: bad header")
+
+
+def test_unreadable_reply_is_retried():
+    async def main():
+        async def garble(reader, writer):
+            await reader.readuntil(b"\r\n\r\n")
+            writer.write(b"HTTP/1.1 OK\r\n\r\n")
+            await writer.drain()
+            writer.close()
+
+        server = await asyncio.start_server(garble, "127.0.0.1", 0)
+        port = server.sockets[0].getsockname()[1]
+        transport = sms_queue.TwilioTransport("AC123", "token", "+15550100000", base_url=f"http://127.0.0.1:{port}")
+        try:
+            with pytest.raises(sms_queue.TransportError) as raised:
+                await transport.send("+15550100001", "Hi")
+        finally:
+            await transport.close()
+            server.close()
+            await server.wait_closed()
+        return raised.value
+
+    error = asyncio.run(main())
+    assert error.retryable and str(error).startswith("Could not read Twilio's reply")
@@ -1,817 +1,3231 @@
-import sys
-import json
-import os
-import csv
-import subprocess
-from PyQt5.QtWidgets import QApplication, QMainWindow, QWidget, QVBoxLayout, QHBoxLayout, QLabel, QLineEdit, QTextEdit, QPushButton, QTableWidget, QTableWidgetItem, QHeaderView, QComboBox, QTabWidget, QFileDialog
-from PyQt5.QtGui import QFont, QPalette, QColor, QPixmap
-from PyQt5.QtCore import Qt
-from reportlab.lib.pagesizes import letter
-from reportlab.lib import colors
-from reportlab.platypus import SimpleDocTemplate, Table, TableStyle
-from PyQt5.QtWidgets import QStyledItemDelegate
-from PyQt5.QtWidgets import QMessageBox
-from PyQt5.QtWidgets import QCalendarWidget, QVBoxLayout, QPushButton
-from PyQt5.QtWidgets import QTabWidget
-from PyQt5.QtWidgets import QGroupBox, QGridLayout
-import sqlite3
-
-def create_connection(db_file):
-    """Create a database connection or return an existing one."""
-    try:
-        connection = sqlite3.connect(db_file)
-        return connection
-    except sqlite3.Error as e:
-        print(e)
-    return None
-
-def create_calendar_table(connection):
-    """Create the Calendar table if it doesn't exist."""
-    create_table_sql = """
-    CREATE TABLE IF NOT EXISTS Calendar (
-        Date TEXT PRIMARY KEY,
-        Notes TEXT
-    );
-    """
-    try:
-        cursor = connection.cursor()
-        cursor.execute(create_table_sql)
-        connection.commit()
-    except sqlite3.Error as e:
-        print(e)
-
-# Use these functions to create a connection and initialize the Calendar table
-db_connection = create_connection("calendar.db")
-if db_connection:
-    create_calendar_table(db_connection)
-    
-def install_dependencies():
-    try:
-        subprocess.check_call([sys.executable, "-m", "pip", "install", "-r", "requirements.txt"])
-    except subprocess.CalledProcessError:
-        print("Failed to install required dependencies.")
-        sys.exit(1)
-
-def check_dependencies():
-    try:
-        import PyQt5
-        import reportlab
-    except ImportError:
-        return False
-    return True
-
-class ContractorLeadsApp(QMainWindow):
-    def __init__(self):
-        super().__init__()
-        self.setWindowTitle("Contractor Leads Database by REA")
-        self.setGeometry(100, 100, 1600, 800)
-
-        if not check_dependencies():
-            install_dependencies()
-
-        self.central_widget = QWidget(self)
-        self.setCentralWidget(self.central_widget)
-
-        # Initialize the database connection
-        db_connection = sqlite3.connect('leads_database.db')
-
-        self.setup_ui(db_connection)  # Pass self.leads and db_connection
-        
-    def setup_ui(self, db_connection):
-        self.tabs = TabWidget(self,  db_connection)  # Pass leads_list and db_connecti
-        self.logo_label = QLabel()
-        self.logo_pixmap = QPixmap("logo.png")
-        self.logo_pixmap = self.logo_pixmap.scaledToWidth(150, Qt.SmoothTransformation)
-        self.logo_label.setPixmap(self.logo_pixmap)
-        self.logo_label.setAlignment(Qt.AlignCenter)
-
-        layout = QVBoxLayout()
-        layout.addWidget(self.logo_label)
-        layout.addWidget(self.tabs)
-        self.central_widget.setLayout(layout)
-
-        self.set_dark_theme()
-
-    def set_dark_theme(self):
-        app = QApplication.instance()
-        app.setStyle("Fusion")
-
-        # Dark palette
-        dark_palette = QPalette()
-        dark_palette.setColor(QPalette.Window, Qt.black)
-        dark_palette.setColor(QPalette.WindowText, Qt.white)
-        dark_palette.setColor(QPalette.Base, QColor(53, 53, 53))
-        dark_palette.setColor(QPalette.AlternateBase, QColor(35, 35, 35))
-        dark_palette.setColor(QPalette.ToolTipBase, Qt.white)
-        dark_palette.setColor(QPalette.ToolTipText, Qt.white)
-        dark_palette.setColor(QPalette.Text, Qt.white)
-        dark_palette.setColor(QPalette.Button, QColor(53, 53, 53))
-        dark_palette.setColor(QPalette.ButtonText, Qt.white)
-        dark_palette.setColor(QPalette.BrightText, Qt.red)
-        dark_palette.setColor(QPalette.Link, QColor(42, 130, 218))
-        dark_palette.setColor(QPalette.Highlight, QColor(42, 130, 218))
-        dark_palette.setColor(QPalette.HighlightedText, Qt.black)
-
-        app.setPalette(dark_palette)
-
-        # Set the font for all widgets to improve readability
-        app_font = QFont("Arial", 10)
-        app.setFont(app_font)
-
-    def closeEvent(self, event):
-        self.save_leads_data()
-        event.accept()
-
-class TabWidget(QWidget):
-    def __init__(self, parent, db_connection):
-        super().__init__()
-
-        self.db_connection = db_connection
-
-        self.tabs = QTabWidget(self)
-
-        self.contractor_input_tab = ContractorInputTab(self, self.db_connection)
-        self.leads_table_tab = LeadsTableTab(self.db_connection)
-        self.calendar_tab = CalendarTab(self.db_connection)
-        self.calls_tab = ComingSoonTab()
-        self.email_tab = QTabWidget()
-        self.email_gmail_tab = ComingSoonTab()
-        self.email_smtp_tab = ComingSoonTab()
-        self.messaging_tab = QTabWidget()
-        self.messaging_twilio_tab = ComingSoonTab()
-        self.forms_tab = QTabWidget()
-        self.forms_my_forms_tab = ComingSoonTab()
-        self.forms_create_tab = ComingSoonTab()
-        self.forms_embed_tab = ComingSoonTab()
-        self.forms_settings_tab = ComingSoonTab()
-        self.integrations_tab = IntegrationsTab()
-        self.integratoins_twilio_tab = TwilioIntegrationTab()
-        self.settings_tab = ComingSoonTab()
-
-        self.email_tab.addTab(self.email_gmail_tab, "Gmail")
-        self.email_tab.addTab(self.email_smtp_tab, "SMTP")
-
-        self.messaging_tab.addTab(self.messaging_twilio_tab, "Twilio")
-
-        self.forms_tab.addTab(self.forms_my_forms_tab, "My Forms")
-        self.forms_tab.addTab(self.forms_create_tab, "Create")
-        self.forms_tab.addTab(self.forms_embed_tab, "Embed")
-        self.forms_tab.addTab(self.forms_settings_tab, "Settings")
-
-        self.tabs.addTab(self.contractor_input_tab, "Contractor Leads Input")
-        self.tabs.addTab(self.leads_table_tab, "Leads Table View")
-        self.tabs.addTab(self.calendar_tab, "Calendar")
-        self.tabs.addTab(self.calls_tab, "Calls")
-        self.tabs.addTab(self.email_tab, "Email")
-        self.tabs.addTab(self.messaging_tab, "Messaging")
-        self.tabs.addTab(self.forms_tab, "Forms")
-
-        self.tabs.addTab(self.integrations_tab, "Integrations")
-
-
-        self.tabs.addTab(self.settings_tab, "Settings")
-
-        layout = QVBoxLayout()
-        layout.addWidget(self.tabs)
-        self.setLayout(layout)
-
-class ContractorInputTab(QWidget):
-    def __init__(self, db_connection, parent):
-        super().__init__()
-
-        self.db_connection = db_connection
-        self.parent = parent
-
-        self.first_name_label = QLabel("First Name:")
-        self.first_name_input = QLineEdit()
-
-        self.last_name_label = QLabel("Last Name:")
-        self.last_name_input = QLineEdit()
-
-        self.address_line1_label = QLabel("Address Line 1:")
-        self.address_line1_input = QLineEdit()
-
-        self.address_line2_label = QLabel("Address Line 2:")
-        self.address_line2_input = QLineEdit()
-
-        self.city_label = QLabel("City:")
-        self.city_input = QLineEdit()
-
-        self.state_label = QLabel("State:")
-        self.state_input = QLineEdit()
-
-        self.zipcode_label = QLabel("Zipcode:")
-        self.zipcode_input = QLineEdit()
-
-        self.phone_label = QLabel("Phone Number:")
-        self.phone_input = QLineEdit()
-
-        self.email_label = QLabel("Email:")
-        self.email_input = QLineEdit()
-
-        self.notes_label = QLabel("Notes:")
-        self.notes_input = QTextEdit()
-
-        self.referred_by_label = QLabel("Referred By:")
-        self.referred_by_input = QLineEdit()
-        
-        self.job_type_label = QLabel("Job Type:")
-        self.job_type_dropdown = QComboBox()
-        self.job_type_dropdown.addItems(["Residential", "Commercial", "Unknown"])
-        
-        self.submit_button = QPushButton("Submit")
-        self.submit_button.clicked.connect(self.add_lead)  # Connect to the add_lead method
-
-    def setup_ui(self):
-        layout = QVBoxLayout()
-        layout.addWidget(self.first_name_label)
-        layout.addWidget(self.first_name_input)
-        layout.addWidget(self.last_name_label)
-        layout.addWidget(self.last_name_input)
-        layout.addWidget(self.address_line1_label)
-        layout.addWidget(self.address_line1_input)
-        layout.addWidget(self.address_line2_label)
-        layout.addWidget(self.address_line2_input)
-        layout.addWidget(self.city_label)
-        layout.addWidget(self.city_input)
-        layout.addWidget(self.state_label)
-        layout.addWidget(self.state_input)
-        layout.addWidget(self.zipcode_label)
-        layout.addWidget(self.zipcode_input)
-        layout.addWidget(self.phone_label)
-        layout.addWidget(self.phone_input)
-        layout.addWidget(self.email_label)
-        layout.addWidget(self.email_input)
-        layout.addWidget(self.notes_label)
-        layout.addWidget(self.notes_input)
-        layout.addWidget(self.referred_by_label)
-        layout.addWidget(self.referred_by_input)
-        layout.addWidget(self.job_type_label)
-        layout.addWidget(self.job_type_dropdown)
-        layout.addWidget(self.submit_button)
-
-        self.setLayout(layout)
-
-        # Create the central widget and layout
-        self.central_widget = QWidget(self)
-
-        self.setup_ui()
-
-        # Initialize and connect to the SQLite database
-        self.connection = sqlite3.connect('leads_database.db')
-        self.cursor = self.connection.cursor()
-        self.cursor.execute('''
-            CREATE TABLE IF NOT EXISTS leads (
-                id INTEGER PRIMARY KEY,
-                first_name TEXT,
-                last_name TEXT,
-                address_line1 TEXT,
-                address_line2 TEXT,
-                city TEXT,
-                state TEXT,
-                zipcode TEXT,
-                phone TEXT,
-                email TEXT,
-                notes TEXT,
-                referred_by TEXT,
-                job_type TEXT,
-                lead_status TEXT
-            )
-        ''')
-        self.connection.commit()
-
-    def add_lead(self):
-        # Collect data from input fields
-        first_name = self.first_name_input.text()
-        last_name = self.last_name_input.text()
-        address_line1 = self.address_line1_input.text()
-        address_line2 = self.address_line2_input.text()
-        city = self.city_input.text()
-        state = self.state_input.text()
-        zipcode = self.zipcode_input.text()
-        phone = self.phone_input.text()
-        email = self.email_input.text()
-        notes = self.notes_input.toPlainText()
-        referred_by = self.referred_by_input.text()
-        job_type = self.job_type_dropdown.currentText()
-
-        # Insert data into the SQLite database
-        self.cursor.execute('''
-            INSERT INTO leads (first_name, last_name, address_line1, address_line2, city, state, zipcode, phone, email, notes, referred_by, job_type, lead_status)
-            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-        ''', (first_name, last_name, address_line1, address_line2, city, state, zipcode, phone, email, notes, referred_by, job_type, "In System"))
-        self.connection.commit()
-
-        # Clear input fields after adding the lead
-        self.clear_input_fields()
-
-        # Refresh the leads table in the parent TabWidget
-        self.parent.leads_table_tab.populate_table()
-
-    def clear_input_fields(self):
-        # Clear all input fields
-        self.first_name_input.clear()
-        self.last_name_input.clear()
-        self.address_line1_input.clear()
-        self.address_line2_input.clear()
-        self.city_input.clear()
-        self.state_input.clear()
-        self.zipcode_input.clear()
-        self.phone_input.clear()
-        self.email_input.clear()
-        self.notes_input.clear()
-        self.referred_by_input.clear()
-        self.job_type_dropdown.setCurrentIndex(0)
-
-class CustomDelegate(QStyledItemDelegate):
-    def createEditor(self, parent, option, index):
-        editor = super().createEditor(parent, option, index)
-        if isinstance(editor, QLineEdit):
-            editor.editingFinished.connect(lambda: self.commitData.emit(editor))
-        elif isinstance(editor, QComboBox):
-            editor.currentIndexChanged.connect(lambda: self.commitData.emit(editor))
-        return editor
-        
-class LeadsTableTab(QWidget):
-    def __init__(self, db_connection):
-        super().__init__()
-
-        self.db_connection = db_connection  # Store the db_connection
-
-        self.table = QTableWidget(self)
-        self.table.setColumnCount(15)  # Adjusted to accommodate the new columns
-        self.table.setHorizontalHeaderLabels(
-            ["Lead Status", "First Name", "Last Name", "Address Line 1", "Address Line 2", "City", "State", "Zipcode",
-             "Phone", "Email", "Notes", "Job Type", "Referred By", "Referred To", "Actions"])  # Adjusted headers
-        self.table.horizontalHeader().setSectionResizeMode(QHeaderView.Stretch)
-
-
-        # Apply custom delegate to handle editing of cell widgets
-        delegate = CustomDelegate()
-        self.table.setItemDelegate(delegate)
-        
-        # Create the refresh button
-        self.refresh_button = QPushButton("Refresh")
-        self.refresh_button.clicked.connect(self.populate_table)
-
-        # Create the export buttons
-        self.export_csv_button = QPushButton("Export to CSV")
-        self.export_csv_button.clicked.connect(self.export_to_csv)
-        self.export_pdf_button = QPushButton("Export to PDF")
-        self.export_pdf_button.clicked.connect(self.export_to_pdf)
-        self.export_txt_button = QPushButton("Export to TXT")
-        self.export_txt_button.clicked.connect(self.export_to_txt)
-
-        # Create the toggle edit mode button
-        self.toggle_edit_button = QPushButton("Toggle Edit Mode")
-        self.toggle_edit_button.clicked.connect(self.toggle_edit_mode)
-
-        # Modify the button sizes here
-        button_width = 120
-        button_height = 30
-
-        # Set fixed sizes for the buttons
-        self.refresh_button.setFixedSize(button_width, button_height)
-        self.export_csv_button.setFixedSize(button_width, button_height)
-        self.export_pdf_button.setFixedSize(button_width, button_height)
-        self.export_txt_button.setFixedSize(button_width, button_height)
-        self.toggle_edit_button.setFixedSize(button_width, button_height)
-
-        # Create a layout for the export buttons
-        export_button_layout = QVBoxLayout()
-        export_button_layout.addWidget(self.export_csv_button)
-        export_button_layout.addWidget(self.export_pdf_button)
-        export_button_layout.addWidget(self.export_txt_button)
-
-        # Create a layout for the buttons and set alignment
-        button_layout = QVBoxLayout()
-        button_layout.addWidget(self.refresh_button)
-        button_layout.addLayout(export_button_layout)
-        button_layout.addWidget(self.toggle_edit_button)
-        button_layout.setAlignment(Qt.AlignCenter)  # Center-align the buttons vertically
-
-        # Create the main layout for the tab
-        layout = QVBoxLayout()
-        layout.addWidget(self.table)
-        layout.addLayout(button_layout)  # Add the button layout to the main layout
-
-        self.setLayout(layout)
-
-        self.populate_table()
-
-
-    def toggle_edit_mode(self):
-        self.edit_mode = not getattr(self, "edit_mode", False)
-        
-        for row in range(self.table.rowCount()):
-            for col in range(1, self.table.columnCount() - 1):
-                item = self.table.cellWidget(row, col)
-                if isinstance(item, QLineEdit):
-                    item.setReadOnly(not self.edit_mode)
-        
-        self.toggle_edit_button.setText("Editing Enabled" if self.edit_mode else "Editing Disabled")
-
-    def createEditor(self, parent, option, index):
-        if not self.edit_mode:
-            QMessageBox.warning(self, "Editing Mode Off", "Editing must be enabled to edit cell data.")
-            return None
-
-        editor = super().createEditor(parent, option, index)
-        if isinstance(editor, QLineEdit):
-            editor.editingFinished.connect(lambda: self.commitData.emit(editor))
-        elif isinstance(editor, QComboBox):
-            editor.currentIndexChanged.connect(lambda: self.commitData.emit(editor))
-        return editor
-
-    def populate_table(self):
-        # Create the mapping of status indices to status strings
-        status_mapping = {
-            0: "In System",
-            1: "Good Lead",
-            2: "Contact Later",
-            3: "Bad Lead",
-            4: "Passed Along",
-            5: "Closed"
-        }
-
-        # Fetch leads data from the SQLite database using self.db_connection
-        self.cursor = self.db_connection.cursor()
-        self.cursor.execute("SELECT * FROM leads")
-        leads_data = self.cursor.fetchall()
-
-        for row, lead in enumerate(leads_data):
-            # Status Combo Box
-            status_combo = QComboBox()
-            status_combo.addItems(status_mapping.values())
-            current_status_index = lead[0]  # Replace 0 with the actual index of "Lead Status" field
-            current_status = status_mapping.get(current_status_index, "Unknown Status")
-            status_combo.setCurrentText(current_status)
-
-            # First Name, Last Name
-            first_name_input = QLineEdit(lead.get("First Name", ""))
-            first_name_input.editingFinished.connect(lambda r=row, input_field=first_name_input: self.first_name_changed(r, input_field.text()))
-            self.table.setCellWidget(row, 1, first_name_input)
-
-            last_name_input = QLineEdit(lead.get("Last Name", ""))
-            last_name_input.editingFinished.connect(lambda r=row, input_field=last_name_input: self.last_name_changed(r, input_field.text()))
-            self.table.setCellWidget(row, 2, last_name_input)
-
-            # Address Inputs
-            address_line1_input = QLineEdit(lead.get("Address Line 1", ""))
-            address_line1_input.editingFinished.connect(lambda r=row, input_field=address_line1_input: self.address_line1_changed(r, input_field.text()))
-            self.table.setCellWidget(row, 3, address_line1_input)
-
-            address_line2_input = QLineEdit(lead.get("Address Line 2", ""))
-            address_line2_input.editingFinished.connect(lambda r=row, input_field=address_line2_input: self.address_line2_changed(r, input_field.text()))
-            self.table.setCellWidget(row, 4, address_line2_input)
-
-            city_input = QLineEdit(lead.get("City", ""))
-            city_input.editingFinished.connect(lambda r=row, input_field=city_input: self.city_changed(r, input_field.text()))
-            self.table.setCellWidget(row, 5, city_input)
-
-            state_input = QLineEdit(lead.get("State", ""))
-            state_input.editingFinished.connect(lambda r=row, input_field=state_input: self.state_changed(r, input_field.text()))
-            self.table.setCellWidget(row, 6, state_input)
-
-            zipcode_input = QLineEdit(lead.get("Zipcode", ""))
-            zipcode_input.editingFinished.connect(lambda r=row, input_field=zipcode_input: self.zipcode_changed(r, input_field.text()))
-            self.table.setCellWidget(row, 7, zipcode_input)
-
-            phone_input = QLineEdit(lead["Phone"])
-            phone_input.editingFinished.connect(lambda r=row, input_field=phone_input: self.input_field_changed(r, "Phone", input_field.text()))
-            self.table.setCellWidget(row, 8, phone_input)
-
-            email_input = QLineEdit(lead["Email"])
-            email_input.editingFinished.connect(lambda r=row, input_field=email_input: self.input_field_changed(r, "Email", input_field.text()))
-            self.table.setCellWidget(row, 9, email_input)
-            
-            # Notes
-            notes_input = QLineEdit(lead["Notes"])
-            self.table.setCellWidget(row, 10, notes_input)
-
-            #Type, Referred to/by
-            self.table.setItem(row, 11, QTableWidgetItem(lead["Job Type"]))
-            self.table.setItem(row, 12, QTableWidgetItem(lead["Referred By"]))
-            self.table.setItem(row, 13, QTableWidgetItem(lead.get("Referred To", "")))
-
-            # Job Type Combo Box
-            job_type_combo = QComboBox()
-            job_type_combo.addItems(["Residential", "Commercial", "Other"])
-            current_job_type = lead["other"]  # Replace <index_of_job_type_field> with the actual index of "Job Type" field
-            job_type_combo.setCurrentText(current_job_type)
-            job_type_combo.currentTextChanged.connect(lambda text, r=row: self.job_type_changed(r, text))
-            self.table.setCellWidget(row, 11, job_type_combo)
-
-            # Referred By, Referred To
-            referred_by_input = QLineEdit(lead.get("Referred By", ""))
-            referred_by_input.textChanged.connect(lambda text, r=row: self.referred_by_changed(r, text))
-            self.table.setCellWidget(row, 12, referred_by_input)
-            referred_to_input = QLineEdit(lead.get("Referred To", ""))
-            referred_to_input.textChanged.connect(lambda text, r=row: self.referred_to_changed(r, text))
-            self.table.setCellWidget(row, 13, referred_to_input)
-
-            # Delete Button
-            delete_button = QPushButton("Delete")
-            delete_button.clicked.connect(lambda _, r=row: self.delete_lead(r))
-            self.table.setCellWidget(row, 14, delete_button)
-
-            # Connect input field changes to corresponding functions
-            referred_by_input.textChanged.connect(lambda text, r=row: self.input_field_changed(r, "Referred By", text))
-            referred_to_input.textChanged.connect(lambda text, r=row: self.input_field_changed(r, "Referred To", text))
-                
-    def input_field_changed(self, row, field_name, new_value):
-        self.leads_list[row][field_name] = new_value
-
-    def status_changed(self, row, text):
-        self.leads_list[row]["Lead Status"] = text
-
-    def first_name_changed(self, row, text):
-        self.leads_list[row]["First Name"] = text
-
-    def last_name_changed(self, row, text):
-        self.leads_list[row]["Last Name"] = text
-        
-    def address_changed(self, row, text):
-        self.leads_list[row]["Address"] = text
-        
-    def phone_changed(self, row, text):
-        self.leads_list[row]["Phone"] = text
-        
-    def email_changed(self, row, text):
-        self.leads_list[row]["Email"] = text
-        
-    def notes_changed(self, row, text):
-        self.leads_list[row]["Notes"] = text
-        
-    def referred_by_changed(self, row, text):
-        self.leads_list[row]["Referred By"] = text
-
-    def referred_to_changed(self, row, text):
-        self.leads_list[row]["Referred To"] = text
-        
-    def export_to_csv(self):
-        options = QFileDialog.Options()
-        options |= QFileDialog.DontUseNativeDialog
-        file_name, _ = QFileDialog.getSaveFileName(self, "Export to CSV", "", "CSV Files (*.csv);;All Files (*)", options=options)
-        if file_name:
-            with open(file_name, "w", newline="") as csvfile:
-                writer = csv.writer(csvfile)
-                # Write the header
-                writer.writerow(["Name", "Address", "Phone", "Email", "Notes", "Job Type"])
-                # Write the data
-                for lead in self.leads_list:
-                    writer.writerow([lead["Name"], lead["Address"], lead["Phone"], lead["Email"], lead["Notes"], lead["Job Type"]])
-
-    def export_to_pdf(self):
-        options = QFileDialog.Options()
-        options |= QFileDialog.DontUseNativeDialog
-        file_name, _ = QFileDialog.getSaveFileName(self, "Export to PDF", "", "PDF Files (*.pdf);;All Files (*)", options=options)
-        if file_name:
-            doc = SimpleDocTemplate(file_name, pagesize=letter)
-            elements = []
-            data = [["Name", "Address", "Phone", "Email", "Notes", "Job Type"]]
-            for lead in self.leads_list:
-                data.append([lead["Name"], lead["Address"], lead["Phone"], lead["Email"], lead["Notes"], lead["Job Type"]])
-            t = Table(data)
-            t.setStyle(TableStyle([('BACKGROUND', (0, 0), (-1, 0), colors.grey),
-                                   ('TEXTCOLOR', (0, 0), (-1, 0), colors.whitesmoke),
-                                   ('ALIGN', (0, 0), (-1, -1), 'CENTER'),
-                                   ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
-                                   ('BOTTOMPADDING', (0, 0), (-1, 0), 12),
-                                   ('BACKGROUND', (0, 1), (-1, -1), colors.beige),
-                                   ('GRID', (0, 0), (-1, -1), 1, colors.black)]))
-            elements.append(t)
-            doc.build(elements)
-
-    def export_to_txt(self):
-        options = QFileDialog.Options()
-        options |= QFileDialog.DontUseNativeDialog
-        file_name, _ = QFileDialog.getSaveFileName(self, "Export to TXT", "", "Text Files (*.txt);;All Files (*)", options=options)
-        if file_name:
-            with open(file_name, "w") as file:
-                for lead in self.leads_list:
-                    file.write(f"Name: {lead['Name']}\n")
-                    file.write(f"Address: {lead['Address']}\n")
-                    file.write(f"Phone: {lead['Phone']}\n")
-                    file.write(f"Email: {lead['Email']}\n")
-                    file.write(f"Notes: {lead['Notes']}\n")
-                    file.write(f"Job Type: {lead['Job Type']}\n")
-                    file.write("\n")
-
-    def delete_lead(self, row):
-        confirmation = QMessageBox.question(
-            self, "Confirm Deletion",
-            "Are you sure you want to delete this lead?",
-            QMessageBox.Yes | QMessageBox.No, QMessageBox.No
-        )
-        
-        if confirmation == QMessageBox.Yes:
-            del self.leads_list[row]
-            self.populate_table()  # Refresh the table
-
-    def job_type_changed(self, row, text):
-        self.leads_list[row]["Job Type"] = text
-
-class CalendarTab(QWidget):
-    def __init__(self, db_connection):
-        super().__init__()
-
-        self.db_connection = db_connection
-
-        self.tab_widget = QTabWidget(self)
-        self.offline_calendar_tab = OfflineCalendarTab(self.db_connection)
-        self.google_calendar_tab = GoogleCalendarTab()
-        self.calendly_tab = CalendlyTab()
-        
-        self.tab_widget.addTab(self.offline_calendar_tab, "Offline Calendar")
-        self.tab_widget.addTab(self.google_calendar_tab, "Google Calendar")
-        self.tab_widget.addTab(self.calendly_tab, "Calendly")
-
-        layout = QVBoxLayout()
-        layout.addWidget(self.tab_widget)
-        self.setLayout(layout)
-
-class OfflineCalendarTab(QWidget):
-    def __init__(self, db_connection):
-        super().__init__()
-
-        self.db_connection = db_connection
-
-        self.calendar = QCalendarWidget(self)
-        self.calendar.selectionChanged.connect(self.populate_notes)
-
-        self.notes_input = QTextEdit()
-
-        self.refresh_button = QPushButton("Refresh")
-        self.refresh_button.clicked.connect(self.populate_notes)
-
-        self.save_button = QPushButton("Save Notes")
-        self.save_button.clicked.connect(self.save_notes)
-
-        layout = QVBoxLayout()
-        layout.addWidget(self.calendar)
-        layout.addWidget(self.notes_input)
-        layout.addWidget(self.refresh_button)
-        layout.addWidget(self.save_button)
-        self.setLayout(layout)
-
-        self.populate_notes()
-
-    def populate_notes(self):
-        selected_date = self.calendar.selectedDate().toString("yyyy-MM-dd")
-        notes = self.get_notes(selected_date)
-        self.notes_input.setPlainText(notes)
-
-    def get_notes(self, date):
-        try:
-            cursor = self.db_connection.cursor()
-            cursor.execute("SELECT Notes FROM Calendar WHERE Date = ?", (date,))
-            result = cursor.fetchone()
-            return result[0] if result else ""
-        except sqlite3.Error as e:
-            print(e)
-            return ""
-
-    def save_notes(self):
-        selected_date = self.calendar.selectedDate().toString("yyyy-MM-dd")
-        notes = self.notes_input.toPlainText()
-        try:
-            cursor = self.db_connection.cursor()
-            cursor.execute("INSERT OR REPLACE INTO Calendar (Date, Notes) VALUES (?, ?)", (selected_date, notes))
-            self.db_connection.commit()
-        except sqlite3.Error as e:
-            print(e)
-
-class GoogleCalendarTab(QWidget):
-    def __init__(self):
-        super().__init__()
-
-        self.label = QLabel("Google Calendar - Coming Soon")
-        self.label.setAlignment(Qt.AlignCenter)
-
-        layout = QVBoxLayout()
-        layout.addWidget(self.label)
-        self.setLayout(layout)
-
-class CalendlyTab(QWidget):
-    def __init__(self):
-        super().__init__()
-
-        self.label = QLabel("Calendly - Coming Soon")
-        self.label.setAlignment(Qt.AlignCenter)
-
-        layout = QVBoxLayout()
-        layout.addWidget(self.label)
-        self.setLayout(layout)
-
-class IntegrationsTab(QWidget):
-    def __init__(self):
-        super().__init__()
-
-        self.tabs = QTabWidget(self)
-
-        self.twilio_integration_tab = TwilioIntegrationTab()
-        self.google_integration_tab = GoogleIntegrationTab()  # Create a class for Google Integration
-        self.zapier_integration_tab = ZapierIntegrationTab()  # Create a class for Zapier Integration
-
-        self.tabs.addTab(self.twilio_integration_tab, "Twilio")
-        self.tabs.addTab(self.google_integration_tab, "Google")
-        self.tabs.addTab(self.zapier_integration_tab, "Zapier")
-
-        layout = QVBoxLayout()
-        layout.addWidget(self.tabs)
-        self.setLayout(layout)
-
-class TwilioIntegrationTab(QWidget):
-    def __init__(self):
-        super().__init__()
-
-        # Create a group box for the Twilio integration section
-        self.group_box = QGroupBox("Twilio Integration")
-        
-        self.twilio_sid_input = QLineEdit()
-        self.twilio_auth_token_input = QLineEdit()
-        self.load_twilio_credentials()
-
-        self.save_button = QPushButton("Save Twilio Credentials")
-        self.save_button.clicked.connect(self.save_twilio_credentials)
-
-        # Create a grid layout for the group box
-        layout = QGridLayout()
-        layout.addWidget(QLabel("Twilio SID:"), 0, 0)
-        layout.addWidget(self.twilio_sid_input, 0, 1)
-        layout.addWidget(QLabel("Twilio Auth Token:"), 1, 0)
-        layout.addWidget(self.twilio_auth_token_input, 1, 1)
-        layout.addWidget(self.save_button, 2, 0, 1, 2, alignment=Qt.AlignCenter)
-        
-        self.group_box.setLayout(layout)
-        
-        # Create a layout for the whole tab
-        main_layout = QVBoxLayout()
-        main_layout.addWidget(self.group_box)
-        self.setLayout(main_layout)
-
-    def load_twilio_credentials(self):
-        connection = create_connection("twilio_credentials.db")
-        if connection:
-            cursor = connection.cursor()
-            cursor.execute("CREATE TABLE IF NOT EXISTS TwilioCredentials (SID TEXT, AuthToken TEXT)")
-            cursor.execute("SELECT * FROM TwilioCredentials LIMIT 1")
-            result = cursor.fetchone()
-            if result:
-                self.twilio_sid_input.setText(result[0])
-                self.twilio_auth_token_input.setText(result[1])
-            connection.close()
-
-    def save_twilio_credentials(self):
-        twilio_sid = self.twilio_sid_input.text()
-        twilio_auth_token = self.twilio_auth_token_input.text()
-        self.save_credentials_to_database(twilio_sid, twilio_auth_token)
-
-    def save_credentials_to_database(self, twilio_sid, twilio_auth_token):
-        connection = create_connection("twilio_credentials.db")
-        if connection:
-            cursor = connection.cursor()
-            cursor.execute("CREATE TABLE IF NOT EXISTS TwilioCredentials (SID TEXT, AuthToken TEXT)")
-            cursor.execute("DELETE FROM TwilioCredentials")
-            cursor.execute("INSERT INTO TwilioCredentials (SID, AuthToken) VALUES (?, ?)", (twilio_sid, twilio_auth_token))
-            connection.commit()
-            connection.close()
-
-class GoogleIntegrationTab(QWidget):
-    def __init__(self):
-        super().__init__()
-
-        self.label = QLabel("Google Integration - Coming Soon")
-        self.label.setAlignment(Qt.AlignCenter)
-
-        layout = QVBoxLayout()
-        layout.addWidget(self.label)
-        self.setLayout(layout)
-
-class ZapierIntegrationTab(QWidget):
-    def __init__(self):
-        super().__init__()
-
-        self.label = QLabel("Zapier Integration - Coming Soon")
-        self.label.setAlignment(Qt.AlignCenter)
-
-        layout = QVBoxLayout()
-        layout.addWidget(self.label)
-        self.setLayout(layout)
-
-class ComingSoonTab(QWidget):
-    def __init__(self):
-        super().__init__()
-        self.label = QLabel("Coming Soon")
-        self.label.setAlignment(Qt.AlignCenter)
-        layout = QVBoxLayout()
-        layout.addWidget(self.label)
-        self.setLayout(layout)
-        
-if __name__ == "__main__":
-    app = QApplication(sys.argv)
-    db_connection = sqlite3.connect('leads_database.db')
-    window = ContractorLeadsApp()
-    window.show()
-    sys.exit(app.exec_())
+import sys
+import time
+
+# Taken before the heavy imports below so --profile-startup can report them
+STARTUP_STARTED = time.perf_counter()
+
+if __name__ == "__main__" and "--check-env" in sys.argv[1:]:
+    # The preflight check runs before PyQt5 is imported so it can report a broken install
+    import preflight
+    sys.exit(preflight.main(sys.argv[1:]))
+
+import json
+import os
+import csv
+import functools
+import threading
+from array import array
+from bisect import bisect_left
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from PyQt5.QtWidgets import QApplication, QMainWindow, QWidget, QVBoxLayout, QHBoxLayout, QLabel, QLineEdit, QTextEdit, QPushButton, QTableWidget, QTableWidgetItem, QHeaderView, QComboBox, QTabWidget, QFileDialog
+from PyQt5.QtWidgets import QTableView, QStyle, QStyleOptionButton, QProgressDialog
+from PyQt5.QtGui import QFont, QPalette, QColor, QPixmap, QTextCharFormat
+from PyQt5.QtCore import Qt, QDate, QDateTime, QObject, QThread, QTimer, QAbstractTableModel, QModelIndex, QEvent, pyqtSignal
+from PyQt5.QtWidgets import QStyledItemDelegate
+from PyQt5.QtWidgets import QMessageBox
+from PyQt5.QtWidgets import QCalendarWidget, QVBoxLayout, QPushButton
+from PyQt5.QtWidgets import QTabWidget
+from PyQt5.QtWidgets import QGroupBox, QGridLayout
+from PyQt5.QtWidgets import QDialog, QListWidget, QDateTimeEdit, QCheckBox
+import sqlite3
+import database
+from database import LEADS_DATABASE, CALENDAR_DATABASE, TWILIO_DATABASE, EMAIL_DATABASE
+import appointments
+import geo
+import lead_dedupe
+import lead_import
+import lead_query
+import leads
+import migrations
+
+class StartupProfile:
+    """Wall-clock time spent in each phase of startup, printed with --profile-startup."""
+    def __init__(self, started):
+        self.last = started
+        self.started = started
+        self.phases = []
+
+    def mark(self, phase):
+        now = time.perf_counter()
+        self.phases.append((phase, now - self.last))
+        self.last = now
+
+    def report(self, file=sys.stderr):
+        for phase, seconds in self.phases:
+            print(f"{phase:<24}{seconds * 1000:8.1f} ms", file=file)
+        print(f"{'total':<24}{(self.last - self.started) * 1000:8.1f} ms", file=file)
+
+
+startup_profile = StartupProfile(STARTUP_STARTED)
+
+# Mapping of the status indices stored in leads.lead_status to status strings
+STATUS_MAPPING = dict(enumerate(leads.LEAD_STATUSES))
+
+JOB_TYPES = list(leads.JOB_TYPES)
+
+# (header, leads column) for each column of the leads grid, in display order
+LEAD_COLUMNS = [
+    ("Lead Status", "lead_status"),
+    ("First Name", "first_name"),
+    ("Last Name", "last_name"),
+    ("Address Line 1", "address_line1"),
+    ("Address Line 2", "address_line2"),
+    ("City", "city"),
+    ("State", "state"),
+    ("Zipcode", "zipcode"),
+    ("Phone", "phone"),
+    ("Email", "email"),
+    ("Notes", "notes"),
+    ("Job Type", "job_type"),
+    ("Referred By", "referred_by"),
+    ("Referred To", "referred_to"),
+]
+
+STATUS_COLUMN = [column for _, column in LEAD_COLUMNS].index("lead_status")
+
+BLANK_LEAD = leads.Lead(*[None] * len(leads.LEAD_FIELDS))
+
+# Columns a grid sort keeps: the one clicked last, then the ones clicked before it
+SORT_KEYS = 3
+
+# How long grid edits wait for typing to pause before they are written
+EDIT_FLUSH_DELAY_MS = 1000
+
+# Months of calendar notes kept in memory; the visible month and the two beside it are always loaded
+CALENDAR_CACHED_MONTHS = 12
+
+# Radius the Nearby Leads dialog starts with, and how many of the nearest leads it lists
+NEARBY_MILES = 15
+NEARBY_SHOWN = 1000
+
+# New leads from the form server reach the grid and dashboard at most this often
+FORM_NOTIFY_INTERVAL_MS = 250
+
+class ContractorLeadsApp(QMainWindow):
+    def __init__(self):
+        super().__init__()
+        self.setWindowTitle("Contractor Leads Database by REA")
+        self.setGeometry(100, 100, 1600, 800)
+
+        # Bring every database's schema up to date before any tab touches it
+        migrations.migrate_all()
+        startup_profile.mark("migrations")
+
+        self.central_widget = QWidget(self)
+        self.setCentralWidget(self.central_widget)
+
+        # Every tab shares the pooled connections for the leads database
+        leads_db = database.get_database(LEADS_DATABASE)
+
+        self.setup_ui(leads_db)
+        startup_profile.mark("build window")
+
+    def setup_ui(self, leads_db):
+        self.tabs = TabWidget(self, leads_db)
+        self.logo_label = QLabel()
+        self.logo_pixmap = QPixmap("logo.png")
+        self.logo_pixmap = self.logo_pixmap.scaledToWidth(150, Qt.SmoothTransformation)
+        self.logo_label.setPixmap(self.logo_pixmap)
+        self.logo_label.setAlignment(Qt.AlignCenter)
+
+        layout = QVBoxLayout()
+        layout.addWidget(self.logo_label)
+        layout.addWidget(self.tabs)
+        self.central_widget.setLayout(layout)
+
+        self.set_dark_theme()
+
+    def set_dark_theme(self):
+        app = QApplication.instance()
+        app.setStyle("Fusion")
+
+        # Dark palette
+        dark_palette = QPalette()
+        dark_palette.setColor(QPalette.Window, Qt.black)
+        dark_palette.setColor(QPalette.WindowText, Qt.white)
+        dark_palette.setColor(QPalette.Base, QColor(53, 53, 53))
+        dark_palette.setColor(QPalette.AlternateBase, QColor(35, 35, 35))
+        dark_palette.setColor(QPalette.ToolTipBase, Qt.white)
+        dark_palette.setColor(QPalette.ToolTipText, Qt.white)
+        dark_palette.setColor(QPalette.Text, Qt.white)
+        dark_palette.setColor(QPalette.Button, QColor(53, 53, 53))
+        dark_palette.setColor(QPalette.ButtonText, Qt.white)
+        dark_palette.setColor(QPalette.BrightText, Qt.red)
+        dark_palette.setColor(QPalette.Link, QColor(42, 130, 218))
+        dark_palette.setColor(QPalette.Highlight, QColor(42, 130, 218))
+        dark_palette.setColor(QPalette.HighlightedText, Qt.black)
+
+        app.setPalette(dark_palette)
+
+        # Set the font for all widgets to improve readability
+        app_font = QFont("Arial", 10)
+        app.setFont(app_font)
+
+    def closeEvent(self, event):
+        # Write any grid edits still waiting in the journal before the window goes away
+        self.tabs.lead_repository.flush_edits(wait=True)
+        # Let running campaigns finish the messages in flight; the rest stays queued
+        if self.tabs.email_tab.widget is not None:
+            self.tabs.email_tab.widget.campaigns_tab.stop_sending(wait=True)
+        if self.tabs.messaging_tab.widget is not None:
+            self.tabs.messaging_tab.widget.stop_sending(wait=True)
+        # The form server writes what it has queued before it stops
+        if self.tabs.forms_tab.widget is not None:
+            self.tabs.forms_tab.widget.stop_server(wait=True)
+        event.accept()
+
+class TabWidget(QWidget):
+    def __init__(self, parent, leads_db):
+        super().__init__()
+
+        self.leads_db = leads_db
+        self.lead_repository = LeadRepository(self.leads_db, self)
+
+        self.tabs = QTabWidget(self)
+
+        # The input tab is what the window opens on; every other tab is built the first time it is shown.
+        # The Email, Messaging and Forms tabs import email_queue, sms_queue and form_intake in the
+        # methods that use them, which keeps asyncio, smtplib and ssl out of startup.
+        self.contractor_input_tab = ContractorInputTab(self, self.leads_db, self.lead_repository)
+        self.tabs.addTab(self.contractor_input_tab, "Contractor Leads Input")
+        self.leads_table_tab = self.add_lazy_tab(lambda: LeadsTableTab(self.lead_repository), "Leads Table View")
+        self.calendar_tab = self.add_lazy_tab(
+            lambda: CalendarTab(database.get_database(CALENDAR_DATABASE), self.lead_repository), "Calendar")
+        self.dashboard_tab = self.add_lazy_tab(lambda: DashboardTab(self.lead_repository), "Dashboard")
+        self.calls_tab = self.add_lazy_tab(ComingSoonTab, "Calls")
+        self.email_tab = self.add_lazy_tab(lambda: EmailTab(self.lead_repository), "Email")
+        self.messaging_tab = self.add_lazy_tab(lambda: MessagingTab(self.lead_repository), "Messaging")
+        self.forms_tab = self.add_lazy_tab(lambda: FormsTab(self.lead_repository), "Forms")
+        self.integrations_tab = self.add_lazy_tab(IntegrationsTab, "Integrations")
+        self.settings_tab = self.add_lazy_tab(ComingSoonTab, "Settings")
+
+        self.tabs.currentChanged.connect(self.tab_changed)
+
+        # Key leads for duplicate checks in the background, e.g. the whole table after an upgrade
+        self.lead_repository.index_duplicates()
+
+        layout = QVBoxLayout()
+        layout.addWidget(self.tabs)
+        self.setLayout(layout)
+
+    def add_lazy_tab(self, factory, title):
+        tab = LazyTab(factory)
+        self.tabs.addTab(tab, title)
+        return tab
+
+    def tab_changed(self, index):
+        tab = self.tabs.widget(index)
+        if isinstance(tab, LazyTab):
+            tab.materialize()
+
+
+class LazyTab(QWidget):
+    """Stands in for a tab until it is first shown, then builds the real one inside itself."""
+    def __init__(self, factory):
+        super().__init__()
+        self.factory = factory
+        self.widget = None
+        layout = QVBoxLayout()
+        layout.setContentsMargins(0, 0, 0, 0)
+        self.setLayout(layout)
+
+    def materialize(self):
+        if self.widget is None:
+            self.widget = self.factory()
+            self.layout().addWidget(self.widget)
+        return self.widget
+
+
+class ContractorInputTab(QWidget):
+    def __init__(self, parent, leads_db, lead_repository):
+        super().__init__()
+
+        self.leads_db = leads_db
+        self.parent = parent
+        self.lead_repository = lead_repository
+
+        self.first_name_label = QLabel("First Name:")
+        self.first_name_input = QLineEdit()
+
+        self.last_name_label = QLabel("Last Name:")
+        self.last_name_input = QLineEdit()
+
+        self.address_line1_label = QLabel("Address Line 1:")
+        self.address_line1_input = QLineEdit()
+
+        self.address_line2_label = QLabel("Address Line 2:")
+        self.address_line2_input = QLineEdit()
+
+        self.city_label = QLabel("City:")
+        self.city_input = QLineEdit()
+
+        self.state_label = QLabel("State:")
+        self.state_input = QLineEdit()
+
+        self.zipcode_label = QLabel("Zipcode:")
+        self.zipcode_input = QLineEdit()
+
+        self.phone_label = QLabel("Phone Number:")
+        self.phone_input = QLineEdit()
+
+        self.email_label = QLabel("Email:")
+        self.email_input = QLineEdit()
+
+        self.notes_label = QLabel("Notes:")
+        self.notes_input = QTextEdit()
+
+        self.referred_by_label = QLabel("Referred By:")
+        self.referred_by_input = QLineEdit()
+        
+        self.job_type_label = QLabel("Job Type:")
+        self.job_type_dropdown = QComboBox()
+        self.job_type_dropdown.addItems(JOB_TYPES)
+        
+        self.submit_button = QPushButton("Submit")
+        self.submit_button.clicked.connect(self.add_lead)  # Connect to the add_lead method
+
+        self.import_button = QPushButton("Import Leads...")
+        self.import_button.clicked.connect(self.import_leads)
+
+        self.load_zips_button = QPushButton("Load ZIP Codes...")
+        self.load_zips_button.clicked.connect(self.load_zips)
+
+        self.setup_ui()
+
+    def setup_ui(self):
+        layout = QVBoxLayout()
+        layout.addWidget(self.first_name_label)
+        layout.addWidget(self.first_name_input)
+        layout.addWidget(self.last_name_label)
+        layout.addWidget(self.last_name_input)
+        layout.addWidget(self.address_line1_label)
+        layout.addWidget(self.address_line1_input)
+        layout.addWidget(self.address_line2_label)
+        layout.addWidget(self.address_line2_input)
+        layout.addWidget(self.city_label)
+        layout.addWidget(self.city_input)
+        layout.addWidget(self.state_label)
+        layout.addWidget(self.state_input)
+        layout.addWidget(self.zipcode_label)
+        layout.addWidget(self.zipcode_input)
+        layout.addWidget(self.phone_label)
+        layout.addWidget(self.phone_input)
+        layout.addWidget(self.email_label)
+        layout.addWidget(self.email_input)
+        layout.addWidget(self.notes_label)
+        layout.addWidget(self.notes_input)
+        layout.addWidget(self.referred_by_label)
+        layout.addWidget(self.referred_by_input)
+        layout.addWidget(self.job_type_label)
+        layout.addWidget(self.job_type_dropdown)
+        layout.addWidget(self.submit_button)
+        layout.addWidget(self.import_button)
+        layout.addWidget(self.load_zips_button)
+
+        self.setLayout(layout)
+
+    def add_lead(self):
+        # Collect data from input fields
+        lead = leads.Lead(
+            first_name=self.first_name_input.text(),
+            last_name=self.last_name_input.text(),
+            address_line1=self.address_line1_input.text(),
+            address_line2=self.address_line2_input.text(),
+            city=self.city_input.text(),
+            state=self.state_input.text(),
+            zipcode=self.zipcode_input.text(),
+            phone=self.phone_input.text(),
+            email=self.email_input.text(),
+            notes=self.notes_input.toPlainText(),
+            referred_by=self.referred_by_input.text(),
+            job_type=self.job_type_dropdown.currentText(),
+        )
+
+        # Look for the same person before inserting; the answer comes back from the database thread
+        self.submit_button.setEnabled(False)
+        self.lead_repository.find_duplicates(
+            lead, callback=lambda matches: self.duplicates_checked(lead, matches),
+            error=lambda e: self.duplicates_checked(lead, []))
+
+    def duplicates_checked(self, lead, matches):
+        self.submit_button.setEnabled(True)
+        if matches:
+            lines = []
+            for match, reasons in matches[:5]:
+                name = " ".join(part for part in (match.first_name, match.last_name) if part) or f"Lead {match.id}"
+                lines.append(f"{name} ({', '.join(reasons)} match)")
+            confirmation = QMessageBox.question(
+                self, "Possible Duplicate",
+                "This lead looks like one already in the database:\n\n" + "\n".join(lines) + "\n\nAdd it anyway?",
+                QMessageBox.Yes | QMessageBox.No, QMessageBox.No
+            )
+            if confirmation != QMessageBox.Yes:
+                return
+
+        # Insert into the database; the leads table picks up the new row from the repository's signal
+        self.lead_repository.add_lead(lead)
+
+        # Clear input fields after adding the lead
+        self.clear_input_fields()
+
+    def import_leads(self):
+        options = QFileDialog.Options()
+        options |= QFileDialog.DontUseNativeDialog
+        file_name, _ = QFileDialog.getOpenFileName(self, "Import Leads", "", "Lead Lists (*.csv *.vcf *.vcard);;All Files (*)", options=options)
+        if not file_name:
+            return
+
+        # The import runs on its own thread and connection so the window stays responsive
+        self.import_thread = LeadImportThread(file_name, LEADS_DATABASE, self)
+        self.import_progress = QProgressDialog("Importing leads...", "Cancel", 0, 0, self)
+        self.import_progress.setWindowModality(Qt.WindowModal)
+        self.import_progress.setMinimumDuration(0)
+        self.import_progress.canceled.connect(self.import_thread.requestInterruption)
+        self.import_thread.progress.connect(self.import_progressed)
+        self.import_thread.import_finished.connect(self.import_finished)
+        self.import_thread.import_failed.connect(self.import_failed)
+        self.import_button.setEnabled(False)
+        self.import_thread.start()
+
+    def import_progressed(self, imported, elapsed):
+        rate = imported / elapsed if elapsed else 0
+        self.import_progress.setLabelText(f"{imported} leads imported ({rate:,.0f} leads/s)")
+
+    def import_finished(self, imported, elapsed, cancelled, first_id, last_id):
+        self.import_progress.reset()
+        self.import_button.setEnabled(True)
+        if imported:
+            self.lead_repository.announce_inserted(list(range(first_id, last_id + 1)))
+        message = f"{imported} leads imported in {elapsed:.1f}s."
+        if cancelled:
+            message += " The import was cancelled; leads imported before cancelling were kept."
+        QMessageBox.information(self, "Import Leads", message)
+
+    def import_failed(self, error):
+        self.import_progress.reset()
+        self.import_button.setEnabled(True)
+        QMessageBox.warning(self, "Import Leads", f"The import failed: {error}")
+
+    def load_zips(self):
+        options = QFileDialog.Options()
+        options |= QFileDialog.DontUseNativeDialog
+        file_name, _ = QFileDialog.getOpenFileName(
+            self, "Load ZIP Codes", "", "ZIP Code Centroids (*.txt *.csv);;All Files (*)", options=options)
+        if not file_name:
+            return
+
+        # Locating every lead again takes a few seconds on a large table
+        self.zip_thread = ZipLoadThread(file_name, LEADS_DATABASE, self)
+        self.zip_thread.load_finished.connect(self.zips_loaded)
+        self.zip_thread.load_failed.connect(self.zips_failed)
+        self.load_zips_button.setEnabled(False)
+        self.zip_thread.start()
+
+    def zips_loaded(self, loaded, located):
+        self.load_zips_button.setEnabled(True)
+        QMessageBox.information(self, "Load ZIP Codes", f"{loaded} ZIP codes loaded; {located} leads located.")
+
+    def zips_failed(self, error):
+        self.load_zips_button.setEnabled(True)
+        QMessageBox.warning(self, "Load ZIP Codes", f"Loading ZIP codes failed: {error}")
+
+    def clear_input_fields(self):
+        # Clear all input fields
+        self.first_name_input.clear()
+        self.last_name_input.clear()
+        self.address_line1_input.clear()
+        self.address_line2_input.clear()
+        self.city_input.clear()
+        self.state_input.clear()
+        self.zipcode_input.clear()
+        self.phone_input.clear()
+        self.email_input.clear()
+        self.notes_input.clear()
+        self.referred_by_input.clear()
+        self.job_type_dropdown.setCurrentIndex(0)
+
+class DatabaseExecutor(QObject):
+    """Run database work on background threads and deliver results back on the GUI thread.
+
+    Requests submitted with the same key are coalesced: a newer request makes older ones
+    that haven't started yet skip their work, and results of superseded requests are
+    dropped. Rapid clicks therefore only query for the last one.
+    """
+    finished = pyqtSignal(object)
+
+    def __init__(self, max_workers=2, parent=None):
+        super().__init__(parent)
+        self.pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="database")
+        self.latest = {}
+
+        # Emitted from worker threads; Qt queues delivery onto the thread this object lives in
+        self.finished.connect(self.deliver)
+
+    def submit(self, function, *args, callback=None, error=None, key=None):
+        """Run function(*args) in the pool and pass its result to callback on the GUI thread."""
+        request = object()
+        if key is not None:
+            self.latest[key] = request
+        self.pool.submit(self.run, request, key, function, args, callback, error)
+
+    def is_current(self, request, key):
+        return key is None or self.latest.get(key) is request
+
+    def run(self, request, key, function, args, callback, error):
+        if not self.is_current(request, key):
+            return
+        try:
+            result = function(*args)
+        except Exception as e:
+            self.finished.emit((request, key, callback, error, None, e))
+        else:
+            self.finished.emit((request, key, callback, error, result, None))
+
+    def deliver(self, outcome):
+        request, key, callback, error, result, exception = outcome
+        if not self.is_current(request, key):
+            return
+        if key is not None:
+            del self.latest[key]
+        if exception is not None:
+            if error:
+                error(exception)
+            else:
+                print(exception)
+        elif callback:
+            callback(result)
+
+    def shutdown(self):
+        self.pool.shutdown(wait=True)
+
+_executor = None
+
+def get_executor():
+    """Return the app-wide DatabaseExecutor, creating it on first use from the GUI thread."""
+    global _executor
+    if _executor is None:
+        _executor = DatabaseExecutor()
+    return _executor
+
+class LeadImportThread(QThread):
+    """Run lead_import.import_leads on a worker thread, reporting progress through signals."""
+    progress = pyqtSignal(int, float)
+    import_finished = pyqtSignal(int, float, bool, int, int)
+    import_failed = pyqtSignal(str)
+
+    def __init__(self, file_name, db_file, parent=None):
+        super().__init__(parent)
+        self.file_name = file_name
+        self.db_file = db_file
+
+    def run(self):
+        # The import gets its own connection; WAL lets the GUI keep reading while it writes
+        connection = database.connect(self.db_file)
+        try:
+            result = lead_import.import_leads(
+                connection, lead_import.read_leads(self.file_name),
+                progress=self.progress.emit, should_cancel=self.isInterruptionRequested)
+        except (OSError, ValueError, UnicodeDecodeError, csv.Error, sqlite3.Error) as e:
+            self.import_failed.emit(str(e))
+        else:
+            self.import_finished.emit(*result)
+        finally:
+            connection.close()
+
+class LeadExportThread(QThread):
+    """Run one of the lead_export writers on a worker thread, reporting progress through signals."""
+    progress = pyqtSignal(int, int)
+    export_finished = pyqtSignal(str, int, bool)
+    export_failed = pyqtSignal(str)
+
+    def __init__(self, export, file_name, db_file, parent=None):
+        super().__init__(parent)
+        self.export = export
+        self.file_name = file_name
+        self.db_file = db_file
+
+    def run(self):
+        connection = database.connect(self.db_file)
+        try:
+            exported, cancelled = self.export(
+                connection, self.file_name, progress=self.progress.emit, should_cancel=self.isInterruptionRequested)
+        except (OSError, sqlite3.Error) as e:
+            self.export_failed.emit(str(e))
+        else:
+            self.export_finished.emit(self.file_name, exported, cancelled)
+        finally:
+            connection.close()
+
+class LeadDedupeThread(QThread):
+    """Run lead_dedupe.find_duplicate_groups on a worker thread, reporting progress through signals."""
+    progress = pyqtSignal(int, int)
+    dedupe_finished = pyqtSignal(list)
+    dedupe_failed = pyqtSignal(str)
+
+    def __init__(self, db_file, parent=None):
+        super().__init__(parent)
+        self.db_file = db_file
+
+    def run(self):
+        connection = database.connect(self.db_file)
+        try:
+            groups = lead_dedupe.find_duplicate_groups(
+                connection, progress=self.progress.emit, should_cancel=self.isInterruptionRequested)
+        except sqlite3.Error as e:
+            self.dedupe_failed.emit(str(e))
+        else:
+            if not self.isInterruptionRequested():
+                self.dedupe_finished.emit(groups)
+        finally:
+            connection.close()
+
+class ZipLoadThread(QThread):
+    """Load ZIP code centroids with geo.load_centroids on a worker thread and locate every lead."""
+    load_finished = pyqtSignal(int, int)
+    load_failed = pyqtSignal(str)
+
+    def __init__(self, file_name, db_file, parent=None):
+        super().__init__(parent)
+        self.file_name = file_name
+        self.db_file = db_file
+
+    def run(self):
+        connection = database.connect(self.db_file)
+        try:
+            with connection:
+                loaded, located = geo.load_centroids(connection, geo.read_centroids(self.file_name))
+        except (OSError, ValueError, UnicodeDecodeError, csv.Error, sqlite3.Error) as e:
+            self.load_failed.emit(str(e))
+        else:
+            self.load_finished.emit(loaded, located)
+        finally:
+            connection.close()
+
+class EmailWorkerThread(QThread):
+    """Drain the email queue with email_queue.EmailWorker on a worker thread."""
+    progress = pyqtSignal()
+    sending_finished = pyqtSignal(int)
+    sending_failed = pyqtSignal(str)
+
+    def __init__(self, db_file, rate, parent=None):
+        super().__init__(parent)
+        self.db_file = db_file
+        self.rate = rate
+
+    def run(self):
+        import email_queue
+
+        connection = database.connect(self.db_file)
+        try:
+            settings = email_queue.load_settings(connection)
+            if settings is None:
+                self.sending_failed.emit("Save the SMTP server settings first.")
+                return
+            transport = email_queue.SmtpTransport(settings)
+            try:
+                worker = email_queue.EmailWorker(connection, transport, self.rate, progress=self.progress.emit)
+                sent = worker.run(should_stop=self.isInterruptionRequested)
+            finally:
+                transport.close()
+        except Exception as e:
+            # Anything uncaught here would end the thread without a word to the tab
+            self.sending_failed.emit(str(e) or type(e).__name__)
+        else:
+            self.sending_finished.emit(sent)
+        finally:
+            connection.close()
+
+class SmsWorkerThread(QThread):
+    """Drain the SMS queue with sms_queue.SmsWorker on a worker thread, in an event loop of its own.
+
+    With refresh set it asks Twilio what became of sent messages instead of sending.
+    """
+    progress = pyqtSignal()
+    sending_finished = pyqtSignal(int)
+    sending_failed = pyqtSignal(str)
+
+    def __init__(self, db_file, rate, refresh=False, parent=None):
+        super().__init__(parent)
+        self.db_file = db_file
+        self.rate = rate
+        self.refresh = refresh
+
+    def run(self):
+        import asyncio
+        import sms_queue
+
+        connection = database.connect(self.db_file)
+        try:
+            credentials = sms_queue.load_credentials(connection)
+            if credentials is None:
+                self.sending_failed.emit("Save a Twilio SID, auth token and from number on the Integrations tab first.")
+                return
+            transport = sms_queue.TwilioTransport(*credentials)
+            worker = sms_queue.SmsWorker(connection, transport, self.rate, progress=self.progress.emit)
+            count = asyncio.run(self.drain(worker, transport))
+        except Exception as e:
+            # Anything uncaught here would end the thread without a word to the tab
+            self.sending_failed.emit(str(e) or type(e).__name__)
+        else:
+            self.sending_finished.emit(count)
+        finally:
+            connection.close()
+
+    async def drain(self, worker, transport):
+        try:
+            if self.refresh:
+                return await worker.refresh_statuses(min_age=0, should_stop=self.isInterruptionRequested)
+            return await worker.run(should_stop=self.isInterruptionRequested)
+        finally:
+            await transport.close()
+
+
+class FormServerThread(QThread):
+    """Serve the web forms with form_intake.IntakeServer on a worker thread, in an event loop of its own.
+
+    The server writes submissions through its own connection; submissions_written
+    carries the ids of each batch's new leads and how many were duplicates.
+    """
+    serving = pyqtSignal(int)
+    submissions_written = pyqtSignal(list, int)
+    serving_failed = pyqtSignal(str)
+
+    def __init__(self, db_file, host, port, parent=None):
+        super().__init__(parent)
+        self.db_file = db_file
+        self.host = host
+        self.port = port
+        self.server = None
+        self.reload_requested = False
+
+    def run(self):
+        import asyncio
+        import form_intake
+
+        server = form_intake.IntakeServer(self.db_file, on_written=self.submissions_written.emit)
+        try:
+            asyncio.run(self.serve(asyncio, server))
+        except (OSError, sqlite3.Error) as e:
+            self.serving_failed.emit(str(e))
+
+    async def serve(self, asyncio, server):
+        port = await server.start(self.host, self.port)
+        self.server = server
+        self.serving.emit(port)
+        try:
+            while not self.isInterruptionRequested():
+                if self.reload_requested:
+                    self.reload_requested = False
+                    await server.reload_forms()
+                await asyncio.sleep(0.2)
+        finally:
+            await server.close()
+
+    def reload_forms(self):
+        """Have the running server pick up forms created or deleted since it started, within 0.2s."""
+        self.reload_requested = True
+
+class LeadRepository(QObject):
+    """Qt front end to the leads module: runs its operations off the GUI thread and announces what changed.
+
+    Writes run on the DatabaseExecutor and each signal is emitted once its write has
+    committed. Every signal carries the ids of the affected leads, so views can patch
+    just those rows instead of reloading the whole table after each add, edit or delete.
+    The fetch methods block and are meant to be submitted to the executor.
+    """
+    leadsInserted = pyqtSignal(list)
+    leadsChanged = pyqtSignal(list)
+    leadsRemoved = pyqtSignal(list)
+    appointmentsChanged = pyqtSignal(list)
+
+    def __init__(self, leads_db, parent=None):
+        super().__init__(parent)
+        self.leads_db = leads_db
+
+        # Grid edits are journaled and written in batches once typing pauses
+        self.journal = leads.EditJournal(leads.journal_path(leads_db.path))
+        self.flush_timer = QTimer(self)
+        self.flush_timer.setSingleShot(True)
+        self.flush_timer.setInterval(EDIT_FLUSH_DELAY_MS)
+        self.flush_timer.timeout.connect(self.flush_edits)
+        QApplication.instance().applicationStateChanged.connect(self.application_state_changed)
+
+        if self.journal.pending:
+            # Edits a crashed session never wrote
+            self.flush_edits()
+
+    def add_lead(self, lead):
+        def insert():
+            with self.leads_db.transaction() as connection:
+                return leads.add_lead(connection, lead)
+
+        get_executor().submit(insert, callback=lambda lead_id: self.leadsInserted.emit([lead_id]))
+
+    def announce_inserted(self, lead_ids):
+        """Tell views about leads that were inserted through another connection, e.g. a bulk import."""
+        self.leadsInserted.emit(list(lead_ids))
+
+    def update_lead(self, lead_id, column, value):
+        """Journal an edit to one cell; it reaches the database with the next flush_edits."""
+        self.journal.record(lead_id, column, value)
+        self.flush_timer.start()
+
+    def flush_edits(self, wait=False):
+        """Write every journaled edit in one transaction, in the background unless wait is set."""
+        self.flush_timer.stop()
+        if not self.journal.pending:
+            return
+
+        def flush():
+            with self.leads_db.transaction() as connection:
+                return self.journal.flush(connection)
+
+        if wait:
+            self.edits_flushed(flush())
+        else:
+            get_executor().submit(flush, callback=self.edits_flushed)
+
+    def edits_flushed(self, lead_ids):
+        if lead_ids:
+            self.leadsChanged.emit(lead_ids)
+
+    def application_state_changed(self, state):
+        if state != Qt.ApplicationActive:
+            self.flush_edits()
+
+    def find_duplicates(self, lead, callback, error=None):
+        """Pass callback the [(Lead, reasons)] already in the database that look like lead."""
+        def find():
+            with self.leads_db.transaction() as connection:
+                return lead_dedupe.find_matches(connection, lead)
+
+        get_executor().submit(find, callback=callback, error=error)
+
+    def index_duplicates(self):
+        """Bring the duplicate index up to date a chunk at a time, so writes can get in between chunks."""
+        def refresh():
+            with self.leads_db.transaction() as connection:
+                return lead_dedupe.refresh_index(connection, lead_dedupe.INDEX_CHUNK_SIZE)
+
+        get_executor().submit(refresh, callback=lambda done: done or self.index_duplicates(), key=(self, "dedupe index"))
+
+    def merge_duplicates(self, groups):
+        def merge():
+            with self.leads_db.transaction() as connection:
+                return lead_dedupe.merge_groups(connection, groups)
+
+        def merged(result):
+            kept_ids, removed_ids = result
+            self.leadsRemoved.emit(removed_ids)
+            self.leadsChanged.emit(kept_ids)
+
+        get_executor().submit(merge, callback=merged)
+
+    def bulk_write(self, write, callback):
+        """Run write(connection) in one transaction and pass its result to callback.
+
+        Journaled edits are written first, so the bulk change has the last word on any
+        cell both touch.
+        """
+        self.flush_timer.stop()
+
+        def run():
+            with self.leads_db.transaction() as connection:
+                edited = self.journal.flush(connection)
+                return edited, write(connection)
+
+        def written(result):
+            edited, value = result
+            self.edits_flushed(edited)
+            callback(value)
+
+        get_executor().submit(run, callback=written)
+
+    def update_leads(self, lead_ids, **changes):
+        """Set the same values on every lead in lead_ids with one statement."""
+        lead_ids = list(lead_ids)
+        self.bulk_write(lambda connection: leads.update_leads(connection, lead_ids, **changes),
+                        lambda _: self.leadsChanged.emit(lead_ids))
+
+    def delete_leads(self, lead_ids, callback=None):
+        """Soft-delete lead_ids as one batch and pass (batch, leads deleted) to callback; undo with restore_leads."""
+        lead_ids = list(lead_ids)
+
+        def deleted(result):
+            self.leadsRemoved.emit(lead_ids)
+            if callback:
+                callback(result)
+
+        self.bulk_write(lambda connection: leads.soft_delete_leads(connection, lead_ids), deleted)
+
+    def restore_leads(self, batch):
+        def restored(lead_ids):
+            self.leadsInserted.emit(lead_ids)
+            self.appointmentsChanged.emit(lead_ids)
+
+        self.bulk_write(lambda connection: leads.restore_leads(connection, batch), restored)
+
+    def schedule_appointment(self, appointment):
+        def insert():
+            with self.leads_db.transaction() as connection:
+                return appointments.add_appointment(connection, appointment)
+
+        get_executor().submit(insert, callback=lambda _: self.appointmentsChanged.emit([appointment.lead_id]))
+
+    def set_appointment_status(self, appointment, status):
+        def update():
+            with self.leads_db.transaction() as connection:
+                appointments.update_appointment(connection, appointment.id, status=status)
+
+        get_executor().submit(update, callback=lambda _: self.appointmentsChanged.emit([appointment.lead_id]))
+
+    def fetch_lead_history(self, lead_id):
+        return appointments.lead_history(self.leads_db.reader(), lead_id)
+
+    def fetch_page(self, after_key, limit, where="", params=(), sort=()):
+        return leads.fetch_sorted_page(self.leads_db.reader(), after_key, limit, where, params, sort)
+
+    def fetch_leads(self, lead_ids):
+        return leads.get_leads(self.leads_db.reader(), lead_ids)
+
+    def fetch_remaining_ids(self, after_key, where="", params=(), sort=(), chunk_size=10000):
+        """Return (ids, last key) for every lead after after_key in sort order, read a chunk at a time."""
+        connection = self.leads_db.reader()
+        ids = array("q")
+        while True:
+            page = leads.fetch_sorted_page(connection, after_key, chunk_size, where, params, sort)
+            ids.extend(lead.id for lead in page)
+            if page:
+                after_key = lead_query.sort_key(page[-1], sort)
+            if len(page) < chunk_size:
+                return ids, after_key
+
+    def fetch_matching(self, lead_ids, where="", params=()):
+        """Return whichever of lead_ids match a lead_query where clause."""
+        where = f"AND {where}" if where else ""
+        return [row[0] for row in self.leads_db.reader().execute(
+            f"SELECT id FROM leads WHERE id IN ({leads.IDS_SQL}) {where}", [json.dumps(list(lead_ids)), *params])]
+
+    def fetch_nearby(self, lead_id, miles, filters):
+        """Return [(miles away, Lead)] around lead_id, or None when its ZIP code isn't loaded."""
+        connection = self.leads_db.reader()
+        center = geo.lead_location(connection, lead_id)
+        if center is None:
+            return None
+        return leads.leads_near(connection, center, miles, filters)
+
+    def plan_route(self, lead_ids, start_lead_id=None, start_zip="", round_trip=False):
+        """Return leads.plan_visits for lead_ids, starting at start_zip or else at start_lead_id's ZIP code."""
+        connection = self.leads_db.reader()
+        start = None
+        if start_zip:
+            start = geo.zip_location(connection, start_zip)
+            if start is None:
+                raise ValueError(f"ZIP code {start_zip} isn't in the loaded ZIP codes.")
+        elif start_lead_id is not None:
+            start = geo.lead_location(connection, start_lead_id)
+        return leads.plan_visits(connection, lead_ids, start, round_trip)
+
+class CustomDelegate(QStyledItemDelegate):
+    def createEditor(self, parent, option, index):
+        editor = super().createEditor(parent, option, index)
+        if isinstance(editor, QLineEdit):
+            editor.editingFinished.connect(lambda: self.commitData.emit(editor))
+        elif isinstance(editor, QComboBox):
+            editor.currentIndexChanged.connect(lambda: self.commitData.emit(editor))
+        return editor
+
+class ComboBoxDelegate(CustomDelegate):
+    """Paint a plain text cell and only create a combo box while the cell is being edited."""
+    def __init__(self, options, parent=None):
+        super().__init__(parent)
+        self.options = list(options)
+
+    def createEditor(self, parent, option, index):
+        editor = QComboBox(parent)
+        editor.addItems(self.options)
+        editor.currentIndexChanged.connect(lambda: self.commitData.emit(editor))
+        return editor
+
+    def setEditorData(self, editor, index):
+        editor.blockSignals(True)
+        editor.setCurrentText(index.data(Qt.EditRole) or "")
+        editor.blockSignals(False)
+
+    def setModelData(self, editor, model, index):
+        model.setData(index, editor.currentText(), Qt.EditRole)
+
+class ButtonDelegate(QStyledItemDelegate):
+    """Paint a push button in every cell of a column without creating a widget per row."""
+    clicked = pyqtSignal(int)
+
+    def __init__(self, text, parent=None):
+        super().__init__(parent)
+        self.text = text
+
+    def paint(self, painter, option, index):
+        button = QStyleOptionButton()
+        button.rect = option.rect.adjusted(2, 2, -2, -2)
+        button.text = self.text
+        button.state = QStyle.State_Enabled | QStyle.State_Raised
+        QApplication.style().drawControl(QStyle.CE_PushButton, button, painter)
+
+    def editorEvent(self, event, model, option, index):
+        if event.type() == QEvent.MouseButtonRelease and option.rect.contains(event.pos()):
+            self.clicked.emit(index.row())
+            return True
+        return False
+
+class LeadsTableModel(QAbstractTableModel):
+    """Table model over the leads table that loads rows in pages as the view scrolls.
+
+    Rows are fetched with keyset pagination, on ``leads.id`` or on the sort columns and
+    id when a header has been clicked, so each page costs the same no matter how far
+    down the table it is. Sorting happens in SQL. Only the ids of loaded rows are kept for
+    the whole table; cell values live in a column-oriented cache covering a window of
+    rows around what the view is showing, and scrolling outside it loads the new
+    window in the background.
+    """
+    def __init__(self, lead_repository, page_size=200, window_size=1000, parent=None):
+        super().__init__(parent)
+        self.lead_repository = lead_repository
+        self.page_size = page_size
+        self.window_size = window_size
+        self.edit_mode = False
+
+        # Ids of the loaded rows in order; 8 bytes a row however far the view has scrolled
+        self.ids = array("q")
+        self.newest_id = 0
+        self.last_key = None
+        self.exhausted = False
+
+        # window[column][row - window_start] holds the values of the cached rows;
+        # window_pending is the (start, end) row range being loaded, if any
+        self.window_start = 0
+        self.window = [[] for _ in LEAD_COLUMNS]
+        self.window_pending = None
+
+        # A page request is in flight; more_inserted notes leads added while it was
+        self.fetching = False
+        self.more_inserted = False
+
+        # Active filter bar predicates from lead_query.build_where
+        self.filters = {}
+        self.where = ""
+        self.params = []
+
+        # (column, descending) pairs rows are sorted by, before id; changed holds leads
+        # edited since the rows were loaded, which may since have moved past last_key
+        self.sort_keys = ()
+        self.changed = set()
+
+        self.lead_repository.leadsInserted.connect(self.leads_inserted)
+        self.lead_repository.leadsChanged.connect(self.leads_changed)
+        self.lead_repository.leadsRemoved.connect(self.leads_removed)
+
+    def rowCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(self.ids)
+
+    def columnCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(LEAD_COLUMNS) + 1
+
+    def headerData(self, section, orientation, role=Qt.DisplayRole):
+        if role == Qt.InitialSortOrderRole:
+            return Qt.AscendingOrder
+        if role != Qt.DisplayRole:
+            return None
+        if orientation == Qt.Horizontal:
+            return LEAD_COLUMNS[section][0] if section < len(LEAD_COLUMNS) else "Actions"
+        return section + 1
+
+    def data(self, index, role=Qt.DisplayRole):
+        if not index.isValid() or index.column() >= len(LEAD_COLUMNS):
+            return None
+        if role in (Qt.DisplayRole, Qt.EditRole, Qt.ToolTipRole):
+            offset = self.window_offset(index.row())
+            if offset is None:
+                # Left blank until the window around this row arrives
+                self.load_window(index.row())
+                return None
+            value = self.cell_value(index.row(), index.column(), offset)
+            if value is None:
+                return ""
+            if index.column() == STATUS_COLUMN:
+                return STATUS_MAPPING.get(value, "Unknown Status")
+            return str(value)
+        return None
+
+    def flags(self, index):
+        flags = super().flags(index)
+        if self.edit_mode and index.isValid() and index.column() < len(LEAD_COLUMNS):
+            flags |= Qt.ItemIsEditable
+        return flags
+
+    def setData(self, index, value, role=Qt.EditRole):
+        if role != Qt.EditRole or not (self.flags(index) & Qt.ItemIsEditable):
+            return False
+        if index.column() == STATUS_COLUMN:
+            value = leads.LEAD_STATUSES.index(value)
+        offset = self.window_offset(index.row())
+        if offset is not None and self.cell_value(index.row(), index.column(), offset) == value:
+            return False
+        self.lead_repository.update_lead(self.ids[index.row()], LEAD_COLUMNS[index.column()][1], value)
+        # Journaled edits show straight away, before they are written
+        self.dataChanged.emit(index, index)
+        return True
+
+    def cell_value(self, row, column, offset):
+        value = self.window[column][offset]
+        journal = self.lead_repository.journal
+        if journal.pending:
+            value = journal.value(self.ids[row], LEAD_COLUMNS[column][1], value)
+        return value
+
+    def window_offset(self, row):
+        offset = row - self.window_start
+        return offset if 0 <= offset < len(self.window[0]) else None
+
+    def set_window(self, start, window_leads):
+        self.window_start = start
+        self.window = [[getattr(lead, column) for lead in window_leads] for _, column in LEAD_COLUMNS]
+
+    def trim_window(self):
+        excess = len(self.window[0]) - self.window_size
+        if excess > 0:
+            for values in self.window:
+                del values[:excess]
+            self.window_start += excess
+
+    def load_window(self, row):
+        if self.window_pending and self.window_pending[0] <= row < self.window_pending[1]:
+            return
+        start = max(0, min(row - self.window_size // 2, len(self.ids) - self.window_size))
+        ids = self.ids[start:start + self.window_size].tolist()
+        self.window_pending = (start, start + len(ids))
+        get_executor().submit(
+            self.lead_repository.fetch_leads, ids,
+            callback=lambda fetched: self.window_loaded(start, ids, fetched), key=(self, "window"))
+
+    def window_loaded(self, start, ids, fetched):
+        self.window_pending = None
+        if self.ids[start:start + len(ids)].tolist() != ids:
+            # Rows were added or removed while loading; try again for the same place
+            self.load_window(start + len(ids) // 2)
+            return
+        by_id = {lead.id: lead for lead in fetched}
+        # A lead deleted meanwhile shows blank until its leadsRemoved arrives
+        self.set_window(start, [by_id.get(lead_id) or BLANK_LEAD for lead_id in ids])
+        self.dataChanged.emit(self.index(start, 0), self.index(start + len(ids) - 1, len(LEAD_COLUMNS) - 1))
+
+    def canFetchMore(self, parent=QModelIndex()):
+        return not parent.isValid() and not self.exhausted and not self.fetching
+
+    def fetchMore(self, parent=QModelIndex()):
+        if parent.isValid() or self.exhausted or self.fetching:
+            return
+        # Pages load in the background and are appended when they arrive
+        self.fetching = True
+        get_executor().submit(
+            self.lead_repository.fetch_page, self.last_key, self.page_size, self.where, self.params, self.sort_keys,
+            callback=self.page_fetched, key=(self, "page"))
+
+    def page_fetched(self, page):
+        self.fetching = False
+        if len(page) < self.page_size:
+            self.exhausted = True
+        if page:
+            self.last_key = lead_query.sort_key(page[-1], self.sort_keys)
+            self.newest_id = max(self.newest_id, max(lead.id for lead in page))
+        if self.changed:
+            # An edit can move a loaded lead to later in the sort; it keeps the row it has
+            page = [lead for lead in page if lead.id not in self.changed or self.row_of(lead.id) is None]
+        if page:
+            start = len(self.ids)
+            self.beginInsertRows(QModelIndex(), start, start + len(page) - 1)
+            self.ids.extend(lead.id for lead in page)
+            # The view asks for more when scrolled to the bottom, so a new page is what it shows next
+            if self.window_start + len(self.window[0]) == start:
+                for values, (_, column) in zip(self.window, LEAD_COLUMNS):
+                    values.extend(getattr(lead, column) for lead in page)
+                self.trim_window()
+            else:
+                self.set_window(start, page)
+            self.endInsertRows()
+        # Go on for leads added while this page was read, or past one made up only of moved leads
+        if self.more_inserted or not (page or self.exhausted):
+            self.more_inserted = False
+            self.exhausted = False
+            self.fetchMore()
+
+    def refresh(self):
+        self.beginResetModel()
+        self.ids = array("q")
+        self.newest_id = 0
+        self.last_key = None
+        self.changed = set()
+        self.exhausted = False
+        self.fetching = False
+        self.more_inserted = False
+        self.set_window(0, [])
+        self.window_pending = None
+        self.endResetModel()
+        self.fetchMore()
+
+    def set_filters(self, filters):
+        sort = self.sort_keys
+        self.filters = filters
+
+        def build_where():
+            return lead_query.build_where(self.lead_repository.leads_db.reader(), filters, sort)
+
+        get_executor().submit(build_where, callback=self.filters_built, key=(self, "filters"))
+
+    def filters_built(self, where):
+        self.where, self.params = where
+        self.refresh()
+
+    def sort(self, column, order=Qt.AscendingOrder):
+        """Sort by column, then by the columns sorted by before it, all in the header's direction.
+
+        Keeping one direction lets a sort that an index covers be read straight off it.
+        """
+        descending = order == Qt.DescendingOrder
+        if 0 <= column < len(LEAD_COLUMNS):
+            name = LEAD_COLUMNS[column][1]
+            names = [name] + [key for key, _ in self.sort_keys if key not in (name, "id")]
+            sort_keys = tuple((key, descending) for key in names[:SORT_KEYS])
+        elif column == len(LEAD_COLUMNS):
+            # The Actions column sorts by when leads were added, newest first when descending
+            sort_keys = (("id", True),) if descending else ()
+        else:
+            sort_keys = ()
+        if sort_keys != self.sort_keys:
+            self.sort_keys = sort_keys
+            # Filters are planned for the order rows are read in, so they are rebuilt too
+            self.set_filters(self.filters)
+
+    def lead_id(self, row):
+        return self.ids[row]
+
+    def row_of(self, lead_id):
+        """Return the row holding lead_id, or None if that lead isn't loaded."""
+        if self.sort_keys:
+            # Sorted rows aren't in id order; array.index scans for it at C speed
+            try:
+                return self.ids.index(lead_id)
+            except ValueError:
+                return None
+        row = bisect_left(self.ids, lead_id)
+        if row < len(self.ids) and self.ids[row] == lead_id:
+            return row
+        return None
+
+    def rows_of(self, lead_ids):
+        """Return the rows holding whichever of lead_ids are loaded."""
+        lead_ids = set(lead_ids)
+        if self.sort_keys and len(lead_ids) > 8:
+            return [row for row, lead_id in enumerate(self.ids) if lead_id in lead_ids]
+        return [row for row in map(self.row_of, lead_ids) if row is not None]
+
+    def fetch_all(self, callback):
+        """Load the ids of every remaining row, then call callback; cell values still load as the view scrolls."""
+        if self.exhausted and not self.fetching:
+            callback()
+            return
+        # Keyed like fetchMore, so a page already in flight is superseded rather than appended twice
+        self.fetching = True
+        get_executor().submit(
+            self.lead_repository.fetch_remaining_ids, self.last_key, self.where, self.params, self.sort_keys,
+            callback=lambda fetched: self.all_fetched(fetched, callback), key=(self, "page"))
+
+    def all_fetched(self, fetched, callback):
+        ids, last_key = fetched
+        self.fetching = False
+        self.exhausted = True
+        self.last_key = last_key
+        if ids:
+            self.newest_id = max(self.newest_id, max(ids))
+        if self.changed:
+            ids = [lead_id for lead_id in ids if lead_id not in self.changed or self.row_of(lead_id) is None]
+        if ids:
+            start = len(self.ids)
+            self.beginInsertRows(QModelIndex(), start, start + len(ids) - 1)
+            self.ids.extend(ids)
+            self.endInsertRows()
+        if self.more_inserted:
+            self.more_inserted = False
+            self.exhausted = False
+            self.fetchMore()
+        callback()
+
+    def leads_inserted(self, lead_ids):
+        # leads.id is AUTOINCREMENT, so new leads get ids above every one read so far; lower ids are
+        # deleted leads put back by an undo
+        restored = [lead_id for lead_id in lead_ids if lead_id <= self.newest_id]
+        if restored:
+            if self.sort_keys:
+                # Where they belong among sorted rows isn't known from their ids alone
+                self.refresh()
+                return
+            get_executor().submit(self.lead_repository.fetch_matching, restored, self.where, self.params,
+                                  callback=self.leads_restored)
+        # New ids sort after everything loaded so far, so the next page picks them up;
+        # sorted, the ones that sort after the last row loaded do and the rest show on refresh.
+        # While pages remain, fetchMore will reach them when the view scrolls that far.
+        if self.fetching:
+            # The page in flight may have been read before these leads were committed
+            self.more_inserted = True
+        elif self.exhausted:
+            self.exhausted = False
+            self.fetchMore()
+
+    def leads_restored(self, lead_ids):
+        # Restored leads go in at their place in id order; ones past the rows read so far come with the next page
+        if self.sort_keys:
+            return
+        runs = []
+        for lead_id in sorted(lead_ids):
+            if lead_id > self.newest_id:
+                break
+            row = bisect_left(self.ids, lead_id)
+            if row < len(self.ids) and self.ids[row] == lead_id:
+                continue
+            if runs and runs[-1][0] == row:
+                runs[-1][1].append(lead_id)
+            else:
+                runs.append((row, [lead_id]))
+        # Inserting from the bottom up keeps the rows of the runs above valid
+        for row, run in reversed(runs):
+            self.beginInsertRows(QModelIndex(), row, row + len(run) - 1)
+            self.ids[row:row] = array("q", run)
+            if row < self.window_start:
+                self.window_start += len(run)
+            elif self.window_offset(row) is not None:
+                # Their values aren't cached, so the window is read again around them
+                self.set_window(0, [])
+            self.endInsertRows()
+
+    def leads_changed(self, lead_ids):
+        if self.sort_keys:
+            self.changed.update(lead_ids)
+        # Rows outside the window are read fresh whenever the view scrolls back to them
+        window = set(self.ids[self.window_start:self.window_start + len(self.window[0])])
+        cached = [lead_id for lead_id in lead_ids if lead_id in window]
+        if cached:
+            get_executor().submit(self.lead_repository.fetch_leads, cached, callback=self.leads_fetched)
+
+    def leads_fetched(self, fetched):
+        offsets = {lead_id: offset for offset, lead_id in
+                   enumerate(self.ids[self.window_start:self.window_start + len(self.window[0])])}
+        changed = []
+        for lead in fetched:
+            offset = offsets.get(lead.id)
+            if offset is None:
+                continue
+            for values, (_, column) in zip(self.window, LEAD_COLUMNS):
+                values[offset] = getattr(lead, column)
+            changed.append(offset)
+        if changed:
+            # One signal over the span of changed rows rather than one per row
+            first, last = self.window_start + min(changed), self.window_start + max(changed)
+            self.dataChanged.emit(self.index(first, 0), self.index(last, len(LEAD_COLUMNS) - 1))
+
+    def leads_removed(self, lead_ids):
+        # Adjacent rows are removed together, so deleting a selection of thousands is a few signals
+        runs = []
+        for row in sorted(self.rows_of(lead_ids)):
+            if runs and runs[-1][1] == row - 1:
+                runs[-1][1] = row
+            else:
+                runs.append([row, row])
+        for first, last in reversed(runs):
+            self.beginRemoveRows(QModelIndex(), first, last)
+            del self.ids[first:last + 1]
+            window_end = self.window_start + len(self.window[0])
+            start, end = max(first, self.window_start), min(last + 1, window_end)
+            if start < end:
+                for values in self.window:
+                    del values[start - self.window_start:end - self.window_start]
+            self.window_start -= max(0, min(last + 1, self.window_start) - first)
+            self.endRemoveRows()
+
+class AppointmentsDialog(QDialog):
+    """One lead's appointment history, with a form to book another and a way to mark how one went."""
+    def __init__(self, lead_repository, lead_id, name, parent=None):
+        super().__init__(parent)
+        self.lead_repository = lead_repository
+        self.lead_id = lead_id
+        self.history = []
+        self.setWindowTitle(f"Appointments - {name}")
+
+        self.history_list = QListWidget()
+
+        self.status_dropdown = QComboBox()
+        self.status_dropdown.addItems(appointments.APPOINTMENT_STATUSES)
+        self.set_status_button = QPushButton("Set Status")
+        self.set_status_button.clicked.connect(self.set_status)
+
+        # Default to the next whole hour, for an hour
+        start = QDateTime.currentDateTime().addSecs(3600)
+        start.setTime(start.time().addSecs(-start.time().minute() * 60 - start.time().second()))
+        self.start_input = QDateTimeEdit(start)
+        self.start_input.setCalendarPopup(True)
+        self.end_input = QDateTimeEdit(start.addSecs(3600))
+        self.end_input.setCalendarPopup(True)
+        self.notes_input = QLineEdit()
+        self.schedule_button = QPushButton("Schedule")
+        self.schedule_button.clicked.connect(self.schedule)
+
+        status_layout = QHBoxLayout()
+        status_layout.addWidget(self.status_dropdown)
+        status_layout.addWidget(self.set_status_button)
+
+        form_layout = QGridLayout()
+        form_layout.addWidget(QLabel("Start:"), 0, 0)
+        form_layout.addWidget(self.start_input, 0, 1)
+        form_layout.addWidget(QLabel("End:"), 1, 0)
+        form_layout.addWidget(self.end_input, 1, 1)
+        form_layout.addWidget(QLabel("Notes:"), 2, 0)
+        form_layout.addWidget(self.notes_input, 2, 1)
+        form_layout.addWidget(self.schedule_button, 3, 0, 1, 2, alignment=Qt.AlignCenter)
+
+        layout = QVBoxLayout()
+        layout.addWidget(QLabel("History:"))
+        layout.addWidget(self.history_list)
+        layout.addLayout(status_layout)
+        layout.addLayout(form_layout)
+        self.setLayout(layout)
+
+        self.lead_repository.appointmentsChanged.connect(self.appointments_changed)
+        self.load_history()
+
+    def load_history(self):
+        get_executor().submit(self.lead_repository.fetch_lead_history, self.lead_id,
+                              callback=self.history_loaded, key=(self, "history"))
+
+    def history_loaded(self, history):
+        self.history = history
+        self.history_list.clear()
+        for appointment in history:
+            notes = f"  {appointment.notes}" if appointment.notes else ""
+            self.history_list.addItem(
+                f"{appointment.start_time} to {appointment.end_time[11:]}  ({appointment.status_label}){notes}")
+
+    def appointments_changed(self, lead_ids):
+        if self.lead_id in lead_ids:
+            self.load_history()
+
+    def schedule(self):
+        start_time = self.start_input.dateTime().toString("yyyy-MM-dd HH:mm")
+        end_time = self.end_input.dateTime().toString("yyyy-MM-dd HH:mm")
+        if end_time <= start_time:
+            QMessageBox.warning(self, "Schedule", "The appointment must end after it starts.")
+            return
+        self.lead_repository.schedule_appointment(
+            appointments.Appointment(self.lead_id, start_time, end_time, notes=self.notes_input.text()))
+        self.notes_input.clear()
+
+    def set_status(self):
+        row = self.history_list.currentRow()
+        if 0 <= row < len(self.history):
+            self.lead_repository.set_appointment_status(self.history[row], self.status_dropdown.currentIndex())
+
+class NearbyLeadsDialog(QDialog):
+    """Leads within some miles of one lead, nearest first, and a route through the ones picked."""
+    def __init__(self, lead_repository, lead_id, name, parent=None):
+        super().__init__(parent)
+        self.lead_repository = lead_repository
+        self.lead_id = lead_id
+        self.name = name
+        self.nearby = []
+        self.setWindowTitle(f"Nearby Leads - {name}")
+
+        self.miles_input = QLineEdit(str(NEARBY_MILES))
+        self.miles_input.returnPressed.connect(self.search)
+        self.status_dropdown = QComboBox()
+        self.status_dropdown.addItems(["Any Status"] + list(STATUS_MAPPING.values()))
+        self.search_button = QPushButton("Search")
+        self.search_button.clicked.connect(self.search)
+
+        self.results_table = QTableWidget(0, 6)
+        self.results_table.setHorizontalHeaderLabels(["Miles", "Name", "Status", "Phone", "Address", "Zipcode"])
+        self.results_table.horizontalHeader().setSectionResizeMode(QHeaderView.Stretch)
+        self.results_table.setSelectionBehavior(QTableWidget.SelectRows)
+        self.results_table.setEditTriggers(QTableWidget.NoEditTriggers)
+
+        self.summary_label = QLabel()
+        self.route_button = QPushButton("Plan Route...")
+        self.route_button.clicked.connect(self.plan_route)
+
+        search_layout = QHBoxLayout()
+        search_layout.addWidget(QLabel("Within"))
+        search_layout.addWidget(self.miles_input)
+        search_layout.addWidget(QLabel("miles"))
+        search_layout.addWidget(self.status_dropdown)
+        search_layout.addWidget(self.search_button)
+
+        layout = QVBoxLayout()
+        layout.addLayout(search_layout)
+        layout.addWidget(self.results_table)
+        layout.addWidget(self.summary_label)
+        layout.addWidget(self.route_button, alignment=Qt.AlignCenter)
+        self.setLayout(layout)
+        self.resize(800, 500)
+
+        self.search()
+
+    def search(self):
+        try:
+            miles = float(self.miles_input.text())
+        except ValueError:
+            miles = 0
+        if miles <= 0:
+            QMessageBox.warning(self, "Nearby Leads", "Enter the distance in miles, e.g. 15.")
+            return
+        status = self.status_dropdown.currentIndex() - 1
+        filters = {"lead_status": status} if status >= 0 else {}
+        get_executor().submit(self.lead_repository.fetch_nearby, self.lead_id, miles, filters,
+                              callback=self.results_loaded, key=(self, "nearby"))
+
+    def results_loaded(self, nearby):
+        self.results_table.setRowCount(0)
+        if nearby is None:
+            self.nearby = []
+            self.summary_label.setText(
+                "This lead's ZIP code isn't in the loaded ZIP codes. Load them from the Contractor Leads Input tab.")
+            return
+        nearby = [(miles, lead) for miles, lead in nearby if lead.id != self.lead_id]
+        self.nearby = nearby[:NEARBY_SHOWN]
+        self.results_table.setRowCount(len(self.nearby))
+        for row, (miles, lead) in enumerate(self.nearby):
+            name = " ".join(part for part in (lead.first_name, lead.last_name) if part) or f"Lead {lead.id}"
+            for column, value in enumerate((f"{miles:.1f}", name, lead.status_label, lead.phone,
+                                            lead.address_line1, lead.zipcode)):
+                self.results_table.setItem(row, column, QTableWidgetItem(value or ""))
+        shown = f"; showing the nearest {NEARBY_SHOWN}" if len(nearby) > NEARBY_SHOWN else ""
+        self.summary_label.setText(f"{len(nearby)} leads{shown}. Select the ones to visit and plan a route.")
+
+    def plan_route(self):
+        rows = sorted(index.row() for index in self.results_table.selectionModel().selectedRows())
+        if not rows:
+            QMessageBox.information(self, "Plan Route", "Select the leads to visit first.")
+            return
+        lead_ids = [self.nearby[row][1].id for row in rows]
+        dialog = RouteDialog(self.lead_repository, lead_ids, f"Route from {self.name}", self.lead_id, self)
+        dialog.setAttribute(Qt.WA_DeleteOnClose)
+        dialog.show()
+
+class RouteDialog(QDialog):
+    """An order to visit some leads in that keeps the driving short, by straight-line miles between ZIP codes."""
+    def __init__(self, lead_repository, lead_ids, title, start_lead_id=None, parent=None):
+        super().__init__(parent)
+        self.lead_repository = lead_repository
+        self.lead_ids = list(lead_ids)
+        self.start_lead_id = start_lead_id
+        self.setWindowTitle(title)
+
+        self.start_zip_input = QLineEdit()
+        self.start_zip_input.setPlaceholderText(
+            "Start ZIP code (default: the first lead's)" if start_lead_id is not None else "Start ZIP code (optional)")
+        self.start_zip_input.returnPressed.connect(self.plan)
+        self.round_trip_checkbox = QCheckBox("Return to start")
+        self.plan_button = QPushButton("Plan")
+        self.plan_button.clicked.connect(self.plan)
+
+        self.stops_list = QListWidget()
+        self.summary_label = QLabel()
+
+        start_layout = QHBoxLayout()
+        start_layout.addWidget(self.start_zip_input)
+        start_layout.addWidget(self.round_trip_checkbox)
+        start_layout.addWidget(self.plan_button)
+
+        layout = QVBoxLayout()
+        layout.addLayout(start_layout)
+        layout.addWidget(self.stops_list)
+        layout.addWidget(self.summary_label)
+        self.setLayout(layout)
+        self.resize(600, 400)
+
+        self.plan()
+
+    def plan(self):
+        get_executor().submit(self.lead_repository.plan_route, self.lead_ids, self.start_lead_id,
+                              self.start_zip_input.text().strip(), self.round_trip_checkbox.isChecked(),
+                              callback=self.route_planned, error=self.route_failed, key=(self, "route"))
+
+    def route_planned(self, planned):
+        route, miles, unlocated = planned
+        self.stops_list.clear()
+        for stop, (lead, leg) in enumerate(route, 1):
+            name = " ".join(part for part in (lead.first_name, lead.last_name) if part) or f"Lead {lead.id}"
+            details = "  ".join(part for part in (lead.phone, lead.address_line1, lead.city, lead.zipcode) if part)
+            self.stops_list.addItem(f"{stop}. +{leg:.1f} mi  {name}  {details}")
+        for lead in unlocated:
+            name = " ".join(part for part in (lead.first_name, lead.last_name) if part) or f"Lead {lead.id}"
+            self.stops_list.addItem(f"?  {name}  ZIP code {lead.zipcode or '(none)'} isn't loaded")
+        summary = f"{len(route)} stops, {miles:.1f} miles"
+        if unlocated:
+            summary += f"; {len(unlocated)} leads couldn't be placed and are listed last"
+        self.summary_label.setText(summary + ".")
+
+    def route_failed(self, error):
+        QMessageBox.warning(self, "Plan Route", str(error))
+
+class LeadsTableTab(QWidget):
+    def __init__(self, lead_repository):
+        super().__init__()
+
+        self.lead_repository = lead_repository
+        self.edit_mode = False
+
+        self.model = LeadsTableModel(self.lead_repository, parent=self)
+
+        self.table = QTableView(self)
+        self.table.setModel(self.model)
+        self.table.horizontalHeader().setSectionResizeMode(QHeaderView.Stretch)
+
+        # Whole rows are selected, any number of them, for the bulk actions below the table
+        self.table.setSelectionBehavior(QTableView.SelectRows)
+        self.table.setSelectionMode(QTableView.ExtendedSelection)
+        self.table.selectionModel().selectionChanged.connect(self.selection_changed)
+
+        # Clicking a header sorts in SQL through LeadsTableModel.sort; rows start in id order
+        self.table.horizontalHeader().setSortIndicator(-1, Qt.AscendingOrder)
+        self.table.setSortingEnabled(True)
+
+        # Fixed row heights let the view lay out rows without measuring each one
+        self.table.verticalHeader().setSectionResizeMode(QHeaderView.Fixed)
+        self.table.verticalHeader().setDefaultSectionSize(30)
+
+        # Cells are painted by delegates; an editor only exists for the cell being edited
+        self.table.setItemDelegate(CustomDelegate(self.table))
+        job_type_column = [column for _, column in LEAD_COLUMNS].index("job_type")
+        self.table.setItemDelegateForColumn(STATUS_COLUMN, ComboBoxDelegate(STATUS_MAPPING.values(), self.table))
+        self.table.setItemDelegateForColumn(job_type_column, ComboBoxDelegate(JOB_TYPES, self.table))
+        self.delete_delegate = ButtonDelegate("Delete", self.table)
+        self.delete_delegate.clicked.connect(self.delete_lead)
+        self.table.setItemDelegateForColumn(len(LEAD_COLUMNS), self.delete_delegate)
+
+        # Create the filter bar; typing restarts a short timer so only the last keystroke queries
+        self.filter_timer = QTimer(self)
+        self.filter_timer.setSingleShot(True)
+        self.filter_timer.setInterval(250)
+        self.filter_timer.timeout.connect(self.apply_filters)
+
+        self.filter_inputs = {}
+        filter_layout = QHBoxLayout()
+        for name, placeholder in [("name", "Name"), ("phone", "Phone"), ("email", "Email"), ("city", "City"),
+                                  ("state", "State"), ("zipcode", "Zipcode"), ("referred_by", "Referred By"),
+                                  ("text", "Search names, address and notes")]:
+            filter_input = QLineEdit()
+            filter_input.setPlaceholderText(placeholder)
+            filter_input.textChanged.connect(self.filter_timer.start)
+            filter_layout.addWidget(filter_input)
+            self.filter_inputs[name] = filter_input
+
+        self.job_type_filter = QComboBox()
+        self.job_type_filter.addItems(["Any Job Type"] + JOB_TYPES)
+        self.job_type_filter.currentIndexChanged.connect(self.filter_timer.start)
+        filter_layout.addWidget(self.job_type_filter)
+
+        self.status_filter = QComboBox()
+        self.status_filter.addItems(["Any Status"] + list(STATUS_MAPPING.values()))
+        self.status_filter.currentIndexChanged.connect(self.filter_timer.start)
+        filter_layout.addWidget(self.status_filter)
+        
+        # Bulk actions on the selected rows; each is one statement in one transaction
+        self.select_all_button = QPushButton("Select All")
+        self.select_all_button.clicked.connect(self.select_all)
+        self.selection_label = QLabel("0 selected")
+
+        self.bulk_status_dropdown = QComboBox()
+        self.bulk_status_dropdown.addItems(STATUS_MAPPING.values())
+        self.set_status_button = QPushButton("Set Status")
+        self.set_status_button.clicked.connect(
+            lambda: self.update_selected(lead_status=self.bulk_status_dropdown.currentIndex()))
+
+        self.bulk_job_type_dropdown = QComboBox()
+        self.bulk_job_type_dropdown.addItems(JOB_TYPES)
+        self.set_job_type_button = QPushButton("Set Job Type")
+        self.set_job_type_button.clicked.connect(
+            lambda: self.update_selected(job_type=self.bulk_job_type_dropdown.currentText()))
+
+        self.bulk_referred_to_input = QLineEdit()
+        self.bulk_referred_to_input.setPlaceholderText("Referred To")
+        self.set_referred_to_button = QPushButton("Set Referred To")
+        self.set_referred_to_button.clicked.connect(
+            lambda: self.update_selected(referred_to=self.bulk_referred_to_input.text().strip()))
+
+        self.delete_selected_button = QPushButton("Delete Selected")
+        self.delete_selected_button.clicked.connect(self.delete_selected)
+
+        # Batches deleted from this tab, latest last; each Undo restores one
+        self.undo_batches = []
+        self.undo_delete_button = QPushButton("Undo Delete")
+        self.undo_delete_button.setEnabled(False)
+        self.undo_delete_button.clicked.connect(self.undo_delete)
+
+        self.export_selected_button = QPushButton("Export Selected...")
+        self.export_selected_button.clicked.connect(self.export_selected)
+
+        bulk_layout = QHBoxLayout()
+        bulk_layout.addWidget(self.select_all_button)
+        bulk_layout.addWidget(self.selection_label)
+        bulk_layout.addStretch()
+        for widget in (self.bulk_status_dropdown, self.set_status_button, self.bulk_job_type_dropdown,
+                       self.set_job_type_button, self.bulk_referred_to_input, self.set_referred_to_button,
+                       self.delete_selected_button, self.undo_delete_button, self.export_selected_button):
+            bulk_layout.addWidget(widget)
+
+        # Create the refresh button
+        self.refresh_button = QPushButton("Refresh")
+        self.refresh_button.clicked.connect(self.populate_table)
+
+        # Create the export buttons
+        self.export_csv_button = QPushButton("Export to CSV")
+        self.export_csv_button.clicked.connect(self.export_to_csv)
+        self.export_pdf_button = QPushButton("Export to PDF")
+        self.export_pdf_button.clicked.connect(self.export_to_pdf)
+        self.export_txt_button = QPushButton("Export to TXT")
+        self.export_txt_button.clicked.connect(self.export_to_txt)
+
+        self.find_duplicates_button = QPushButton("Find Duplicates")
+        self.find_duplicates_button.clicked.connect(self.find_duplicates)
+
+        self.appointments_button = QPushButton("Appointments...")
+        self.appointments_button.clicked.connect(self.show_appointments)
+
+        self.nearby_button = QPushButton("Nearby Leads...")
+        self.nearby_button.clicked.connect(self.show_nearby)
+
+        # Create the toggle edit mode button
+        self.toggle_edit_button = QPushButton("Toggle Edit Mode")
+        self.toggle_edit_button.clicked.connect(self.toggle_edit_mode)
+
+        # Modify the button sizes here
+        button_width = 120
+        button_height = 30
+
+        # Set fixed sizes for the buttons
+        self.refresh_button.setFixedSize(button_width, button_height)
+        self.export_csv_button.setFixedSize(button_width, button_height)
+        self.export_pdf_button.setFixedSize(button_width, button_height)
+        self.export_txt_button.setFixedSize(button_width, button_height)
+        self.toggle_edit_button.setFixedSize(button_width, button_height)
+        self.find_duplicates_button.setFixedSize(button_width, button_height)
+        self.appointments_button.setFixedSize(button_width, button_height)
+        self.nearby_button.setFixedSize(button_width, button_height)
+
+        # Create a layout for the export buttons
+        export_button_layout = QVBoxLayout()
+        export_button_layout.addWidget(self.export_csv_button)
+        export_button_layout.addWidget(self.export_pdf_button)
+        export_button_layout.addWidget(self.export_txt_button)
+
+        # Create a layout for the buttons and set alignment
+        button_layout = QVBoxLayout()
+        button_layout.addWidget(self.refresh_button)
+        button_layout.addLayout(export_button_layout)
+        button_layout.addWidget(self.toggle_edit_button)
+        button_layout.addWidget(self.find_duplicates_button)
+        button_layout.addWidget(self.appointments_button)
+        button_layout.addWidget(self.nearby_button)
+        button_layout.setAlignment(Qt.AlignCenter)  # Center-align the buttons vertically
+
+        # Create the main layout for the tab
+        layout = QVBoxLayout()
+        layout.addLayout(filter_layout)
+        layout.addWidget(self.table)
+        layout.addLayout(bulk_layout)
+        layout.addLayout(button_layout)  # Add the button layout to the main layout
+
+        self.setLayout(layout)
+
+        self.populate_table()
+
+
+    def toggle_edit_mode(self):
+        self.edit_mode = not self.edit_mode
+        self.model.edit_mode = self.edit_mode
+        
+        self.toggle_edit_button.setText("Editing Enabled" if self.edit_mode else "Editing Disabled")
+
+    def populate_table(self):
+        # Only the first page is loaded here; the view asks the model for more as it scrolls
+        self.model.refresh()
+
+    def apply_filters(self):
+        filters = {name: filter_input.text() for name, filter_input in self.filter_inputs.items()}
+        if self.job_type_filter.currentIndex() > 0:
+            filters["job_type"] = self.job_type_filter.currentText()
+        if self.status_filter.currentIndex() > 0:
+            filters["lead_status"] = self.status_filter.currentIndex() - 1
+        self.model.set_filters(filters)
+        
+    def export_to_csv(self):
+        options = QFileDialog.Options()
+        options |= QFileDialog.DontUseNativeDialog
+        file_name, _ = QFileDialog.getSaveFileName(self, "Export to CSV", "", "CSV Files (*.csv);;All Files (*)", options=options)
+        if file_name:
+            import lead_export
+            self.start_export(lead_export.export_csv, file_name)
+
+    def export_to_pdf(self):
+        options = QFileDialog.Options()
+        options |= QFileDialog.DontUseNativeDialog
+        file_name, _ = QFileDialog.getSaveFileName(self, "Export to PDF", "", "PDF Files (*.pdf);;All Files (*)", options=options)
+        if file_name:
+            import lead_export
+            self.start_export(lead_export.export_pdf_parallel, file_name)
+
+    def export_to_txt(self):
+        options = QFileDialog.Options()
+        options |= QFileDialog.DontUseNativeDialog
+        file_name, _ = QFileDialog.getSaveFileName(self, "Export to TXT", "", "Text Files (*.txt);;All Files (*)", options=options)
+        if file_name:
+            import lead_export
+            self.start_export(lead_export.export_txt, file_name)
+
+    def start_export(self, export, file_name):
+        # Exports read the database on a worker thread so the window stays responsive
+        self.export_thread = LeadExportThread(export, file_name, LEADS_DATABASE, self)
+        self.export_progress = QProgressDialog("Exporting leads...", "Cancel", 0, 0, self)
+        self.export_progress.setWindowModality(Qt.WindowModal)
+        self.export_progress.setMinimumDuration(0)
+        self.export_progress.canceled.connect(self.export_thread.requestInterruption)
+        self.export_thread.progress.connect(self.export_progressed)
+        self.export_thread.export_finished.connect(self.export_finished)
+        self.export_thread.export_failed.connect(self.export_failed)
+        self.set_export_buttons_enabled(False)
+        self.export_thread.start()
+
+    def set_export_buttons_enabled(self, enabled):
+        self.export_csv_button.setEnabled(enabled)
+        self.export_pdf_button.setEnabled(enabled)
+        self.export_txt_button.setEnabled(enabled)
+        self.export_selected_button.setEnabled(enabled)
+
+    def export_progressed(self, exported, total):
+        self.export_progress.setMaximum(total)
+        self.export_progress.setValue(exported)
+        self.export_progress.setLabelText(f"Exported {exported} of {total} leads...")
+
+    def export_finished(self, file_name, exported, cancelled):
+        self.export_progress.reset()
+        self.set_export_buttons_enabled(True)
+        if not cancelled:
+            QMessageBox.information(self, "Export", f"Exported {exported} leads to {file_name}.")
+
+    def export_failed(self, error):
+        self.export_progress.reset()
+        self.set_export_buttons_enabled(True)
+        QMessageBox.warning(self, "Export", f"The export failed: {error}")
+
+    def current_lead(self, title):
+        """Return (lead id, name) for the current row, or None after asking for a selection."""
+        row = self.table.currentIndex().row()
+        if row < 0:
+            QMessageBox.information(self, title, "Select a lead first.")
+            return None
+        lead_id = self.model.lead_id(row)
+        columns = [column for _, column in LEAD_COLUMNS]
+        name = " ".join(self.model.data(self.model.index(row, columns.index(column))) or ""
+                        for column in ("first_name", "last_name")).strip() or f"Lead {lead_id}"
+        return lead_id, name
+
+    def show_appointments(self):
+        lead = self.current_lead("Appointments")
+        if lead is None:
+            return
+        dialog = AppointmentsDialog(self.lead_repository, *lead, self)
+        dialog.setAttribute(Qt.WA_DeleteOnClose)
+        dialog.show()
+
+    def show_nearby(self):
+        lead = self.current_lead("Nearby Leads")
+        if lead is None:
+            return
+        dialog = NearbyLeadsDialog(self.lead_repository, *lead, self)
+        dialog.setAttribute(Qt.WA_DeleteOnClose)
+        dialog.show()
+
+    def find_duplicates(self):
+        # Comparing a large table takes a while, so it runs on its own thread and connection
+        self.dedupe_thread = LeadDedupeThread(LEADS_DATABASE, self)
+        self.dedupe_progress = QProgressDialog("Looking for duplicate leads...", "Cancel", 0, 0, self)
+        self.dedupe_progress.setWindowModality(Qt.WindowModal)
+        self.dedupe_progress.setMinimumDuration(0)
+        self.dedupe_progress.canceled.connect(self.dedupe_thread.requestInterruption)
+        self.dedupe_thread.progress.connect(self.dedupe_progressed)
+        self.dedupe_thread.dedupe_finished.connect(self.dedupe_finished)
+        self.dedupe_thread.dedupe_failed.connect(self.dedupe_failed)
+        self.dedupe_thread.finished.connect(lambda: self.find_duplicates_button.setEnabled(True))
+        self.find_duplicates_button.setEnabled(False)
+        self.dedupe_thread.start()
+
+    def dedupe_progressed(self, done, total):
+        self.dedupe_progress.setMaximum(total)
+        self.dedupe_progress.setValue(done)
+
+    def dedupe_finished(self, groups):
+        self.dedupe_progress.reset()
+        if not groups:
+            QMessageBox.information(self, "Find Duplicates", "No duplicate leads found.")
+            return
+        duplicates = sum(len(group) - 1 for group in groups)
+        confirmation = QMessageBox.question(
+            self, "Find Duplicates",
+            f"Found {duplicates} duplicate leads in {len(groups)} groups. "
+            "Merge each group into its oldest lead? Blank fields are filled in from the duplicates "
+            "and their notes are combined.",
+            QMessageBox.Yes | QMessageBox.No, QMessageBox.No
+        )
+        if confirmation == QMessageBox.Yes:
+            self.lead_repository.merge_duplicates(groups)
+
+    def dedupe_failed(self, error):
+        self.dedupe_progress.reset()
+        QMessageBox.warning(self, "Find Duplicates", f"Looking for duplicates failed: {error}")
+
+    def delete_lead(self, row):
+        # Deletes can be undone, so there's nothing to confirm
+        self.lead_repository.delete_leads([self.model.lead_id(row)], callback=self.leads_deleted)
+
+    def selected_row_ranges(self):
+        """Return the selected rows as sorted, non-overlapping (first, last) ranges."""
+        ranges = sorted((selection.top(), selection.bottom()) for selection in self.table.selectionModel().selection())
+        merged = []
+        for first, last in ranges:
+            if merged and first <= merged[-1][1] + 1:
+                merged[-1][1] = max(merged[-1][1], last)
+            else:
+                merged.append([first, last])
+        return merged
+
+    def selected_lead_ids(self):
+        """The ids of the selected rows, in the order they're shown."""
+        lead_ids = array("q")
+        for first, last in self.selected_row_ranges():
+            lead_ids.extend(self.model.ids[first:last + 1])
+        return lead_ids.tolist()
+
+    def selection_changed(self):
+        selected = sum(last - first + 1 for first, last in self.selected_row_ranges())
+        self.selection_label.setText(f"{selected} selected")
+
+    def select_all(self):
+        # Rows load a page at a time, so every remaining row matching the filters is loaded first
+        self.select_all_button.setEnabled(False)
+
+        def loaded():
+            self.select_all_button.setEnabled(True)
+            self.table.selectAll()
+
+        self.model.fetch_all(loaded)
+
+    def update_selected(self, **changes):
+        lead_ids = self.selected_lead_ids()
+        if not lead_ids:
+            QMessageBox.information(self, "Bulk Edit", "Select leads first.")
+            return
+        self.lead_repository.update_leads(lead_ids, **changes)
+
+    def delete_selected(self):
+        lead_ids = self.selected_lead_ids()
+        if not lead_ids:
+            QMessageBox.information(self, "Delete Selected", "Select leads first.")
+            return
+        self.lead_repository.delete_leads(lead_ids, callback=self.leads_deleted)
+
+    def leads_deleted(self, result):
+        batch, deleted = result
+        if deleted:
+            self.undo_batches.append((batch, deleted))
+            self.update_undo_button()
+
+    def undo_delete(self):
+        if self.undo_batches:
+            batch, _ = self.undo_batches.pop()
+            self.lead_repository.restore_leads(batch)
+            self.update_undo_button()
+
+    def update_undo_button(self):
+        if self.undo_batches:
+            self.undo_delete_button.setText(f"Undo Delete ({self.undo_batches[-1][1]})")
+            self.undo_delete_button.setEnabled(True)
+        else:
+            self.undo_delete_button.setText("Undo Delete")
+            self.undo_delete_button.setEnabled(False)
+
+    def export_selected(self):
+        lead_ids = self.selected_lead_ids()
+        if not lead_ids:
+            QMessageBox.information(self, "Export Selected", "Select leads first.")
+            return
+        options = QFileDialog.Options()
+        options |= QFileDialog.DontUseNativeDialog
+        file_name, file_filter = QFileDialog.getSaveFileName(
+            self, "Export Selected", "", "CSV Files (*.csv);;PDF Files (*.pdf);;Text Files (*.txt)", options=options)
+        if not file_name:
+            return
+        extension = os.path.splitext(file_name)[1].lower()
+        if extension not in (".csv", ".pdf", ".txt"):
+            # No extension typed; take the format from the chosen file type
+            extension = next((ext for ext in (".pdf", ".txt") if f"*{ext}" in file_filter), ".csv")
+            file_name += extension
+        import lead_export
+        export = {".csv": lead_export.export_csv, ".pdf": lead_export.export_pdf, ".txt": lead_export.export_txt}[extension]
+        self.start_export(functools.partial(export, lead_ids=lead_ids), file_name)
+
+class DashboardTab(QWidget):
+    """Lead pipeline numbers, read from the counts the database keeps up to date (see lead_counts).
+
+    Loading them costs the same however many leads there are, so the dashboard simply
+    reloads shortly after any leads are added, edited or deleted.
+    """
+    def __init__(self, lead_repository):
+        super().__init__()
+
+        self.lead_repository = lead_repository
+
+        self.total_label = QLabel()
+        self.total_label.setFont(QFont("Arial", 14, QFont.Bold))
+
+        self.status_table = self.counts_table("Status")
+        self.job_type_table = self.counts_table("Job Type")
+        self.referred_by_table = self.counts_table("Referred By")
+        self.city_table = self.counts_table("City")
+        self.week_table = self.counts_table("Week Of")
+
+        layout = QGridLayout()
+        layout.addWidget(self.total_label, 0, 0, 1, 3)
+        layout.addWidget(self.status_table, 1, 0)
+        layout.addWidget(self.job_type_table, 1, 1)
+        layout.addWidget(self.week_table, 1, 2)
+        layout.addWidget(self.referred_by_table, 2, 0)
+        layout.addWidget(self.city_table, 2, 1)
+        self.setLayout(layout)
+
+        self.refresh_timer = QTimer(self)
+        self.refresh_timer.setSingleShot(True)
+        self.refresh_timer.setInterval(500)
+        self.refresh_timer.timeout.connect(self.load_stats)
+        self.lead_repository.leadsInserted.connect(self.refresh_timer.start)
+        self.lead_repository.leadsChanged.connect(self.refresh_timer.start)
+        self.lead_repository.leadsRemoved.connect(self.refresh_timer.start)
+
+        self.load_stats()
+
+    def counts_table(self, title):
+        table = QTableWidget(0, 3)
+        table.setHorizontalHeaderLabels([title, "Leads", "Share"])
+        table.horizontalHeader().setSectionResizeMode(QHeaderView.Stretch)
+        table.verticalHeader().setVisible(False)
+        table.setEditTriggers(QTableWidget.NoEditTriggers)
+        return table
+
+    def load_stats(self):
+        get_executor().submit(lambda: leads.lead_stats(self.lead_repository.leads_db.reader()),
+                              callback=self.show_stats, key="lead_stats")
+
+    def show_stats(self, stats):
+        total = stats["total"]
+        self.total_label.setText(f"{total:,} leads")
+        for table, key in [(self.status_table, "by_status"), (self.job_type_table, "by_job_type"),
+                           (self.referred_by_table, "by_referred_by"), (self.city_table, "by_city"),
+                           (self.week_table, "by_week")]:
+            counts = stats[key]
+            table.setRowCount(len(counts))
+            for row, (value, count) in enumerate(counts.items()):
+                share = f"{count / total:.0%}" if total else ""
+                for column, text in enumerate([value or "(none)", f"{count:,}", share]):
+                    item = QTableWidgetItem(text)
+                    if column:
+                        item.setTextAlignment(Qt.AlignRight | Qt.AlignVCenter)
+                    table.setItem(row, column, item)
+
+class CalendarTab(QWidget):
+    def __init__(self, calendar_db, lead_repository=None):
+        super().__init__()
+
+        self.calendar_db = calendar_db
+
+        self.tab_widget = QTabWidget(self)
+        self.offline_calendar_tab = OfflineCalendarTab(self.calendar_db, lead_repository)
+        self.google_calendar_tab = GoogleCalendarTab()
+        self.calendly_tab = CalendlyTab()
+        
+        self.tab_widget.addTab(self.offline_calendar_tab, "Offline Calendar")
+        self.tab_widget.addTab(self.google_calendar_tab, "Google Calendar")
+        self.tab_widget.addTab(self.calendly_tab, "Calendly")
+
+        layout = QVBoxLayout()
+        layout.addWidget(self.tab_widget)
+        self.setLayout(layout)
+
+def month_of(date):
+    """The (year, month) cache key for a "yyyy-MM-dd" date."""
+    return int(date[:4]), int(date[5:7])
+
+def set_month_notes(month, date, text):
+    if text:
+        month.notes[date] = text
+    else:
+        month.notes.pop(date, None)
+
+def adjacent_months(year, month):
+    return [(year - 1, 12) if month == 1 else (year, month - 1), (year, month),
+            (year + 1, 1) if month == 12 else (year, month + 1)]
+
+class CalendarMonth:
+    """What the calendar shows for one month: {date: notes} and {date: [(Appointment, Lead)]}."""
+    __slots__ = ("year", "month", "notes", "appointments")
+
+    def __init__(self, year, month, notes, appointments):
+        self.year = year
+        self.month = month
+        self.notes = notes
+        self.appointments = appointments
+
+    def busy_dates(self):
+        return self.notes.keys() | self.appointments.keys()
+
+class CalendarNotesCache:
+    """Calendar notes and appointments for recently viewed months, read a whole month per query.
+
+    Months are evicted least recently used first. Loads run on the database thread and
+    lookups on the GUI thread, so the cache is guarded by a lock. Appointments are only
+    loaded when a leads database is given.
+    """
+    def __init__(self, calendar_db, leads_db=None, capacity=CALENDAR_CACHED_MONTHS):
+        self.calendar_db = calendar_db
+        self.leads_db = leads_db
+        self.capacity = capacity
+        self.months = OrderedDict()
+        # Notes saved from the GUI whose write hasn't committed yet, applied over any month read before it did
+        self.unsaved = {}
+        self.lock = threading.Lock()
+
+    def cached_month(self, year, month):
+        """Return the CalendarMonth if it is loaded, else None."""
+        with self.lock:
+            calendar_month = self.months.get((year, month))
+            if calendar_month is not None:
+                self.months.move_to_end((year, month))
+            return calendar_month
+
+    def load_month(self, year, month):
+        # Date and start_time both sort as text, so a month is one range scan of an index in each database
+        first_day = f"{year:04d}-{month:02d}-01"
+        next_year, next_month = adjacent_months(year, month)[2]
+        next_first_day = f"{next_year:04d}-{next_month:02d}-01"
+        notes = {}
+        month_appointments = {}
+        try:
+            rows = self.calendar_db.reader().execute(
+                "SELECT Date, Notes FROM Calendar WHERE Date >= ? AND Date < ?", (first_day, next_first_day)).fetchall()
+            notes = {date: text for date, text in rows if text}
+            if self.leads_db is not None:
+                for appointment, lead in appointments.agenda(self.leads_db.reader(), first_day, next_first_day):
+                    month_appointments.setdefault(appointment.start_time[:10], []).append((appointment, lead))
+        except sqlite3.Error as e:
+            print(e)
+        calendar_month = CalendarMonth(year, month, notes, month_appointments)
+        with self.lock:
+            for date, text in self.unsaved.items():
+                if month_of(date) == (year, month):
+                    set_month_notes(calendar_month, date, text)
+            self.months[(year, month)] = calendar_month
+            self.months.move_to_end((year, month))
+            while len(self.months) > self.capacity:
+                self.months.popitem(last=False)
+        return calendar_month
+
+    def month(self, date):
+        """The CalendarMonth holding date, loading it if it isn't cached."""
+        calendar_month = self.cached_month(*month_of(date))
+        if calendar_month is None:
+            calendar_month = self.load_month(*month_of(date))
+        return calendar_month
+
+    def notes(self, date):
+        return self.month(date).notes.get(date, "")
+
+    def set_notes(self, date, text):
+        """Record notes saved from the GUI; call saved() once they are written."""
+        with self.lock:
+            self.unsaved[date] = text
+            calendar_month = self.months.get(month_of(date))
+            if calendar_month is not None:
+                set_month_notes(calendar_month, date, text)
+
+    def saved(self, date, text):
+        with self.lock:
+            if self.unsaved.get(date) == text:
+                del self.unsaved[date]
+
+    def evict_leads(self, lead_ids):
+        """Drop the months showing an appointment with any of lead_ids; returns whether any were dropped."""
+        lead_ids = set(lead_ids)
+        with self.lock:
+            stale = [key for key, calendar_month in self.months.items()
+                     if any(appointment.lead_id in lead_ids
+                            for day_appointments in calendar_month.appointments.values()
+                            for appointment, _ in day_appointments)]
+            for key in stale:
+                del self.months[key]
+        return bool(stale)
+
+    def clear(self):
+        with self.lock:
+            self.months.clear()
+
+class OfflineCalendarTab(QWidget):
+    def __init__(self, calendar_db, lead_repository=None):
+        super().__init__()
+
+        self.calendar_db = calendar_db
+        self.lead_repository = lead_repository
+        self.notes_cache = CalendarNotesCache(calendar_db, lead_repository and lead_repository.leads_db)
+        self.day_appointments = []
+
+        self.busy_format = QTextCharFormat()
+        self.busy_format.setFontWeight(QFont.Bold)
+        self.busy_format.setForeground(QColor("darkblue"))
+
+        self.calendar = QCalendarWidget(self)
+        self.calendar.selectionChanged.connect(self.populate_notes)
+        self.calendar.currentPageChanged.connect(self.show_month)
+
+        self.appointments_list = QListWidget()
+        self.appointments_list.setMaximumHeight(100)
+
+        self.route_button = QPushButton("Plan Route")
+        self.route_button.clicked.connect(self.plan_route)
+
+        self.notes_input = QTextEdit()
+
+        self.refresh_button = QPushButton("Refresh")
+        self.refresh_button.clicked.connect(self.refresh)
+
+        self.save_button = QPushButton("Save Notes")
+        self.save_button.clicked.connect(self.save_notes)
+
+        layout = QVBoxLayout()
+        layout.addWidget(self.calendar)
+        if lead_repository is not None:
+            layout.addWidget(QLabel("Appointments:"))
+            layout.addWidget(self.appointments_list)
+            layout.addWidget(self.route_button)
+            lead_repository.appointmentsChanged.connect(self.appointments_changed)
+            # Editing or deleting a lead only touches the months showing its appointments
+            lead_repository.leadsChanged.connect(self.leads_changed)
+            lead_repository.leadsRemoved.connect(self.leads_changed)
+        layout.addWidget(self.notes_input)
+        layout.addWidget(self.refresh_button)
+        layout.addWidget(self.save_button)
+        self.setLayout(layout)
+
+        self.show_month(self.calendar.yearShown(), self.calendar.monthShown())
+        self.populate_notes()
+
+    def selected_date(self):
+        return self.calendar.selectedDate().toString("yyyy-MM-dd")
+
+    def show_month(self, year, month):
+        # The page also shows days of the months either side, and they are the likely next pages
+        for year, month in adjacent_months(year, month):
+            calendar_month = self.notes_cache.cached_month(year, month)
+            if calendar_month is None:
+                get_executor().submit(self.notes_cache.load_month, year, month,
+                                      callback=self.month_loaded, key=(self, "month", year, month))
+            else:
+                self.month_loaded(calendar_month)
+
+    def month_loaded(self, calendar_month):
+        busy_dates = calendar_month.busy_dates()
+        day = QDate(calendar_month.year, calendar_month.month, 1)
+        for _ in range(day.daysInMonth()):
+            busy = day.toString("yyyy-MM-dd") in busy_dates
+            self.calendar.setDateTextFormat(day, self.busy_format if busy else QTextCharFormat())
+            day = day.addDays(1)
+        selected_date = self.selected_date()
+        if month_of(selected_date) == (calendar_month.year, calendar_month.month):
+            self.show_appointments(calendar_month.appointments.get(selected_date, []))
+
+    def show_appointments(self, day_appointments):
+        self.day_appointments = day_appointments
+        self.appointments_list.clear()
+        for appointment, lead in day_appointments:
+            name = " ".join(part for part in (lead.first_name, lead.last_name) if part) or f"Lead {lead.id}"
+            details = "  ".join(part for part in (lead.phone, lead.address_line1, lead.city) if part)
+            self.appointments_list.addItem(
+                f"{appointment.start_time[11:]}-{appointment.end_time[11:]}  {name}  {details}  ({appointment.status_label})")
+
+    def plan_route(self):
+        # As with `leads.py route --day`, only the appointments still scheduled
+        lead_ids = [appointment.lead_id for appointment, _ in self.day_appointments
+                    if appointment.status == appointments.APPOINTMENT_STATUSES.index("Scheduled")]
+        if not lead_ids:
+            QMessageBox.information(self, "Plan Route", "There are no scheduled appointments on this day.")
+            return
+        dialog = RouteDialog(self.lead_repository, lead_ids, f"Route - {self.selected_date()}", parent=self)
+        dialog.setAttribute(Qt.WA_DeleteOnClose)
+        dialog.show()
+
+    def populate_notes(self):
+        selected_date = self.selected_date()
+        calendar_month = self.notes_cache.cached_month(*month_of(selected_date))
+        if calendar_month is not None:
+            self.date_loaded((selected_date, calendar_month))
+            return
+        # Keyed so that clicking through dates quickly only loads the last one selected
+        get_executor().submit(self.get_notes, selected_date, callback=self.date_loaded, key=(self, "notes"))
+
+    def date_loaded(self, loaded):
+        date, calendar_month = loaded
+        if date == self.selected_date():
+            self.notes_input.setPlainText(calendar_month.notes.get(date, ""))
+            self.show_appointments(calendar_month.appointments.get(date, []))
+
+    def get_notes(self, date):
+        return date, self.notes_cache.month(date)
+
+    def appointments_changed(self, lead_ids):
+        # An appointment can land in any month; reload the visible ones without touching the
+        # notes box, which may hold unsaved text
+        self.notes_cache.clear()
+        self.show_month(self.calendar.yearShown(), self.calendar.monthShown())
+
+    def leads_changed(self, lead_ids):
+        if self.notes_cache.evict_leads(lead_ids):
+            self.show_month(self.calendar.yearShown(), self.calendar.monthShown())
+
+    def refresh(self):
+        self.notes_cache.clear()
+        self.calendar.setDateTextFormat(QDate(), QTextCharFormat())
+        self.show_month(self.calendar.yearShown(), self.calendar.monthShown())
+        self.populate_notes()
+
+    def save_notes(self):
+        selected_date = self.selected_date()
+        notes = self.notes_input.toPlainText()
+        # Update the cache and the date's format straight away; the write follows on the database thread
+        self.notes_cache.set_notes(selected_date, notes)
+        calendar_month = self.notes_cache.cached_month(*month_of(selected_date))
+        busy = bool(notes) or bool(calendar_month and selected_date in calendar_month.appointments)
+        self.calendar.setDateTextFormat(self.calendar.selectedDate(), self.busy_format if busy else QTextCharFormat())
+        get_executor().submit(self.store_notes, selected_date, notes)
+
+    def store_notes(self, date, notes):
+        try:
+            with self.calendar_db.transaction() as connection:
+                connection.execute("INSERT OR REPLACE INTO Calendar (Date, Notes) VALUES (?, ?)", (date, notes))
+        except sqlite3.Error as e:
+            print(e)
+        else:
+            self.notes_cache.saved(date, notes)
+
+class GoogleCalendarTab(QWidget):
+    def __init__(self):
+        super().__init__()
+
+        self.label = QLabel("Google Calendar - Coming Soon")
+        self.label.setAlignment(Qt.AlignCenter)
+
+        layout = QVBoxLayout()
+        layout.addWidget(self.label)
+        self.setLayout(layout)
+
+class CalendlyTab(QWidget):
+    def __init__(self):
+        super().__init__()
+
+        self.label = QLabel("Calendly - Coming Soon")
+        self.label.setAlignment(Qt.AlignCenter)
+
+        layout = QVBoxLayout()
+        layout.addWidget(self.label)
+        self.setLayout(layout)
+
+class IntegrationsTab(QWidget):
+    def __init__(self):
+        super().__init__()
+
+        self.tabs = QTabWidget(self)
+
+        self.twilio_integration_tab = TwilioIntegrationTab()
+        self.google_integration_tab = GoogleIntegrationTab()  # Create a class for Google Integration
+        self.zapier_integration_tab = ZapierIntegrationTab()  # Create a class for Zapier Integration
+
+        self.tabs.addTab(self.twilio_integration_tab, "Twilio")
+        self.tabs.addTab(self.google_integration_tab, "Google")
+        self.tabs.addTab(self.zapier_integration_tab, "Zapier")
+
+        layout = QVBoxLayout()
+        layout.addWidget(self.tabs)
+        self.setLayout(layout)
+
+class EmailTab(QWidget):
+    def __init__(self, lead_repository):
+        super().__init__()
+
+        self.tabs = QTabWidget(self)
+
+        self.campaigns_tab = EmailCampaignTab(lead_repository)
+        self.smtp_settings_tab = SmtpSettingsTab()
+
+        self.tabs.addTab(self.campaigns_tab, "Campaigns")
+        self.tabs.addTab(self.smtp_settings_tab, "SMTP")
+
+        layout = QVBoxLayout()
+        layout.addWidget(self.tabs)
+        self.setLayout(layout)
+
+class EmailCampaignTab(QWidget):
+    """Email campaigns to leads over the SMTP server saved on the SMTP tab.
+
+    Works like MessagingTab: queuing renders one message per matching lead into the
+    email queue, and Send Queued drains it on an EmailWorkerThread.
+    """
+    def __init__(self, lead_repository):
+        import email_queue
+
+        super().__init__()
+
+        self.lead_repository = lead_repository
+        self.worker_thread = None
+
+        self.campaign_input = QLineEdit()
+        self.campaign_input.setPlaceholderText("Campaign name")
+        self.subject_input = QLineEdit()
+        self.subject_input.setPlaceholderText("Subject, e.g. A quote for your $city project")
+        self.body_input = QTextEdit()
+        self.body_input.setPlaceholderText("Hi $first_name, ... ($first_name, $last_name, $city etc. are filled in per lead)")
+
+        self.city_filter = QLineEdit()
+        self.city_filter.setPlaceholderText("City")
+        self.text_filter = QLineEdit()
+        self.text_filter.setPlaceholderText("Search names, address and notes")
+        self.job_type_filter = QComboBox()
+        self.job_type_filter.addItems(["Any Job Type"] + JOB_TYPES)
+        self.status_filter = QComboBox()
+        self.status_filter.addItems(["Any Status"] + list(STATUS_MAPPING.values()))
+
+        self.queue_button = QPushButton("Queue Campaign")
+        self.queue_button.clicked.connect(self.queue_campaign)
+
+        filter_layout = QHBoxLayout()
+        filter_layout.addWidget(self.city_filter)
+        filter_layout.addWidget(self.text_filter)
+        filter_layout.addWidget(self.job_type_filter)
+        filter_layout.addWidget(self.status_filter)
+        filter_layout.addWidget(self.queue_button)
+
+        campaign_layout = QVBoxLayout()
+        campaign_layout.addWidget(self.campaign_input)
+        campaign_layout.addWidget(self.subject_input)
+        campaign_layout.addWidget(self.body_input)
+        campaign_layout.addLayout(filter_layout)
+        self.group_box = QGroupBox("New Campaign")
+        self.group_box.setLayout(campaign_layout)
+
+        self.campaigns_table = QTableWidget(0, 2 + len(email_queue.MESSAGE_STATUSES))
+        self.campaigns_table.setHorizontalHeaderLabels(
+            ["Campaign", "Created"] + [status.title() for status in email_queue.MESSAGE_STATUSES])
+        self.campaigns_table.horizontalHeader().setSectionResizeMode(QHeaderView.Stretch)
+        self.campaigns_table.setEditTriggers(QTableWidget.NoEditTriggers)
+
+        self.rate_input = QLineEdit(str(email_queue.DEFAULT_RATE))
+        self.rate_input.setFixedWidth(60)
+        self.send_button = QPushButton("Send Queued")
+        self.send_button.clicked.connect(self.send_queued)
+        self.stop_button = QPushButton("Stop Sending")
+        self.stop_button.clicked.connect(self.stop_sending)
+        self.stop_button.setEnabled(False)
+        self.status_label = QLabel()
+
+        button_layout = QHBoxLayout()
+        button_layout.addWidget(QLabel("Emails per second:"))
+        button_layout.addWidget(self.rate_input)
+        button_layout.addWidget(self.send_button)
+        button_layout.addWidget(self.stop_button)
+        button_layout.addWidget(self.status_label)
+        button_layout.addStretch()
+
+        layout = QVBoxLayout()
+        layout.addWidget(self.group_box)
+        layout.addWidget(self.campaigns_table)
+        layout.addLayout(button_layout)
+        self.setLayout(layout)
+
+        self.load_campaigns()
+
+    def filters(self):
+        filters = {"city": self.city_filter.text(), "text": self.text_filter.text()}
+        if self.job_type_filter.currentIndex() > 0:
+            filters["job_type"] = self.job_type_filter.currentText()
+        if self.status_filter.currentIndex() > 0:
+            filters["lead_status"] = self.status_filter.currentIndex() - 1
+        return filters
+
+    def queue_campaign(self):
+        name = self.campaign_input.text().strip()
+        subject = self.subject_input.text().strip()
+        body = self.body_input.toPlainText().strip()
+        if not name or not subject or not body:
+            QMessageBox.information(self, "Email", "Give the campaign a name, a subject and a message.")
+            return
+        self.queue_button.setEnabled(False)
+        get_executor().submit(self.enqueue, name, subject, body, self.filters(),
+                              callback=self.campaign_queued, error=self.queue_failed)
+
+    def enqueue(self, name, subject, body, filters):
+        import email_queue
+
+        with database.get_database(EMAIL_DATABASE).transaction() as connection:
+            return email_queue.enqueue_campaign(
+                connection, self.lead_repository.leads_db.reader(), name, subject, body, filters)
+
+    def campaign_queued(self, result):
+        campaign_id, queued, skipped = result
+        self.queue_button.setEnabled(True)
+        self.campaign_input.clear()
+        self.status_label.setText(f"{queued} emails queued, {skipped} leads without an email address")
+        self.load_campaigns()
+
+    def queue_failed(self, error):
+        self.queue_button.setEnabled(True)
+        print(error)
+
+    def load_campaigns(self):
+        import email_queue
+
+        get_executor().submit(
+            lambda: email_queue.campaign_summaries(database.get_database(EMAIL_DATABASE).reader()),
+            callback=self.show_campaigns, key="email_campaigns")
+
+    def show_campaigns(self, summaries):
+        import email_queue
+
+        self.campaigns_table.setRowCount(len(summaries))
+        for row, (campaign_id, name, created_at, counts) in enumerate(summaries):
+            values = [name, created_at] + [str(counts[status]) for status in email_queue.MESSAGE_STATUSES]
+            for column, value in enumerate(values):
+                self.campaigns_table.setItem(row, column, QTableWidgetItem(value))
+
+    def send_queued(self):
+        if self.worker_thread is not None:
+            return
+        try:
+            rate = float(self.rate_input.text())
+        except ValueError:
+            rate = 0
+        if rate <= 0:
+            QMessageBox.information(self, "Email", "Emails per second must be a number above 0.")
+            return
+        self.worker_thread = EmailWorkerThread(EMAIL_DATABASE, rate, self)
+        self.worker_thread.progress.connect(self.load_campaigns)
+        self.worker_thread.sending_finished.connect(
+            lambda sent: self.status_label.setText(f"{sent} emails sent"))
+        self.worker_thread.sending_failed.connect(self.sending_failed)
+        self.worker_thread.finished.connect(self.worker_stopped)
+        self.send_button.setEnabled(False)
+        self.stop_button.setEnabled(True)
+        self.status_label.setText("Sending...")
+        self.worker_thread.start()
+
+    def stop_sending(self, wait=False):
+        if self.worker_thread is None:
+            return
+        self.worker_thread.requestInterruption()
+        if wait:
+            self.worker_thread.wait()
+
+    def sending_failed(self, error):
+        self.status_label.setText("")
+        QMessageBox.warning(self, "Email", error)
+
+    def worker_stopped(self):
+        self.worker_thread = None
+        self.send_button.setEnabled(True)
+        self.stop_button.setEnabled(False)
+        self.load_campaigns()
+
+class SmtpSettingsTab(QWidget):
+    def __init__(self):
+        import email_queue
+
+        super().__init__()
+
+        self.group_box = QGroupBox("SMTP Server")
+
+        self.host_input = QLineEdit()
+        self.port_input = QLineEdit(str(email_queue.DEFAULT_PORTS["starttls"]))
+        self.security_dropdown = QComboBox()
+        self.security_dropdown.addItems(email_queue.SECURITY_MODES)
+        self.username_input = QLineEdit()
+        self.password_input = QLineEdit()
+        self.password_input.setEchoMode(QLineEdit.Password)
+        self.from_address_input = QLineEdit()
+        self.from_name_input = QLineEdit()
+        self.load_smtp_settings()
+
+        self.gmail_button = QPushButton("Use Gmail")
+        self.gmail_button.clicked.connect(self.use_gmail)
+        self.save_button = QPushButton("Save SMTP Settings")
+        self.save_button.clicked.connect(self.save_smtp_settings)
+
+        layout = QGridLayout()
+        for row, (label, widget) in enumerate([
+                ("Server:", self.host_input), ("Port:", self.port_input), ("Security:", self.security_dropdown),
+                ("Username:", self.username_input), ("Password:", self.password_input),
+                ("From Address:", self.from_address_input), ("From Name:", self.from_name_input)]):
+            layout.addWidget(QLabel(label), row, 0)
+            layout.addWidget(widget, row, 1)
+        button_layout = QHBoxLayout()
+        button_layout.addWidget(self.gmail_button)
+        button_layout.addWidget(self.save_button)
+        layout.addLayout(button_layout, row + 1, 0, 1, 2, alignment=Qt.AlignCenter)
+
+        self.group_box.setLayout(layout)
+
+        main_layout = QVBoxLayout()
+        main_layout.addWidget(self.group_box)
+        self.setLayout(main_layout)
+
+    def use_gmail(self):
+        import email_queue
+
+        # Gmail wants an app password here, not the account's normal one
+        host, port, security = email_queue.GMAIL_SERVER
+        self.host_input.setText(host)
+        self.port_input.setText(str(port))
+        self.security_dropdown.setCurrentText(security)
+
+    def load_smtp_settings(self):
+        import email_queue
+
+        get_executor().submit(
+            lambda: email_queue.load_settings(database.get_database(EMAIL_DATABASE).reader()),
+            callback=self.show_smtp_settings)
+
+    def show_smtp_settings(self, settings):
+        if settings:
+            self.host_input.setText(settings.host)
+            self.port_input.setText(str(settings.port))
+            self.security_dropdown.setCurrentText(settings.security)
+            self.username_input.setText(settings.username or "")
+            self.password_input.setText(settings.password or "")
+            self.from_address_input.setText(settings.from_address)
+            self.from_name_input.setText(settings.from_name or "")
+
+    def save_smtp_settings(self):
+        import email_queue
+
+        host = self.host_input.text().strip()
+        from_address = self.from_address_input.text().strip()
+        if not host or not self.port_input.text().isdigit() or not email_queue.email_address(from_address):
+            QMessageBox.information(self, "SMTP", "Enter a server, a port number and the address to send from.")
+            return
+        settings = email_queue.SmtpSettings(
+            host, int(self.port_input.text()), self.security_dropdown.currentText(),
+            self.username_input.text().strip() or None, self.password_input.text() or None,
+            from_address, self.from_name_input.text().strip() or None)
+        get_executor().submit(self.save_settings_to_database, settings)
+
+    def save_settings_to_database(self, settings):
+        import email_queue
+
+        with database.get_database(EMAIL_DATABASE).transaction() as connection:
+            email_queue.save_settings(connection, settings)
+
+class MessagingTab(QWidget):
+    """Text campaigns to leads through Twilio.
+
+    Queuing a campaign writes one message per matching lead to the SMS queue; Send
+    Queued drains it on an SmsWorkerThread. Messages stay queued across restarts, so
+    a stopped or interrupted campaign carries on with the next Send Queued.
+    """
+    def __init__(self, lead_repository):
+        import sms_queue
+
+        super().__init__()
+
+        self.lead_repository = lead_repository
+        self.worker_thread = None
+
+        self.campaign_input = QLineEdit()
+        self.campaign_input.setPlaceholderText("Campaign name")
+        self.body_input = QTextEdit()
+        self.body_input.setPlaceholderText("Hi $first_name, ... ($first_name, $last_name, $city etc. are filled in per lead)")
+        self.body_input.setFixedHeight(80)
+
+        # Which leads get the campaign, as on the Leads Table View
+        self.city_filter = QLineEdit()
+        self.city_filter.setPlaceholderText("City")
+        self.text_filter = QLineEdit()
+        self.text_filter.setPlaceholderText("Search names, address and notes")
+        self.job_type_filter = QComboBox()
+        self.job_type_filter.addItems(["Any Job Type"] + JOB_TYPES)
+        self.status_filter = QComboBox()
+        self.status_filter.addItems(["Any Status"] + list(STATUS_MAPPING.values()))
+
+        self.queue_button = QPushButton("Queue Campaign")
+        self.queue_button.clicked.connect(self.queue_campaign)
+
+        filter_layout = QHBoxLayout()
+        filter_layout.addWidget(self.city_filter)
+        filter_layout.addWidget(self.text_filter)
+        filter_layout.addWidget(self.job_type_filter)
+        filter_layout.addWidget(self.status_filter)
+        filter_layout.addWidget(self.queue_button)
+
+        campaign_layout = QVBoxLayout()
+        campaign_layout.addWidget(self.campaign_input)
+        campaign_layout.addWidget(self.body_input)
+        campaign_layout.addLayout(filter_layout)
+        self.group_box = QGroupBox("New Campaign")
+        self.group_box.setLayout(campaign_layout)
+
+        self.campaigns_table = QTableWidget(0, 2 + len(sms_queue.MESSAGE_STATUSES))
+        self.campaigns_table.setHorizontalHeaderLabels(
+            ["Campaign", "Created"] + [status.title() for status in sms_queue.MESSAGE_STATUSES])
+        self.campaigns_table.horizontalHeader().setSectionResizeMode(QHeaderView.Stretch)
+        self.campaigns_table.setEditTriggers(QTableWidget.NoEditTriggers)
+
+        self.send_button = QPushButton("Send Queued")
+        self.send_button.clicked.connect(self.send_queued)
+        self.stop_button = QPushButton("Stop Sending")
+        self.stop_button.clicked.connect(self.stop_sending)
+        self.stop_button.setEnabled(False)
+        self.check_button = QPushButton("Check Delivery")
+        self.check_button.clicked.connect(self.check_delivery)
+        self.status_label = QLabel()
+
+        # A single Twilio number may send about one text a second; toll-free numbers and services more
+        self.rate_input = QLineEdit(str(sms_queue.DEFAULT_RATE))
+        self.rate_input.setFixedWidth(60)
+
+        button_layout = QHBoxLayout()
+        button_layout.addWidget(QLabel("Texts per second:"))
+        button_layout.addWidget(self.rate_input)
+        button_layout.addWidget(self.send_button)
+        button_layout.addWidget(self.stop_button)
+        button_layout.addWidget(self.check_button)
+        button_layout.addWidget(self.status_label)
+        button_layout.addStretch()
+
+        layout = QVBoxLayout()
+        layout.addWidget(self.group_box)
+        layout.addWidget(self.campaigns_table)
+        layout.addLayout(button_layout)
+        self.setLayout(layout)
+
+        self.load_campaigns()
+
+    def filters(self):
+        filters = {"city": self.city_filter.text(), "text": self.text_filter.text()}
+        if self.job_type_filter.currentIndex() > 0:
+            filters["job_type"] = self.job_type_filter.currentText()
+        if self.status_filter.currentIndex() > 0:
+            filters["lead_status"] = self.status_filter.currentIndex() - 1
+        return filters
+
+    def queue_campaign(self):
+        name = self.campaign_input.text().strip()
+        body = self.body_input.toPlainText().strip()
+        if not name or not body:
+            QMessageBox.information(self, "Messaging", "Give the campaign a name and a message.")
+            return
+        self.queue_button.setEnabled(False)
+        get_executor().submit(self.enqueue, name, body, self.filters(),
+                              callback=self.campaign_queued, error=self.queue_failed)
+
+    def enqueue(self, name, body, filters):
+        import sms_queue
+
+        with database.get_database(TWILIO_DATABASE).transaction() as connection:
+            return sms_queue.enqueue_campaign(connection, self.lead_repository.leads_db.reader(), name, body, filters)
+
+    def campaign_queued(self, result):
+        campaign_id, queued, skipped = result
+        self.queue_button.setEnabled(True)
+        self.campaign_input.clear()
+        self.status_label.setText(f"{queued} messages queued, {skipped} leads without a textable phone number")
+        self.load_campaigns()
+
+    def queue_failed(self, error):
+        self.queue_button.setEnabled(True)
+        print(error)
+
+    def load_campaigns(self):
+        import sms_queue
+
+        get_executor().submit(
+            lambda: sms_queue.campaign_summaries(database.get_database(TWILIO_DATABASE).reader()),
+            callback=self.show_campaigns, key="sms_campaigns")
+
+    def show_campaigns(self, summaries):
+        import sms_queue
+
+        self.campaigns_table.setRowCount(len(summaries))
+        for row, (campaign_id, name, created_at, counts) in enumerate(summaries):
+            values = [name, created_at] + [str(counts[status]) for status in sms_queue.MESSAGE_STATUSES]
+            for column, value in enumerate(values):
+                self.campaigns_table.setItem(row, column, QTableWidgetItem(value))
+
+    def send_queued(self):
+        self.start_worker(refresh=False)
+
+    def check_delivery(self):
+        self.start_worker(refresh=True)
+
+    def start_worker(self, refresh):
+        if self.worker_thread is not None:
+            return
+        try:
+            rate = float(self.rate_input.text())
+        except ValueError:
+            rate = 0
+        if rate <= 0:
+            QMessageBox.information(self, "Messaging", "Texts per second must be a number above 0.")
+            return
+        self.worker_thread = SmsWorkerThread(TWILIO_DATABASE, rate, refresh, self)
+        self.worker_thread.progress.connect(self.load_campaigns)
+        self.worker_thread.sending_finished.connect(self.sending_finished)
+        self.worker_thread.sending_failed.connect(self.sending_failed)
+        self.worker_thread.finished.connect(self.worker_stopped)
+        self.send_button.setEnabled(False)
+        self.check_button.setEnabled(False)
+        self.stop_button.setEnabled(True)
+        self.status_label.setText("Checking delivery..." if refresh else "Sending...")
+        self.worker_thread.start()
+
+    def stop_sending(self, wait=False):
+        if self.worker_thread is None:
+            return
+        self.worker_thread.requestInterruption()
+        if wait:
+            self.worker_thread.wait()
+
+    def sending_finished(self, count):
+        if self.worker_thread.refresh:
+            self.status_label.setText(f"{count} messages settled")
+        else:
+            self.status_label.setText(f"{count} messages sent")
+
+    def sending_failed(self, error):
+        self.status_label.setText("")
+        QMessageBox.warning(self, "Messaging", error)
+
+    def worker_stopped(self):
+        self.worker_thread = None
+        self.send_button.setEnabled(True)
+        self.check_button.setEnabled(True)
+        self.stop_button.setEnabled(False)
+        self.load_campaigns()
+
+class FormsTab(QWidget):
+    """Web forms that add leads, served by a FormServerThread while the server is started.
+
+    My Forms lists the forms with their counts, Create adds one, Embed gives the HTML
+    to paste into a website and Settings picks where the server listens. Leads the
+    server takes in are announced through the repository in batches, so the grid and
+    dashboard show them as they arrive.
+    """
+    def __init__(self, lead_repository):
+        super().__init__()
+
+        self.lead_repository = lead_repository
+        self.server_thread = None
+        self.port = None
+        self.forms = []
+        self.new_ids = []
+        self.new_leads = 0
+        self.duplicates = 0
+
+        self.notify_timer = QTimer(self)
+        self.notify_timer.setSingleShot(True)
+        self.notify_timer.setInterval(FORM_NOTIFY_INTERVAL_MS)
+        self.notify_timer.timeout.connect(self.announce_new_leads)
+
+        self.tabs = QTabWidget(self)
+        self.tabs.addTab(self.my_forms_page(), "My Forms")
+        self.tabs.addTab(self.create_page(), "Create")
+        self.tabs.addTab(self.embed_page(), "Embed")
+        self.tabs.addTab(self.settings_page(), "Settings")
+
+        self.start_button = QPushButton("Start Server")
+        self.start_button.clicked.connect(self.start_server)
+        self.stop_button = QPushButton("Stop Server")
+        self.stop_button.clicked.connect(self.stop_server)
+        self.stop_button.setEnabled(False)
+        self.status_label = QLabel("Server stopped")
+
+        button_layout = QHBoxLayout()
+        button_layout.addWidget(self.start_button)
+        button_layout.addWidget(self.stop_button)
+        button_layout.addWidget(self.status_label)
+        button_layout.addStretch()
+
+        layout = QVBoxLayout()
+        layout.addWidget(self.tabs)
+        layout.addLayout(button_layout)
+        self.setLayout(layout)
+
+        self.load_forms()
+
+    def my_forms_page(self):
+        self.forms_table = QTableWidget(0, 6)
+        self.forms_table.setHorizontalHeaderLabels(["Form", "Address", "Lead Source", "Submissions", "Duplicates", "Created"])
+        self.forms_table.horizontalHeader().setSectionResizeMode(QHeaderView.Stretch)
+        self.forms_table.setEditTriggers(QTableWidget.NoEditTriggers)
+        self.forms_table.setSelectionBehavior(QTableWidget.SelectRows)
+
+        self.delete_button = QPushButton("Delete Form")
+        self.delete_button.clicked.connect(self.delete_form)
+
+        button_layout = QHBoxLayout()
+        button_layout.addStretch()
+        button_layout.addWidget(self.delete_button)
+
+        page = QWidget()
+        layout = QVBoxLayout(page)
+        layout.addWidget(self.forms_table)
+        layout.addLayout(button_layout)
+        return page
+
+    def create_page(self):
+        import form_intake
+
+        self.title_input = QLineEdit()
+        self.title_input.setPlaceholderText("Form title, e.g. Free Roof Estimate")
+        self.source_input = QLineEdit()
+        self.source_input.setPlaceholderText("Referred By for its leads, e.g. Website (default: the title)")
+
+        fields_layout = QGridLayout()
+        self.field_checks = {}
+        for index, field in enumerate(form_intake.FORM_FIELDS):
+            check = QCheckBox(form_intake.FIELD_LABELS[field])
+            check.setChecked(field in form_intake.DEFAULT_FIELDS)
+            self.field_checks[field] = check
+            fields_layout.addWidget(check, index // 3, index % 3)
+        fields_box = QGroupBox("Ask For")
+        fields_box.setLayout(fields_layout)
+
+        self.create_button = QPushButton("Create Form")
+        self.create_button.clicked.connect(self.create_form)
+
+        page = QWidget()
+        layout = QVBoxLayout(page)
+        layout.addWidget(self.title_input)
+        layout.addWidget(self.source_input)
+        layout.addWidget(fields_box)
+        layout.addWidget(self.create_button, alignment=Qt.AlignLeft)
+        layout.addStretch()
+        return page
+
+    def embed_page(self):
+        self.embed_dropdown = QComboBox()
+        self.embed_dropdown.currentIndexChanged.connect(self.show_embed)
+        self.embed_text = QTextEdit()
+        self.embed_text.setReadOnly(True)
+        self.copy_button = QPushButton("Copy")
+        self.copy_button.clicked.connect(lambda: QApplication.clipboard().setText(self.embed_text.toPlainText()))
+
+        top_layout = QHBoxLayout()
+        top_layout.addWidget(QLabel("Form:"))
+        top_layout.addWidget(self.embed_dropdown, 1)
+        top_layout.addWidget(self.copy_button)
+
+        page = QWidget()
+        layout = QVBoxLayout(page)
+        layout.addLayout(top_layout)
+        layout.addWidget(self.embed_text)
+        return page
+
+    def settings_page(self):
+        import form_intake
+
+        self.port_input = QLineEdit(str(form_intake.DEFAULT_PORT))
+        self.port_input.setFixedWidth(80)
+        self.network_check = QCheckBox("Take submissions from other devices on the network, not just this computer")
+        self.address_input = QLineEdit()
+        self.address_input.setPlaceholderText("Address websites reach the server at, e.g. https://forms.example.com")
+        self.address_input.textChanged.connect(self.show_embed)
+
+        layout = QGridLayout()
+        layout.addWidget(QLabel("Port:"), 0, 0)
+        layout.addWidget(self.port_input, 0, 1, alignment=Qt.AlignLeft)
+        layout.addWidget(self.network_check, 1, 0, 1, 2)
+        layout.addWidget(QLabel("Public Address:"), 2, 0)
+        layout.addWidget(self.address_input, 2, 1)
+        layout.setRowStretch(3, 1)
+
+        page = QWidget()
+        page.setLayout(layout)
+        return page
+
+    def base_url(self):
+        address = self.address_input.text().strip().rstrip("/")
+        return address or f"http://127.0.0.1:{self.port or self.port_input.text()}"
+
+    def load_forms(self):
+        import form_intake
+
+        get_executor().submit(lambda: form_intake.list_forms(self.lead_repository.leads_db.reader()),
+                              callback=self.show_forms, key="lead_forms")
+
+    def show_forms(self, forms):
+        self.forms = forms
+        self.forms_table.setRowCount(len(forms))
+        for row, form in enumerate(forms):
+            values = [form.title, f"/forms/{form.slug}", form.referred_by or form.title,
+                      str(form.submissions), str(form.duplicates), form.created_at]
+            for column, value in enumerate(values):
+                self.forms_table.setItem(row, column, QTableWidgetItem(value))
+
+        selected = self.embed_dropdown.currentData()
+        self.embed_dropdown.blockSignals(True)
+        self.embed_dropdown.clear()
+        for form in forms:
+            self.embed_dropdown.addItem(form.title, form.slug)
+        self.embed_dropdown.blockSignals(False)
+        index = self.embed_dropdown.findData(selected)
+        self.embed_dropdown.setCurrentIndex(max(index, 0))
+        self.show_embed()
+
+    def show_embed(self):
+        import form_intake
+
+        slug = self.embed_dropdown.currentData()
+        form = next((form for form in self.forms if form.slug == slug), None)
+        self.embed_text.setPlainText(form_intake.embed_snippet(form, self.base_url()) if form else "")
+
+    def create_form(self):
+        import form_intake
+
+        fields = [field for field, check in self.field_checks.items() if check.isChecked()]
+
+        def create(title, source):
+            with self.lead_repository.leads_db.transaction() as connection:
+                return form_intake.create_form(connection, title, fields, source)
+
+        self.create_button.setEnabled(False)
+        get_executor().submit(create, self.title_input.text(), self.source_input.text(),
+                              callback=self.form_created, error=self.create_failed)
+
+    def form_created(self, form):
+        self.create_button.setEnabled(True)
+        self.title_input.clear()
+        self.source_input.clear()
+        self.forms_changed()
+        # Show where to paste it
+        self.embed_dropdown.addItem(form.title, form.slug)
+        self.embed_dropdown.setCurrentIndex(self.embed_dropdown.count() - 1)
+        self.tabs.setCurrentIndex(2)
+
+    def create_failed(self, error):
+        self.create_button.setEnabled(True)
+        QMessageBox.information(self, "Forms", str(error))
+
+    def delete_form(self):
+        import form_intake
+
+        row = self.forms_table.currentRow()
+        if row < 0 or row >= len(self.forms):
+            QMessageBox.information(self, "Forms", "Select a form to delete.")
+            return
+        form = self.forms[row]
+        reply = QMessageBox.question(
+            self, "Delete Form", f"Delete {form.title}? The leads it took in stay.", QMessageBox.Yes | QMessageBox.No)
+        if reply != QMessageBox.Yes:
+            return
+
+        def delete():
+            with self.lead_repository.leads_db.transaction() as connection:
+                form_intake.delete_form(connection, form.slug)
+
+        get_executor().submit(delete, callback=lambda _: self.forms_changed())
+
+    def forms_changed(self):
+        self.load_forms()
+        if self.server_thread is not None:
+            self.server_thread.reload_forms()
+
+    def start_server(self):
+        import form_intake
+
+        if self.server_thread is not None:
+            return
+        port = self.port_input.text().strip()
+        if not port.isdigit() or not 0 < int(port) < 65536:
+            QMessageBox.information(self, "Forms", "The port must be a number from 1 to 65535.")
+            return
+        host = "0.0.0.0" if self.network_check.isChecked() else form_intake.DEFAULT_HOST
+        self.server_thread = FormServerThread(self.lead_repository.leads_db.path, host, int(port), self)
+        self.server_thread.serving.connect(self.serving)
+        self.server_thread.submissions_written.connect(self.submissions_written)
+        self.server_thread.serving_failed.connect(self.serving_failed)
+        self.server_thread.finished.connect(self.server_stopped)
+        self.start_button.setEnabled(False)
+        self.stop_button.setEnabled(True)
+        self.status_label.setText("Starting...")
+        self.server_thread.start()
+
+    def stop_server(self, wait=False):
+        if self.server_thread is None:
+            return
+        self.server_thread.requestInterruption()
+        if wait:
+            self.server_thread.wait()
+            self.announce_new_leads()
+
+    def serving(self, port):
+        self.port = port
+        self.new_leads = self.duplicates = 0
+        self.show_status()
+        self.show_embed()
+
+    def serving_failed(self, error):
+        QMessageBox.warning(self, "Forms", f"The form server stopped: {error}")
+
+    def server_stopped(self):
+        self.server_thread = None
+        self.port = None
+        self.start_button.setEnabled(True)
+        self.stop_button.setEnabled(False)
+        self.status_label.setText("Server stopped")
+        self.announce_new_leads()
+
+    def submissions_written(self, lead_ids, duplicates):
+        self.new_ids.extend(lead_ids)
+        self.new_leads += len(lead_ids)
+        self.duplicates += duplicates
+        # At most one announcement per interval, however fast submissions come in
+        if not self.notify_timer.isActive():
+            self.notify_timer.start()
+
+    def announce_new_leads(self):
+        if self.new_ids:
+            self.lead_repository.announce_inserted(self.new_ids)
+            self.new_ids = []
+        if self.server_thread is not None and self.port is not None:
+            self.show_status()
+        self.load_forms()
+
+    def show_status(self):
+        text = f"Serving on port {self.port}: {self.new_leads} new leads, {self.duplicates} duplicates"
+        server = self.server_thread.server
+        if server is not None and server.rejected:
+            text += f", {server.rejected} turned away while busy"
+        self.status_label.setText(text)
+
+class TwilioIntegrationTab(QWidget):
+    def __init__(self):
+        super().__init__()
+
+        # Create a group box for the Twilio integration section
+        self.group_box = QGroupBox("Twilio Integration")
+        
+        self.twilio_sid_input = QLineEdit()
+        self.twilio_auth_token_input = QLineEdit()
+        self.twilio_from_number_input = QLineEdit()
+        self.twilio_from_number_input.setPlaceholderText("+15551234567 or a messaging service SID (MG...)")
+        self.load_twilio_credentials()
+
+        self.save_button = QPushButton("Save Twilio Credentials")
+        self.save_button.clicked.connect(self.save_twilio_credentials)
+
+        # Create a grid layout for the group box
+        layout = QGridLayout()
+        layout.addWidget(QLabel("Twilio SID:"), 0, 0)
+        layout.addWidget(self.twilio_sid_input, 0, 1)
+        layout.addWidget(QLabel("Twilio Auth Token:"), 1, 0)
+        layout.addWidget(self.twilio_auth_token_input, 1, 1)
+        layout.addWidget(QLabel("Send Texts From:"), 2, 0)
+        layout.addWidget(self.twilio_from_number_input, 2, 1)
+        layout.addWidget(self.save_button, 3, 0, 1, 2, alignment=Qt.AlignCenter)
+        
+        self.group_box.setLayout(layout)
+        
+        # Create a layout for the whole tab
+        main_layout = QVBoxLayout()
+        main_layout.addWidget(self.group_box)
+        self.setLayout(main_layout)
+
+    def load_twilio_credentials(self):
+        get_executor().submit(self.load_credentials_from_database, callback=self.show_twilio_credentials)
+
+    def load_credentials_from_database(self):
+        return database.get_database(TWILIO_DATABASE).reader().execute("SELECT SID, AuthToken, FromNumber FROM TwilioCredentials LIMIT 1").fetchone()
+
+    def show_twilio_credentials(self, result):
+        if result:
+            self.twilio_sid_input.setText(result[0])
+            self.twilio_auth_token_input.setText(result[1])
+            self.twilio_from_number_input.setText(result[2] or "")
+
+    def save_twilio_credentials(self):
+        twilio_sid = self.twilio_sid_input.text()
+        twilio_auth_token = self.twilio_auth_token_input.text()
+        twilio_from_number = self.twilio_from_number_input.text().strip()
+        get_executor().submit(self.save_credentials_to_database, twilio_sid, twilio_auth_token, twilio_from_number)
+
+    def save_credentials_to_database(self, twilio_sid, twilio_auth_token, twilio_from_number):
+        with database.get_database(TWILIO_DATABASE).transaction() as connection:
+            connection.execute("DELETE FROM TwilioCredentials")
+            connection.execute("INSERT INTO TwilioCredentials (SID, AuthToken, FromNumber) VALUES (?, ?, ?)",
+                               (twilio_sid, twilio_auth_token, twilio_from_number))
+
+class GoogleIntegrationTab(QWidget):
+    def __init__(self):
+        super().__init__()
+
+        self.label = QLabel("Google Integration - Coming Soon")
+        self.label.setAlignment(Qt.AlignCenter)
+
+        layout = QVBoxLayout()
+        layout.addWidget(self.label)
+        self.setLayout(layout)
+
+class ZapierIntegrationTab(QWidget):
+    def __init__(self):
+        super().__init__()
+
+        self.label = QLabel("Zapier Integration - Coming Soon")
+        self.label.setAlignment(Qt.AlignCenter)
+
+        layout = QVBoxLayout()
+        layout.addWidget(self.label)
+        self.setLayout(layout)
+
+class ComingSoonTab(QWidget):
+    def __init__(self):
+        super().__init__()
+        self.label = QLabel("Coming Soon")
+        self.label.setAlignment(Qt.AlignCenter)
+        layout = QVBoxLayout()
+        layout.addWidget(self.label)
+        self.setLayout(layout)
+        
+if __name__ == "__main__":
+    profile_startup = "--profile-startup" in sys.argv[1:]
+    if profile_startup:
+        sys.argv.remove("--profile-startup")
+    startup_profile.mark("imports")
+    app = QApplication(sys.argv)
+    startup_profile.mark("QApplication")
+    window = ContractorLeadsApp()
+    window.show()
+    startup_profile.mark("show")
+    if profile_startup:
+        # Runs once the event loop has painted the first frame
+        QTimer.singleShot(0, lambda: (startup_profile.mark("first paint"), startup_profile.report()))
+    exit_code = app.exec_()
+    get_executor().shutdown()
+    database.close_all()
+    sys.exit(exit_code)